@@ -0,0 +1,114 @@
+"""
+A/B harness for observation encodings (see obs/encode_obs.py).
+
+Runs the same (env, seed) episodes once per obs_format and reports, per env:
+mean/std reward, mean obs/prompt tokens per agent-step, token saving versus
+verbose and the paired (same-seed) reward difference versus verbose.
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+
+from benchmark_runner import run_benchmark
+from obs.encode_obs import OBS_FORMATS
+
+ENVIRONMENTS = ["spread", "adversary", "tag"]
+BASE_OUT_DIR = "results/ab_obs_format"
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Compare obs encodings (tokens vs reward) on identical seeds.")
+    p.add_argument("--envs", nargs="+", default=ENVIRONMENTS)
+    p.add_argument("--formats", nargs="+", default=list(OBS_FORMATS), choices=list(OBS_FORMATS))
+    p.add_argument("--episodes", type=int, default=5)
+    p.add_argument("--seed_start", type=int, default=1)
+    p.add_argument("--out_dir", type=str, default=BASE_OUT_DIR)
+    p.add_argument("--provider", type=str, default="zaiwen")
+    p.add_argument("--model_name", type=str, default=None)
+    p.add_argument("--api_base", type=str, default=os.getenv("ZAIWEN_API_BASE"))
+    p.add_argument("--api_key", type=str, default=os.getenv("ZAIWEN_API_KEY"))
+    return p.parse_args()
+
+
+def _paired_diff(a, b):
+    """Mean and std-error of per-seed differences b - a."""
+    diffs = [y - x for x, y in zip(a, b) if x is not None and y is not None]
+    if not diffs:
+        return None, None
+    mean = sum(diffs) / len(diffs)
+    if len(diffs) < 2:
+        return mean, None
+    var = sum((d - mean) ** 2 for d in diffs) / (len(diffs) - 1)
+    return mean, math.sqrt(var / len(diffs))
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    engine_kwargs = {}
+    if args.model_name:
+        engine_kwargs["model_name"] = args.model_name
+    if args.api_key:
+        engine_kwargs["api_key"] = args.api_key
+    if args.api_base:
+        engine_kwargs["api_base"] = args.api_base
+
+    results = {}
+    start_time = time.time()
+    for env in args.envs:
+        results[env] = {}
+        for fmt in args.formats:
+            print(f"\n--- A/B: env={env} | obs_format={fmt} | episodes={args.episodes} ---")
+            result = run_benchmark(
+                env_name=env,
+                provider=args.provider,
+                episodes=args.episodes,
+                output_dir=os.path.join(args.out_dir, fmt),
+                seed_start=args.seed_start,
+                obs_format=fmt,
+                **engine_kwargs,
+            )
+            results[env][fmt] = {
+                "mean_reward": result["mean_reward"],
+                "std_reward": result["std_reward"],
+                "obs_tokens_mean": result.get("obs_tokens_mean"),
+                "prompt_tokens_mean": result.get("prompt_tokens_mean"),
+                "episode_means": [ep.get("mean_reward") for ep in result["episode_stats"]],
+            }
+
+    print("\n" + "=" * 100)
+    print("OBS FORMAT A/B SUMMARY")
+    print("=" * 100)
+    print(f"{'env':<18}{'format':<10}{'reward':>18}{'obs_tok':>10}{'prompt_tok':>12}{'tok_saved':>11}{'d_reward(paired)':>22}")
+    for env, by_fmt in results.items():
+        base = by_fmt.get("verbose")
+        for fmt, row in by_fmt.items():
+            saved = "-"
+            diff = "-"
+            if base and fmt != "verbose":
+                if base.get("prompt_tokens_mean") and row.get("prompt_tokens_mean") is not None:
+                    pct = 1.0 - row["prompt_tokens_mean"] / base["prompt_tokens_mean"]
+                    saved = f"{pct * 100:.1f}%"
+                    row["prompt_token_saving"] = pct
+                mean_d, se_d = _paired_diff(base["episode_means"], row["episode_means"])
+                if mean_d is not None:
+                    diff = f"{mean_d:+.3f}" + (f" +/- {se_d:.3f}" if se_d is not None else "")
+                    row["paired_reward_diff"] = mean_d
+                    row["paired_reward_diff_se"] = se_d
+            reward = f"{row['mean_reward']:.3f} +/- {row['std_reward']:.3f}"
+            obs_tok = f"{row['obs_tokens_mean']:.1f}" if row.get("obs_tokens_mean") is not None else "-"
+            prm_tok = f"{row['prompt_tokens_mean']:.1f}" if row.get("prompt_tokens_mean") is not None else "-"
+            print(f"{env:<18}{fmt:<10}{reward:>18}{obs_tok:>10}{prm_tok:>12}{saved:>11}{diff:>22}")
+
+    summary_path = os.path.join(args.out_dir, "ab_summary.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=4, ensure_ascii=False)
+    print(f"\nDone in {time.time() - start_time:.1f}s. Summary saved to {summary_path}")
+
+
+if __name__ == "__main__":
+    main()
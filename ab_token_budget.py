@@ -0,0 +1,144 @@
+"""
+A/B harness for generation budgets (see token_budget.py).
+
+Runs the same (env, seed) episodes once per budget setting and reports, per
+env: mean/std reward, completion tokens and latency per LLM call, truncated
+responses, token / latency / cost saving versus the first setting and the
+paired (same-seed) reward difference versus it.
+
+Settings:
+    legacy          fixed 4096 cap (previous behaviour)
+    fixed:<N>       fixed N-token cap
+    auto            DEFAULT_TOKEN_BUDGETS per game/role
+    auto:<effort>   per-game budgets scaled by reasoning_effort (none/low/medium/high),
+                    effort also forwarded to the provider
+    effort:<effort> reasoning_effort only, legacy cap
+
+Offline check against the reasoning emulation of the local mock server:
+    python mock_server.py --port 8765 --think_tokens 800 --ms_per_token 0.5
+    python ab_token_budget.py --api_base http://127.0.0.1:8765/v1 --api_key local --model_name mock
+"""
+
+import argparse
+import json
+import os
+import time
+
+from ab_obs_format import _paired_diff
+from benchmark_runner import run_benchmark
+from token_budget import REASONING_EFFORTS
+
+ENVIRONMENTS = ["spread", "crypto", "speaker_listener"]
+SETTINGS = ["legacy", "auto", "auto:low", "auto:none"]
+BASE_OUT_DIR = "results/ab_token_budget"
+
+
+def parse_setting(setting: str) -> dict:
+    kind, _, value = setting.partition(":")
+    if kind == "legacy" and not value:
+        return {}
+    if kind == "fixed" and value.isdigit():
+        return {"max_tokens": int(value)}
+    if kind == "auto" and (not value or value in REASONING_EFFORTS):
+        return {"token_budget": "auto", **({"reasoning_effort": value} if value else {})}
+    if kind == "effort" and value in REASONING_EFFORTS:
+        return {"reasoning_effort": value}
+    raise argparse.ArgumentTypeError(f"invalid setting {setting!r}")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Compare generation budgets (latency/cost vs reward) on identical seeds.")
+    p.add_argument("--envs", nargs="+", default=ENVIRONMENTS)
+    p.add_argument("--settings", nargs="+", default=SETTINGS, help="First setting is the baseline")
+    p.add_argument("--episodes", type=int, default=5)
+    p.add_argument("--seed_start", type=int, default=1)
+    p.add_argument("--out_dir", type=str, default=BASE_OUT_DIR)
+    p.add_argument("--provider", type=str, default="zaiwen")
+    p.add_argument("--model_name", type=str, default=None)
+    p.add_argument("--api_base", type=str, default=os.getenv("ZAIWEN_API_BASE"))
+    p.add_argument("--api_key", type=str, default=os.getenv("ZAIWEN_API_KEY"))
+    p.add_argument("--price_out", type=float, default=None, help="USD per 1M completion tokens, for the cost column")
+    args = p.parse_args()
+    for s in args.settings:
+        parse_setting(s)
+    return args
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    engine_kwargs = {}
+    if args.model_name:
+        engine_kwargs["model_name"] = args.model_name
+    if args.api_key:
+        engine_kwargs["api_key"] = args.api_key
+    if args.api_base:
+        engine_kwargs["api_base"] = args.api_base
+
+    results = {}
+    start_time = time.time()
+    for env in args.envs:
+        results[env] = {}
+        for setting in args.settings:
+            print(f"\n--- A/B: env={env} | budget={setting} | episodes={args.episodes} ---")
+            result = run_benchmark(
+                env_name=env,
+                provider=args.provider,
+                episodes=args.episodes,
+                output_dir=os.path.join(args.out_dir, setting.replace(":", "_")),
+                seed_start=args.seed_start,
+                **parse_setting(setting),
+                **engine_kwargs,
+            )
+            qos = result["llm_qos"]
+            calls = qos["calls"] or 1
+            results[env][setting] = {
+                "mean_reward": result["mean_reward"],
+                "std_reward": result["std_reward"],
+                "tokens_out_per_call": qos["tokens_out"] / calls,
+                "latency_s_mean": qos["latency_s_mean"],
+                "truncated_rate": qos["truncated"] / calls,
+                "failure_rate": qos["failure_rate"],
+                "calls": qos["calls"],
+                "episode_means": [ep.get("mean_reward") for ep in result["episode_stats"]],
+            }
+
+    print("\n" + "=" * 118)
+    print("TOKEN BUDGET A/B SUMMARY")
+    print("=" * 118)
+    print(f"{'env':<18}{'budget':<12}{'reward':>18}{'tok_out':>9}{'lat_s':>8}{'trunc':>7}"
+          f"{'tok_saved':>11}{'lat_saved':>11}{'usd/1k_calls':>14}{'d_reward(paired)':>20}")
+    for env, by_setting in results.items():
+        base = by_setting[args.settings[0]]
+        for setting, row in by_setting.items():
+            tok_saved = lat_saved = diff = "-"
+            if setting != args.settings[0]:
+                if base["tokens_out_per_call"]:
+                    row["token_saving"] = 1.0 - row["tokens_out_per_call"] / base["tokens_out_per_call"]
+                    tok_saved = f"{row['token_saving'] * 100:.1f}%"
+                if base["latency_s_mean"] and row["latency_s_mean"] is not None:
+                    row["latency_saving"] = 1.0 - row["latency_s_mean"] / base["latency_s_mean"]
+                    lat_saved = f"{row['latency_saving'] * 100:.1f}%"
+                mean_d, se_d = _paired_diff(base["episode_means"], row["episode_means"])
+                if mean_d is not None:
+                    diff = f"{mean_d:+.3f}" + (f" +/- {se_d:.3f}" if se_d is not None else "")
+                    row["paired_reward_diff"] = mean_d
+                    row["paired_reward_diff_se"] = se_d
+            cost = "-"
+            if args.price_out is not None:
+                row["usd_per_1k_calls"] = row["tokens_out_per_call"] * args.price_out / 1000.0
+                cost = f"{row['usd_per_1k_calls']:.4f}"
+            reward = f"{row['mean_reward']:.3f} +/- {row['std_reward']:.3f}"
+            lat = f"{row['latency_s_mean']:.3f}" if row["latency_s_mean"] is not None else "-"
+            print(f"{env:<18}{setting:<12}{reward:>18}{row['tokens_out_per_call']:>9.1f}{lat:>8}"
+                  f"{row['truncated_rate'] * 100:>6.1f}%{tok_saved:>11}{lat_saved:>11}{cost:>14}{diff:>20}")
+
+    summary_path = os.path.join(args.out_dir, "ab_summary.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=4, ensure_ascii=False)
+    print(f"\nDone in {time.time() - start_time:.1f}s. Summary saved to {summary_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
+import logging
 import numpy as np
-import imageio
 import json
 from typing import Dict, Any
 
@@ -12,6 +12,11 @@ from prompt.prompt_for_adv import (
     get_task_and_reward,
 )
 from obs.parse_adv_obs import parse_adversary_obs
+from obs.encode_obs import count_tokens, encode_obs
+from log_utils import get_logger
+from step_pipeline import StepPipeline
+
+logger = get_logger("adversary")
 
 # 2. 导入环境
 try:
@@ -28,10 +33,9 @@ def get_header(env_name: str, agent_name: str, step: int, role: str) -> str:
     )
 
 
-def _format_current_obs(obs_struct: Dict[str, Any], num_good: int) -> str:
+def _format_current_obs(obs_struct: Dict[str, Any], num_good: int, obs_format: str = "verbose") -> str:
     """Format current observation data with role-specific highlights."""
-    json_str = json.dumps(obs_struct)
-    
+
     # Add obs semantics
     obs_semantics = (
         "OBSERVATION SEMANTICS:\n"
@@ -46,7 +50,16 @@ def _format_current_obs(obs_struct: Dict[str, Any], num_good: int) -> str:
             "- adversary: The enemy you must fool.\n"
             "- teammates: Your partner in crime.\n\n"
         )
-    
+
+    # compact/minimal: the CRITICAL INFO block only repeats goal/adversary fields
+    if obs_format != "verbose":
+        return (
+            obs_semantics +
+            f"CURRENT OBS ({obs_format}):\n"
+            f"{encode_obs(obs_struct, obs_format)}\n"
+        )
+
+    json_str = json.dumps(obs_struct)
     if obs_struct['role'] == 'GOOD_AGENT':
         goal_info = (
             f"- REAL TARGET (GOAL): {obs_struct['goal']['rel']} (Dist: {obs_struct['goal']['dist']})\n"
@@ -79,7 +92,14 @@ def _format_current_obs(obs_struct: Dict[str, Any], num_good: int) -> str:
         )
 
 
-def user_prompt_adversary(agent: str, step: int, obs: Dict[str, Any], is_adversary: bool, num_good: int) -> str:
+def user_prompt_adversary(
+    agent: str,
+    step: int,
+    obs: Dict[str, Any],
+    is_adversary: bool,
+    num_good: int,
+    obs_format: str = "verbose",
+) -> str:
     """Assemble full prompt from modular components."""
     role_name = "ADVERSARY" if is_adversary else "GOOD_AGENT"
     
@@ -89,7 +109,7 @@ def user_prompt_adversary(agent: str, step: int, obs: Dict[str, Any], is_adversa
         get_physics_rules(),
         get_action_and_response_format(),
         get_navigation_hints(is_adversary),
-        _format_current_obs(obs, num_good),
+        _format_current_obs(obs, num_good, obs_format),
     ]
     return "\n\n".join(parts)
 
@@ -105,7 +125,8 @@ def run_adversary_game(provider: str, output_name: str, **kwargs):
     Args:
         provider: 模型提供商 ('qwen', 'deepseek', 'gpt', 'ollama', 'transformers', etc.)
         output_name: 输出文件名前缀
-        **kwargs: 传递给 get_api_engine 的额外参数（支持 seed 参数）
+        **kwargs: 传递给 get_api_engine 的额外参数（支持 seed / obs_format / pipeline 参数，
+                  pipeline=False 关闭渲染/决策/日志的流水线并发，见 step_pipeline.py）
     """
     # 配置
     N_GOOD = 3         # 好人数量          
@@ -113,161 +134,173 @@ def run_adversary_game(provider: str, output_name: str, **kwargs):
     
     # 初始化
     seed = kwargs.pop('seed', None)
+    obs_format = kwargs.pop('obs_format', 'verbose')
+    pipeline = kwargs.pop('pipeline', True)
+    checkpoint = kwargs.pop('checkpoint', False)
+    capture = kwargs.pop('capture', None)
     llm_engine = get_api_engine(provider, **kwargs)
-    print(f"Initializing Adversary Env (N={N_GOOD})...")
+    logger.info("Initializing Adversary Env (N=%d)...", N_GOOD)
     # 注意：render_mode="rgb_array" 用于生成视频
     env = simple_adversary_v3.parallel_env(N=N_GOOD, max_cycles=MAX_STEPS, continuous_actions=True, render_mode="rgb_array")
     
     observations, infos = env.reset(seed=seed) if seed is not None else env.reset()
-    frames = []
-    
-    # 全局统计
-    game_log = []
-    total_reward_good = 0.0
-    total_reward_adv = 0.0
-
-    for step in range(MAX_STEPS):
-        print(f"\n{'='*20} STEP {step} {'='*20}")
-        
-        # 1. 渲染画面
-        frame = env.render()
-        if frame is not None: frames.append(frame)
-        
-        actions = {}
-        # 暂存本回合每个智能体的信息，等拿到 reward 再打印
-        step_buffer = {} 
-
-        # --- 2. 决策阶段 (Decision Phase) ---
-        for agent_id in env.agents:
-            obs_raw = observations[agent_id]
-            is_adversary = "adversary" in agent_id
-            
-            # A. 解析观测 (Parsing)
-            obs_struct = parse_adversary_obs(obs_raw, agent_id, N_GOOD)
-            
-            # B. 组装提示词 (Prompting)
-            full_prompt = user_prompt_adversary(agent_id, step, obs_struct, is_adversary, N_GOOD)
-            
-            # C. 调用大模型 (Reasoning)
-            system_role = "You are a Spy. Capture the target." if is_adversary else "You are a Secret Agent. Protect the target."
-            
-            # 为了防止网络波动，可以加个简单的重试或者异常捕获（在 get_api_engine 里已处理）
-            action_vec, raw_thought = llm_engine.generate_action(system_role, full_prompt)
-            
-            # D. 动作后处理 (维度保护 + Clipping)
-            expected_dim = env.action_space(agent_id).shape[0]
-            actual_dim = int(action_vec.shape[0])
-            if actual_dim != expected_dim:
-                if actual_dim > expected_dim:
-                    action_vec = action_vec[:expected_dim]
+    # macro_block_size=1 用于解决某些播放器的尺寸兼容问题
+    pipe = StepPipeline(llm_engine, output_name + ".mp4", fps=4, enabled=pipeline,
+                        checkpoint=checkpoint, seed=seed, capture=capture,
+                        json_kwargs={"indent": 4, "ensure_ascii": False}, macro_block_size=1)
+    try:
+
+        # 全局统计
+        game_log = []
+        total_reward_good = 0.0
+        total_reward_adv = 0.0
+        obs_tokens = []
+        prompt_tokens = []
+        debug_on = logger.isEnabledFor(logging.DEBUG)
+
+        for step in range(MAX_STEPS):
+            logger.debug("=== STEP %d ===", step)
+
+            # 1. 渲染画面（后台线程，与决策并行）
+            pipe.render(env)
+
+            # --- 2. 决策阶段 (Decision Phase) ---
+            def decide(agent_id):
+                obs_raw = observations[agent_id]
+                is_adversary = "adversary" in agent_id
+
+                # A. 解析观测 (Parsing)
+                obs_struct = parse_adversary_obs(obs_raw, agent_id, N_GOOD)
+
+                # B. 组装提示词 (Prompting)
+                full_prompt = user_prompt_adversary(agent_id, step, obs_struct, is_adversary, N_GOOD, obs_format)
+                obs_text = _format_current_obs(obs_struct, N_GOOD, obs_format)
+
+                # C. 调用大模型 (Reasoning)
+                system_role = "You are a Spy. Capture the target." if is_adversary else "You are a Secret Agent. Protect the target."
+
+                # 为了防止网络波动，可以加个简单的重试或者异常捕获（在 get_api_engine 里已处理）
+                ctx = {"env": "adversary", "seed": seed, "step": step, "agent": agent_id, "obs": obs_struct,
+                       "action_dim": env.action_space(agent_id).shape[0]}
+                action_vec, raw_thought = llm_engine.generate_action(system_role, full_prompt, context=ctx)
+
+                # D. 动作后处理 (宽度已由 generate_action 按 action_dim 对齐，这里只做 Clipping)
+                action_vec = np.clip(action_vec, 0.0, 1.0)
+
+                # 存入 Buffer
+                return {
+                    "role": "BAD" if is_adversary else "GOOD",
+                    "obs_text": obs_text,
+                    "obs_tokens": count_tokens(obs_text),
+                    "prompt_tokens": count_tokens(full_prompt),
+                    "llm": llm_engine.last_call_info(),
+                    "thought": raw_thought,
+                    "action": action_vec,
+                    # 存原始结构方便后续存 JSON
+                    "obs_struct": obs_struct 
+                }
+
+            # 暂存本回合每个智能体的信息，等拿到 reward 再打印
+            step_buffer = pipe.decide(env.agents, decide)
+            actions = {agent_id: info["action"] for agent_id, info in step_buffer.items()}
+            obs_tokens.extend(info["obs_tokens"] for info in step_buffer.values())
+            prompt_tokens.extend(info["prompt_tokens"] for info in step_buffer.values())
+
+            if not actions: 
+                logger.warning("No actions generated. Ending episode.")
+                break
+
+            # --- 3. 环境步进 (Physics Step) ---
+            pipe.sync_env()
+            observations, rewards, terminations, truncations, infos = env.step(actions)
+
+            # --- 4. 统一打印日志 (Readable Log & Analysis) ---
+            for agent_id, info in step_buffer.items():
+                reward = rewards.get(agent_id, 0.0)
+                role_tag = f"[{info['role']}] {agent_id}"
+
+                # 累加统计
+                if info['role'] == "GOOD":
+                    # Good agents 共享奖励，为了不算重，这里只加一次，或者除以 N
+                    # 简单起见，我们在外面单算
+                    pass
                 else:
-                    action_vec = np.pad(action_vec, (0, expected_dim - actual_dim), mode='constant', constant_values=0.0)
-                print(
-                    f"⚠️ Action dim adjusted for {agent_id}: expected {expected_dim}, got {actual_dim}. "
-                    f"Using {expected_dim}-dim action."
-                )
-
-            action_vec = np.clip(action_vec, 0.0, 1.0)
-            actions[agent_id] = action_vec
-            
-            # 存入 Buffer
-            step_buffer[agent_id] = {
-                "role": "BAD" if is_adversary else "GOOD",
-                "obs_text": _format_current_obs(obs_struct, N_GOOD),
-                "thought": raw_thought,
-                "action": action_vec,
-                # 存原始结构方便后续存 JSON
-                "obs_struct": obs_struct 
-            }
-
-        if not actions: 
-            print("No actions generated. Ending episode.")
-            break
-
-        # --- 3. 环境步进 (Physics Step) ---
-        observations, rewards, terminations, truncations, infos = env.step(actions)
-        
-        # --- 4. 统一打印日志 (Readable Log & Analysis) ---
-        for agent_id, info in step_buffer.items():
-            reward = rewards.get(agent_id, 0.0)
-            role_tag = f"[{info['role']}] {agent_id}"
-            
-            # 累加统计
-            if info['role'] == "GOOD":
-                # Good agents 共享奖励，为了不算重，这里只加一次，或者除以 N
-                # 简单起见，我们在外面单算
-                pass
-            else:
-                total_reward_adv += reward
-
-            # 存入 JSON log
-            game_log.append({
-                "step": step,
-                "agent": agent_id,
-                "role": info['role'],
-                "obs": info['obs_struct'],
-                "action": info['action'].tolist(),
-                "thought": info['thought'],
-                "reward": reward
-            })
-            
-            # 打印控制台
-            print(f"\n🔷 {role_tag} | Reward: {reward:.3f}")
-            
-            # 4.1 打印模型看到的关键信息 (Obs Highlight)
-            print(f"   👀 Obs Highlight:")
-            for line in info['obs_text'].split('\n'):
-                # 只打印包含关键信息的行，保持整洁
-                if any(k in line for k in ["TARGET", "ADVERSARY", "Direction", "role"]):
-                    print(f"      {line.strip()}")
-            
-            # 4.2 打印思考过程 (Thought)
-            # 处理 DeepSeek 的 <think> 标签或 JSON 格式，取前 150 字符预览
-            thought_preview = info['thought'][:150].replace('\n', ' ')
-            print(f"   🧠 Thought: {thought_preview}...") 
-            
-            # 4.3 打印动作 (Action)
-            act = info['action']
-            act_str = f"[{act[0]:.1f}, L:{act[1]:.2f}, R:{act[2]:.2f}, D:{act[3]:.2f}, U:{act[4]:.2f}]"
-            print(f"   🎬 Action: {act_str}")
-
-        # 统计 Good Agent 的总分 (取其中一个即可，因为共享)
-        # 假设 agent_0 是好人
-        if 'agent_0' in rewards:
-            total_reward_good += rewards['agent_0']
-
-        if all(terminations.values()) or all(truncations.values()):
-            print("\nGame Over (Terminated/Truncated).")
-            break
-
-    env.close()
-    
-    # Add final summary
-    mean_reward = (total_reward_good + total_reward_adv) / 2.0
-    game_log.append({
-        "final_summary": True,
-        "total_rewards": {"good": total_reward_good, "adversary": total_reward_adv},
-        "mean_reward": float(mean_reward)
-    })
-    
-    print(f"\n{'='*40}")
-    print(f"📊 EPISODE SUMMARY")
-    print(f"   Total Good Reward: {total_reward_good:.2f}")
-    print(f"   Total Adv Reward:  {total_reward_adv:.2f}")
-    print(f"   Mean Reward: {mean_reward:.2f}")
-    print(f"{'='*40}\n")
-
-    # --- 5. 保存结果 ---
-    if frames:
-        final_video = get_unique_filename(output_name + ".mp4")
-        print(f"Saving video to {final_video} ...")
-        # macro_block_size=1 用于解决某些播放器的尺寸兼容问题
-        imageio.mimsave(final_video, frames, fps=4, macro_block_size=1)
-    
-    final_log = get_unique_filename(output_name + ".json")
-    print(f"Saving logs to {final_log} ...")
-    with open(final_log, "w", encoding="utf-8") as f:
-        json.dump(game_log, f, indent=4, ensure_ascii=False)
+                    total_reward_adv += reward
+
+                # 存入 JSON log
+                game_log.append({
+                    "step": step,
+                    "agent": agent_id,
+                    "role": info['role'],
+                    "obs": info['obs_struct'],
+                    "action": info['action'].tolist(),
+                    "thought": info['thought'],
+                    "reward": reward,
+                    "obs_tokens": info['obs_tokens'],
+                    "llm": info.get("llm"),
+                })
+
+                if debug_on:
+                    # 打印控制台
+                    logger.debug("%s | Reward: %.3f", role_tag, reward)
+
+                    # 4.1 打印模型看到的关键信息 (Obs Highlight)
+                    logger.debug("   Obs Highlight:")
+                    for line in info['obs_text'].split('\n'):
+                        # 只打印包含关键信息的行，保持整洁
+                        if any(k in line for k in ["TARGET", "ADVERSARY", "Direction", "role"]):
+                            logger.debug("      %s", line.strip())
+
+                    # 4.2 打印思考过程 (Thought)
+                    # 处理 DeepSeek 的 <think> 标签或 JSON 格式，取前 150 字符预览
+                    thought_preview = info['thought'][:150].replace('\n', ' ')
+                    logger.debug("   Thought: %s...", thought_preview)
+
+                    # 4.3 打印动作 (Action)
+                    act = info['action']
+                    act_str = f"[{act[0]:.1f}, L:{act[1]:.2f}, R:{act[2]:.2f}, D:{act[3]:.2f}, U:{act[4]:.2f}]"
+                    logger.debug("   Action: %s", act_str)
+
+            # 统计 Good Agent 的总分 (取其中一个即可，因为共享)
+            # 假设 agent_0 是好人
+            if 'agent_0' in rewards:
+                total_reward_good += rewards['agent_0']
+
+            pipe.log(game_log)
+            if all(terminations.values()) or all(truncations.values()):
+                logger.debug("Game Over (Terminated/Truncated).")
+                break
+
+        # Add final summary
+        mean_reward = (total_reward_good + total_reward_adv) / 2.0
+        game_log.append({
+            "final_summary": True,
+            "env": "adversary",
+            "seed": seed,
+            "total_rewards": {"good": total_reward_good, "adversary": total_reward_adv},
+            "mean_reward": float(mean_reward),
+            "obs_format": obs_format,
+            "obs_tokens_mean": float(np.mean(obs_tokens)) if obs_tokens else 0.0,
+            "prompt_tokens_mean": float(np.mean(prompt_tokens)) if prompt_tokens else 0.0,
+            "circuit": llm_engine.circuit_summary(),
+        })
+
+        logger.info(
+            "EPISODE SUMMARY: Total Good Reward=%.2f, Total Adv Reward=%.2f, Mean Reward=%.2f",
+            total_reward_good, total_reward_adv, mean_reward,
+        )
+
+        # --- 5. 保存结果 ---
+        final_video = pipe.finish_video()
+        if final_video:
+            logger.info("Saved video to %s", final_video)
+
+        final_log = get_unique_filename(output_name + ".json")
+        logger.info("Saving logs to %s ...", final_log)
+        pipe.write_log(game_log, final_log)
+    finally:
+        pipe.close()
+        env.close()
 
 # ==============================================================================
 # 3. 运行入口
@@ -0,0 +1,206 @@
+"""
+Incremental cache of parsed episode summaries for the analysis scripts.
+
+The analyzers used to json.load and re-parse every episode log on every run,
+although a results tree only grows by the episodes of the model just
+benchmarked. EpisodeCache keeps a manifest next to the results
+
+    {"version": ..., "entries": {path: {"size", "mtime_ns", "sha1", "summary"}}}
+
+and only opens a file when it is new or its (size, mtime) changed. A changed
+stat with an unchanged content hash (copied / touched logs) reuses the cached
+summary without re-parsing. Aggregates are then rebuilt from the per-episode
+summaries, which is cheap compared with loading the logs.
+
+Decoding large pretty-printed logs is CPU-bound, so prefetch() fans the
+files that do need parsing out over a process pool before the analyzer
+walks them with get(); stats() reports the parsing throughput. Files are
+memory-mapped and decoded with episode_stream, keeping only the record
+fields the summarizer reads.
+
+    cache = EpisodeCache(BASE_DIR / ".analysis_cache.json", version="batch-1", fields=("step", "reward", ...))
+    cache.prefetch([(path, summarize) for path in paths], workers=8)
+    summary = cache.get(path, summarize)   # summarize(path, entries) -> JSON-serializable
+    cache.save()
+
+summarize runs in worker processes and must be picklable (a module-level
+function or a functools.partial of one).
+"""
+
+import hashlib
+import inspect
+import json
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from episode_stream import load_records
+from log_utils import get_logger
+
+logger = get_logger("analysis_cache")
+
+Summarize = Callable[[Path, List[Any]], Any]
+
+
+def source_digest(*modules: ModuleType) -> str:
+    """
+    Short hash of the source of the modules a summarizer depends on. Put it into the cache version so
+    that editing the summarize code invalidates the manifest without a manual bump.
+    """
+    h = hashlib.sha1()
+    for module in modules:
+        try:
+            h.update(inspect.getsource(module).encode("utf-8"))
+        except (OSError, TypeError):
+            # 无源码（冻结 / zip 包）：退回只用手动维护的版本标签
+            h.update(module.__name__.encode("utf-8"))
+    return h.hexdigest()[:12]
+
+
+def _load(path: str, summarize: Summarize, fields: Tuple[str, ...],
+          known_sha1: Optional[str]) -> Tuple[Dict[str, Any], bool]:
+    """Hash one log; summarize its records unless its content matches known_sha1. Runs in worker processes."""
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if st.st_size else b""
+        try:
+            digest = hashlib.sha1(buf).hexdigest()
+            entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": digest, "summary": None}
+            if digest == known_sha1:
+                return entry, False
+            entry["summary"] = summarize(Path(path), load_records(buf, fields))
+            return entry, True
+        finally:
+            if st.st_size:
+                buf.close()
+
+
+class EpisodeCache:
+    def __init__(self, manifest_path: Path, version: str, fields: Iterable[str], enabled: bool = True):
+        """
+        manifest_path: JSON manifest file (created on save)
+        version: summary format tag of the caller; a different version discards the manifest
+        fields: top-level record keys summarize() reads; all other keys are skipped while decoding
+        enabled: False ignores the manifest (every file is parsed once per run) and does not write it
+        """
+        self.manifest_path = Path(manifest_path)
+        self.version = version
+        self.fields = tuple(fields)
+        self.enabled = bool(enabled)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.hits = 0
+        self.rehashed = 0
+        self.parsed = 0
+        self.bytes_read = 0
+        self.load_s = 0.0
+        self._fresh = set()  # 本次运行中已读取过的文件
+        self._dirty = False
+        if self.enabled:
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            with self.manifest_path.open("r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            logger.warning("Ignoring unreadable analysis cache %s: %s", self.manifest_path, exc)
+            return
+        if manifest.get("version") != self.version:
+            logger.info("Analysis cache %s has version %s (need %s); rebuilding",
+                        self.manifest_path, manifest.get("version"), self.version)
+            self._dirty = True
+            return
+        self.entries = manifest.get("entries") or {}
+
+    def _is_current(self, key: str) -> bool:
+        cached = self.entries.get(key)
+        if cached is None:
+            return False
+        if key in self._fresh:
+            return True
+        st = os.stat(key)
+        return cached["size"] == st.st_size and cached["mtime_ns"] == st.st_mtime_ns
+
+    def _store(self, key: str, entry: Dict[str, Any], parsed: bool) -> None:
+        if parsed:
+            self.parsed += 1
+        else:
+            self.rehashed += 1
+            entry["summary"] = self.entries[key]["summary"]
+        self.bytes_read += entry["size"]
+        self.entries[key] = entry
+        self._fresh.add(key)
+        self._dirty = True
+
+    def prefetch(self, jobs: Iterable[Tuple[Path, Summarize]], workers: Optional[int] = None) -> None:
+        """
+        Parse every new / changed file of jobs [(path, summarize), ...] up front, in parallel.
+        workers: process count (default os.cpu_count()); <= 1 parses in this process
+        """
+        pending = {}
+        for path, summarize in jobs:
+            key = str(path)
+            if key not in pending and not self._is_current(key):
+                pending[key] = summarize
+        if not pending:
+            return
+        workers = min(workers or os.cpu_count() or 1, len(pending))
+        known = {key: (self.entries.get(key) or {}).get("sha1") for key in pending}
+        t0 = time.perf_counter()
+        if workers <= 1:
+            for key, summarize in pending.items():
+                self._store(key, *_load(key, summarize, self.fields, known[key]))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {key: pool.submit(_load, key, summarize, self.fields, known[key])
+                           for key, summarize in pending.items()}
+                for key, future in futures.items():
+                    self._store(key, *future.result())
+        self.load_s += time.perf_counter() - t0
+
+    def get(self, path: Path, summarize: Summarize) -> Any:
+        """Summary of one episode log, re-parsed only if the file is new or its content changed."""
+        key = str(path)
+        if self._is_current(key):
+            if key not in self._fresh:
+                self.hits += 1
+                self._fresh.add(key)
+            return self.entries[key]["summary"]
+        t0 = time.perf_counter()
+        self._store(key, *_load(key, summarize, self.fields, (self.entries.get(key) or {}).get("sha1")))
+        self.load_s += time.perf_counter() - t0
+        return self.entries[key]["summary"]
+
+    def save(self) -> None:
+        """Write the manifest (atomically), dropping entries whose file no longer exists."""
+        if not self.enabled:
+            return
+        stale = [key for key in self.entries if not os.path.exists(key)]
+        for key in stale:
+            del self.entries[key]
+        if not (self._dirty or stale):
+            return
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "entries": self.entries}, f, ensure_ascii=False)
+        os.replace(tmp, self.manifest_path)
+        self._dirty = False
+
+    def stats(self) -> Dict[str, Any]:
+        """File counts by source plus read/parse throughput of the files actually loaded."""
+        loaded = self.parsed + self.rehashed
+        return {
+            "cached": self.hits,
+            "rehashed": self.rehashed,
+            "parsed": self.parsed,
+            "load_s": round(self.load_s, 3),
+            "mb_per_s": round(self.bytes_read / 1e6 / self.load_s, 1) if self.load_s > 0 else None,
+            "files_per_s": round(loaded / self.load_s, 1) if self.load_s > 0 else None,
+        }
@@ -0,0 +1,443 @@
+"""
+Shared analysis engine for batch benchmark results (all games, any models).
+
+Results layout (run_batch_benchmark.py):
+
+    <base_dir>/summary.json                              results index {model: {game: ...}}
+    <base_dir>/<model>/<game>/<game>_ep<N>[_<k>].json    episode logs (latest rerun wins)
+
+load_results() discovers models and games from the index and the directory
+tree (or takes explicit lists), parses every episode log once through the
+incremental EpisodeCache, and returns a ResultsTable: per-episode summaries
+plus one set of row columns (episode, step, camp, reward) for the whole
+tree. Camp-level aggregates (step curves, camp totals) are numpy group-bys
+over those columns rather than per-model / per-game loops.
+
+Camps come from CampRegistry: per game an ordered list of
+(camp, role_regex, agent_regex) rules, first match wins, unmatched rows
+are "other". The defaults cover all nine games; a JSON config can add or
+override games:
+
+    {"base_dir": "results/batch_benchmarks", "models": ["kimi-k2.5"], "games": ["tag", "crypto"],
+     "camps": {"tag": [["predators", "predator", "^adversary_"], ["prey", "prey", "^agent_"]]}}
+"""
+
+import argparse
+import json
+import re
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import llm_qos
+from analysis_cache import EpisodeCache, source_digest
+from llm_qos import summarize_llm_calls
+from log_utils import get_logger
+from reward_stats import DEFAULT_BOOTSTRAP, DEFAULT_CI
+
+logger = get_logger("analysis")
+
+DEFAULT_BASE_DIR = Path("results/batch_benchmarks")
+INDEX_NAME = "summary.json"
+CACHE_NAME = ".analysis_cache.json"
+# 手动标签：缓存格式变化时修改；源码摘要：summarize_episode / 阵营规则 / llm_qos 的任何改动都会使缓存失效
+CACHE_VERSION = f"engine-2+{source_digest(sys.modules[__name__], llm_qos)}"
+# Record keys summarize_episode reads; thought / obs are skipped while decoding (see episode_stream.py)
+EPISODE_FIELDS = ("step", "agent", "role", "reward", "action", "llm", "final_summary", "mean_reward", "total_rewards",
+                  "seed")
+
+TEAM = "team"
+OTHER = "other"
+
+# (camp, role 正则, agent 正则)：按顺序匹配，role 或 agent 任一命中即归入该阵营（None 表示不检查）
+DEFAULT_CAMPS: Dict[str, List[Tuple[str, Optional[str], Optional[str]]]] = {
+    "simple": [("good", "", None)],
+    "spread": [("good", "", None)],
+    "reference": [("good", "", None)],
+    "speaker_listener": [("speaker", "speaker", "^speaker"), ("listener", "listener", "^listener")],
+    "adversary": [("adversary", "adversary|bad", "adversary"), ("good", "good", "^agent_")],
+    "tag": [("predators", "predator", "^adversary_"), ("prey", "prey", "^agent_")],
+    "push": [("adversary", "adversary", "^adversary_"), ("good", "good", "^agent_")],
+    "crypto": [("adversary", "eve", "^eve"), ("good", "alice|bob", "^(alice|bob)")],
+    "world_comm": [("adversary", "leader|hunter|adversary", "adversary"), ("good", "prey|good", "^agent_")],
+}
+GAMES = tuple(DEFAULT_CAMPS)
+
+_EPISODE_RE = re.compile(r"_ep(\d+)(?:_(\d+))?\.json$")
+
+
+class CampRegistry:
+    def __init__(self, rules: Optional[Dict[str, Sequence[Sequence[Optional[str]]]]] = None):
+        self.rules: Dict[str, List[Tuple[str, Any, Any]]] = {}
+        for game, game_rules in {**DEFAULT_CAMPS, **(rules or {})}.items():
+            self.rules[game] = [
+                (camp, re.compile(role_re, re.I) if role_re is not None else None,
+                 re.compile(agent_re, re.I) if agent_re is not None else None)
+                for camp, role_re, agent_re in game_rules
+            ]
+        self._memo: Dict[Tuple[str, str, str], str] = {}
+
+    def camp(self, game: str, agent: str, role: str = "") -> str:
+        key = (game, agent, role)
+        if key not in self._memo:
+            self._memo[key] = OTHER
+            for camp, role_re, agent_re in self.rules.get(game, ()):
+                if (role_re is not None and role_re.search(role)) or (agent_re is not None and agent_re.search(agent)):
+                    self._memo[key] = camp
+                    break
+        return self._memo[key]
+
+    def camps(self, game: str) -> List[str]:
+        """Camps of a game in registry order (without team / other)."""
+        return [camp for camp, _, _ in self.rules.get(game, ())]
+
+
+# ---------- 发现 ----------
+def episode_sort_key(path: Path) -> Tuple[int, int]:
+    match = _EPISODE_RE.search(path.name)
+    if not match:
+        return (10**9, 0)
+    return (int(match.group(1)), int(match.group(2) or 0))
+
+
+def latest_episode_files(game_dir: Path) -> List[Path]:
+    """One log per episode number: the most recently written rerun."""
+    grouped: Dict[int, List[Path]] = defaultdict(list)
+    for path in game_dir.glob("*.json"):
+        if _EPISODE_RE.search(path.name):
+            grouped[episode_sort_key(path)[0]].append(path)
+    return [max(grouped[ep], key=lambda p: (p.stat().st_mtime, episode_sort_key(p))) for ep in sorted(grouped)]
+
+
+def discover(base_dir: Path, models: Optional[Iterable[str]] = None,
+             games: Optional[Iterable[str]] = None) -> Tuple[List[str], List[str]]:
+    """Models / games from the results index and the directory tree; explicit lists win."""
+    index_models: List[str] = []
+    index_games = set()
+    index_path = base_dir / INDEX_NAME
+    if index_path.exists():
+        with index_path.open("r", encoding="utf-8") as f:
+            index = json.load(f)
+        for model, per_game in index.items():
+            index_models.append(model)
+            index_games.update(per_game or {})
+
+    tree_models: List[str] = []
+    tree_games = set()
+    if base_dir.is_dir():
+        for model_dir in sorted(p for p in base_dir.iterdir() if p.is_dir()):
+            found = [g.name for g in model_dir.iterdir() if g.is_dir() and any(g.glob("*_ep*.json"))]
+            if found:
+                tree_models.append(model_dir.name)
+                tree_games.update(found)
+
+    if models is None:
+        models = index_models + [m for m in tree_models if m not in index_models]
+    if games is None:
+        found_games = index_games | tree_games
+        games = [g for g in GAMES if g in found_games] + sorted(found_games - set(GAMES))
+    return list(models), list(games)
+
+
+# ---------- 单局摘要 ----------
+def safe_mean(values: Sequence[float]) -> float:
+    return sum(values) / len(values) if values else 0.0
+
+
+def safe_var(values: Sequence[float]) -> float:
+    if not values:
+        return 0.0
+    mean_val = safe_mean(values)
+    return sum((x - mean_val) ** 2 for x in values) / len(values)
+
+
+def summarize_episode(file_path: Path, data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Per-episode scalars plus compact step-row columns (JSON-serializable, cached per file)."""
+    final_summary = None
+    step_rows = []
+    for item in data:
+        if item.get("final_summary"):
+            final_summary = item
+        elif "step" in item:
+            step_rows.append(item)
+
+    rewards = [float(item.get("reward", 0.0)) for item in step_rows]
+    actions = [item.get("action") for item in step_rows if isinstance(item.get("action"), list)]
+    action_dims = [len(action) for action in actions]
+
+    max_step = max((int(item.get("step", 0)) for item in step_rows), default=-1)
+    step_count = max_step + 1 if max_step >= 0 else 0
+
+    per_agent_reward: Dict[str, float] = defaultdict(float)
+    actors: Dict[Tuple[str, str], int] = {}
+    who = []
+    for item in step_rows:
+        agent = item.get("agent", "unknown")
+        per_agent_reward[agent] += float(item.get("reward", 0.0))
+        actor = (str(agent), str(item.get("role", "")))
+        who.append(actors.setdefault(actor, len(actors)))
+
+    if final_summary:
+        episode_mean_reward = float(final_summary.get("mean_reward", 0.0))
+        total_rewards = final_summary.get("total_rewards", {}) or {}
+    elif per_agent_reward:
+        episode_mean_reward = safe_mean(list(per_agent_reward.values()))
+        total_rewards = dict(per_agent_reward)
+    else:
+        episode_mean_reward = 0.0
+        total_rewards = {}
+
+    return {
+        "file": str(file_path),
+        "step_rows": len(step_rows),
+        "step_count": step_count,
+        "episode_mean_reward": episode_mean_reward,
+        "reward_mean_per_row": safe_mean(rewards),
+        "reward_var_per_row": safe_var(rewards),
+        "reward_min_per_row": min(rewards) if rewards else 0.0,
+        "reward_max_per_row": max(rewards) if rewards else 0.0,
+        "action_dim_modes": sorted(set(action_dims)),
+        "total_rewards": total_rewards,
+        "has_final_summary": final_summary is not None,
+        # env.reset seed of the episode (None in logs written before runners recorded it)
+        "seed": final_summary.get("seed") if final_summary else None,
+        "agent_count": len(set(item.get("agent", "unknown") for item in step_rows)),
+        "llm_qos": summarize_llm_calls(step_rows),
+        # 列式步级数据：actors[who[i]] = [agent, role]
+        "actors": [list(actor) for actor in actors],
+        "rows": {"step": [int(item.get("step", 0)) for item in step_rows], "who": who, "reward": rewards},
+    }
+
+
+# ---------- 列式结果表 ----------
+class ResultsTable:
+    def __init__(self, base_dir: Path, models: List[str], games: List[str], registry: CampRegistry,
+                 episodes: Dict[Tuple[str, str], List[Dict[str, Any]]], missing: Dict[Tuple[str, str], str]):
+        """
+        episodes: {(model, game): [episode summary, ...]} in episode order
+        missing: {(model, game): reason} for groups without logs
+        """
+        self.base_dir = base_dir
+        self.models = models
+        self.games = games
+        self.registry = registry
+        self.episodes = episodes
+        self.missing = missing
+        self.groups = list(episodes)
+        self.camp_names = [TEAM, OTHER] + sorted({c for g in games for c in registry.camps(g)})
+        self._build_columns()
+
+    def _build_columns(self) -> None:
+        camp_code = {name: i for i, name in enumerate(self.camp_names)}
+        ep_group, ep_final, ep_seed = [], [], []
+        step, camp, agent, reward, ep_index = [], [], [], [], []
+        for group_idx, (model, game) in enumerate(self.groups):
+            for summary in self.episodes[(model, game)]:
+                rows = summary["rows"]
+                codes = np.array(
+                    [camp_code[self.registry.camp(game, agent, role)] for agent, role in summary["actors"]],
+                    dtype=np.int64,
+                )
+                n = len(rows["step"])
+                ep_index.append(np.full(n, len(ep_group), dtype=np.int64))
+                step.append(np.asarray(rows["step"], dtype=np.int64))
+                camp.append(codes[np.asarray(rows["who"], dtype=np.int64)] if n else np.zeros(0, dtype=np.int64))
+                agent.append(np.asarray(rows["who"], dtype=np.int64))
+                reward.append(np.asarray(rows["reward"], dtype=np.float64))
+                ep_group.append(group_idx)
+                ep_final.append(bool(summary.get("has_final_summary")))
+                # 配对轴用日志记录的 seed（不同批量脚本的 ep1 可能对应不同 seed）；旧日志回退到局号
+                seed = summary.get("seed")
+                ep_seed.append(int(seed) if seed is not None else episode_sort_key(Path(summary["file"]))[0])
+        empty_i, empty_f = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        self.ep_group = np.asarray(ep_group, dtype=np.int64)
+        self.ep_final = np.asarray(ep_final, dtype=bool)
+        self.ep_seed = np.asarray(ep_seed, dtype=np.int64)
+        self.ep_file = [summary["file"] for group in self.groups for summary in self.episodes[group]]
+        self.row_episode = np.concatenate(ep_index) if ep_index else empty_i
+        self.row_step = np.concatenate(step) if step else empty_i
+        self.row_camp = np.concatenate(camp) if camp else empty_i
+        self.row_reward = np.concatenate(reward) if reward else empty_f
+        # actor 序号（各局内按首次出现的顺序，同一游戏各局一致）
+        self.row_agent = np.concatenate(agent) if agent else empty_i
+
+    def _episode_slots(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[int]]:
+        """
+        (model index, game index, seed index) per episode, plus the sorted seeds (seed axis). Two episodes of a
+        (model, game) on the same seed share a slot; the later one in episode order is kept.
+        """
+        group_model = np.array([self.models.index(m) for m, _ in self.groups], dtype=np.int64)
+        group_game = np.array([self.games.index(g) for _, g in self.groups], dtype=np.int64)
+        seeds, seed_idx = np.unique(self.ep_seed, return_inverse=True)
+        return group_model[self.ep_group], group_game[self.ep_group], seed_idx.reshape(-1), seeds.tolist()
+
+    def episode_matrix(self, key: str = "episode_mean_reward", exclude: Iterable[str] = ()) -> np.ndarray:
+        """
+        (models, games, seeds) array of a per-episode scalar, NaN where missing;
+        seeds are the logged env seeds (episode_seeds()), paired across models. exclude: episode files to drop.
+        """
+        model_idx, game_idx, seed_idx, seeds = self._episode_slots()
+        out = np.full((len(self.models), len(self.games), len(seeds)), np.nan)
+        values = np.array([float(s[key]) for group in self.groups for s in self.episodes[group]])
+        keep = ~np.isin(np.array(self.ep_file, dtype=object), list(exclude)) if exclude else slice(None)
+        out[model_idx[keep], game_idx[keep], seed_idx[keep]] = values[keep]
+        return out
+
+    def reward_tensor(self) -> np.ndarray:
+        """(models, games, seeds, steps, agents) per-step rewards, NaN where missing."""
+        model_idx, game_idx, seed_idx, seeds = self._episode_slots()
+        n_steps = int(self.row_step.max()) + 1 if len(self.row_step) else 0
+        n_agents = int(self.row_agent.max()) + 1 if len(self.row_agent) else 0
+        out = np.full((len(self.models), len(self.games), len(seeds), n_steps, n_agents), np.nan)
+        ep = self.row_episode
+        out[model_idx[ep], game_idx[ep], seed_idx[ep], self.row_step, self.row_agent] = self.row_reward
+        return out
+
+    def episode_seeds(self) -> List[int]:
+        return self._episode_slots()[3]
+
+    def step_curves(self) -> Dict[str, Dict[str, Dict[int, Dict[str, float]]]]:
+        """
+        {model: {game: {step: {camp: mean reward}}}}: mean over agents of a camp within an episode step,
+        then over the episodes that reached the step; "team" pools all agents.
+        """
+        n_camps = len(self.camp_names)
+        episode = np.concatenate([self.row_episode, self.row_episode])
+        step = np.concatenate([self.row_step, self.row_step])
+        camp = np.concatenate([self.row_camp, np.zeros_like(self.row_camp)])  # 第二份全部记为 team
+        reward = np.concatenate([self.row_reward, self.row_reward])
+        curves: Dict[str, Dict[str, Dict[int, Dict[str, float]]]] = defaultdict(lambda: defaultdict(dict))
+        if not len(step):
+            return curves
+        n_steps = int(step.max()) + 1
+
+        # (episode, step, camp) 内均值
+        key, inverse = np.unique((episode * n_steps + step) * n_camps + camp, return_inverse=True)
+        ep_mean = np.bincount(inverse, weights=reward) / np.bincount(inverse)
+        # (group, step, camp) 上对各局取均值
+        ep_u, rest = np.divmod(key, n_steps * n_camps)
+        key2, inverse2 = np.unique(self.ep_group[ep_u] * (n_steps * n_camps) + rest, return_inverse=True)
+        group_mean = np.bincount(inverse2, weights=ep_mean) / np.bincount(inverse2)
+
+        group_u, rest2 = np.divmod(key2, n_steps * n_camps)
+        step_u, camp_u = np.divmod(rest2, n_camps)
+        for g, s, c, v in zip(group_u.tolist(), step_u.tolist(), camp_u.tolist(), group_mean.tolist()):
+            model, game = self.groups[g]
+            curves[model][game].setdefault(s, {})[self.camp_names[c]] = v
+        return curves
+
+    def camp_totals(self) -> Dict[str, Dict[str, Dict[str, Dict[str, float]]]]:
+        """
+        {model: {game: {camp: {mean, var, min, max, episodes}}}} of per-episode camp total reward
+        (final_summary total_rewards; several agents of one camp are averaged).
+        """
+        group_col, camp_col, value_col = [], [], []
+        for group_idx, (model, game) in enumerate(self.groups):
+            for summary in self.episodes[(model, game)]:
+                if not summary.get("has_final_summary"):
+                    continue
+                per_camp: Dict[str, List[float]] = defaultdict(list)
+                for key, value in (summary.get("total_rewards") or {}).items():
+                    per_camp[self.registry.camp(game, str(key), str(key))].append(float(value))
+                for camp_name, values in per_camp.items():
+                    group_col.append(group_idx)
+                    camp_col.append(self.camp_names.index(camp_name))
+                    value_col.append(sum(values) / len(values))
+
+        totals: Dict[str, Dict[str, Dict[str, Dict[str, float]]]] = defaultdict(lambda: defaultdict(dict))
+        if not value_col:
+            return totals
+        values = np.asarray(value_col, dtype=np.float64)
+        key, inverse = np.unique(np.asarray(group_col) * len(self.camp_names) + np.asarray(camp_col), return_inverse=True)
+        count = np.bincount(inverse)
+        mean = np.bincount(inverse, weights=values) / count
+        var = np.bincount(inverse, weights=(values - mean[inverse]) ** 2) / count
+        vmin = np.full(len(key), np.inf)
+        vmax = np.full(len(key), -np.inf)
+        np.minimum.at(vmin, inverse, values)
+        np.maximum.at(vmax, inverse, values)
+        for i, k in enumerate(key.tolist()):
+            group_idx, camp_idx = divmod(k, len(self.camp_names))
+            model, game = self.groups[group_idx]
+            totals[model][game][self.camp_names[camp_idx]] = {
+                "mean": float(mean[i]), "var": float(var[i]), "min": float(vmin[i]), "max": float(vmax[i]),
+                "episodes": int(count[i]),
+            }
+        return totals
+
+    def zero_total_episodes(self) -> List[Tuple[str, str, str]]:
+        """(model, game, file name) of multi-camp episodes whose final camp totals are all exactly 0."""
+        zeros = []
+        for model, game in self.groups:
+            if len(self.registry.camps(game)) < 2:
+                continue
+            for summary in self.episodes[(model, game)]:
+                totals = summary.get("total_rewards") or {}
+                if summary.get("has_final_summary") and totals and all(float(v) == 0.0 for v in totals.values()):
+                    zeros.append((model, game, Path(summary["file"]).name))
+        return zeros
+
+
+def load_results(base_dir: Path = DEFAULT_BASE_DIR, models: Optional[Iterable[str]] = None,
+                 games: Optional[Iterable[str]] = None, registry: Optional[CampRegistry] = None,
+                 incremental: bool = True, workers: Optional[int] = None) -> ResultsTable:
+    """Parse the whole results tree once (only new / changed logs with incremental=True)."""
+    base_dir = Path(base_dir)
+    models, games = discover(base_dir, models, games)
+    registry = registry or CampRegistry()
+
+    files: Dict[Tuple[str, str], List[Path]] = {}
+    missing: Dict[Tuple[str, str], str] = {}
+    for model in models:
+        for game in games:
+            game_dir = base_dir / model / game
+            if not game_dir.exists():
+                missing[(model, game)] = f"missing directory: {game_dir}"
+                continue
+            paths = latest_episode_files(game_dir)
+            if paths:
+                files[(model, game)] = paths
+            else:
+                missing[(model, game)] = "no json logs found"
+
+    cache = EpisodeCache(base_dir / CACHE_NAME, CACHE_VERSION, EPISODE_FIELDS, enabled=incremental)
+    cache.prefetch([(path, summarize_episode) for paths in files.values() for path in paths], workers=workers)
+    episodes = {group: [cache.get(path, summarize_episode) for path in paths] for group, paths in files.items()}
+    cache.save()
+    logger.info("Episode logs: %s", cache.stats())
+    return ResultsTable(base_dir, models, games, registry, episodes, missing)
+
+
+# ---------- CLI ----------
+def add_cli_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--config", type=str, default=None,
+                        help="JSON config with base_dir / models / games / camps (flags below override it)")
+    parser.add_argument("--base_dir", type=str, default=None, help=f"Results root (default {DEFAULT_BASE_DIR})")
+    parser.add_argument("--models", nargs="+", default=None, help="Models to analyze (default: discovered)")
+    parser.add_argument("--games", nargs="+", default=None, help="Games to analyze (default: discovered)")
+    parser.add_argument("--full", action="store_true", help="Re-parse every episode log instead of using the cache")
+    parser.add_argument("--workers", type=int, default=None, help="Parser / plotting processes (default: CPU count)")
+    parser.add_argument("--no_plots", action="store_true", help="Write the reports only (matplotlib is not imported)")
+    parser.add_argument("--force_plots", action="store_true", help="Redraw figures even if their data is unchanged")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Model the others are compared with on paired seeds (default: first model)")
+    parser.add_argument("--ci", type=float, default=DEFAULT_CI, help="Confidence level of intervals and bands")
+    parser.add_argument("--bootstrap", type=int, default=DEFAULT_BOOTSTRAP, help="Bootstrap resamples")
+
+
+def load_from_args(args: argparse.Namespace) -> ResultsTable:
+    config: Dict[str, Any] = {}
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    return load_results(
+        base_dir=Path(args.base_dir or config.get("base_dir") or DEFAULT_BASE_DIR),
+        models=args.models or config.get("models"),
+        games=args.games or config.get("games"),
+        registry=CampRegistry(config.get("camps")),
+        incremental=not args.full,
+        workers=args.workers,
+    )
@@ -1,129 +1,73 @@
-import json
-import math
-import re
+import argparse
 from collections import defaultdict
 from pathlib import Path
 
-import matplotlib.pyplot as plt
-
-BASE_DIR = Path("results/batch_benchmarks")
-TARGET_MODELS = ["Gemini-3.0-Flash", "kimi-k2.5", "Qwen-3-Max"]
-TARGET_GAMES = ["spread", "adversary", "tag"]
-REPORT_PATH = BASE_DIR / "batch_benchmark_report.md"
-PLOTS_DIR = BASE_DIR / "plots"
-TREND_PLOT_PATH = PLOTS_DIR / "reward_trend_by_game.png"
-SUMMARY_PLOT_PATH = PLOTS_DIR / "reward_mean_std.png"
-
-
-def _episode_sort_key(file_path: Path):
-    match = re.search(r"_ep(\d+)(?:_(\d+))?\.json$", file_path.name)
-    if not match:
-        return (10**9, 0)
-    ep = int(match.group(1))
-    rerun = int(match.group(2) or 0)
-    return (ep, rerun)
-
-
-def _group_latest_episode_files(files):
-    grouped = defaultdict(list)
-    for file_path in files:
-        match = re.search(r"_ep(\d+)(?:_\d+)?\.json$", file_path.name)
-        if not match:
-            continue
-        ep = int(match.group(1))
-        grouped[ep].append(file_path)
-
-    latest = []
-    for ep in sorted(grouped.keys()):
-        candidates = grouped[ep]
-        chosen = sorted(candidates, key=lambda p: (p.stat().st_mtime, _episode_sort_key(p)))[-1]
-        latest.append(chosen)
-    return latest
-
-
-def _safe_mean(values):
-    return sum(values) / len(values) if values else 0.0
-
-
-def _safe_var(values):
-    if not values:
-        return 0.0
-    mean_val = _safe_mean(values)
-    return sum((x - mean_val) ** 2 for x in values) / len(values)
+from analysis_engine import (
+    EPISODE_FIELDS,
+    ResultsTable,
+    add_cli_args,
+    load_from_args,
+    safe_mean,
+    safe_var,
+    summarize_episode,
+)
+from episode_stream import load_records
+from llm_qos import is_affected, merge_summaries
+from plot_cache import MANIFEST_NAME as PLOT_MANIFEST_NAME, FigureJob, game_axes, render_figures
+from reward_stats import DEFAULT_BOOTSTRAP, DEFAULT_CI, summarize
+
+# 模型 / 游戏由 analysis_engine 从结果目录（summary.json 与子目录）发现，或用 --models / --games 指定
+REPORT_NAME = "batch_benchmark_report.md"
+PLOTS_NAME = "plots"
+TREND_PLOT_NAME = "reward_trend_by_game.png"
+SUMMARY_PLOT_NAME = "reward_mean_ci.png"
+# Drop episodes whose LLM failure rate (default_zeros + transport_failure) exceeds this; None keeps all
+MAX_FAILURE_RATE = None
 
 
 def parse_episode_json(file_path: Path):
-    with file_path.open("r", encoding="utf-8") as file:
-        data = json.load(file)
-
-    final_summary = None
-    step_rows = []
-    for item in data:
-        if item.get("final_summary"):
-            final_summary = item
-        elif "step" in item:
-            step_rows.append(item)
-
-    rewards = [float(item.get("reward", 0.0)) for item in step_rows]
-    actions = [item.get("action") for item in step_rows if isinstance(item.get("action"), list)]
-    action_dims = [len(action) for action in actions]
-
-    max_step = max((int(item.get("step", 0)) for item in step_rows), default=-1)
-    step_count = max_step + 1 if max_step >= 0 else 0
-
-    per_agent_reward = defaultdict(float)
-    for item in step_rows:
-        agent = item.get("agent", "unknown")
-        per_agent_reward[agent] += float(item.get("reward", 0.0))
-
-    episode_mean_reward = None
-    total_rewards = {}
-    if final_summary:
-        episode_mean_reward = float(final_summary.get("mean_reward", 0.0))
-        total_rewards = final_summary.get("total_rewards", {}) or {}
-    else:
-        if per_agent_reward:
-            episode_mean_reward = _safe_mean(list(per_agent_reward.values()))
-            total_rewards = dict(per_agent_reward)
-        else:
-            episode_mean_reward = 0.0
-
-    return {
-        "file": str(file_path),
-        "step_rows": len(step_rows),
-        "step_count": step_count,
-        "episode_mean_reward": episode_mean_reward,
-        "reward_mean_per_row": _safe_mean(rewards),
-        "reward_var_per_row": _safe_var(rewards),
-        "reward_min_per_row": min(rewards) if rewards else 0.0,
-        "reward_max_per_row": max(rewards) if rewards else 0.0,
-        "action_dim_modes": sorted(set(action_dims)),
-        "total_rewards": total_rewards,
-        "agent_count": len(set(item.get("agent", "unknown") for item in step_rows)),
-    }
+    return summarize_episode(file_path, load_records(file_path, EPISODE_FIELDS))
 
 
-def analyze_all():
+def analyze_all(table: ResultsTable, baseline=None, ci: float = DEFAULT_CI, n_boot: int = DEFAULT_BOOTSTRAP):
+    """
+    Per (model, game) statistics over the episode summaries of a loaded ResultsTable.
+    Episode-mean statistics, bootstrap CIs and paired-seed differences against `baseline`
+    (default: first model) come from one reward_stats.summarize() pass over all models and games.
+    """
     all_results = {}
     model_game_stats = {}
 
-    for model in TARGET_MODELS:
+    excluded_files = {
+        group: [ep["file"] for ep in episodes if is_affected(ep["llm_qos"], MAX_FAILURE_RATE)]
+        for group, episodes in table.episodes.items()
+    }
+    if baseline not in table.models:
+        baseline = table.models[0] if table.models else None
+    stats = summarize(
+        table.episode_matrix(exclude=[f for files in excluded_files.values() for f in files]),
+        baseline=table.models.index(baseline) if baseline is not None else None,
+        n_boot=n_boot,
+        ci=ci,
+    )
+    stats["baseline"] = baseline
+    ep_stats, paired = stats["episode"], stats["paired"]
+
+    for mi, model in enumerate(table.models):
         all_results[model] = {}
-        model_dir = BASE_DIR / model
-        for game in TARGET_GAMES:
-            game_dir = model_dir / game
-            if not game_dir.exists():
-                all_results[model][game] = {"error": f"missing directory: {game_dir}"}
+        for gi, game in enumerate(table.games):
+            if (model, game) in table.missing:
+                all_results[model][game] = {"error": table.missing[(model, game)]}
                 continue
 
-            files = sorted(game_dir.glob("*.json"), key=_episode_sort_key)
-            files = _group_latest_episode_files(files)
-            if not files:
-                all_results[model][game] = {"error": "no json logs found"}
+            episodes = table.episodes[(model, game)]
+            llm_qos = merge_summaries([ep["llm_qos"] for ep in episodes])
+            excluded = excluded_files[(model, game)]
+            episodes = [ep for ep in episodes if ep["file"] not in excluded]
+            if not episodes:
+                all_results[model][game] = {"error": "all episodes excluded by MAX_FAILURE_RATE", "llm_qos": llm_qos}
                 continue
 
-            episodes = [parse_episode_json(file_path) for file_path in files]
-
             ep_means = [ep["episode_mean_reward"] for ep in episodes]
             step_counts = [ep["step_count"] for ep in episodes]
             row_reward_means = [ep["reward_mean_per_row"] for ep in episodes]
@@ -138,8 +82,8 @@ def analyze_all():
 
             role_reward_summary = {
                 role: {
-                    "mean_total_reward": _safe_mean(vals),
-                    "var_total_reward": _safe_var(vals),
+                    "mean_total_reward": safe_mean(vals),
+                    "var_total_reward": safe_var(vals),
                     "min_total_reward": min(vals),
                     "max_total_reward": max(vals),
                 }
@@ -148,40 +92,41 @@ def analyze_all():
 
             game_stats = {
                 "episodes": len(episodes),
-                "episode_mean_reward_avg": _safe_mean(ep_means),
-                "episode_mean_reward_var": _safe_var(ep_means),
-                "episode_mean_reward_std": math.sqrt(_safe_var(ep_means)),
-                "episode_mean_reward_min": min(ep_means),
-                "episode_mean_reward_max": max(ep_means),
-                "avg_step_count": _safe_mean(step_counts),
-                "avg_reward_mean_per_row": _safe_mean(row_reward_means),
-                "avg_reward_var_per_row": _safe_mean(row_reward_vars),
+                "episode_mean_reward_avg": float(ep_stats["mean"][mi, gi]),
+                "episode_mean_reward_var": float(ep_stats["var"][mi, gi]),
+                "episode_mean_reward_std": float(ep_stats["std"][mi, gi]),
+                "episode_mean_reward_min": float(ep_stats["min"][mi, gi]),
+                "episode_mean_reward_max": float(ep_stats["max"][mi, gi]),
+                "episode_mean_reward_ci": [float(stats["ci_low"][mi, gi]), float(stats["ci_high"][mi, gi])],
+                "paired_vs_baseline": None if model == baseline or paired is None else {
+                    "baseline": baseline,
+                    "seeds": int(paired["n"][mi, gi]),
+                    "mean_diff": float(paired["mean"][mi, gi]),
+                    "ci": [float(paired["ci_low"][mi, gi]), float(paired["ci_high"][mi, gi])],
+                },
+                "avg_step_count": safe_mean(step_counts),
+                "avg_reward_mean_per_row": safe_mean(row_reward_means),
+                "avg_reward_var_per_row": safe_mean(row_reward_vars),
                 "action_dims_seen": sorted(action_dims),
                 "role_reward_summary": role_reward_summary,
                 "episode_files": [ep["file"] for ep in episodes],
                 "episode_mean_series": ep_means,
+                "llm_qos": llm_qos,
+                "excluded_episode_files": excluded,
             }
 
             all_results[model][game] = game_stats
             model_game_stats[(model, game)] = game_stats
 
-    return all_results, model_game_stats
-
+    return all_results, model_game_stats, stats
 
-def build_plots(model_game_stats):
-    PLOTS_DIR.mkdir(parents=True, exist_ok=True)
 
-    fig, axes = plt.subplots(1, len(TARGET_GAMES), figsize=(18, 5), sharey=False)
-    if len(TARGET_GAMES) == 1:
-        axes = [axes]
-
-    for idx, game in enumerate(TARGET_GAMES):
+def render_trend_plot(plt, data, path: Path):
+    games = data["games"]
+    fig, axes = game_axes(plt, len(games))
+    for idx, game in enumerate(games):
         ax = axes[idx]
-        for model in TARGET_MODELS:
-            stats = model_game_stats.get((model, game))
-            if not stats or "episode_mean_series" not in stats:
-                continue
-            series = stats["episode_mean_series"]
+        for model, series in data["series"][game].items():
             x = list(range(1, len(series) + 1))
             ax.plot(x, series, marker="o", linewidth=1.5, label=model)
 
@@ -192,58 +137,76 @@ def build_plots(model_game_stats):
 
     handles, labels = axes[0].get_legend_handles_labels()
     if handles:
-        fig.legend(handles, labels, loc="upper center", ncol=3, bbox_to_anchor=(0.5, 1.08))
+        fig.legend(handles, labels, loc="upper center", ncol=min(len(handles), 4), bbox_to_anchor=(0.5, 1.08))
     fig.tight_layout()
-    fig.savefig(TREND_PLOT_PATH, dpi=180, bbox_inches="tight")
-    plt.close(fig)
+    fig.savefig(path, dpi=180, bbox_inches="tight")
 
-    fig, axes = plt.subplots(1, len(TARGET_GAMES), figsize=(18, 5), sharey=False)
-    if len(TARGET_GAMES) == 1:
-        axes = [axes]
 
-    for idx, game in enumerate(TARGET_GAMES):
+def render_summary_plot(plt, data, path: Path):
+    games = data["games"]
+    fig, axes = game_axes(plt, len(games))
+    for idx, game in enumerate(games):
         ax = axes[idx]
-        means = []
-        stds = []
-        labels = []
-        for model in TARGET_MODELS:
-            stats = model_game_stats.get((model, game))
-            if not stats:
-                continue
-            means.append(stats["episode_mean_reward_avg"])
-            stds.append(stats["episode_mean_reward_std"])
-            labels.append(model)
+        bars = data["bars"][game]
+        labels = [model for model, _, _, _ in bars]
+        means = [mean for _, mean, _, _ in bars]
+        errors = [[mean - low for _, mean, low, _ in bars], [high - mean for _, mean, _, high in bars]]
 
         x = list(range(len(labels)))
         if labels:
-            ax.bar(x, means, yerr=stds, capsize=4)
+            ax.bar(x, means, yerr=errors, capsize=4)
             ax.set_xticks(x)
             ax.set_xticklabels(labels, rotation=20, ha="right")
 
-        ax.set_title(f"{game} mean ± std")
+        ax.set_title(f"{game} mean ({data['ci']:.0%} bootstrap CI)")
         ax.set_ylabel("Mean reward")
         ax.grid(True, axis="y", alpha=0.25)
 
     fig.tight_layout()
-    fig.savefig(SUMMARY_PLOT_PATH, dpi=180, bbox_inches="tight")
-    plt.close(fig)
+    fig.savefig(path, dpi=180, bbox_inches="tight")
 
 
-def build_report(all_results):
+def plot_jobs(model_game_stats, models, games, plots_dir: Path, ci: float = DEFAULT_CI):
+    """Figure jobs of the report; each carries only the aggregates it draws (see plot_cache.py)."""
+    series = {game: {} for game in games}
+    bars = {game: [] for game in games}
+    for game in games:
+        for model in models:
+            stats = model_game_stats.get((model, game))
+            if not stats:
+                continue
+            series[game][model] = stats["episode_mean_series"]
+            bars[game].append([model, stats["episode_mean_reward_avg"], *stats["episode_mean_reward_ci"]])
+    return [
+        FigureJob(plots_dir / TREND_PLOT_NAME, render_trend_plot, {"games": games, "series": series}),
+        FigureJob(plots_dir / SUMMARY_PLOT_NAME, render_summary_plot, {"games": games, "bars": bars, "ci": ci}),
+    ]
+
+
+def build_plots(model_game_stats, models, games, plots_dir: Path, ci: float = DEFAULT_CI,
+                workers=None, force: bool = False):
+    """Draw the report figures whose data changed since the last run (matplotlib is imported only then)."""
+    return render_figures(plot_jobs(model_game_stats, models, games, plots_dir, ci),
+                          plots_dir / PLOT_MANIFEST_NAME, workers=workers, force=force)
+
+
+def build_report(all_results, models, games, base_dir: Path, summary, figures=None):
     lines = []
     lines.append("# Batch Benchmarks 日志分析报告")
     lines.append("")
-    lines.append(f"分析目录: `{BASE_DIR}`")
+    lines.append(f"分析目录: `{base_dir}`")
+    lines.append("")
+    lines.append(f"模型: {', '.join(models) or '-'}；游戏: {', '.join(games) or '-'}")
     lines.append("")
     lines.append("## 1) 按游戏区分的 JSON 日志读取路径")
     lines.append("")
 
-    for game in TARGET_GAMES:
+    for game in games:
         lines.append(f"### {game}")
         lines.append("")
         lines.append("| 模型 | 日志数量 | 示例日志路径 |")
         lines.append("|---|---:|---|")
-        for model in TARGET_MODELS:
+        for model in models:
             stats = all_results.get(model, {}).get(game, {})
             if "error" in stats:
                 lines.append(f"| {model} | 0 | {stats['error']} |")
@@ -257,7 +220,7 @@ def build_report(all_results):
     lines.append("")
     lines.append("日志中可直接读取的核心字段：")
     lines.append("")
-    lines.append("- 步级字段：`step`, `agent`, `role`, `obs`, `action`, `thought`, `reward`")
+    lines.append("- 步级字段：`step`, `agent`, `role`, `obs`, `action`, `thought`, `reward`, `llm`（解析结果/尝试次数/延迟）")
     lines.append("- 局级字段（结尾）：`final_summary`, `total_rewards`, `mean_reward`")
     lines.append("- 可衍生统计：每局步数、每步奖励均值/方差、动作维度一致性、各角色总回报统计")
     lines.append("")
@@ -267,8 +230,8 @@ def build_report(all_results):
     lines.append("| 模型 | 游戏 | 局数 | 局均值reward均值 | 局均值reward方差 | 局均值reward标准差 | min | max | 平均步数 | 动作维度 |")
     lines.append("|---|---|---:|---:|---:|---:|---:|---:|---:|---|")
 
-    for model in TARGET_MODELS:
-        for game in TARGET_GAMES:
+    for model in models:
+        for game in games:
             stats = all_results.get(model, {}).get(game, {})
             if "error" in stats:
                 lines.append(f"| {model} | {game} | 0 | - | - | - | - | - | - | {stats['error']} |")
@@ -288,16 +251,36 @@ def build_report(all_results):
                 )
             )
 
+    lines.append("")
+    lines.append(f"### 置信区间与配对差异（{summary['ci']:.0%} bootstrap，{summary['n_boot']} 次重采样；基线: {summary['baseline'] or '-'}）")
+    lines.append("")
+    lines.append("配对差异 = 该模型局均值 − 基线模型同一 seed 的局均值，只统计两者都有的 seed。")
+    lines.append("")
+    lines.append("| 模型 | 游戏 | 局均值reward均值 | CI 下限 | CI 上限 | 配对 seed 数 | 与基线差值 | 差值 CI |")
+    lines.append("|---|---|---:|---:|---:|---:|---:|---|")
+    for model in models:
+        for game in games:
+            game_stats = all_results.get(model, {}).get(game, {})
+            if "error" in game_stats:
+                continue
+            low, high = game_stats["episode_mean_reward_ci"]
+            pair = game_stats.get("paired_vs_baseline")
+            if pair and pair["seeds"]:
+                pair_cols = f"{pair['seeds']} | {pair['mean_diff']:+.4f} | [{pair['ci'][0]:+.4f}, {pair['ci'][1]:+.4f}]"
+            else:
+                pair_cols = "- | - | -"
+            lines.append(f"| {model} | {game} | {game_stats['episode_mean_reward_avg']:.4f} | {low:.4f} | {high:.4f} | {pair_cols} |")
+
     lines.append("")
     lines.append("## 4) 各游戏-各模型角色总回报统计")
     lines.append("")
 
-    for game in TARGET_GAMES:
+    for game in games:
         lines.append(f"### {game}")
         lines.append("")
         lines.append("| 模型 | 角色 | 平均总回报 | 方差 | 最小值 | 最大值 |")
         lines.append("|---|---|---:|---:|---:|---:|")
-        for model in TARGET_MODELS:
+        for model in models:
             stats = all_results.get(model, {}).get(game, {})
             if "error" in stats:
                 lines.append(f"| {model} | - | - | - | - | - |")
@@ -312,22 +295,62 @@ def build_report(all_results):
                 )
         lines.append("")
 
-    lines.append("## 5) 折线图与可视化")
+    lines.append("## 5) LLM 调用质量（解析失败 / 兜底动作）")
+    lines.append("")
+    if MAX_FAILURE_RATE is not None:
+        lines.append(f"失败率 > {MAX_FAILURE_RATE:.0%} 的局已从第 3、4 节统计中剔除。")
+        lines.append("")
+    lines.append("| 模型 | 游戏 | 调用数 | clean | regex兜底 | 默认零动作 | 传输失败 | 失败率 | 重试次数 | 重试耗时(s) | 剔除局数 |")
+    lines.append("|---|---|---:|---:|---:|---:|---:|---:|---:|---:|---:|")
+    for model in models:
+        for game in games:
+            stats = all_results.get(model, {}).get(game, {})
+            qos = stats.get("llm_qos")
+            if not qos or not qos["calls"]:
+                lines.append(f"| {model} | {game} | 0 | - | - | - | - | - | - | - | - |")
+                continue
+            o = qos["outcomes"]
+            lines.append(
+                f"| {model} | {game} | {qos['calls']} | {o['clean']} | {o['regex_fallback']} | {o['default_zeros']} | "
+                f"{o['transport_failure']} | {qos['failure_rate']:.2%} | {qos['retries']} | {qos['wasted_retry_s']:.1f} | "
+                f"{len(stats.get('excluded_episode_files', []))} |"
+            )
+    lines.append("")
+
+    lines.append("## 6) 折线图与可视化")
     lines.append("")
-    lines.append("- 局均值 reward 折线图（按游戏分面）: ![trend](plots/reward_trend_by_game.png)")
-    lines.append("- 均值±标准差柱状图: ![summary](plots/reward_mean_std.png)")
+    # 只嵌入本次 render_figures 画出或确认最新的图（--no_plots 时没有）
+    figures = figures or {}
+    plots_dir = base_dir / PLOTS_NAME
+    if str(plots_dir / TREND_PLOT_NAME) in figures:
+        lines.append(f"- 局均值 reward 折线图（按游戏分面）: ![trend]({PLOTS_NAME}/{TREND_PLOT_NAME})")
+    if str(plots_dir / SUMMARY_PLOT_NAME) in figures:
+        lines.append(f"- 均值与 bootstrap 置信区间柱状图: ![summary]({PLOTS_NAME}/{SUMMARY_PLOT_NAME})")
+    if not figures:
+        lines.append("- 未生成图表（--no_plots）")
     lines.append("")
 
-    REPORT_PATH.write_text("\n".join(lines), encoding="utf-8")
+    (base_dir / REPORT_NAME).write_text("\n".join(lines), encoding="utf-8")
 
 
 def main():
-    all_results, model_game_stats = analyze_all()
-    build_plots(model_game_stats)
-    build_report(all_results)
-    print(f"Report generated: {REPORT_PATH}")
-    print(f"Trend plot: {TREND_PLOT_PATH}")
-    print(f"Summary plot: {SUMMARY_PLOT_PATH}")
+    parser = argparse.ArgumentParser(description="Analyze batch benchmark episode logs.")
+    add_cli_args(parser)
+    args = parser.parse_args()
+
+    table = load_from_args(args)
+    all_results, model_game_stats, summary = analyze_all(table, baseline=args.baseline, ci=args.ci, n_boot=args.bootstrap)
+    plots_dir = table.base_dir / PLOTS_NAME
+    figures = {}
+    if not args.no_plots:
+        figures = build_plots(model_game_stats, table.models, table.games, plots_dir, ci=args.ci,
+                              workers=args.workers, force=args.force_plots)
+    build_report(all_results, table.models, table.games, table.base_dir, summary, figures)
+    print(f"Report generated: {table.base_dir / REPORT_NAME}")
+    if args.no_plots:
+        return
+    print(f"Trend plot: {plots_dir / TREND_PLOT_NAME} ({figures[str(plots_dir / TREND_PLOT_NAME)]})")
+    print(f"Summary plot: {plots_dir / SUMMARY_PLOT_NAME} ({figures[str(plots_dir / SUMMARY_PLOT_NAME)]})")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,133 @@
+"""
+Micro-benchmark for action extraction (utils_api.extract_action) against the
+previous _parse_json implementation.
+
+The corpus is every step "thought" (raw model response) found in episode
+logs under --log_dir. When no logs are available, a synthetic corpus of
+typical response shapes is generated instead (plain JSON, fenced JSON,
+<think> reasoning of varying length, nested objects, truncated output).
+
+Usage:
+    python bench_parse.py --log_dir results/batch_benchmarks
+    python bench_parse.py --synthetic 5000
+"""
+
+import argparse
+import json
+import random
+import re
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+
+from utils_api import extract_action
+
+
+def _legacy_parse_json(text: str) -> np.ndarray:
+    """The previous APIInferencer._parse_json, kept for comparison."""
+    try:
+        clean_text = text.split("</think>")[-1] if "</think>" in text else text
+        match = re.search(r'```json\s*(\{.*?\})\s*```', clean_text, re.DOTALL)
+        if not match:
+            match = re.search(r'(\{.*?\})', clean_text, re.DOTALL)
+        if match:
+            data = json.loads(match.group(1))
+            return np.array(data.get("action", [0] * 5), dtype=np.float32)
+        match = re.search(r'"action"\s*:\s*\[(.*?)\]', clean_text, re.DOTALL)
+        if match:
+            nums = re.findall(r"[-+]?\d*\.\d+|\d+", match.group(1))
+            if len(nums) >= 5:
+                return np.array([float(x) for x in nums[:5]], dtype=np.float32)
+        return np.array([0, 0, 0, 0, 0], dtype=np.float32)
+    except Exception:
+        return np.array([0, 0, 0, 0, 0], dtype=np.float32)
+
+
+def load_logged_responses(log_dir: Path) -> List[str]:
+    texts = []
+    for path in sorted(log_dir.rglob("*.json")):
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not isinstance(data, list):
+            continue
+        texts.extend(e["thought"] for e in data
+                     if isinstance(e, dict) and isinstance(e.get("thought"), str) and not e["thought"].startswith("Failed:"))
+    return texts
+
+
+def synthetic_responses(n: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    words = "move toward the landmark avoid collision teammate covers target so I go left up".split()
+    out = []
+    for i in range(n):
+        dim = rng.choice([3, 4, 5, 5, 5, 9])
+        action = [round(rng.random(), 3) for _ in range(dim)]
+        body = {"action": action, "notes": " ".join(rng.choices(words, k=rng.randint(3, 20)))}
+        kind = i % 6
+        if kind == 0:
+            text = json.dumps(body)
+        elif kind == 1:
+            text = "```json\n" + json.dumps(body, indent=2) + "\n```"
+        elif kind == 2:
+            think = " ".join(rng.choices(words, k=rng.randint(200, 1500)))
+            text = f"<think>{think} maybe {{\"action\": [1, 0]}}?</think>\n" + json.dumps(body)
+        elif kind == 3:
+            text = json.dumps({"analysis": {"target": [0.1, -0.2], "plan": "cover"}, **body})
+        elif kind == 4:
+            text = "Reasoning: " + " ".join(rng.choices(words, k=rng.randint(20, 200))) + "\nFinal: " + json.dumps(body)
+        else:
+            text = json.dumps(body)[:-12]  # truncated output
+        out.append(text)
+    return out
+
+
+def _time(fn: Callable[[str], np.ndarray], texts: List[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for t in texts:
+            fn(t)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark action extraction on logged or synthetic responses.")
+    p.add_argument("--log_dir", type=str, default="results")
+    p.add_argument("--synthetic", type=int, default=3000, help="Corpus size when no logs are found")
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args()
+
+    texts = load_logged_responses(Path(args.log_dir)) if Path(args.log_dir).exists() else []
+    source = f"{len(texts)} logged responses from {args.log_dir}"
+    if not texts:
+        texts = synthetic_responses(args.synthetic)
+        source = f"{len(texts)} synthetic responses"
+
+    new_fn = lambda t: extract_action(t)[0]
+    t_old = _time(_legacy_parse_json, texts, args.repeat)
+    t_new = _time(new_fn, texts, args.repeat)
+
+    outcomes = {}
+    same = 0
+    for t in texts:
+        vec, outcome = extract_action(t)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        old = _legacy_parse_json(t)
+        same += int(old.shape == vec.shape and np.allclose(old, vec))
+    n = len(texts)
+    print(f"corpus: {source}, mean length {sum(map(len, texts)) / n:.0f} chars")
+    print(f"legacy _parse_json : {1e6 * t_old / n:8.2f} us/response")
+    print(f"extract_action     : {1e6 * t_new / n:8.2f} us/response  ({t_old / t_new:.2f}x)")
+    print(f"outcomes: {outcomes}")
+    print(f"identical to legacy: {same}/{n} ({same / n:.1%}); differences are nested JSON, non-5 widths and "
+          f"reasoning-text objects the legacy regex picked up")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,11 @@ Unified benchmark runner for all 9 MPE games.
 Features:
 - Runs any supported game for N episodes with adjustable parameters.
 - Each episode saves video (*.mp4) and JSON log (per-step: obs, action, thought, reward).
-- Computes per-episode total/mean rewards and aggregates mean/std across episodes.
+- Computes per-episode total/mean rewards and aggregates mean/std (plus a Student-t CI) across episodes.
 """
 
-import json
-import math
 import sys
+import time
 from pathlib import Path
 from typing import Any, Callable, Dict, List, Optional
 
@@ -34,6 +33,15 @@ from reference import run_reference_game
 from speaker_listener import run_speaker_listener
 from world_comm import run_world_comm
 from simple import run_simple_game
+from log_utils import episode_context, get_logger, log_progress
+from sweep_status import STATUS
+import metrics_exporter as metrics
+from llm_qos import is_affected, merge_summaries, summarize_llm_calls
+from circuit_breaker import CircuitOpenError
+from episode_stream import load_records
+from reward_stats import describe, t_interval
+
+logger = get_logger("benchmark")
 
 # Map environment name to its runner callable and a default step cap for display/logging only
 GAME_RUNNERS: Dict[str, Callable[..., None]] = {
@@ -59,9 +67,15 @@ def _find_latest_with_prefix(prefix: Path, suffix: str) -> Optional[Path]:
     return candidates[-1] if candidates else None
 
 
+# Record keys read from episode logs; thought / obs are skipped while decoding (see episode_stream.py)
+_LOG_FIELDS = (
+    "step", "agent", "reward", "obs_tokens", "llm",
+    "final_summary", "total_rewards", "mean_reward", "obs_format", "obs_tokens_mean", "prompt_tokens_mean", "circuit",
+)
+
+
 def _parse_episode_log(log_path: Path) -> Dict[str, Any]:
-    with log_path.open("r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_records(log_path, _LOG_FIELDS)
 
     # Strategy: Prioritize final_summary (most accurate for multi-role scenarios)
     final_summary = None
@@ -78,12 +92,28 @@ def _parse_episode_log(log_path: Path) -> Dict[str, Any]:
             steps.append(entry)
     
     # ✅ Primary: Use final_summary if available (accurate for role-based aggregation)
+    # Prompt-size stats (obs_tokens per agent-step, see obs/encode_obs.py)
+    obs_token_counts = [e["obs_tokens"] for e in steps if e.get("obs_tokens") is not None]
+    token_stats = {
+        "obs_format": (final_summary or {}).get("obs_format", "verbose"),
+        "obs_tokens_mean": (
+            float(final_summary["obs_tokens_mean"]) if final_summary and "obs_tokens_mean" in final_summary
+            else (sum(obs_token_counts) / len(obs_token_counts) if obs_token_counts else None)
+        ),
+        "prompt_tokens_mean": (final_summary or {}).get("prompt_tokens_mean"),
+        # Parse/transport outcome of every LLM call (see llm_qos.py)
+        "llm_qos": summarize_llm_calls(steps),
+        # Circuit breaker state and trips during the episode (see circuit_breaker.py)
+        "circuit": (final_summary or {}).get("circuit"),
+    }
+
     if final_summary:
         return {
             "log_path": str(log_path),
             "total_rewards": final_summary.get("total_rewards", {}),
             "mean_reward": float(final_summary.get("mean_reward", 0.0)),
             "steps": len(steps),
+            **token_stats,
         }
     
     # ✅ Fallback: Accumulate per-agent rewards (for backwards compatibility)
@@ -101,6 +131,7 @@ def _parse_episode_log(log_path: Path) -> Dict[str, Any]:
         "total_rewards": rewards_per_agent,
         "mean_reward": mean_reward,
         "steps": len(steps),
+        **token_stats,
     }
 
 
@@ -158,17 +189,84 @@ def run_single_episode(env_name: str, provider: str, episode_idx: int, output_di
             "mean_reward": parsed["mean_reward"],
             "total_rewards": parsed["total_rewards"],
             "steps": parsed["steps"],
+            "obs_format": parsed["obs_format"],
+            "obs_tokens_mean": parsed["obs_tokens_mean"],
+            "prompt_tokens_mean": parsed["prompt_tokens_mean"],
+            "llm_qos": parsed["llm_qos"],
+            "circuit": parsed["circuit"],
         })
 
     return episode_stats
 
 
+def _run_tracked_episode(
+    env_name: str,
+    provider: str,
+    ep: int,
+    episodes: int,
+    seed: int,
+    out_dir: Path,
+    status_model: str,
+    max_failure_rate: Optional[float] = None,
+    rerun: int = 0,
+    max_reruns: int = 0,
+    **game_kwargs,
+) -> Dict[str, Any]:
+    """
+    run_single_episode plus sweep status, metrics and the per-episode progress line.
+    Attempt `rerun` of planned episode `ep`: an attempt flagged by max_failure_rate that will be re-run
+    (rerun < max_reruns) is counted as a rerun, so started / done stay one per planned episode.
+    """
+    t0 = time.perf_counter()
+    ep_labels = {"model": status_model, "env": env_name}
+    started = STATUS.episode_started(status_model, env_name)
+    if rerun == 0:
+        metrics.EPISODES_STARTED.inc(**ep_labels)
+    metrics.EPISODES_IN_FLIGHT.inc(**ep_labels)
+    try:
+        with episode_context(env=env_name, episode=ep, seed=seed):
+            logger.info("Episode %d/%d starting", ep, episodes)
+            stats = run_single_episode(env_name, provider, ep, out_dir, seed=seed, **game_kwargs)
+    except BaseException as e:
+        STATUS.episode_finished(status_model, env_name, started, ok=False)
+        metrics.EPISODES_IN_FLIGHT.dec(**ep_labels)
+        metrics.EPISODES_FINISHED.inc(status="circuit_open" if isinstance(e, CircuitOpenError) else "error", **ep_labels)
+        raise
+    stats["status"] = "ok"
+    stats["reruns"] = rerun
+    stats["qos_affected"] = is_affected(stats.get("llm_qos") or {"calls": 0}, max_failure_rate)
+    retry = stats["qos_affected"] and rerun < max_reruns
+    STATUS.episode_finished(status_model, env_name, started, ok=True, rerun=retry)
+    metrics.EPISODES_IN_FLIGHT.dec(**ep_labels)
+    if retry:
+        metrics.EPISODE_RERUNS.inc(**ep_labels)
+    else:
+        metrics.EPISODES_FINISHED.inc(status="ok", **ep_labels)
+    metrics.EPISODE_DURATION.observe(time.perf_counter() - t0, **ep_labels)
+    mean_r = stats.get("mean_reward")
+    if mean_r is not None and not retry:
+        metrics.EPISODE_MEAN_REWARD.set(mean_r, **ep_labels)
+    qos = stats.get("llm_qos") or {}
+    log_progress(
+        logger, "[Benchmark] episode done",
+        env=env_name, episode=f"{ep}/{episodes}", seed=seed, rerun=rerun or None,
+        mean_reward=round(mean_r, 4) if mean_r is not None else None,
+        steps=stats.get("steps"), elapsed_s=round(time.perf_counter() - t0, 2),
+        llm_fail=f"{qos['failure_rate']:.1%}" if qos.get("calls") else None,
+    )
+    return stats
+
+
 def run_benchmark(
     env_name: str,
     provider: str,
     episodes: int = 3,
     output_dir: str = "results/benchmarks",
     seed_start: int = 1,
+    max_failure_rate: Optional[float] = None,
+    max_reruns: int = 0,
+    target_ci_half_width: Optional[float] = None,
+    min_episodes: int = 3,
     **game_kwargs,
 ) -> Dict[str, Any]:
     """
@@ -181,38 +279,113 @@ def run_benchmark(
         episodes: Number of episodes to run
         output_dir: Directory to save results
         seed_start: Starting seed value (default 1). Seeds used: seed_start, seed_start+1, ..., seed_start+episodes-1
-        **game_kwargs: Additional arguments to pass to game runners
+        max_failure_rate: Episodes whose share of default_zeros/transport_failure LLM calls exceeds this
+            are flagged in `affected_episodes` and excluded from `mean_reward_unaffected` (None: no flagging)
+        max_reruns: Re-run a flagged episode (same seed) up to this many times before keeping it.
+            Episodes aborted by an open circuit breaker (circuit_breaker=..., see circuit_breaker.py)
+            are recorded with status "circuit_open" and no reward, listed in `circuit_open_episodes`
+        target_ci_half_width: Adaptive mode. Stop once the half-width of the Student-t 95% CI of the
+            mean episode reward is <= this value (after at least min_episodes scored episodes);
+            `episodes` becomes the maximum. The decision is recorded in `early_stop` (None: fixed N)
+        min_episodes: Scored episodes required before the adaptive mode may stop
+        **game_kwargs: Additional arguments to pass to game runners, e.g. max_tokens / token_budget /
+            reasoning_effort for per-game generation budgets (see token_budget.py), or checkpoint=True
+            to resume interrupted episodes step by step (see step_checkpoint.py), capture="obs" / "state"
+            to save raw per-step arrays next to each log (see episode_capture.py)
     
     Returns:
-        Benchmark results with mean/std of rewards across episodes
+        Benchmark results with mean/std and Student-t 95% CI (mean_reward_ci95, None below two scored
+        episodes) of rewards across episodes
     """
     out_dir = Path(output_dir)
     _ensure_dir(out_dir)
 
     all_episode_stats: List[Dict[str, Any]] = []
     episode_means: List[float] = []
+    status_model = game_kwargs.get("model_name") or provider
+    STATUS.plan(status_model, env_name, episodes)
 
     for ep in range(1, episodes + 1):
         seed = seed_start + ep - 1
-        print(f"\n[Benchmark] {env_name} | Episode {ep}/{episodes} | Seed {seed}")
-        stats = run_single_episode(env_name, provider, ep, out_dir, seed=seed, **game_kwargs)
+        for rerun in range(max_reruns + 1):
+            try:
+                stats = _run_tracked_episode(env_name, provider, ep, episodes, seed, out_dir, status_model,
+                                             max_failure_rate=max_failure_rate, rerun=rerun, max_reruns=max_reruns,
+                                             **game_kwargs)
+            except CircuitOpenError as e:
+                logger.error("Episode %d aborted: %s", ep, e)
+                stats = {"episode": ep, "env": env_name, "mean_reward": None, "total_rewards": {},
+                         "status": "circuit_open", "error": str(e), "reruns": rerun, "qos_affected": False}
+                break
+            if not stats["qos_affected"]:
+                break
+            logger.warning(
+                "Episode %d has LLM failure rate %.1f%% > %.1f%%%s", ep,
+                100 * stats["llm_qos"]["failure_rate"], 100 * max_failure_rate,
+                "; re-running" if rerun < max_reruns else "",
+            )
         all_episode_stats.append(stats)
         if stats.get("mean_reward") is not None:
             episode_means.append(stats["mean_reward"])
 
-    mean_reward = sum(episode_means) / len(episode_means) if episode_means else 0.0
-    variance = (
-        sum((x - mean_reward) ** 2 for x in episode_means) / len(episode_means)
-        if episode_means else 0.0
-    )
-    std_reward = math.sqrt(variance)
+        # 自适应模式：CI 半宽达到目标即停止，剩余 seed 不再消耗 API
+        if target_ci_half_width is not None and len(episode_means) >= max(min_episodes, 2):
+            # t 区间：3-5 局时 bootstrap 分位数区间过窄，会让噪声大的组合过早停止
+            ci_low, ci_high = t_interval(episode_means)
+            half_width = float(ci_high - ci_low) / 2
+            if half_width <= target_ci_half_width:
+                if ep < episodes:
+                    logger.info("CI half-width %.4f <= %.4f after %d episodes; stopping early",
+                                half_width, target_ci_half_width, ep)
+                    STATUS.stop_early(status_model, env_name)
+                break
+
+    # 总体标准差（ddof=0）与跨 seed 的 Student-t 95% CI；无有效局时均值/标准差为 0，不足两局时 CI 为 None
+    reward_stats = describe(episode_means)
+    ci_low, ci_high = t_interval(episode_means)
+    mean_reward = float(reward_stats["mean"]) if episode_means else 0.0
+    std_reward = float(reward_stats["std"]) if episode_means else 0.0
+    mean_reward_ci = [float(ci_low), float(ci_high)] if len(episode_means) >= 2 else None
+    early_stop = None
+    if target_ci_half_width is not None:
+        half_width = (mean_reward_ci[1] - mean_reward_ci[0]) / 2 if mean_reward_ci else None
+        reached = half_width is not None and len(episode_means) >= max(min_episodes, 2) and half_width <= target_ci_half_width
+        early_stop = {
+            "target_ci_half_width": target_ci_half_width,
+            "min_episodes": min_episodes,
+            "max_episodes": episodes,
+            "ci_half_width": half_width,
+            # ci_target: 达到目标（可能恰在最后一局）；max_episodes: 用完上限仍未达到
+            "reason": "ci_target" if reached else "max_episodes",
+            "stopped_early": len(all_episode_stats) < episodes,
+        }
+
+    def _mean_of(key: str) -> Optional[float]:
+        vals = [s[key] for s in all_episode_stats if s.get(key) is not None]
+        return sum(vals) / len(vals) if vals else None
+
+    clean_means = [
+        s["mean_reward"] for s in all_episode_stats
+        if s.get("mean_reward") is not None and not s.get("qos_affected")
+    ]
 
     return {
         "env": env_name,
         "provider": provider,
-        "episodes": episodes,
+        "episodes": len(all_episode_stats),
         "mean_reward": mean_reward,
         "std_reward": std_reward,
+        "mean_reward_ci95": mean_reward_ci,
+        "early_stop": early_stop,
+        "obs_format": game_kwargs.get("obs_format", "verbose"),
+        # Generation budget settings (see token_budget.py); llm_qos carries the resulting tokens_out / truncated
+        "generation": {k: game_kwargs.get(k) for k in ("max_tokens", "token_budget", "reasoning_effort")},
+        "obs_tokens_mean": _mean_of("obs_tokens_mean"),
+        "prompt_tokens_mean": _mean_of("prompt_tokens_mean"),
+        "llm_qos": merge_summaries([s["llm_qos"] for s in all_episode_stats if s.get("llm_qos")]),
+        "affected_episodes": [s["episode"] for s in all_episode_stats if s.get("qos_affected")],
+        "circuit_open_episodes": [s["episode"] for s in all_episode_stats if s.get("status") == "circuit_open"],
+        "mean_reward_unaffected": sum(clean_means) / len(clean_means) if clean_means else None,
         "episode_stats": all_episode_stats,
     }
 
@@ -0,0 +1,128 @@
+"""
+Circuit breaker per remote endpoint (provider, base_url).
+
+Without it a degraded endpoint costs every agent-step max_retries failed
+attempts before the zero action is used, and the episode still "completes"
+with meaningless rewards. With circuit_breaker enabled on the engine:
+
+    closed     attempts pass; failure_threshold consecutive failed attempts trip it
+    open       attempts are rejected immediately (CircuitOpenError) for cooldown_s
+    half_open  after the cooldown one probe attempt passes: success closes the
+               circuit, failure re-opens it for another cooldown. Concurrent
+               attempts (the other agents of the step) wait for the probe's
+               outcome instead of being rejected
+
+A rejected call either fails over to the engine's `failover` provider or
+raises CircuitOpenError, which run_benchmark records as a failed episode
+(status "circuit_open") before moving on. Breakers are shared by every
+engine in the process, so concurrent and subsequent episodes against the
+same endpoint see the same state.
+
+    engine = get_api_engine("zaiwen", circuit_breaker=True)
+    engine = get_api_engine("zaiwen", circuit_breaker={"failure_threshold": 10, "cooldown_s": 120},
+                            failover={"provider": "deepseek", "api_key": "..."})
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+from log_utils import get_logger
+import metrics_exporter as metrics
+
+logger = get_logger("circuit")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an endpoint whose circuit is open."""
+    retryable = False
+
+
+class CircuitBreaker:
+    def __init__(self, key: Tuple[str, str], failure_threshold: int = 8, cooldown_s: float = 60.0):
+        self.key = key
+        self.failure_threshold = int(failure_threshold)
+        self.cooldown_s = float(cooldown_s)
+        self._lock = threading.Lock()
+        self._probe_done = threading.Condition(self._lock)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probe_in_flight = False
+        self.transitions: List[Dict[str, Any]] = []
+
+    def _transition(self, state: str, reason: str) -> None:
+        # 调用方持有 self._lock
+        self.state = state
+        self.transitions.append({"t": round(time.time(), 3), "state": state, "reason": reason})
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            self.trips += 1
+            metrics.LLM_CIRCUIT_TRIPS.inc(provider=self.key[0], endpoint=self.key[1])
+            logger.warning("Circuit OPEN for %s %s: %s (cooldown %.0fs)", *self.key, reason, self.cooldown_s)
+        else:
+            logger.info("Circuit %s for %s %s: %s", state.upper(), *self.key, reason)
+
+    def allow(self) -> bool:
+        """
+        True if an attempt may be sent now, False only while the circuit is open. In half_open one probe
+        is sent at a time; other callers block until it succeeds (allowed) or fails (rejected).
+        """
+        with self._lock:
+            while True:
+                if self.state == CLOSED:
+                    return True
+                if self.state == OPEN:
+                    if time.monotonic() - self.opened_at < self.cooldown_s:
+                        return False
+                    self._transition(HALF_OPEN, "cooldown elapsed")
+                if not self._probe_in_flight:
+                    self._probe_in_flight = True
+                    return True
+                # 探测进行中：等待其结果；探测方异常退出未上报时，超时后由当前调用接替探测
+                if not self._probe_done.wait(timeout=self.cooldown_s) and self.state == HALF_OPEN:
+                    self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                self._probe_in_flight = False
+                self._transition(CLOSED, "probe succeeded")
+                self._probe_done.notify_all()
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                self._transition(OPEN, "probe failed")
+                self._probe_done.notify_all()
+            elif self.state == CLOSED and self.consecutive_failures >= self.failure_threshold:
+                self._transition(OPEN, f"{self.consecutive_failures} consecutive failed attempts")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "endpoint": "|".join(self.key),
+                "state": self.state,
+                "trips": self.trips,
+                "consecutive_failures": self.consecutive_failures,
+            }
+
+
+_BREAKERS: Dict[Tuple[str, str], CircuitBreaker] = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get_breaker(key: Tuple[str, str], **config: Any) -> CircuitBreaker:
+    """Process-wide breaker for (provider, base_url); config only applies when the key is first seen."""
+    with _BREAKERS_LOCK:
+        if key not in _BREAKERS:
+            _BREAKERS[key] = CircuitBreaker(key, **config)
+        return _BREAKERS[key]
@@ -1,3 +1,4 @@
+import logging
 import numpy as np
 import json
 from typing import Dict, Any
@@ -11,6 +12,11 @@ from prompt.prompt_for_crypto import (
     get_task_and_reward,
 )
 from obs.parse_crypto_obs import parse_crypto_obs
+from obs.encode_obs import count_tokens, encode_obs
+from log_utils import get_logger
+from step_pipeline import StepPipeline
+
+logger = get_logger("crypto")
 
 # 2. 导入环境
 try:
@@ -26,8 +32,10 @@ def get_header(env_name: str, agent_name: str, step: int) -> str:
     )
 
 
-def _format_current_obs(obs_struct: Dict[str, Any]) -> str:
+def _format_current_obs(obs_struct: Dict[str, Any], obs_format: str = "verbose") -> str:
     role = obs_struct.get("role", "UNKNOWN")
+    if obs_format != "verbose":
+        return f"CURRENT DATA FLOW ({obs_format}):\n" + encode_obs(obs_struct, obs_format)
     data_flow = [
         "CURRENT DATA FLOW:",
         f"- role: {role}",
@@ -44,7 +52,7 @@ def _format_current_obs(obs_struct: Dict[str, Any]) -> str:
     return "\n".join(data_flow)
 
 
-def user_prompt_crypto(agent_id: str, step: int, obs_struct: Dict[str, Any]) -> str:
+def user_prompt_crypto(agent_id: str, step: int, obs_struct: Dict[str, Any], obs_format: str = "verbose") -> str:
     role = obs_struct.get("role", "UNKNOWN")
     parts = [
         get_header("Simple_Crypto_v3", agent_id, step),
@@ -52,7 +60,7 @@ def user_prompt_crypto(agent_id: str, step: int, obs_struct: Dict[str, Any]) ->
         get_physics_rules(),
         get_action_and_response_format(),
         get_navigation_hints(role),
-        _format_current_obs(obs_struct),
+        _format_current_obs(obs_struct, obs_format),
     ]
     return "\n\n".join(parts)
 
@@ -66,138 +74,155 @@ def run_crypto_game(provider: str, output_name: str, **kwargs):
     MAX_STEPS = 10
     
     seed = kwargs.pop('seed', None)
+    obs_format = kwargs.pop('obs_format', 'verbose')
+    pipeline = kwargs.pop('pipeline', True)
+    checkpoint = kwargs.pop('checkpoint', False)
+    capture = kwargs.pop('capture', None)
     llm_engine = get_api_engine(provider, **kwargs)
 
-    print("Initializing Crypto Env (Fair Mode)...")
+    logger.info("Initializing Crypto Env (Fair Mode)...")
     env = simple_crypto_v3.parallel_env(max_cycles=MAX_STEPS, continuous_actions=True, render_mode="rgb_array")
     
     observations, infos = env.reset(seed=seed) if seed is not None else env.reset()
-    frames = []
-    game_log = []
-    
-    for step in range(MAX_STEPS):
-        print(f"\n{'='*40} STEP {step} {'='*40}")
-        
-        frame = env.render()
-        if frame is not None:
-            frames.append(frame)
-        
-        actions = {}
-        step_buffer = {} # 暂存本回合信息
-
-        # --- 1. Decision Phase ---
-        for agent_id in env.agents:
-            obs_raw = observations[agent_id]
-            obs_struct = parse_crypto_obs(obs_raw, agent_id)
-            
-            # Prompt
-            full_prompt = user_prompt_crypto(agent_id, step, obs_struct)
-            
-            # System Role
-            if 'alice' in agent_id: sys_r = "You are Alice, a Cryptographer."
-            elif 'bob' in agent_id: sys_r = "You are Bob, a Cryptographer."
-            else: sys_r = "You are Eve, a Code Breaker."
-            
-            # API Call
-            action_vec, raw_thought = llm_engine.generate_action(sys_r, full_prompt)
-            
-            # 维度修正 & Clip
-            if len(action_vec) < 4:
-                action_vec = np.concatenate([action_vec, np.zeros(4 - len(action_vec))])
-            elif len(action_vec) > 4:
-                action_vec = action_vec[:4]
-            action_vec = np.clip(action_vec, 0.0, 1.0)
-            
-            actions[agent_id] = action_vec
-            
-            step_buffer[agent_id] = {
-                "struct": obs_struct,
-                "action": action_vec,
-                "thought": raw_thought
-            }
-
-        # --- 2. Step Phase ---
-        observations, rewards, terminations, truncations, infos = env.step(actions)
-        
-        # --- 3. Analysis Phase ---
-        # 获取真值 (Ground Truth)
-        true_msg = step_buffer['alice_0']['struct']['message']
-        
-        for aid, info in step_buffer.items():
-            r = rewards.get(aid, 0.0)
-            role = info['struct']['role']
-            print(f"\n👤 {aid} ({role}) | Reward: {r:.3f}")
-            
-            # 打印逻辑链
-            if role == 'ALICE':
-                msg = np.array(info['struct']['message'])
-                key = np.array(info['struct']['key'])
-                cip = np.array(info['action'])
-                print(f"   [Logic] Msg {np.round(msg,2)} + Key {np.round(key,2)} -> Cipher {np.round(cip,2)}")
-                
-            elif role == 'BOB':
-                key = np.array(info['struct']['key'])
-                cip = np.array(info['struct']['ciphertext']) # 这是上一回合的，或者本回合还没收到？
-                # MPE 机制提醒：Bob 这一步看到的 Ciphertext 其实是 Alice *上一步* 发的。
-                # 在 Step 0，Bob 看到的 Ciphertext 通常是 0。
-                # 所以 Bob 的推理其实是滞后一步的。但为了评测 LLM 单步能力，我们看它是否尝试去算。
-                guess = np.array(info['action'])
-                print(f"   [Logic] Key {np.round(key,2)} + Cipher {np.round(cip,2)} -> Guess {np.round(guess,2)}")
-                
-                # 计算当前帧误差 (虽然环境可能是滞后结算，我们肉眼看当下的匹配度)
-                # 注意：Bob 本回合的猜测应该对应 Alice 本回合的发送吗？
-                # 不，MPE 是 Alice 发 -> Env 存 -> 下一步 Bob 收。
-                # 所以 Step 0 Bob 猜不对是正常的。我们要看 Step 1。
-                
-            elif role == 'EVE':
-                cip = np.array(info['struct']['ciphertext'])
-                guess = np.array(info['action'])
-                print(f"   [Logic] Cipher {np.round(cip,2)} -> Guess {np.round(guess,2)}")
-
-            # 打印思维链摘要
-            print(f"   🧠 Thought: {info['thought'][:200].replace(chr(10), ' ')}...")
-            
-            game_log.append({
-                "step": step,
-                "agent": aid,
-                "reward": r,
-                "obs": info['struct'],
-                "action": info['action'].tolist(),
-                "thought": info['thought']
-            })
-
-        if all(terminations.values()) or all(truncations.values()):
-            print("Game Over.")
-            break
-
-    env.close()
-    
-    # Calculate final summary
-    total_rewards = {}
-    for entry in game_log:
-        if "agent" in entry:
-            aid = entry["agent"]
-            total_rewards[aid] = total_rewards.get(aid, 0.0) + entry.get("reward", 0.0)
-    
-    mean_reward = sum(total_rewards.values()) / len(total_rewards) if total_rewards else 0.0
-    game_log.append({
-        "final_summary": True,
-        "total_rewards": total_rewards,
-        "mean_reward": float(mean_reward)
-    })
-    print(f"\n📊 FINAL: Total Rewards={total_rewards}, Mean={mean_reward:.3f}")
-    
-    # Save video
-    if frames:
-        vid_name = get_unique_filename(output_name + ".mp4")
-        import imageio
-        imageio.mimsave(vid_name, frames, fps=1, macro_block_size=1)
-        print(f"Saved video to {vid_name}")
-    
-    final_log = get_unique_filename(output_name + ".json")
-    with open(final_log, "w", encoding="utf-8") as f:
-        json.dump(game_log, f, indent=4)
-    print(f"Saved logs to {final_log}")
+    pipe = StepPipeline(llm_engine, output_name + ".mp4", fps=1, enabled=pipeline,
+                        checkpoint=checkpoint, seed=seed, capture=capture, macro_block_size=1)
+    try:
+        game_log = []
+        obs_tokens = []
+        prompt_tokens = []
+        debug_on = logger.isEnabledFor(logging.DEBUG)
+
+        for step in range(MAX_STEPS):
+            logger.debug("=== STEP %d ===", step)
+
+            pipe.render(env)
+
+            # --- 1. Decision Phase ---（各智能体并发决策，结果按智能体顺序暂存）
+            def decide(agent_id):
+                obs_raw = observations[agent_id]
+                obs_struct = parse_crypto_obs(obs_raw, agent_id)
+
+                # Prompt
+                full_prompt = user_prompt_crypto(agent_id, step, obs_struct, obs_format)
+
+                # System Role
+                if 'alice' in agent_id: sys_r = "You are Alice, a Cryptographer."
+                elif 'bob' in agent_id: sys_r = "You are Bob, a Cryptographer."
+                else: sys_r = "You are Eve, a Code Breaker."
+
+                # API Call
+                ctx = {"env": "crypto", "seed": seed, "step": step, "agent": agent_id, "obs": obs_struct,
+                       "action_dim": env.action_space(agent_id).shape[0]}
+                action_vec, raw_thought = llm_engine.generate_action(sys_r, full_prompt, context=ctx)
+
+                # Clip（宽度已按 action_dim 对齐）
+                action_vec = np.clip(action_vec, 0.0, 1.0)
+
+                return {
+                    "struct": obs_struct,
+                    "action": action_vec,
+                    "thought": raw_thought,
+                    "obs_tokens": count_tokens(_format_current_obs(obs_struct, obs_format)),
+                    "prompt_tokens": count_tokens(full_prompt),
+                    "llm": llm_engine.last_call_info(),
+                }
+
+            step_buffer = pipe.decide(env.agents, decide)  # 暂存本回合信息
+            actions = {aid: info["action"] for aid, info in step_buffer.items()}
+            obs_tokens.extend(info["obs_tokens"] for info in step_buffer.values())
+            prompt_tokens.extend(info["prompt_tokens"] for info in step_buffer.values())
+
+            # --- 2. Step Phase ---
+            pipe.sync_env()
+            observations, rewards, terminations, truncations, infos = env.step(actions)
+
+            # --- 3. Analysis Phase ---
+            # 获取真值 (Ground Truth)
+            true_msg = step_buffer['alice_0']['struct']['message']
+
+            for aid, info in step_buffer.items():
+                r = rewards.get(aid, 0.0)
+                role = info['struct']['role']
+
+                # 打印逻辑链（仅 DEBUG 级别）
+                if debug_on:
+                    logger.debug("%s (%s) | Reward: %.3f", aid, role, r)
+                    if role == 'ALICE':
+                        msg = np.array(info['struct']['message'])
+                        key = np.array(info['struct']['key'])
+                        cip = np.array(info['action'])
+                        logger.debug("   [Logic] Msg %s + Key %s -> Cipher %s", np.round(msg,2), np.round(key,2), np.round(cip,2))
+
+                    elif role == 'BOB':
+                        key = np.array(info['struct']['key'])
+                        cip = np.array(info['struct']['ciphertext']) # 这是上一回合的，或者本回合还没收到？
+                        # MPE 机制提醒：Bob 这一步看到的 Ciphertext 其实是 Alice *上一步* 发的。
+                        # 在 Step 0，Bob 看到的 Ciphertext 通常是 0。
+                        # 所以 Bob 的推理其实是滞后一步的。但为了评测 LLM 单步能力，我们看它是否尝试去算。
+                        guess = np.array(info['action'])
+                        logger.debug("   [Logic] Key %s + Cipher %s -> Guess %s", np.round(key,2), np.round(cip,2), np.round(guess,2))
+
+                        # 计算当前帧误差 (虽然环境可能是滞后结算，我们肉眼看当下的匹配度)
+                        # 注意：Bob 本回合的猜测应该对应 Alice 本回合的发送吗？
+                        # 不，MPE 是 Alice 发 -> Env 存 -> 下一步 Bob 收。
+                        # 所以 Step 0 Bob 猜不对是正常的。我们要看 Step 1。
+
+                    elif role == 'EVE':
+                        cip = np.array(info['struct']['ciphertext'])
+                        guess = np.array(info['action'])
+                        logger.debug("   [Logic] Cipher %s -> Guess %s", np.round(cip,2), np.round(guess,2))
+
+                    # 思维链摘要
+                    logger.debug("   Thought: %s...", info['thought'][:200].replace(chr(10), ' '))
+
+                game_log.append({
+                    "step": step,
+                    "agent": aid,
+                    "reward": r,
+                    "obs": info['struct'],
+                    "action": info['action'].tolist(),
+                    "thought": info['thought'],
+                    "obs_tokens": info['obs_tokens'],
+                    "llm": info.get("llm"),
+                })
+
+            pipe.log(game_log)
+            if all(terminations.values()) or all(truncations.values()):
+                logger.debug("Game Over.")
+                break
+
+        # Calculate final summary
+        total_rewards = {}
+        for entry in game_log:
+            if "agent" in entry:
+                aid = entry["agent"]
+                total_rewards[aid] = total_rewards.get(aid, 0.0) + entry.get("reward", 0.0)
+
+        mean_reward = sum(total_rewards.values()) / len(total_rewards) if total_rewards else 0.0
+        game_log.append({
+            "final_summary": True,
+            "env": "crypto",
+            "seed": seed,
+            "total_rewards": total_rewards,
+            "mean_reward": float(mean_reward),
+            "obs_format": obs_format,
+            "obs_tokens_mean": float(np.mean(obs_tokens)) if obs_tokens else 0.0,
+            "prompt_tokens_mean": float(np.mean(prompt_tokens)) if prompt_tokens else 0.0,
+            "circuit": llm_engine.circuit_summary(),
+        })
+        logger.info("FINAL: Total Rewards=%s, Mean=%.3f", total_rewards, mean_reward)
+
+        # Save video
+        vid_name = pipe.finish_video()
+        if vid_name:
+            logger.info("Saved video to %s", vid_name)
+
+        final_log = get_unique_filename(output_name + ".json")
+        pipe.write_log(game_log, final_log)
+    finally:
+        pipe.close()
+        env.close()
+    logger.info("Saved logs to %s", final_log)
 
 # ============================================================================== 
 # 4. 入口
@@ -0,0 +1,181 @@
+"""
+Raw per-step capture of observations, actions, rewards and world state.
+
+The JSON logs keep the parsed, rounded obs structs the prompts were built
+from. EpisodeCapture records the lossless side: the float32 observation
+vector of every agent-step (exactly what env.step returned), the float32
+action sent back, the reward and, in "state" mode, the position of every
+entity (agents, landmarks) and the agents' velocities.
+
+Buffers are allocated once per episode from the env (max_cycles × agents ×
+obs/action dims) and filled in place, so a step costs a few row copies; the
+arrays are written once, when the episode log is saved, as plain .npy files
+in a directory next to the log:
+
+    <log>.capture/meta.json            env, seed, steps, agents, entities, dims
+    <log>.capture/obs.<agent>.npy      (steps, obs_dim)    float32
+    <log>.capture/action.<agent>.npy   (steps, action_dim) float32
+    <log>.capture/reward.npy           (steps, agents)     float64, NaN = agent did not act
+    <log>.capture/entity_pos.npy       (steps, entities, 2) float32   ("state" mode)
+    <log>.capture/agent_vel.npy        (steps, agents, 2)   float32   ("state" mode)
+
+Row t is the state the agents observed at step t. Single .npy files (not a
+compressed .npz) so load_capture() can memory-map them:
+
+    cap = load_capture("results/.../spread_ep1.capture")
+    cap["obs"]["agent_0"][:10], cap["reward"].sum(axis=0), cap["meta"]["seed"]
+
+StepPipeline(capture="obs" | "state") drives it (runner kwarg capture=...):
+observe() runs in render(env) before the agents decide, record() in log()
+after the step's rewards are logged.
+"""
+
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from log_utils import get_logger
+
+logger = get_logger("capture")
+
+CAPTURE_MODES = ("obs", "state")
+CAPTURE_SUFFIX = ".capture"
+CAPTURE_VERSION = 1
+
+
+class EpisodeCapture:
+    def __init__(self, mode: str = "obs", seed: Optional[int] = None):
+        if mode not in CAPTURE_MODES:
+            raise ValueError(f"Unknown capture mode {mode!r}; choose from {CAPTURE_MODES}")
+        self.mode = mode
+        self.seed = seed
+        self.steps = 0
+        self.agents: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._pending = False
+        self.meta: Dict[str, Any] = {}
+        self.obs: Dict[str, np.ndarray] = {}
+        self.action: Dict[str, np.ndarray] = {}
+        self.reward: Optional[np.ndarray] = None
+        self.entity_pos: Optional[np.ndarray] = None
+        self.agent_vel: Optional[np.ndarray] = None
+
+    def _allocate(self, env: Any) -> None:
+        raw = env.unwrapped
+        capacity = int(getattr(raw, "max_cycles", 0) or 0) or 64
+        self.agents = list(env.possible_agents)
+        self._index = {aid: i for i, aid in enumerate(self.agents)}
+        for aid in self.agents:
+            self.obs[aid] = np.zeros((capacity,) + env.observation_space(aid).shape, dtype=np.float32)
+            self.action[aid] = np.zeros((capacity,) + env.action_space(aid).shape, dtype=np.float32)
+        self.reward = np.full((capacity, len(self.agents)), np.nan)
+        world = raw.world
+        entities = [e.name for e in list(world.agents) + list(world.landmarks)]
+        if self.mode == "state":
+            self.entity_pos = np.zeros((capacity, len(entities), world.dim_p), dtype=np.float32)
+            self.agent_vel = np.zeros((capacity, len(world.agents), world.dim_p), dtype=np.float32)
+        self.meta = {
+            "version": CAPTURE_VERSION,
+            "env": raw.metadata.get("name"),
+            "seed": self.seed,
+            "mode": self.mode,
+            "agents": self.agents,
+            "entities": entities,
+            "obs_dims": {aid: list(self.obs[aid].shape[1:]) for aid in self.agents},
+            "action_dims": {aid: list(self.action[aid].shape[1:]) for aid in self.agents},
+        }
+
+    def _grow(self) -> None:
+        # max_cycles 之外的步数（runner 自定义循环上限）：容量翻倍
+        def grow(a: np.ndarray, fill: float = 0.0) -> np.ndarray:
+            extra = np.full((len(a),) + a.shape[1:], fill, dtype=a.dtype)
+            return np.concatenate([a, extra])
+        self.obs = {aid: grow(a) for aid, a in self.obs.items()}
+        self.action = {aid: grow(a) for aid, a in self.action.items()}
+        self.reward = grow(self.reward, np.nan)
+        if self.entity_pos is not None:
+            self.entity_pos = grow(self.entity_pos)
+            self.agent_vel = grow(self.agent_vel)
+
+    def observe(self, env: Any) -> None:
+        """Snapshot the observations (and world state) the agents act on at this step; call before env.step."""
+        if self.reward is None:
+            self._allocate(env)
+        t = self.steps
+        if t >= len(self.reward):
+            self._grow()
+        raw = env.unwrapped
+        for aid in env.agents:
+            if aid in self._index:
+                self.obs[aid][t] = raw.observe(aid)
+        if self.entity_pos is not None:
+            world = raw.world
+            self.entity_pos[t] = [e.state.p_pos for e in list(world.agents) + list(world.landmarks)]
+            self.agent_vel[t] = [a.state.p_vel for a in world.agents]
+        self._pending = True
+
+    def record(self, entries: List[Dict[str, Any]]) -> None:
+        """Actions and rewards of the observed step, taken from its log entries ("agent", "action", "reward")."""
+        if not self._pending:
+            return
+        t = self.steps
+        for e in entries:
+            i = self._index.get(e.get("agent"))
+            if i is None:
+                continue
+            aid = self.agents[i]
+            if e.get("action") is not None:
+                self.action[aid][t] = np.asarray(e["action"], dtype=np.float32).reshape(self.action[aid].shape[1:])
+            if e.get("reward") is not None:
+                self.reward[t, i] = float(e["reward"])
+        self.steps += 1
+        self._pending = False
+
+    def save(self, path: str) -> Optional[str]:
+        """Write the recorded steps to the directory `path`; returns it (None if nothing was recorded)."""
+        if self.reward is None or self.steps == 0:
+            return None
+        os.makedirs(path, exist_ok=True)
+        n = self.steps
+        for aid in self.agents:
+            np.save(os.path.join(path, f"obs.{aid}.npy"), self.obs[aid][:n])
+            np.save(os.path.join(path, f"action.{aid}.npy"), self.action[aid][:n])
+        np.save(os.path.join(path, "reward.npy"), self.reward[:n])
+        if self.entity_pos is not None:
+            np.save(os.path.join(path, "entity_pos.npy"), self.entity_pos[:n])
+            np.save(os.path.join(path, "agent_vel.npy"), self.agent_vel[:n])
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({**self.meta, "steps": n}, f, indent=2, ensure_ascii=False)
+        return path
+
+
+def capture_path(log_path: str) -> str:
+    """Capture directory of an episode log: <log without .json>.capture."""
+    return os.path.splitext(log_path)[0] + CAPTURE_SUFFIX
+
+
+def load_capture(path: str, mmap: bool = True) -> Dict[str, Any]:
+    """
+    Arrays of a capture directory (or of the episode log it belongs to), memory-mapped read-only by default:
+    {"meta", "obs": {agent: array}, "action": {agent: array}, "reward", "entity_pos", "agent_vel"}
+    """
+    if path.endswith(".json"):
+        path = capture_path(path)
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    mode = "r" if mmap else None
+
+    def load(name: str) -> Optional[np.ndarray]:
+        file = os.path.join(path, name)
+        return np.load(file, mmap_mode=mode) if os.path.exists(file) else None
+
+    return {
+        "meta": meta,
+        "obs": {aid: load(f"obs.{aid}.npy") for aid in meta["agents"]},
+        "action": {aid: load(f"action.{aid}.npy") for aid in meta["agents"]},
+        "reward": load("reward.npy"),
+        "entity_pos": load("entity_pos.npy"),
+        "agent_vel": load("agent_vel.npy"),
+    }
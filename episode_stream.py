@@ -0,0 +1,203 @@
+"""
+Field-selective streaming reader for episode JSON logs.
+
+An episode log is a JSON array of flat records (step entries plus the
+final_summary entry). Most of its bytes are the "thought" strings and the
+nested "obs" dicts, which the result parsers never look at. json.load still
+builds all of them. iter_records() scans the (memory-mapped) file instead and
+decodes only the requested top-level keys of each record; every other value
+is skipped by finding its extent with compiled regexes, without creating
+Python objects for it.
+
+    for rec in iter_records(path, ("step", "agent", "reward", "final_summary", "total_rewards")):
+        ...
+
+Records keep only the requested keys that are present, so `"step" in rec` /
+rec.get(...) behave as on the full record. Non-object array elements are
+skipped.
+
+Scanning costs a few microseconds of Python per key, so it only pays off
+when records are dominated by long strings. Logs whose first record is
+shorter than STREAM_MIN_RECORD_BYTES (no reasoning text, e.g. heuristic or
+non-thinking models) are decoded in one C-level pass and then filtered. A truncated or structurally broken log raises ValueError, as
+json.load would; the content of skipped values is not validated.
+"""
+
+import mmap
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
+
+# orjson（可选）解析更快；两者都接受 bytes
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+    _json_loads = json.loads
+
+Source = Union[str, Path, bytes, bytearray, memoryview, mmap.mmap]
+
+# 首条记录短于此值时整体解码再筛字段更快（obs 为主、无长 thought 的日志）
+STREAM_MIN_RECORD_BYTES = 8192
+
+_WS = re.compile(rb"[ \t\n\r]*")
+_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+_SCALAR = re.compile(rb"[^,}\]\s]+")
+# 跳过嵌套容器（obs 等）时逐个匹配：字符串（其中的括号不计入深度）、不含字符串的扁平数组（整体跳过）、括号
+_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|\[[^\[\]{}"]*\]|[\[\]{}]')
+
+_QUOTE, _BACKSLASH, _COMMA, _COLON = ord('"'), ord("\\"), ord(","), ord(":")
+_LBRACE, _RBRACE, _LBRACKET, _RBRACKET = ord("{"), ord("}"), ord("["), ord("]")
+_OPEN = (_LBRACE, _LBRACKET)
+
+
+def _error(msg: str, pos: int) -> ValueError:
+    return ValueError(f"{msg} at byte {pos}")
+
+
+def _string_end(buf: Any, pos: int) -> int:
+    """End offset of the string starting at pos (the opening quote)."""
+    # 转义引号不多时用 memchr 级别的 find() 逐个跳过；转义很密集时交给正则逐字符匹配
+    i = pos + 1
+    for _ in range(16):
+        j = buf.find(b'"', i)
+        if j < 0:
+            raise _error("Unterminated string", pos)
+        k = j - 1
+        while buf[k] == _BACKSLASH:
+            k -= 1
+        if (j - k) % 2:  # 前面是偶数个反斜杠：未被转义
+            return j + 1
+        i = j + 1
+    m = _STRING.match(buf, pos)
+    if m is None:
+        raise _error("Unterminated string", pos)
+    return m.end()
+
+
+def _skip_value(buf: Any, pos: int) -> int:
+    """End offset of the JSON value starting at pos."""
+    c = buf[pos]
+    if c == _QUOTE:
+        return _string_end(buf, pos)
+    if c in _OPEN:
+        depth = 0
+        for m in _TOKEN.finditer(buf, pos):
+            start, end = m.span()
+            if end - start == 1:
+                depth += 1 if buf[start] in _OPEN else -1
+            elif buf[start] == _QUOTE:
+                continue
+            if depth == 0:
+                return end
+        raise _error("Unterminated container", pos)
+    m = _SCALAR.match(buf, pos)
+    if m is None:
+        raise _error("Expecting value", pos)
+    return m.end()
+
+
+def _read_object(buf: Any, pos: int, wanted: Dict[bytes, str]) -> Tuple[Dict[str, Any], int]:
+    record: Dict[str, Any] = {}
+    pos = _WS.match(buf, pos + 1).end()
+    if buf[pos] == _RBRACE:
+        return record, pos + 1
+    while True:
+        if buf[pos] != _QUOTE:
+            raise _error("Expecting property name", pos)
+        key_end = _skip_value(buf, pos)
+        key = bytes(buf[pos + 1:key_end - 1])
+        if b"\\" in key:
+            key = _json_loads(bytes(buf[pos:key_end])).encode("utf-8")
+        pos = _WS.match(buf, key_end).end()
+        if buf[pos] != _COLON:
+            raise _error("Expecting ':'", pos)
+        start = _WS.match(buf, pos + 1).end()
+        end = _skip_value(buf, start)
+        name = wanted.get(key)
+        if name is not None:
+            record[name] = _json_loads(bytes(buf[start:end]))
+        pos = _WS.match(buf, end).end()
+        c = buf[pos]
+        if c == _RBRACE:
+            return record, pos + 1
+        if c != _COMMA:
+            raise _error("Expecting ',' or '}'", pos)
+        pos = _WS.match(buf, pos + 1).end()
+
+
+def _first_record_bytes(buf: Any) -> int:
+    pos = _WS.match(buf, 0).end()
+    if pos < len(buf) and buf[pos] == _LBRACKET:
+        pos = _WS.match(buf, pos + 1).end()
+        if pos < len(buf) and buf[pos] == _LBRACE:
+            return _skip_value(buf, pos) - pos
+    return 0
+
+
+def _iter_buffer(buf: Any, wanted: Dict[bytes, str]) -> Iterator[Dict[str, Any]]:
+    try:
+        if _first_record_bytes(buf) >= STREAM_MIN_RECORD_BYTES:
+            yield from _scan_array(buf, wanted)
+            return
+    except IndexError:  # 在值/对象中途读到文件末尾
+        raise _error("Unexpected end of data", len(buf)) from None
+    data = _json_loads(bytes(buf))
+    if not isinstance(data, list):
+        raise _error("Expecting '[' (episode log must be a JSON array)", 0)
+    names = set(wanted.values())
+    for entry in data:
+        if isinstance(entry, dict):
+            yield {k: v for k, v in entry.items() if k in names}
+
+
+def _scan_array(buf: Any, wanted: Dict[bytes, str]) -> Iterator[Dict[str, Any]]:
+    size = len(buf)
+    pos = _WS.match(buf, 0).end()
+    if pos >= size or buf[pos] != _LBRACKET:
+        raise _error("Expecting '[' (episode log must be a JSON array)", pos)
+    pos = _WS.match(buf, pos + 1).end()
+    if pos < size and buf[pos] == _RBRACKET:
+        return
+    while pos < size:
+        if buf[pos] == _LBRACE:
+            record, pos = _read_object(buf, pos, wanted)
+            yield record
+        else:
+            pos = _skip_value(buf, pos)
+        pos = _WS.match(buf, pos).end()
+        if pos >= size:
+            break
+        c = buf[pos]
+        if c == _RBRACKET:
+            return
+        if c != _COMMA:
+            raise _error("Expecting ',' or ']'", pos)
+        pos = _WS.match(buf, pos + 1).end()
+    raise _error("Unterminated array", pos)
+
+
+def iter_records(source: Source, fields: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Yield {field: value} for every record of an episode log, decoding only `fields`.
+    source: log path (memory-mapped while iterating) or an in-memory bytes-like buffer
+    """
+    wanted = {f.encode("utf-8"): f for f in fields}
+    if not isinstance(source, (str, Path)):
+        yield from _iter_buffer(source, wanted)
+        return
+    with open(source, "rb") as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # 空文件无法 mmap
+            raise _error("Expecting '[' (episode log must be a JSON array)", 0) from None
+        try:
+            yield from _iter_buffer(buf, wanted)
+        finally:
+            buf.close()
+
+
+def load_records(source: Source, fields: Iterable[str]) -> List[Dict[str, Any]]:
+    """list(iter_records(...)): the json.load(...) list with only `fields` kept per record."""
+    return list(iter_records(source, fields))
@@ -0,0 +1,134 @@
+"""
+Request hedging for remote (OpenAI-protocol) calls.
+
+Every agent must act before env.step, so one slow request holds up the
+whole step. With hedging enabled, a call that has not returned after the
+running p95 latency of its endpoint gets a duplicate request; whichever
+finishes first (successfully) is used and the other is left to complete in
+the background. Hedges are capped at `budget` times the number of calls
+(default 10%), so the extra load stays bounded.
+
+State (latency window, budget counters, worker pool) is shared per
+(provider, base_url, model) across every engine in the process, so the
+percentile estimate survives the per-episode engines the runners create.
+
+    engine = get_api_engine("zaiwen", hedge=True)
+    engine = get_api_engine("zaiwen", hedge={"quantile": 0.9, "budget": 0.05})
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+
+class LatencyTracker:
+    """Thread-safe sliding window of successful request latencies (seconds)."""
+
+    def __init__(self, window: int = 256, min_samples: int = 20):
+        self._samples = deque(maxlen=int(window))
+        self._lock = threading.Lock()
+        self.min_samples = int(min_samples)
+
+    def record(self, latency_s: float) -> None:
+        with self._lock:
+            self._samples.append(latency_s)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """None until min_samples latencies have been seen."""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = list(self._samples)
+        return float(np.quantile(samples, q))
+
+
+class Hedger:
+    def __init__(
+        self,
+        quantile: float = 0.95,
+        budget: float = 0.1,
+        min_samples: int = 20,
+        min_delay_s: float = 0.0,
+        window: int = 256,
+        max_workers: int = 64,
+    ):
+        if not 0.0 < quantile < 1.0:
+            raise ValueError(f"hedge quantile must be in (0, 1), got {quantile}")
+        self.quantile = float(quantile)
+        self.budget = float(budget)
+        self.min_delay_s = float(min_delay_s)
+        self.tracker = LatencyTracker(window, min_samples)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _submit(self, fn: Callable[[], Any]) -> Future:
+        def timed():
+            t0 = time.perf_counter()
+            result = fn()
+            self.tracker.record(time.perf_counter() - t0)
+            return result
+        return self._pool.submit(timed)
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self.hedged + 1 > self.budget * self.calls:
+                return False
+            self.hedged += 1
+            return True
+
+    def call(self, fn: Callable[[], Any]) -> Tuple[Any, Dict[str, Any]]:
+        """
+        Run fn() (a complete request, safe to issue twice), hedging it when slow.
+        Returns (result, {"hedged": bool, "hedge_won": bool}); re-raises if every issued request failed.
+        """
+        with self._lock:
+            self.calls += 1
+        primary = self._submit(fn)
+        delay = self.tracker.quantile(self.quantile)
+        if delay is None or wait([primary], timeout=max(delay, self.min_delay_s)).done:
+            return primary.result(), {"hedged": False, "hedge_won": False}
+        if not self._take_budget():
+            return primary.result(), {"hedged": False, "hedge_won": False}
+
+        hedge = self._submit(fn)
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    won = f is hedge
+                    if won:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return f.result(), {"hedged": True, "hedge_won": won}
+                error = error or f.exception()
+        raise error
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "delay_s": self.tracker.quantile(self.quantile),
+            }
+
+
+_HEDGERS: Dict[Tuple[str, ...], Hedger] = {}
+_HEDGERS_LOCK = threading.Lock()
+
+
+def get_hedger(key: Tuple[str, ...], **config: Any) -> Hedger:
+    """Process-wide Hedger for an endpoint key; config only applies when the key is first seen."""
+    with _HEDGERS_LOCK:
+        if key not in _HEDGERS:
+            _HEDGERS[key] = Hedger(**config)
+        return _HEDGERS[key]
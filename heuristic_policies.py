@@ -0,0 +1,280 @@
+"""
+Scripted heuristic policies for all nine MPE games (non-LLM baselines).
+
+Each policy maps the structured observation produced by obs/parse_*_obs.py to
+an MPE continuous action. HeuristicBackend wraps them behind the same
+complete(system_prompt, user_prompt, context) interface as the offline
+backends in mock_providers.py, so runners use them unchanged through
+get_api_engine("heuristic"); the runner passes the parsed struct as
+context["obs"].
+
+Action layout (continuous): [no_op, left, right, down, up] (+ comm channels),
+force_x = right - left, force_y = up - down.
+"""
+
+import json
+import math
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+# distance at which the heuristic still pushes with full force; closer targets get proportional force
+FULL_FORCE_DIST = 0.3
+# velocity damping so agents brake before reaching the target instead of orbiting it
+VEL_DAMPING = 0.5
+
+
+class HeuristicContextError(ValueError):
+    """The runner did not pass the parsed observation (context['obs'])."""
+    retryable = False
+
+
+def _vec(v: Optional[Sequence[float]]) -> List[float]:
+    if not v or len(v) < 2:
+        return [0.0, 0.0]
+    return [float(v[0]), float(v[1])]
+
+
+def _norm(v: Sequence[float]) -> float:
+    return math.hypot(v[0], v[1])
+
+
+def move_toward(rel: Sequence[float], vel: Optional[Sequence[float]] = None) -> List[float]:
+    """5-dim move action accelerating towards the relative position rel (with braking)."""
+    dx, dy = _vec(rel)
+    if vel is not None:
+        vx, vy = _vec(vel)
+        dx -= VEL_DAMPING * vx
+        dy -= VEL_DAMPING * vy
+    dist = math.hypot(dx, dy)
+    if dist < 1e-6:
+        return [1.0, 0.0, 0.0, 0.0, 0.0]
+    scale = min(1.0, dist / FULL_FORCE_DIST) / dist
+    fx, fy = dx * scale, dy * scale
+    return [0.0, max(-fx, 0.0), max(fx, 0.0), max(-fy, 0.0), max(fy, 0.0)]
+
+
+def move_away(threats: List[Sequence[float]], self_pos: Optional[Sequence[float]] = None) -> List[float]:
+    """Flee: inverse-distance weighted repulsion from threats plus a pull back into the arena."""
+    fx, fy = 0.0, 0.0
+    for rel in threats:
+        dx, dy = _vec(rel)
+        d = max(math.hypot(dx, dy), 0.05)
+        fx -= dx / (d * d)
+        fy -= dy / (d * d)
+    if self_pos is not None:
+        # soft wall from |pos| > 0.6 growing towards the edge (prey outside 0.9 are penalised)
+        px, py = _vec(self_pos)
+        if abs(px) > 0.6:
+            fx -= math.copysign(8.0 * (abs(px) - 0.6) / max(1.0 - abs(px), 0.05), px)
+        if abs(py) > 0.6:
+            fy -= math.copysign(8.0 * (abs(py) - 0.6) / max(1.0 - abs(py), 0.05), py)
+    return move_toward([fx, fy])
+
+
+def _nearest(rels: List[Sequence[float]]) -> Optional[List[float]]:
+    rels = [_vec(r) for r in rels if r is not None]
+    return min(rels, key=_norm) if rels else None
+
+
+def _one_hot(idx: int, n: int) -> List[float]:
+    return [1.0 if i == idx else 0.0 for i in range(n)]
+
+
+# ==============================================================================
+# Per-game policies: (agent_id, obs_struct) -> action list
+# ==============================================================================
+def policy_simple(agent_id: str, obs: Dict[str, Any]) -> List[float]:
+    return move_toward(obs.get("landmark_rel"), obs.get("vel"))
+
+
+def policy_spread(agent_id: str, obs: Dict[str, Any]) -> List[float]:
+    """
+    Greedy landmark assignment: every agent reconstructs the full
+    agent-landmark distance matrix from its own view (landmark_rel and
+    other_agent_rel) and takes the landmark it gets in a global greedy
+    matching, so agents agree without communicating.
+    """
+    landmarks = [_vec(l) for l in obs.get("landmark_rel", [])]
+    if not landmarks:
+        return [1.0, 0.0, 0.0, 0.0, 0.0]
+    others = [_vec(o) for o in obs.get("other_agent_rel", [])]
+    agents = [[0.0, 0.0]] + others  # index 0 = self
+
+    pairs = []
+    for a, apos in enumerate(agents):
+        for k, lpos in enumerate(landmarks):
+            pairs.append((math.hypot(lpos[0] - apos[0], lpos[1] - apos[1]), a, k))
+    pairs.sort()
+    taken_agents, taken_lms = set(), set()
+    target = None
+    for _, a, k in pairs:
+        if a in taken_agents or k in taken_lms:
+            continue
+        taken_agents.add(a)
+        taken_lms.add(k)
+        if a == 0:
+            target = landmarks[k]
+            break
+    if target is None:
+        target = _nearest(landmarks)
+    return move_toward(target, obs.get("self_vel"))
+
+
+def policy_tag(agent_id: str, obs: Dict[str, Any]) -> List[float]:
+    """Predators pursue the nearest prey; prey flee from all predators."""
+    enemies = obs.get("enemies", [])
+    if "adversary" in agent_id:
+        target = _nearest(enemies)
+        return move_toward(target, obs.get("self_vel")) if target else [1.0, 0.0, 0.0, 0.0, 0.0]
+    return move_away(enemies, obs.get("self_pos"))
+
+
+def policy_adversary(agent_id: str, obs: Dict[str, Any]) -> List[float]:
+    """
+    Good agents: the one closer to the goal covers it, the others cover the
+    decoy landmarks. Adversary: heads for the landmark the good agents crowd.
+    """
+    if obs.get("role") == "ADVERSARY":
+        landmarks = [_vec(l.get("rel")) for l in obs.get("landmarks", [])]
+        goods = [_vec(g.get("rel")) for g in obs.get("good_agents", [])]
+        if not landmarks:
+            return [1.0, 0.0, 0.0, 0.0, 0.0]
+        if goods:
+            target = min(landmarks, key=lambda l: min(math.hypot(l[0] - g[0], l[1] - g[1]) for g in goods))
+        else:
+            target = _nearest(landmarks)
+        return move_toward(target)
+
+    goal = _vec((obs.get("goal") or {}).get("rel"))
+    teammates = [_vec(t.get("rel")) for t in obs.get("teammates", [])]
+    my_goal_dist = _norm(goal)
+    mate_goal_dist = min((math.hypot(goal[0] - t[0], goal[1] - t[1]) for t in teammates), default=float("inf"))
+    if my_goal_dist <= mate_goal_dist:
+        return move_toward(goal)
+    decoys = [_vec(l.get("rel")) for l in obs.get("landmarks", []) if not l.get("is_target")]
+    return move_toward(_nearest(decoys) or goal)
+
+
+def policy_push(agent_id: str, obs: Dict[str, Any]) -> List[float]:
+    """Good agent goes to its goal; adversary blocks between the good agent and its nearest landmark."""
+    vel = obs.get("vel")
+    if obs.get("role") != "ADVERSARY":
+        return move_toward(obs.get("goal_rel"), vel)
+    opp = _vec(obs.get("opponent_rel"))
+    landmarks = [_vec(l.get("rel")) for l in obs.get("landmarks", [])]
+    if not landmarks:
+        return move_toward(opp, vel)
+    lm = min(landmarks, key=lambda l: math.hypot(l[0] - opp[0], l[1] - opp[1]))
+    return move_toward([(opp[0] + lm[0]) / 2.0, (opp[1] + lm[1]) / 2.0], vel)
+
+
+def policy_crypto(agent_id: str, obs: Dict[str, Any]) -> List[float]:
+    """
+    Continuous XOR cipher: Alice sends |message - key|, Bob decodes
+    |ciphertext - key| (exact for 0/1 vectors), Eve echoes the ciphertext.
+    """
+    role = obs.get("role")
+    if role == "ALICE":
+        msg, key = obs.get("message", [0.0] * 4), obs.get("key", [0.0] * 4)
+        return [abs(m - k) for m, k in zip(msg, key)]
+    if role == "BOB":
+        key, ct = obs.get("key", [0.0] * 4), obs.get("ciphertext", [0.0] * 4)
+        return [abs(c - k) for c, k in zip(ct, key)]
+    return [min(max(float(c), 0.0), 1.0) for c in obs.get("ciphertext", [0.0] * 4)]
+
+
+def policy_speaker_listener(agent_id: str, obs: Dict[str, Any]) -> List[float]:
+    """Speaker broadcasts the target one-hot; listener follows the heard landmark id."""
+    if obs.get("role") == "SPEAKER":
+        return _one_hot(int(obs.get("target_landmark_id", 0)), 3)
+    landmarks = obs.get("landmarks", [])
+    heard = obs.get("heard_id", -1)
+    if 0 <= heard < len(landmarks):
+        return move_toward(landmarks[heard].get("rel"), obs.get("vel"))
+    return [1.0, 0.0, 0.0, 0.0, 0.0]
+
+
+def policy_reference(agent_id: str, obs: Dict[str, Any]) -> List[float]:
+    """Say the partner's goal id on channel 5+id; move to the landmark the partner names."""
+    landmarks = obs.get("landmarks", [])
+    heard = obs.get("heard_signal", -1)
+    if 0 <= heard < len(landmarks):
+        move = move_toward(landmarks[heard].get("rel"), obs.get("vel"))
+    else:
+        move = [1.0, 0.0, 0.0, 0.0, 0.0]
+    say = [0.0] * 10
+    target = obs.get("partner_target_id", -1)
+    if 0 <= target < 10:
+        say[target] = 1.0
+    return move + say
+
+
+def policy_world_comm(agent_id: str, obs: Dict[str, Any]) -> List[float]:
+    """
+    Hunters/leader chase the nearest visible prey (else sweep back to the
+    centre); prey flee threats within 0.6 and otherwise graze the nearest food.
+    """
+    role = obs.get("role")
+    me = obs.get("self", {})
+    vel, pos = me.get("velocity"), me.get("position")
+    if role in ("LEADER", "HUNTER"):
+        visible = [e.get("rel") for e in obs.get("enemies", []) if e.get("status") == "VISIBLE"]
+        target = _nearest(visible)
+        if target is None:
+            target = [-p for p in _vec(pos)]
+        move = move_toward(target, vel)
+        return move + [0.0] * 4 if role == "LEADER" else move
+
+    threats = [e.get("rel") for e in obs.get("enemies", []) if e.get("dist", 0.0) > 0.01]
+    close = [t for t in threats if _norm(_vec(t)) < 0.6]
+    if close:
+        return move_away(close, pos)
+    lms = obs.get("landmarks", {})
+    food = _nearest([lms.get("food_1"), lms.get("food_2")])
+    return move_toward(food, vel) if food else [1.0, 0.0, 0.0, 0.0, 0.0]
+
+
+POLICIES: Dict[str, Callable[[str, Dict[str, Any]], List[float]]] = {
+    "simple": policy_simple,
+    "spread": policy_spread,
+    "tag": policy_tag,
+    "adversary": policy_adversary,
+    "push": policy_push,
+    "crypto": policy_crypto,
+    "speaker_listener": policy_speaker_listener,
+    "reference": policy_reference,
+    "world_comm": policy_world_comm,
+}
+
+
+class HeuristicBackend:
+    """Serve heuristic actions as response text, one policy per env (see POLICIES)."""
+
+    def __init__(self, **_unused: Any):
+        pass
+
+    def act(self, env: str, agent_id: str, obs_struct: Dict[str, Any]) -> List[float]:
+        if env not in POLICIES:
+            raise HeuristicContextError(f"no heuristic policy for env '{env}' (available: {sorted(POLICIES)})")
+        return [round(float(x), 4) for x in POLICIES[env](agent_id, obs_struct)]
+
+    def complete(self, system_prompt: str, user_prompt: str, context: Optional[Dict[str, Any]] = None) -> str:
+        if not context or "obs" not in context or "env" not in context:
+            raise HeuristicContextError("heuristic provider needs context={'env', 'agent', 'obs': <parsed obs>}")
+        action = self.act(str(context["env"]), str(context.get("agent", "")), context["obs"])
+        return json.dumps({"action": action, "notes": f"heuristic:{context['env']}"})
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Heuristic policy self-test")
+    print("=" * 60)
+    spread_obs = {
+        "self_vel": [0.0, 0.0],
+        "self_pos": [0.0, 0.0],
+        "landmark_rel": [[0.5, 0.0, 0.5], [-0.6, 0.0, 0.6], [0.0, 0.9, 0.9]],
+        "other_agent_rel": [[0.45, 0.05, 0.45], [-0.1, 0.8, 0.81]],
+    }
+    # agent_1 takes landmark 0, agent_2 landmark 2 -> self goes left to landmark 1
+    print("spread  ", policy_spread("agent_0", spread_obs))
+    print("crypto  ", policy_crypto("alice_0", {"role": "ALICE", "message": [1, 0, 0, 0], "key": [0, 0, 1, 0]}))
+    print("speaker ", policy_speaker_listener("speaker_0", {"role": "SPEAKER", "target_landmark_id": 2}))
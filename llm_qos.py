@@ -0,0 +1,138 @@
+"""
+Per-call LLM outcome tags and per-episode quality-of-service summaries.
+
+APIInferencer.generate_action tags every call with one outcome; the runners
+store it (plus attempts / latency / wasted time / token budget and usage)
+under "llm" in each step
+record of the episode JSON log, so rewards can be separated from transport
+and parsing failures afterwards:
+
+    clean              JSON object with an "action" field parsed
+    regex_fallback     no valid JSON object, action recovered by regex
+    default_zeros      nothing parsable, zero action used
+    transport_failure  all retries failed, zero action used
+
+Logs written before this field existed have no "llm" entry; their
+summaries report calls=0 and are never treated as affected.
+
+Step latency (step_llm_s_*) is the LLM time of one env step, i.e. what the
+step waits for before env.step. StepPipeline decides the agents of a step
+concurrently and stores the measured wall time of the whole decision phase
+as "step_wall_s" in every call's "llm" field; logs without it were written
+by sequential runners, where the step time is the summed latency + retry
+time of the step's calls. Hedged calls (hedging.py) are counted too.
+"""
+
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+OUTCOME_CLEAN = "clean"
+OUTCOME_REGEX = "regex_fallback"
+OUTCOME_DEFAULT = "default_zeros"
+OUTCOME_TRANSPORT = "transport_failure"
+OUTCOMES = (OUTCOME_CLEAN, OUTCOME_REGEX, OUTCOME_DEFAULT, OUTCOME_TRANSPORT)
+# Outcomes where the executed action did not come from the model
+FAILED_OUTCOMES = (OUTCOME_DEFAULT, OUTCOME_TRANSPORT)
+
+
+def summarize_llm_calls(step_rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Aggregate the "llm" field of step records (one episode or any pooled set)."""
+    rows = [r for r in step_rows if isinstance(r.get("llm"), dict)]
+    infos = [r["llm"] for r in rows]
+    step_time: Dict[Any, float] = defaultdict(float)
+    step_wall: Dict[Any, float] = {}
+    for r in rows:
+        step = r.get("step")
+        step_time[step] += float(r["llm"].get("latency_s", 0.0)) + float(r["llm"].get("wasted_s", 0.0))
+        if r["llm"].get("step_wall_s") is not None:
+            step_wall[step] = max(step_wall.get(step, 0.0), float(r["llm"]["step_wall_s"]))
+    # 并发决策的步用实测墙钟时间；没有记录的步（顺序 runner 的旧日志）用各调用耗时之和
+    step_s = np.array([step_wall.get(step, t) for step, t in step_time.items()], dtype=float)
+    counts = {o: 0 for o in OUTCOMES}
+    attempts = 0
+    latency = 0.0
+    wasted = 0.0
+    tokens_out = 0
+    truncated = 0
+    hedged = hedge_wins = 0
+    for info in infos:
+        outcome = info.get("outcome", OUTCOME_CLEAN)
+        counts[outcome] = counts.get(outcome, 0) + 1
+        attempts += int(info.get("attempts", 1))
+        latency += float(info.get("latency_s", 0.0))
+        wasted += float(info.get("wasted_s", 0.0))
+        tokens_out += int(info.get("tokens_out", 0))
+        truncated += int(bool(info.get("truncated")))
+        hedged += int(bool(info.get("hedged")))
+        hedge_wins += int(bool(info.get("hedge_won")))
+    n = len(infos)
+    failed = sum(counts[o] for o in FAILED_OUTCOMES)
+    return {
+        "calls": n,
+        "outcomes": counts,
+        "failure_rate": failed / n if n else 0.0,
+        "regex_fallback_rate": counts[OUTCOME_REGEX] / n if n else 0.0,
+        "retries": attempts - n,
+        "latency_s_mean": latency / n if n else None,
+        "wasted_retry_s": round(wasted, 3),
+        "tokens_out": tokens_out,
+        "truncated": truncated,
+        "hedged": hedged,
+        "hedge_wins": hedge_wins,
+        "steps": len(step_s),
+        "step_llm_s_mean": float(step_s.mean()) if len(step_s) else None,
+        "step_llm_s_p95": float(np.percentile(step_s, 95)) if len(step_s) else None,
+        "step_llm_s_max": float(step_s.max()) if len(step_s) else None,
+    }
+
+
+def merge_summaries(summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Pool several summarize_llm_calls() results (e.g. all episodes of one model/env).
+    step_llm_s_p95 of the pool is the step-weighted mean of the per-episode p95s.
+    """
+    counts = {o: 0 for o in OUTCOMES}
+    calls = retries = tokens_out = truncated = hedged = hedge_wins = steps = 0
+    latency = wasted = step_sum = step_p95_sum = 0.0
+    step_max = None
+    for s in summaries:
+        calls += s["calls"]
+        retries += s["retries"]
+        wasted += s["wasted_retry_s"]
+        latency += (s["latency_s_mean"] or 0.0) * s["calls"]
+        tokens_out += s.get("tokens_out", 0)
+        truncated += s.get("truncated", 0)
+        hedged += s.get("hedged", 0)
+        hedge_wins += s.get("hedge_wins", 0)
+        if s.get("steps"):
+            steps += s["steps"]
+            step_sum += s["step_llm_s_mean"] * s["steps"]
+            step_p95_sum += s["step_llm_s_p95"] * s["steps"]
+            step_max = s["step_llm_s_max"] if step_max is None else max(step_max, s["step_llm_s_max"])
+        for o, c in s["outcomes"].items():
+            counts[o] = counts.get(o, 0) + c
+    failed = sum(counts[o] for o in FAILED_OUTCOMES)
+    return {
+        "calls": calls,
+        "outcomes": counts,
+        "failure_rate": failed / calls if calls else 0.0,
+        "regex_fallback_rate": counts[OUTCOME_REGEX] / calls if calls else 0.0,
+        "retries": retries,
+        "latency_s_mean": latency / calls if calls else None,
+        "wasted_retry_s": round(wasted, 3),
+        "tokens_out": tokens_out,
+        "truncated": truncated,
+        "hedged": hedged,
+        "hedge_wins": hedge_wins,
+        "steps": steps,
+        "step_llm_s_mean": step_sum / steps if steps else None,
+        "step_llm_s_p95": step_p95_sum / steps if steps else None,
+        "step_llm_s_max": step_max,
+    }
+
+
+def is_affected(summary: Dict[str, Any], max_failure_rate: Optional[float]) -> bool:
+    """True if the episode's failure rate exceeds the threshold (None disables the check)."""
+    return max_failure_rate is not None and summary["calls"] > 0 and summary["failure_rate"] > max_failure_rate
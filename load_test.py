@@ -0,0 +1,170 @@
+"""
+End-to-end load test through the full APIInferencer stack.
+
+By default starts mock_server.py in-process on a free port and drives it via
+get_api_engine("zaiwen", api_base=...), i.e. the same OpenAI-protocol client,
+retry loop and JSON parsing the benchmark uses. Pass --api_base to target an
+already running server (mock_server.py, vLLM, a real gateway, ...).
+
+Reports requests/s, p50/p95/p99 latency of generate_action() and failure counts.
+With --agents_per_step N, calls are grouped into env steps of N sequential agent
+calls (as the game runners issue them) and step latency percentiles are reported
+too; compare runs with and without --hedge (hedging.py) for the tail-latency effect.
+
+Usage:
+    python load_test.py --requests 500 --concurrency 32 --latency_ms 300 --latency_dist lognormal
+    python load_test.py --requests 200 --concurrency 16 --max_rps 50 --stream
+    python load_test.py --api_base http://127.0.0.1:8765/v1 --requests 1000 --concurrency 64
+    python load_test.py --requests 1200 --concurrency 8 --agents_per_step 3 --latency_jitter_ms 400 --hedge
+"""
+
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils_api import get_api_engine
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Load test APIInferencer against an OpenAI-compatible server.")
+    p.add_argument("--requests", type=int, default=200)
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--api_base", type=str, default=None, help="Existing server; default starts mock_server in-process")
+    p.add_argument("--api_key", type=str, default="local-load-test")
+    p.add_argument("--model_name", type=str, default="mock")
+    p.add_argument("--stream", action="store_true")
+    p.add_argument("--max_retries", type=int, default=3)
+    p.add_argument("--retry_delay", type=float, default=0.1)
+    p.add_argument("--client_max_retries", type=int, default=0, help="OpenAI SDK internal retries")
+    p.add_argument("--timeout", type=float, default=60.0)
+    p.add_argument("--agents_per_step", type=int, default=1, help="Sequential calls per simulated env step")
+    p.add_argument("--hedge", action="store_true", help="Hedge calls slower than the running quantile")
+    p.add_argument("--hedge_quantile", type=float, default=0.95)
+    p.add_argument("--hedge_budget", type=float, default=0.1, help="Max hedged share of calls")
+    # in-process server knobs (ignored with --api_base)
+    p.add_argument("--latency_ms", type=float, default=200.0)
+    p.add_argument("--latency_dist", type=str, default="lognormal")
+    p.add_argument("--latency_jitter_ms", type=float, default=0.0)
+    p.add_argument("--error_rate", type=float, default=0.0)
+    p.add_argument("--rate_limit_rate", type=float, default=0.0)
+    p.add_argument("--max_rps", type=float, default=0.0)
+    p.add_argument("--max_concurrency", type=int, default=0)
+    p.add_argument("--out", type=str, default=None, help="Optional JSON report path")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    server = None
+    api_base = args.api_base
+    if api_base is None:
+        from mock_server import start_server
+        server, _ = start_server(
+            max_rps=args.max_rps,
+            max_concurrency=args.max_concurrency,
+            latency_ms=args.latency_ms,
+            latency_dist=args.latency_dist,
+            latency_jitter_ms=args.latency_jitter_ms,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+        )
+        api_base = server.base_url
+        print(f"Started mock server at {api_base}")
+
+    engine = get_api_engine(
+        "zaiwen",
+        api_base=api_base,
+        api_key=args.api_key,
+        model_name=args.model_name,
+        stream=args.stream,
+        retry_delay=args.retry_delay,
+        timeout=args.timeout,
+        client_max_retries=args.client_max_retries,
+        hedge={"quantile": args.hedge_quantile, "budget": args.hedge_budget} if args.hedge else None,
+    )
+
+    system_prompt = "You control an agent in a particle environment. Reply with JSON {\"action\": [5 floats]}."
+
+    def one_call(i, agent=0):
+        t0 = time.perf_counter()
+        _, text = engine.generate_action(
+            system_prompt,
+            f"Step {i}: observation placeholder",
+            max_retries=args.max_retries,
+            context={"env": "load_test", "seed": 0, "step": i, "agent": f"agent_{agent}"},
+        )
+        return time.perf_counter() - t0, not str(text).startswith("Failed:")
+
+    def one_step(i):
+        t0 = time.perf_counter()
+        calls = [one_call(i, a) for a in range(args.agents_per_step)]
+        return time.perf_counter() - t0, calls
+
+    n_steps = max(1, args.requests // args.agents_per_step)
+    print(f"Firing {n_steps * args.agents_per_step} requests ({n_steps} steps x {args.agents_per_step} agents) "
+          f"at concurrency {args.concurrency} (stream={args.stream}, hedge={args.hedge})...")
+    wall0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        steps = list(pool.map(one_step, range(n_steps)))
+    wall = time.perf_counter() - wall0
+
+    results = [c for _, calls in steps for c in calls]
+    latencies = np.array([r[0] for r in results]) * 1000.0
+    step_latencies = np.array([s[0] for s in steps]) * 1000.0
+    ok = sum(1 for r in results if r[1])
+    n_requests = len(results)
+    report = {
+        "api_base": api_base,
+        "requests": n_requests,
+        "concurrency": args.concurrency,
+        "stream": args.stream,
+        "hedge": args.hedge,
+        "wall_s": wall,
+        "requests_per_s": n_requests / wall if wall > 0 else None,
+        "ok": ok,
+        "failed": n_requests - ok,
+        "latency_ms_p50": float(np.percentile(latencies, 50)),
+        "latency_ms_p95": float(np.percentile(latencies, 95)),
+        "latency_ms_p99": float(np.percentile(latencies, 99)),
+        "latency_ms_mean": float(latencies.mean()),
+        "agents_per_step": args.agents_per_step,
+        "step_latency_ms_p50": float(np.percentile(step_latencies, 50)),
+        "step_latency_ms_p95": float(np.percentile(step_latencies, 95)),
+        "step_latency_ms_p99": float(np.percentile(step_latencies, 99)),
+        "step_latency_ms_mean": float(step_latencies.mean()),
+    }
+    if engine.hedger is not None:
+        report["hedge_stats"] = engine.hedger.stats()
+    if server is not None:
+        report["server_stats"] = dict(server.stats)
+        server.shutdown()
+        server.server_close()
+
+    print("\n" + "=" * 60)
+    print("LOAD TEST REPORT")
+    print("=" * 60)
+    print(f"Requests:     {report['requests']} ({report['ok']} ok, {report['failed']} failed)")
+    print(f"Wall time:    {report['wall_s']:.2f}s")
+    print(f"Throughput:   {report['requests_per_s']:.1f} req/s")
+    print(f"Latency (ms): p50={report['latency_ms_p50']:.1f}  p95={report['latency_ms_p95']:.1f}  "
+          f"p99={report['latency_ms_p99']:.1f}  mean={report['latency_ms_mean']:.1f}")
+    if args.agents_per_step > 1:
+        print(f"Step (ms):    p50={report['step_latency_ms_p50']:.1f}  p95={report['step_latency_ms_p95']:.1f}  "
+              f"p99={report['step_latency_ms_p99']:.1f}  mean={report['step_latency_ms_mean']:.1f}")
+    if "hedge_stats" in report:
+        print(f"Hedging:      {report['hedge_stats']}")
+    if "server_stats" in report:
+        print(f"Server:       {report['server_stats']}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Report saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Leveled, structured logging shared by the runners, APIInferencer and benchmark_runner.
+
+All loggers live under the "mpe_bench" namespace (get_logger("spread") ->
+"mpe_bench.spread") and carry the current episode context (env, seed,
+episode, model) set with episode_context(). Per-step detail (obs, response
+text, per-agent rewards) is logged at DEBUG, which is off by default.
+
+Console modes (configure_logging):
+- default: INFO and above
+- quiet:   WARNING and above plus one progress line per episode (log_progress)
+- json_lines=True: one JSON object per record (for sweeps / log shippers)
+
+Repeated messages (e.g. the same inference error on every retry) are
+rate-limited per call site so parallel sweeps do not flood stdout.
+
+Environment overrides: MPE_LOG_LEVEL=DEBUG|INFO|WARNING, MPE_LOG_QUIET=1.
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+LOGGER_ROOT = "mpe_bench"
+DEFAULT_FORMAT = "%(asctime)s %(levelname)-7s %(name)s%(ctx_str)s | %(message)s%(data_str)s"
+
+_episode_ctx: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("mpe_episode_ctx", default={})
+_configured = False
+_config_lock = threading.Lock()
+
+
+def _fmt_fields(fields: Dict[str, Any]) -> str:
+    return " ".join(f"{k}={v}" for k, v in fields.items() if v is not None)
+
+
+class _ContextFilter(logging.Filter):
+    """Attach the episode context and structured fields (extra={'data': {...}}) to every record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        ctx = _episode_ctx.get()
+        record.ctx = ctx
+        record.ctx_str = f" [{_fmt_fields(ctx)}]" if ctx else ""
+        data = getattr(record, "data", None) or {}
+        record.data = data
+        record.data_str = f" | {_fmt_fields(data)}" if data else ""
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Allow at most `burst` records per call site (logger, message template)
+    every `interval_s` seconds; the next record that passes reports how many
+    were suppressed. DEBUG records are never limited (they are opt-in).
+    """
+
+    def __init__(self, interval_s: float = 5.0, burst: int = 3):
+        super().__init__()
+        self.interval_s = interval_s
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._state: Dict[Any, list] = {}  # key -> [window_start, count, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG or getattr(record, "progress", False):
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            state = self._state.setdefault(key, [now, 0, 0])
+            if now - state[0] >= self.interval_s:
+                state[0], state[1] = now, 0
+            if state[1] >= self.burst:
+                state[2] += 1
+                return False
+            state[1] += 1
+            suppressed, state[2] = state[2], 0
+        if suppressed:
+            record.data_str = f"{getattr(record, 'data_str', '')} (+{suppressed} similar suppressed)"
+        return True
+
+
+class _QuietFilter(logging.Filter):
+    """Quiet console: warnings/errors and episode progress lines only."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or getattr(record, "progress", False)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **getattr(record, "ctx", {}),
+            **getattr(record, "data", {}),
+        }
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def configure_logging(
+    level: Optional[str] = None,
+    quiet: Optional[bool] = None,
+    json_lines: bool = False,
+    log_file: Optional[str] = None,
+    rate_limit_interval_s: float = 5.0,
+    rate_limit_burst: int = 3,
+) -> logging.Logger:
+    """
+    (Re)configure the "mpe_bench" logger tree. Safe to call more than once.
+
+    Args:
+        level: DEBUG | INFO | WARNING | ERROR (default: $MPE_LOG_LEVEL or INFO)
+        quiet: console shows only warnings and one progress line per episode
+        json_lines: render console/file records as JSON objects
+        log_file: also write every record at `level` to this file
+    """
+    global _configured
+    if level is None:
+        level = os.getenv("MPE_LOG_LEVEL", "INFO")
+    if quiet is None:
+        quiet = os.getenv("MPE_LOG_QUIET", "0") not in ("", "0", "false", "False")
+
+    root = logging.getLogger(LOGGER_ROOT)
+    with _config_lock:
+        for h in list(root.handlers):
+            root.removeHandler(h)
+            h.close()
+        root.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+        root.propagate = False
+
+        formatter = JsonLinesFormatter() if json_lines else logging.Formatter(DEFAULT_FORMAT, "%H:%M:%S")
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(formatter)
+        console.addFilter(_ContextFilter())
+        console.addFilter(RateLimitFilter(rate_limit_interval_s, rate_limit_burst))
+        if quiet:
+            console.addFilter(_QuietFilter())
+        root.addHandler(console)
+
+        if log_file:
+            fh = logging.FileHandler(log_file, encoding="utf-8")
+            fh.setFormatter(formatter)
+            fh.addFilter(_ContextFilter())
+            root.addHandler(fh)
+        _configured = True
+    return root
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger "mpe_bench.<name>"; installs the default configuration on first use."""
+    if not _configured:
+        configure_logging()
+    return logging.getLogger(f"{LOGGER_ROOT}.{name}")
+
+
+@contextlib.contextmanager
+def episode_context(**fields: Any) -> Iterator[None]:
+    """Tag every record logged inside the block with e.g. env=..., seed=..., episode=..."""
+    token = _episode_ctx.set({**_episode_ctx.get(), **fields})
+    try:
+        yield
+    finally:
+        _episode_ctx.reset(token)
+
+
+def log_progress(logger: logging.Logger, msg: str, *args: Any, **data: Any) -> None:
+    """INFO record that stays visible in quiet mode (one per episode)."""
+    logger.info(msg, *args, extra={"progress": True, "data": data})
@@ -0,0 +1,329 @@
+"""
+Prometheus-style metrics for the inference layer and the benchmark scheduler.
+
+No external dependency: metrics are kept in a small in-process registry and
+rendered in the Prometheus text exposition format (version 0.0.4), which both
+Prometheus scrapes and the node_exporter textfile collector accept.
+
+Fed by:
+- APIInferencer.generate_action: calls, attempts, retries, failures by
+  exception class, latency histogram, tokens in/out, parse failures and
+  fallback zero-actions (labels: provider, model)
+- run_benchmark: episodes started/finished, in-flight gauge, last episode
+  mean reward, episode duration histogram (labels: model, env)
+
+Exposure (both optional):
+    from metrics_exporter import REGISTRY, start_metrics_server, write_textfile
+    server, _ = start_metrics_server(port=9108)       # GET http://host:9108/metrics
+    write_textfile("/var/lib/node_exporter/mpe.prom") # atomic rewrite
+
+Local scrape check (no external service):
+    python metrics_exporter.py --selftest
+"""
+
+import argparse
+import math
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+EPISODE_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_value(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    if math.isnan(v):
+        return "NaN"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {_escape(self.help)}", f"# TYPE {self.name} {self.kind}"]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        if amount < 0:
+            raise ValueError("counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}" for k, v in items
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels: Any) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[2] if state else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, ([*s[0]], s[1], s[2])) for k, s in self._values.items())
+        lines = self._header()
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, ('le', _fmt_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, ('le', '+Inf'))} {n}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(total)}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        with self._lock:
+            for m in self._metrics.values():
+                m.clear()
+
+
+REGISTRY = Registry()
+
+_LLM = ("provider", "model")
+_EP = ("model", "env")
+
+LLM_CALLS = REGISTRY.counter("mpe_llm_calls_total", "generate_action calls", _LLM)
+LLM_ATTEMPTS = REGISTRY.counter("mpe_llm_attempts_total", "Backend attempts, including retries", _LLM)
+LLM_RETRIES = REGISTRY.counter("mpe_llm_retries_total", "Attempts after the first within one call", _LLM)
+LLM_FAILURES = REGISTRY.counter("mpe_llm_failures_total", "Failed attempts by exception class", _LLM + ("error",))
+LLM_LATENCY = REGISTRY.histogram("mpe_llm_latency_seconds", "Wall time of the successful (or last) attempt", _LLM)
+LLM_TOKENS_IN = REGISTRY.counter("mpe_llm_prompt_tokens_total", "Prompt tokens (server usage or estimate)", _LLM)
+LLM_TOKENS_OUT = REGISTRY.counter("mpe_llm_completion_tokens_total", "Completion tokens (server usage or estimate)", _LLM)
+LLM_PARSE_FAILURES = REGISTRY.counter(
+    "mpe_llm_parse_failures_total", "Responses with no parsable action (default zero action used)", _LLM)
+LLM_FALLBACKS = REGISTRY.counter(
+    "mpe_llm_fallback_actions_total", "Calls that exhausted retries and returned the zero action", _LLM)
+LLM_OUTCOMES = REGISTRY.counter(
+    "mpe_llm_outcomes_total", "Calls by outcome (clean/regex_fallback/default_zeros/transport_failure)", _LLM + ("outcome",))
+LLM_CIRCUIT_TRIPS = REGISTRY.counter(
+    "mpe_llm_circuit_trips_total", "Circuit breaker transitions to open", ("provider", "endpoint"))
+LLM_HEDGES = REGISTRY.counter(
+    "mpe_llm_hedged_requests_total", "Duplicate requests fired after the p95 delay, by which request won", _LLM + ("winner",))
+
+EPISODES_STARTED = REGISTRY.counter("mpe_episodes_started_total", "Episodes started by run_benchmark", _EP)
+EPISODES_FINISHED = REGISTRY.counter("mpe_episodes_finished_total", "Episodes finished, by status", _EP + ("status",))
+EPISODE_RERUNS = REGISTRY.counter(
+    "mpe_episode_reruns_total", "Episode attempts discarded and re-run (same planned episode)", _EP)
+EPISODES_IN_FLIGHT = REGISTRY.gauge("mpe_episodes_in_flight", "Episodes currently running", _EP)
+EPISODE_MEAN_REWARD = REGISTRY.gauge("mpe_episode_mean_reward", "Mean reward of the last finished episode", _EP)
+EPISODE_DURATION = REGISTRY.histogram(
+    "mpe_episode_duration_seconds", "Episode wall time", _EP, buckets=EPISODE_BUCKETS)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def write_textfile(path: str, registry: Registry = REGISTRY) -> None:
+    """Atomically (re)write a node_exporter textfile-collector file (*.prom)."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(tmp, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:  # silence per-scrape stderr lines
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr: Tuple[str, int], registry: Registry = REGISTRY):
+        super().__init__(addr, _MetricsHandler)
+        self.registry = registry
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+
+def start_metrics_server(host: str = "127.0.0.1", port: int = 0,
+                         registry: Registry = REGISTRY) -> Tuple[MetricsServer, threading.Thread]:
+    """Serve GET /metrics on a background thread; port=0 picks a free port (see server.url)."""
+    server = MetricsServer((host, port), registry)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    return server, thread
+
+
+def parse_exposition(text: str) -> Dict[str, float]:
+    """Minimal parser of the text format ('name{labels}' -> value), used by the self-test."""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name, _, value = line.rpartition(" ")
+        samples[name] = float(value)
+    return samples
+
+
+def _selftest(episodes: int, env: str) -> None:
+    import urllib.request
+    import tempfile
+
+    from benchmark_runner import run_benchmark
+    import metrics_exporter as mod  # the registry utils_api/benchmark_runner feed (not this __main__ copy)
+
+    server, _ = mod.start_metrics_server()
+    with tempfile.TemporaryDirectory() as out_dir:
+        run_benchmark(env, "heuristic", episodes=episodes, output_dir=out_dir)
+        with urllib.request.urlopen(server.url, timeout=10) as resp:
+            assert resp.headers["Content-Type"] == CONTENT_TYPE
+            text = resp.read().decode("utf-8")
+        mod.write_textfile(os.path.join(out_dir, "mpe.prom"))
+        with open(os.path.join(out_dir, "mpe.prom"), encoding="utf-8") as f:
+            assert parse_exposition(f.read()).keys() == parse_exposition(text).keys()
+    server.shutdown()
+
+    samples = parse_exposition(text)
+    llm = '{provider="heuristic",model="heuristic"}'
+    ep = f'{{model="heuristic",env="{env}"}}'
+    assert samples[f"mpe_llm_calls_total{llm}"] > 0
+    assert samples[f"mpe_llm_latency_seconds_count{llm}"] == samples[f"mpe_llm_calls_total{llm}"]
+    assert samples[f'mpe_episodes_finished_total{{model="heuristic",env="{env}",status="ok"}}'] == episodes
+    assert samples[f"mpe_episodes_in_flight{ep}"] == 0
+    print(text, end="")
+    print(f"# selftest ok: scraped {len(samples)} samples from {server.url}")
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Prometheus metrics exporter for MPE benchmark runs.")
+    p.add_argument("--selftest", action="store_true",
+                   help="Run heuristic episodes, scrape the local endpoint and check the samples")
+    p.add_argument("--env", type=str, default="simple")
+    p.add_argument("--episodes", type=int, default=1)
+    args = p.parse_args()
+    if args.selftest:
+        _selftest(args.episodes, args.env)
+    else:
+        p.print_help()
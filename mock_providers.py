@@ -0,0 +1,265 @@
+"""
+Offline LLM backends for load testing and deterministic reruns.
+
+- MockBackend: scripted or random JSON actions with a configurable latency
+  distribution and injected errors / HTTP-429 style rate limits.
+- ReplayBackend: serves the recorded response text of past episode logs,
+  keyed by (env, seed, step, agent).
+
+Both are used through get_api_engine("mock" | "replay", ...) in utils_api.py
+and need neither network access nor model weights.
+"""
+
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from log_utils import get_logger
+
+logger = get_logger("mock")
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+
+class MockProviderError(RuntimeError):
+    """Injected transport failure (behaves like a 5xx from a remote API)."""
+    status_code = 500
+
+
+class MockRateLimitError(MockProviderError):
+    """Injected rate limit (behaves like an HTTP 429 from a remote API)."""
+    status_code = 429
+
+
+class ReplayMissError(LookupError):
+    """No recorded response for the requested (env, seed, step, agent)."""
+    retryable = False
+
+
+def _context_key(context: Optional[Dict[str, Any]]) -> Optional[Tuple[str, int, int, str]]:
+    if not context:
+        return None
+    try:
+        return (str(context["env"]), int(context["seed"]), int(context["step"]), str(context["agent"]))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class MockBackend:
+    """
+    Scripted / random action generator with injected latency and failures.
+
+    Args:
+        responses: list of response texts ("script" mode): with an (env, seed, step, agent)
+                   context every agent walks the list by step (retries of a step move on to the
+                   next text), otherwise they are served round-robin in call order;
+                   when empty, a random {"action": [...]} JSON is generated
+        action_dim: length of the random action vector (context["action_dim"] overrides it per call)
+        latency_ms: mean latency per call
+        latency_dist: 'fixed' | 'uniform' | 'exponential' | 'lognormal'
+        latency_jitter_ms: half-width (uniform) or sigma-scale (lognormal)
+        error_rate: probability of raising MockProviderError
+        rate_limit_rate: probability of raising MockRateLimitError (429)
+        mock_seed: base seed; calls with an (env, seed, step, agent) context are
+                   deterministic regardless of call order or concurrency
+    """
+
+    def __init__(
+        self,
+        responses: Optional[List[str]] = None,
+        action_dim: int = 5,
+        latency_ms: float = 0.0,
+        latency_dist: str = "fixed",
+        latency_jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        mock_seed: int = 0,
+        **_unused: Any,
+    ):
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency_dist: {latency_dist} (choose from {LATENCY_DISTRIBUTIONS})")
+        self.responses = list(responses or [])
+        self.action_dim = int(action_dim)
+        self.latency_ms = float(latency_ms)
+        self.latency_dist = latency_dist
+        self.latency_jitter_ms = float(latency_jitter_ms)
+        self.error_rate = float(error_rate)
+        self.rate_limit_rate = float(rate_limit_rate)
+        self.mock_seed = int(mock_seed)
+        self._lock = threading.Lock()
+        self._rng = random.Random(self.mock_seed)
+        self._calls = 0
+        self._attempts: Dict[Tuple[str, int, int, str], int] = {}
+
+    def _attempt(self, key: Tuple[str, int, int, str]) -> int:
+        # 按 agent-step 计数的尝试序号：重试看到新的随机数，且与其他智能体的调用顺序无关
+        with self._lock:
+            attempt = self._attempts.get(key, 0)
+            self._attempts[key] = attempt + 1
+        return attempt
+
+    def _call_rng(self, key: Optional[Tuple[str, int, int, str]], attempt: int) -> random.Random:
+        if key is None:
+            with self._lock:
+                return random.Random(self._rng.getrandbits(64))
+        digest = hashlib.sha1(repr((self.mock_seed, key, attempt)).encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "little"))
+
+    def sample_latency(self, rng: random.Random) -> float:
+        """Latency in seconds drawn from the configured distribution."""
+        mean = self.latency_ms
+        if mean <= 0:
+            return 0.0
+        if self.latency_dist == "fixed":
+            ms = mean
+        elif self.latency_dist == "uniform":
+            ms = rng.uniform(mean - self.latency_jitter_ms, mean + self.latency_jitter_ms)
+        elif self.latency_dist == "exponential":
+            ms = rng.expovariate(1.0 / mean)
+        else:  # lognormal with the requested mean
+            sigma = self.latency_jitter_ms / mean if self.latency_jitter_ms > 0 else 0.5
+            mu = math.log(mean) - sigma * sigma / 2.0
+            ms = rng.lognormvariate(mu, sigma)
+        return max(ms, 0.0) / 1000.0
+
+    def complete(self, system_prompt: str, user_prompt: str, context: Optional[Dict[str, Any]] = None) -> str:
+        with self._lock:
+            call_idx = self._calls
+            self._calls += 1
+        key = _context_key(context)
+        attempt = self._attempt(key) if key is not None else 0
+        rng = self._call_rng(key, attempt)
+
+        delay = self.sample_latency(rng)
+        if delay > 0:
+            time.sleep(delay)
+
+        draw = rng.random()
+        if draw < self.rate_limit_rate:
+            raise MockRateLimitError("429 Too Many Requests (injected by mock provider)")
+        if draw < self.rate_limit_rate + self.error_rate:
+            raise MockProviderError("500 Internal Server Error (injected by mock provider)")
+
+        if self.responses:
+            # 有上下文时按 (step, 尝试序号) 取脚本：并发决策下与线程调度顺序无关
+            idx = key[2] + attempt if key is not None else call_idx
+            return self.responses[idx % len(self.responses)]
+        dim = int((context or {}).get("action_dim") or self.action_dim)
+        action = [round(rng.random(), 3) for _ in range(dim)]
+        return json.dumps({"action": action, "notes": "mock"})
+
+
+class ReplayBackend:
+    """
+    Serve recorded responses from episode logs under replay_dir.
+
+    Episode identity comes from the log's final_summary ('env', 'seed'); older
+    logs without them fall back to the benchmark naming scheme
+    <env>/<env>_ep<N>.json with seed = seed_start + N - 1.
+
+    replay_model restricts the index to logs below a directory of that name
+    (batch trees are <model>/<env>/<env>_ep<N>.json). The same (env, seed, step,
+    agent) recorded in two directories (e.g. two models) is ambiguous and raises
+    ValueError; reruns of an episode in one directory (<env>_ep<N>_1.json) are
+    resolved to the most recently written log.
+    """
+
+    def __init__(self, replay_dir: str, seed_start: int = 1, replay_model: Optional[str] = None, **_unused: Any):
+        self.replay_dir = Path(replay_dir)
+        self.seed_start = int(seed_start)
+        self.replay_model = replay_model
+        self.index: Dict[Tuple[str, int, int, str], str] = {}
+        self._source: Dict[Tuple[str, int, int, str], Path] = {}
+        self._conflicts: List[Tuple[Path, Path]] = []
+        self._overridden = 0
+        if not self.replay_dir.exists():
+            raise FileNotFoundError(f"replay_dir not found: {self.replay_dir}")
+        paths = [p for p in self.replay_dir.rglob("*.json")
+                 if replay_model is None or replay_model in p.relative_to(self.replay_dir).parts[:-1]]
+        if replay_model is not None and not paths:
+            raise FileNotFoundError(f"no logs of model {replay_model!r} under {self.replay_dir}")
+        # 同一目录下的重跑日志：按写入时间排序，最新的覆盖旧的
+        for path in sorted(paths, key=lambda p: (p.stat().st_mtime, str(p))):
+            self._index_file(path)
+        if self._conflicts:
+            a, b = self._conflicts[0]
+            raise ValueError(
+                f"{len(self._conflicts)} recorded responses appear in several directories under {self.replay_dir} "
+                f"(e.g. {a} and {b}); pass replay_model=<model directory> or point replay_dir at one model's results")
+        if self._overridden:
+            logger.warning("Replay index: %d responses recorded by several reruns; serving the latest log",
+                           self._overridden)
+
+    def _identity(self, path: Path, summary: Optional[Dict[str, Any]]) -> Optional[Tuple[str, int]]:
+        env = (summary or {}).get("env")
+        seed = (summary or {}).get("seed")
+        match = re.match(r"(.+?)_ep(\d+)(?:_\d+)?\.json$", path.name)
+        if env is None and match:
+            env = match.group(1)
+        if seed is None and match:
+            seed = self.seed_start + int(match.group(2)) - 1
+        if env is None or seed is None:
+            return None
+        return str(env), int(seed)
+
+    def _index_file(self, path: Path) -> None:
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, list):
+            return
+        summary = next((e for e in data if isinstance(e, dict) and e.get("final_summary")), None)
+        identity = self._identity(path, summary)
+        if identity is None:
+            return
+        env, seed = identity
+        for entry in data:
+            if not isinstance(entry, dict) or "step" not in entry or "agent" not in entry:
+                continue
+            thought = entry.get("thought")
+            if thought is None:
+                continue
+            key = (env, seed, int(entry["step"]), str(entry["agent"]))
+            previous = self._source.get(key)
+            if previous is not None and previous != path:
+                if previous.parent != path.parent:
+                    self._conflicts.append((previous, path))
+                    continue
+                self._overridden += 1
+            self._source[key] = path
+            self.index[key] = str(thought)
+
+    def complete(self, system_prompt: str, user_prompt: str, context: Optional[Dict[str, Any]] = None) -> str:
+        key = _context_key(context)
+        if key is None:
+            raise ReplayMissError("replay provider needs context={'env', 'seed', 'step', 'agent'}")
+        if key not in self.index:
+            raise ReplayMissError(f"no recorded response for {key} under {self.replay_dir}")
+        return self.index[key]
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Mock provider self-test")
+    print("=" * 60)
+    backend = MockBackend(latency_ms=20, latency_dist="lognormal", error_rate=0.1, rate_limit_rate=0.1)
+    outcomes = {"ok": 0, "429": 0, "500": 0}
+    t0 = time.time()
+    for i in range(50):
+        ctx = {"env": "spread", "seed": 1, "step": i, "agent": "agent_0"}
+        try:
+            backend.complete("", "", ctx)
+            outcomes["ok"] += 1
+        except MockRateLimitError:
+            outcomes["429"] += 1
+        except MockProviderError:
+            outcomes["500"] += 1
+    print(f"50 calls in {time.time() - t0:.2f}s -> {outcomes}")
@@ -0,0 +1,312 @@
+"""
+Local OpenAI-compatible stand-in server for end-to-end concurrency tests.
+
+Implements POST /v1/chat/completions (plain JSON and SSE streaming) on top of
+mock_providers.MockBackend, so latency distributions and 5xx/429 injection are
+configured the same way as the in-process mock provider. Additional knobs:
+
+- max_rps: requests-per-second ceiling (token bucket); excess requests get 429
+- max_concurrency: requests processed at once; the rest queue on the server
+- stream_chunk_chars / stream_chunk_delay_ms: SSE chunking of the response
+- response_format: json_schema sizes the random action to the schema's
+  maxItems; json_schema_support=False answers it with 400 (like providers
+  that only offer JSON mode) to exercise the client's json_object downgrade
+- think_tokens / ms_per_token: emulate a reasoning model that emits
+  think_tokens <think> tokens (scaled by reasoning_effort: none 0, low 0.5,
+  medium 1, high 2) before the answer at ms_per_token decode cost; max_tokens
+  truncates the output (finish_reason "length"), so token budgets can be
+  evaluated offline (see ab_token_budget.py)
+
+Point any OpenAI-protocol provider at it, e.g.:
+    engine = get_api_engine("zaiwen", api_base="http://127.0.0.1:8765/v1", api_key="local")
+
+Usage:
+    python mock_server.py --port 8765 --latency_ms 500 --latency_dist lognormal --rate_limit_rate 0.02
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+from mock_providers import MockBackend, MockRateLimitError
+from obs.encode_obs import count_tokens
+from token_budget import EFFORT_SCALE
+
+
+class _TokenBucket:
+    """Thread-safe token bucket; rate <= 0 disables the ceiling."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(self.rate, 1.0))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        if self.rate <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # default 5 drops SYNs under high client concurrency
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        max_rps: float = 0.0,
+        max_concurrency: int = 0,
+        stream_chunk_chars: int = 16,
+        stream_chunk_delay_ms: float = 0.0,
+        json_schema_support: bool = True,
+        think_tokens: int = 0,
+        ms_per_token: float = 0.0,
+        **mock_kwargs: Any,
+    ):
+        super().__init__(address, _ChatCompletionsHandler)
+        self.backend = MockBackend(**mock_kwargs)
+        self.bucket = _TokenBucket(max_rps)
+        self.slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency > 0 else None
+        self.stream_chunk_chars = max(1, int(stream_chunk_chars))
+        self.stream_chunk_delay_ms = float(stream_chunk_delay_ms)
+        self.json_schema_support = bool(json_schema_support)
+        self.think_tokens = max(0, int(think_tokens))
+        self.ms_per_token = float(ms_per_token)
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0, "streamed": 0, "structured": 0,
+                      "truncated": 0}
+
+    def count(self, key: str) -> None:
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def decode(self, text: str, request: Dict[str, Any]) -> Tuple[str, str]:
+        """Prefix emulated reasoning, apply max_tokens and the per-token decode delay; returns (text, finish_reason)."""
+        effort = request.get("reasoning_effort")
+        if (request.get("enable_thinking") is False) or effort == "none":
+            scale = 0.0
+        else:
+            scale = EFFORT_SCALE.get(effort or "medium", 1.0)
+        n_think = int(self.think_tokens * scale)
+        if request.get("thinking_budget"):
+            n_think = min(n_think, int(request["thinking_budget"]))
+        if n_think:
+            text = "<think>" + " hmm" * n_think + "</think>\n" + text
+        finish = "stop"
+        max_tokens = request.get("max_tokens") or request.get("max_completion_tokens")
+        total = count_tokens(text)
+        if max_tokens and total > int(max_tokens):
+            text = text[: len(text) * int(max_tokens) // total]
+            finish = "length"
+            self.count("truncated")
+        if self.ms_per_token > 0:
+            time.sleep(self.ms_per_token * count_tokens(text) / 1000.0)
+        return text, finish
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+class _ChatCompletionsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so client connection pooling is exercised
+    server: MockOpenAIServer
+
+    def log_message(self, format: str, *args: Any) -> None:  # silence per-request stderr lines
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str, err_type: str) -> None:
+        self._send_json(status, {"error": {"message": message, "type": err_type, "code": status}})
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") in ("/v1/models", "/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        else:
+            self._send_error(404, f"unknown path {self.path}", "not_found")
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self._send_error(404, f"unknown path {self.path}", "not_found")
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_error(400, "invalid JSON body", "invalid_request_error")
+            return
+
+        srv = self.server
+        srv.count("requests")
+        if not srv.bucket.take():
+            srv.count("rate_limited")
+            self._send_error(429, "rate limit exceeded (max_rps)", "rate_limit_exceeded")
+            return
+
+        messages = request.get("messages") or []
+        system_prompt = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        user_prompt = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+
+        context = None
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            if not srv.json_schema_support:
+                self._send_error(400, "response_format type json_schema is not supported", "invalid_request_error")
+                return
+            srv.count("structured")
+            schema = (response_format.get("json_schema") or {}).get("schema") or {}
+            dim = ((schema.get("properties") or {}).get("action") or {}).get("maxItems")
+            context = {"action_dim": dim} if dim else None
+        elif response_format.get("type") == "json_object":
+            srv.count("structured")
+
+        if srv.slots is not None:
+            srv.slots.acquire()
+        try:
+            text = srv.backend.complete(system_prompt, user_prompt, context)
+            text, finish = srv.decode(text, request)
+        except MockRateLimitError as e:
+            srv.count("rate_limited")
+            self._send_error(429, str(e), "rate_limit_exceeded")
+            return
+        except Exception as e:
+            srv.count("errors")
+            self._send_error(500, str(e), "server_error")
+            return
+        finally:
+            if srv.slots is not None:
+                srv.slots.release()
+
+        model = request.get("model", "mock")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        usage = {
+            "prompt_tokens": count_tokens(system_prompt) + count_tokens(user_prompt),
+            "completion_tokens": count_tokens(text),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if request.get("stream"):
+            srv.count("streamed")
+            self._stream(completion_id, model, text, finish)
+        else:
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": finish,
+                }],
+                "usage": usage,
+            })
+        srv.count("ok")
+
+    def _stream(self, completion_id: str, model: str, text: str, finish: str = "stop") -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta: Dict[str, Any], finish: Optional[str] = None) -> None:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        chunk({"role": "assistant", "content": ""})
+        step = self.server.stream_chunk_chars
+        for i in range(0, len(text), step):
+            if self.server.stream_chunk_delay_ms > 0:
+                time.sleep(self.server.stream_chunk_delay_ms / 1000.0)
+            chunk({"content": text[i:i + step]})
+        chunk({}, finish=finish)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, **kwargs: Any) -> Tuple[MockOpenAIServer, threading.Thread]:
+    """Start the server on a background thread; port=0 picks a free port (see server.base_url)."""
+    server = MockOpenAIServer((host, port), **kwargs)
+    thread = threading.Thread(target=server.serve_forever, name="mock-openai-server", daemon=True)
+    thread.start()
+    return server, thread
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Local OpenAI-compatible /v1/chat/completions stand-in.")
+    p.add_argument("--host", type=str, default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--latency_ms", type=float, default=0.0)
+    p.add_argument("--latency_dist", type=str, default="fixed")
+    p.add_argument("--latency_jitter_ms", type=float, default=0.0)
+    p.add_argument("--error_rate", type=float, default=0.0)
+    p.add_argument("--rate_limit_rate", type=float, default=0.0)
+    p.add_argument("--max_rps", type=float, default=0.0)
+    p.add_argument("--max_concurrency", type=int, default=0)
+    p.add_argument("--action_dim", type=int, default=5)
+    p.add_argument("--stream_chunk_chars", type=int, default=16)
+    p.add_argument("--stream_chunk_delay_ms", type=float, default=0.0)
+    p.add_argument("--no_json_schema", action="store_true", help="Reject response_format json_schema with 400")
+    p.add_argument("--think_tokens", type=int, default=0, help="Emulated reasoning tokens per response (medium effort)")
+    p.add_argument("--ms_per_token", type=float, default=0.0, help="Emulated decode time per output token")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    srv = MockOpenAIServer(
+        (args.host, args.port),
+        max_rps=args.max_rps,
+        max_concurrency=args.max_concurrency,
+        stream_chunk_chars=args.stream_chunk_chars,
+        stream_chunk_delay_ms=args.stream_chunk_delay_ms,
+        json_schema_support=not args.no_json_schema,
+        think_tokens=args.think_tokens,
+        ms_per_token=args.ms_per_token,
+        latency_ms=args.latency_ms,
+        latency_dist=args.latency_dist,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        action_dim=args.action_dim,
+    )
+    print(f"Mock OpenAI server listening on {srv.base_url} (Ctrl+C to stop)")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+        print(f"Stats: {srv.stats}")
@@ -0,0 +1,247 @@
+"""
+Observation text encoders shared by all game runners.
+
+The parsers in obs/parse_*_obs.py return nested dicts. Runners used to embed
+them verbatim (Python repr / json.dumps), which spends many prompt tokens on
+long keys, padding and derived fields. This module renders the same struct in
+three selectable formats:
+
+- verbose: the runner's original rendering (kept in the runner itself)
+- compact: short keys, tabular lists, trimmed numbers
+- minimal: compact minus redundant/derived fields (raw vectors, distances,
+           directions, speeds, ids that repeat the list index)
+
+Each encoding can be measured with count_tokens() so the per-agent-step input
+cost of every format is visible in the episode logs.
+"""
+
+import json
+import math
+from typing import Any, Dict, List
+
+__all__ = ["OBS_FORMATS", "encode_obs", "count_tokens", "row_layout"]
+
+OBS_FORMATS = ("verbose", "compact", "minimal")
+
+# Generic long keys -> short aliases used by compact/minimal encodings.
+# Game-specific keys (landmark_rel, enemies, ...) are kept because the runners'
+# OBSERVATION SEMANTICS text refers to them by name.
+KEY_ALIASES = {
+    "relative_position": "rel",
+    "distance": "d",
+    "dist": "d",
+    "direction": "dir",
+    "position": "pos",
+    "velocity": "vel",
+    "is_target": "tgt",
+}
+
+# Fields dropped by the minimal encoding (debug copies or values the model can
+# derive from the remaining numbers)
+MINIMAL_DROP_KEYS = {
+    "raw",
+    "raw_vector",
+    "raw_len",
+    "agent_id",
+    "agent_name",
+    "speed",
+    "direction",
+    "distance",
+    "dist",
+    "opponent_dist",
+    "goal_dist",
+    "fake_dist",
+    "in_bounds",
+    "color_name",
+    "id",
+}
+
+# Parser fields holding [dx, dy, dist] rows (a single row or a list of rows:
+# parse_spread/simple/tag_obs); minimal keeps [dx, dy]. Matched by key, not by
+# value: other numeric triples (comm_vector, partner_goal_rgb, ...) stay intact.
+DIST_ROW_KEYS = {
+    "landmark_rel",
+    "other_agent_rel",
+    "obstacles_rel",
+    "enemies",
+    "teammates",
+}
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Token count of a prompt fragment.
+    Uses tiktoken (cl100k_base) when installed, otherwise the usual
+    ~4 characters per token estimate.
+    """
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return int(math.ceil(len(text) / 4.0))
+
+
+def _num(x: Any) -> str:
+    """Shortest faithful rendering of a rounded float: 0.50 -> .5, -0.0 -> 0."""
+    if hasattr(x, "item") and not isinstance(x, (list, tuple, dict)):
+        x = x.item()  # numpy scalars (np.bool_, np.float32, ...)
+    if isinstance(x, bool):
+        return "1" if x else "0"
+    if isinstance(x, int):
+        return str(x)
+    if isinstance(x, float):
+        if x == 0:
+            return "0"
+        s = f"{x:.3f}".rstrip("0").rstrip(".")
+        if s.startswith("0."):
+            s = s[1:]
+        elif s.startswith("-0."):
+            s = "-" + s[2:]
+        return s
+    return str(x)
+
+
+def row_layout(obs_format: str) -> str:
+    """Column layout of the DIST_ROW_KEYS rows in encode_obs(..., obs_format), for the prompt header."""
+    return "[dx dy]" if obs_format == "minimal" else "[dx dy dist]"
+
+
+def _is_row(v: Any) -> bool:
+    return isinstance(v, (list, tuple)) and len(v) == 3 and _scalar_list(v)
+
+
+def _drop_dist(value: List[Any]) -> List[Any]:
+    # 单行 [dx, dy, dist]（simple 的 landmark_rel）或行列表（spread / tag）；dict 行（world_comm）不受影响
+    if _is_row(value):
+        return list(value[:2])
+    return [list(row[:2]) if _is_row(row) else row for row in value]
+
+
+def _prune(value: Any, minimal: bool, key: str = "") -> Any:
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            if minimal and k in MINIMAL_DROP_KEYS:
+                continue
+            if v is None:
+                continue
+            out[KEY_ALIASES.get(k, k)] = _prune(v, minimal, k)
+        return out
+    if isinstance(value, (list, tuple)):
+        if minimal and key in DIST_ROW_KEYS:
+            value = _drop_dist(value)
+        return [_prune(v, minimal) for v in value]
+    return value
+
+
+def _scalar_list(v: List[Any]) -> bool:
+    return all(not isinstance(x, (dict, list, tuple)) for x in v)
+
+
+def _render(key: str, value: Any, indent: str, lines: List[str]) -> None:
+    if isinstance(value, dict):
+        if value and all(not isinstance(v, (dict, list, tuple)) or (isinstance(v, list) and _scalar_list(v))
+                         for v in value.values()):
+            cells = " ".join(
+                f"{k}={','.join(_num(x) for x in v) if isinstance(v, list) else _num(v)}"
+                for k, v in value.items()
+            )
+            lines.append(f"{indent}{key}: {cells}")
+            return
+        lines.append(f"{indent}{key}:")
+        for k, v in value.items():
+            _render(k, v, indent + " ", lines)
+        return
+
+    if isinstance(value, (list, tuple)):
+        if not value:
+            lines.append(f"{indent}{key}: -")
+            return
+        if _scalar_list(value):
+            lines.append(f"{indent}{key}: {' '.join(_num(x) for x in value)}")
+            return
+        # list of rows -> table, one row per line, index as row label
+        if all(isinstance(row, dict) for row in value):
+            cols: List[str] = []
+            for row in value:
+                for k in row:
+                    if k not in cols:
+                        cols.append(k)
+            lines.append(f"{indent}{key}[{'|'.join(cols)}]:")
+            for i, row in enumerate(value):
+                cells = []
+                for c in cols:
+                    v = row.get(c)
+                    if isinstance(v, list):
+                        cells.append(",".join(_num(x) for x in v))
+                    elif isinstance(v, dict):
+                        cells.append(json.dumps(v, separators=(",", ":")))
+                    else:
+                        cells.append("-" if v is None else _num(v))
+                lines.append(f"{indent} {i}|{'|'.join(cells)}")
+            return
+        lines.append(f"{indent}{key}:")
+        for i, row in enumerate(value):
+            if isinstance(row, (list, tuple)) and _scalar_list(row):
+                lines.append(f"{indent} {i}: {' '.join(_num(x) for x in row)}")
+            else:
+                _render(str(i), row, indent + " ", lines)
+        return
+
+    lines.append(f"{indent}{key}: {_num(value)}")
+
+
+def encode_obs(obs_struct: Dict[str, Any], obs_format: str = "compact") -> str:
+    """
+    Render a parsed observation struct as prompt text.
+
+    Args:
+        obs_struct: output of one of the obs/parse_*_obs.py parsers
+        obs_format: 'compact' or 'minimal' ('verbose' falls back to one-line JSON;
+                    runners keep their own verbose rendering)
+    """
+    if obs_format not in OBS_FORMATS:
+        raise ValueError(f"Unknown obs_format: {obs_format} (choose from {OBS_FORMATS})")
+    if obs_format == "verbose":
+        return json.dumps(obs_struct)
+
+    pruned = _prune(obs_struct, minimal=(obs_format == "minimal"))
+    lines: List[str] = []
+    for k, v in pruned.items():
+        _render(k, v, "", lines)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Observation encoder self-test")
+    print("=" * 60)
+
+    spread_struct = {
+        "self_vel": [0.1, -0.05],
+        "self_pos": [0.2, 0.3],
+        "landmark_rel": [[0.5, 0.4, 0.64], [-0.3, 0.2, 0.36], [0.1, -0.6, 0.61]],
+        "other_agent_rel": [[0.15, 0.25, 0.29], [-0.8, 0.6, 1.0]],
+    }
+    adv_struct = {
+        "role": "GOOD_AGENT",
+        "goal": {"rel": [0.5, 0.3], "dist": 0.58},
+        "landmarks": [
+            {"id": 0, "rel": [0.5, 0.3], "dist": 0.58, "is_target": True},
+            {"id": 1, "rel": [-0.2, 0.8], "dist": 0.82, "is_target": False},
+        ],
+        "adversary": {"rel": [-0.3, -0.5], "dist": 0.58},
+        "teammates": [{"rel": [0.4, 0.1], "dist": 0.41}],
+    }
+
+    for name, struct in [("spread", spread_struct), ("adversary", adv_struct)]:
+        for fmt in OBS_FORMATS:
+            text = encode_obs(struct, fmt) if fmt != "verbose" else str(struct)
+            print(f"\n[{name} / {fmt}] tokens={count_tokens(text)}")
+            print(text)
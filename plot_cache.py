@@ -0,0 +1,174 @@
+"""
+Lazy, cached figure rendering for the analysis scripts.
+
+A figure is a FigureJob(path, render, data): render(plt, data, path) is a
+module-level function that draws the JSON-serializable aggregates in `data`
+and saves the figure to path. render_figures() then
+
+- skips figures whose (render code, data) hash matches the manifest entry
+  of the last run and whose file still exists,
+- imports matplotlib only if some figure does need drawing, always with the
+  non-interactive Agg backend (no display needed on headless servers),
+- draws the remaining figures in a process pool (pyplot is not thread-safe).
+
+    jobs = [FigureJob(plots_dir / "trend.png", render_trend, {"games": ..., "series": ...})]
+    render_figures(jobs, plots_dir / MANIFEST_NAME, workers=4)   # {path: "cached" | "rendered"}
+
+render runs in worker processes and must be picklable (module-level).
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional
+
+from log_utils import get_logger
+
+logger = get_logger("plot_cache")
+
+MANIFEST_NAME = ".plot_cache.json"
+# bump to redraw every figure (e.g. after changing shared styling)
+PLOT_VERSION = "1"
+
+_plt = None
+
+
+class FigureJob(NamedTuple):
+    path: Path
+    render: Callable[[Any, Any, Path], None]
+    data: Any
+
+
+def pyplot():
+    """matplotlib.pyplot on the Agg backend, imported on first use."""
+    global _plt
+    if _plt is None:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        _plt = plt
+    return _plt
+
+
+def game_axes(plt, n_games: int, max_cols: int = 3, **kwargs):
+    """(fig, axes list) with one subplot per game, at most max_cols per row; unused cells are hidden."""
+    n = max(n_games, 1)
+    ncols = min(max_cols, n)
+    nrows = -(-n // ncols)
+    fig, axes = plt.subplots(nrows, ncols, figsize=(6 * ncols, 5 * nrows), squeeze=False, **kwargs)
+    axes = list(axes.flat)
+    for ax in axes[n_games:]:
+        ax.set_visible(False)
+    return fig, axes
+
+
+@lru_cache(maxsize=None)
+def _module_digest(module_name: str) -> Optional[str]:
+    try:
+        source = inspect.getsource(sys.modules[module_name])
+    except (KeyError, OSError, TypeError):
+        return None
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+def _code_digest(code: Any, h: Any) -> None:
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode("utf-8"))
+    for const in code.co_consts:
+        # 嵌套函数 / 推导式的 code 对象的 repr 含内存地址，递归展开
+        if inspect.iscode(const):
+            _code_digest(const, h)
+        elif isinstance(const, frozenset):
+            # `x in {...}` 常量：字符串哈希随机化下 repr 顺序不固定
+            h.update(repr(sorted(map(repr, const))).encode("utf-8"))
+        else:
+            h.update(repr(const).encode("utf-8"))
+
+
+def _render_digest(render: Callable) -> str:
+    """
+    Hash of the code that draws a figure: the source of render's module (so edits to render or to the
+    module helpers it calls redraw the figure), or render's own bytecode and constants if the source
+    is not available.
+    """
+    digest = _module_digest(render.__module__)
+    if digest is None:
+        h = hashlib.sha1()
+        _code_digest(render.__code__, h)
+        digest = h.hexdigest()
+    return digest
+
+
+def figure_key(job: FigureJob) -> str:
+    payload = json.dumps(job.data, sort_keys=True, ensure_ascii=False, default=str)
+    code = _render_digest(job.render)
+    return hashlib.sha1(f"{PLOT_VERSION}|{job.render.__qualname__}|{code}|{payload}".encode("utf-8")).hexdigest()
+
+
+def _render(render: Callable[[Any, Any, Path], None], data: Any, path: str) -> None:
+    """Draw one figure. Runs in worker processes."""
+    plt = pyplot()
+    try:
+        render(plt, data, Path(path))
+    finally:
+        plt.close("all")
+
+
+def _load_manifest(manifest_path: Path) -> Dict[str, str]:
+    try:
+        with manifest_path.open("r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as exc:
+        logger.warning("Ignoring unreadable plot cache %s: %s", manifest_path, exc)
+        return {}
+    return manifest.get("figures") or {}
+
+
+def render_figures(jobs: Iterable[FigureJob], manifest_path: Path, workers: Optional[int] = None,
+                   force: bool = False) -> Dict[str, str]:
+    """
+    Draw the figures whose data changed since the last run (all of them with force=True).
+    workers: process count (default os.cpu_count()); <= 1 draws in this process
+    Returns {path: "cached" | "rendered"}.
+    """
+    manifest_path = Path(manifest_path)
+    figures = _load_manifest(manifest_path)
+    status: Dict[str, str] = {}
+    pending = {}
+    for job in jobs:
+        key, path = figure_key(job), str(job.path)
+        if not force and figures.get(path) == key and os.path.exists(path):
+            status[path] = "cached"
+            continue
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        pending[path] = (job, key)
+
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    if pending and workers <= 1:
+        for path, (job, key) in pending.items():
+            _render(job.render, job.data, path)
+            figures[path] = key
+            status[path] = "rendered"
+    elif pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {path: pool.submit(_render, job.render, job.data, path) for path, (job, _) in pending.items()}
+            for path, future in futures.items():
+                future.result()
+                figures[path] = pending[path][1]
+                status[path] = "rendered"
+
+    if pending:
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = manifest_path.with_name(manifest_path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump({"version": PLOT_VERSION, "figures": figures}, f, ensure_ascii=False)
+        os.replace(tmp, manifest_path)
+    logger.info("Figures: %d rendered, %d unchanged", len(pending), len(status) - len(pending))
+    return status
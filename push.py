@@ -1,3 +1,4 @@
+import logging
 import numpy as np
 import json
 from typing import Dict, Any
@@ -10,14 +11,26 @@ from prompt.prompt_for_push import (
     get_task_and_reward,
 )
 from obs.parse_push_obs import parse_push_obs
+from obs.encode_obs import count_tokens, encode_obs
+from log_utils import get_logger
+from step_pipeline import StepPipeline
+
+logger = get_logger("push")
 
 try:
     from pettingzoo.mpe import simple_push_v3
 except ImportError:
     raise ImportError("请安装 pettingzoo: pip install pettingzoo[mpe]")
 
-def _format_current_obs(obs_struct: Dict[str, Any]) -> str:
+def _format_current_obs(obs_struct: Dict[str, Any], obs_format: str = "verbose") -> str:
     role = obs_struct['role']
+    if obs_format != "verbose":
+        return "\n".join([
+            "OBSERVATION SEMANTICS:",
+            "- obs = [self_vel, landmarks..., opponent_rel] (role-dependent)",
+            f"CURRENT OBS ({obs_format}):",
+            encode_obs(obs_struct, obs_format),
+        ])
     obs_lines = [
         "OBSERVATION SEMANTICS:",
         "- obs = [self_vel, landmarks..., opponent_rel] (role-dependent)",
@@ -41,14 +54,14 @@ def _format_current_obs(obs_struct: Dict[str, Any]) -> str:
     return "\n".join(obs_lines)
 
 
-def user_prompt_push(agent_id: str, step: int, obs_struct: Dict[str, Any]) -> str:
+def user_prompt_push(agent_id: str, step: int, obs_struct: Dict[str, Any], obs_format: str = "verbose") -> str:
     role = obs_struct['role']
     parts = [
         get_task_and_reward(role),
         get_physics_rules(),
         get_action_and_response_format(),
         get_navigation_hints(role),
-        _format_current_obs(obs_struct),
+        _format_current_obs(obs_struct, obs_format),
     ]
     return "\n\n".join(parts)
 
@@ -59,123 +72,146 @@ def run_push_game(provider: str, output_name: str, **kwargs):
     MAX_STEPS = 30
     
     seed = kwargs.pop('seed', None)
+    obs_format = kwargs.pop('obs_format', 'verbose')
+    pipeline = kwargs.pop('pipeline', True)
+    checkpoint = kwargs.pop('checkpoint', False)
+    capture = kwargs.pop('capture', None)
     llm_engine = get_api_engine(provider, **kwargs)
 
-    print("Initializing Push Env (Full Info Mode)...")
+    logger.info("Initializing Push Env (Full Info Mode)...")
     env = simple_push_v3.parallel_env(max_cycles=MAX_STEPS, continuous_actions=True, render_mode="rgb_array")
     
     observations, infos = env.reset(seed=seed) if seed is not None else env.reset()
-    frames = []
-    game_log = []
-    
-    total_r_good = 0
-    total_r_adv = 0
-
-    for step in range(MAX_STEPS):
-        print(f"\n{'='*30} STEP {step} {'='*30}")
-        frame = env.render()
-        if frame is not None: frames.append(frame)
-        
-        actions = {}
-        step_buffer = {}
-
-        # --- Decision Phase ---
-        for agent_id in env.agents:
-            obs_raw = observations[agent_id]
-            obs_struct = parse_push_obs(obs_raw, agent_id)
-            full_prompt = user_prompt_push(agent_id, step, obs_struct)
-            
-            sys_r = "You are a strategic AI agent in a physics simulation."
-            action_vec, raw_thought = llm_engine.generate_action(sys_r, full_prompt)
-            action_vec = np.clip(action_vec, 0.0, 1.0)
-            actions[agent_id] = action_vec
-            
-            step_buffer[agent_id] = {
-                "struct": obs_struct,
-                "action": action_vec,
-                "thought": raw_thought
-            }
-
-        # --- Environment Step ---
-        observations, rewards, terminations, truncations, infos = env.step(actions)
-        
-        # --- Logging Phase ---
-        for aid, info in step_buffer.items():
-            r = rewards.get(aid, 0.0)
-            role = info['struct']['role']
-            icon = "🔴" if role == 'ADVERSARY' else "🟢"
-            
-            if role == 'ADVERSARY': total_r_adv += r
-            else: total_r_good += r
-            
-            # 1. 打印基础信息
-            print(f"\n{icon} {aid} | Reward: {r:.4f}")
-            
-            # 2. 打印物理感知 (Sight)
-            if role == 'GOOD_AGENT':
-                goal_vec = info['struct']['goal_rel']
-                fake_vec = info['struct']['fake_rel']
-                adv_vec = info['struct']['opponent_rel']
-                print(f"   [Eye] Goal: {goal_vec}")
-                print(f"   [Eye] Fake: {fake_vec}")
-                print(f"   [Eye] Adv:  {adv_vec}")
-            else:
-                opp_vec = info['struct']['opponent_rel']
-                print(f"   [Eye] GoodAgent: {opp_vec}")
-                # 打印坏人看到的两个地标
-                lms = info['struct']['landmarks']
-                print(f"   [Eye] LM_A: {lms[0]['rel']} | LM_B: {lms[1]['rel']}")
-
-            # 3. 打印完整思维 (Full Thought)
-            print(f"   🧠 THOUGHT:\n   {info['thought'].strip()}") 
-
-            # 4. 打印动作解释
-            act = info['action']
-            act_str = []
-            if act[1]>0.1: act_str.append(f"LEFT({act[1]:.2f})")
-            if act[2]>0.1: act_str.append(f"RIGHT({act[2]:.2f})")
-            if act[3]>0.1: act_str.append(f"DOWN({act[3]:.2f})")
-            if act[4]>0.1: act_str.append(f"UP({act[4]:.2f})")
-            if sum(act) < 0.1: act_str.append("NO-OP")
-            print(f"   🎬 EXECUTION: {np.round(act, 2)} -> {' + '.join(act_str)}")
-            
-            # 5. 保存详细数据到 Log
-            game_log.append({
-                "step": step,
-                "agent": aid,
-                "role": role,
-                "obs": info['struct'],
-                "action": info['action'].tolist(),
-                "thought": info['thought'],
-                "reward": r
-            })
-
-        if all(terminations.values()) or all(truncations.values()):
-            print("Game Over.")
-            break
-
-    env.close()
-    
-    # Add final summary
-    mean_reward = (total_r_good + total_r_adv) / 2.0
-    game_log.append({
-        "final_summary": True,
-        "total_rewards": {"good": total_r_good, "adversary": total_r_adv},
-        "mean_reward": float(mean_reward)
-    })
-    
-    print(f"\n📊 SUMMARY: Good Reward={total_r_good:.2f}, Adv Reward={total_r_adv:.2f}, Mean={mean_reward:.2f}")
-    
-    if frames:
-        vid_name = get_unique_filename(output_name + ".mp4")
-        import imageio
-        imageio.mimsave(vid_name, frames, fps=1, macro_block_size=1)
-        print(f"Saved video to {vid_name}")
-    
-    final_log = get_unique_filename(output_name + ".json")
-    with open(final_log, "w", encoding="utf-8") as f:
-        json.dump(game_log, f, indent=4)
-    print(f"Saved detailed logs to {final_log}")
+    pipe = StepPipeline(llm_engine, output_name + ".mp4", fps=1, enabled=pipeline,
+                        checkpoint=checkpoint, seed=seed, capture=capture, macro_block_size=1)
+    try:
+        game_log = []
+
+        total_r_good = 0
+        total_r_adv = 0
+        obs_tokens = []
+        prompt_tokens = []
+        debug_on = logger.isEnabledFor(logging.DEBUG)
+
+        for step in range(MAX_STEPS):
+            logger.debug("=== STEP %d ===", step)
+            pipe.render(env)
+
+            # --- Decision Phase ---
+            def decide(agent_id):
+                obs_raw = observations[agent_id]
+                obs_struct = parse_push_obs(obs_raw, agent_id)
+                full_prompt = user_prompt_push(agent_id, step, obs_struct, obs_format)
+
+                sys_r = "You are a strategic AI agent in a physics simulation."
+                ctx = {"env": "push", "seed": seed, "step": step, "agent": agent_id, "obs": obs_struct,
+                       "action_dim": env.action_space(agent_id).shape[0]}
+                action_vec, raw_thought = llm_engine.generate_action(sys_r, full_prompt, context=ctx)
+                action_vec = np.clip(action_vec, 0.0, 1.0)
+
+                return {
+                    "struct": obs_struct,
+                    "action": action_vec,
+                    "thought": raw_thought,
+                    "obs_tokens": count_tokens(_format_current_obs(obs_struct, obs_format)),
+                    "prompt_tokens": count_tokens(full_prompt),
+                    "llm": llm_engine.last_call_info(),
+                }
+
+            step_buffer = pipe.decide(env.agents, decide)
+            actions = {aid: info["action"] for aid, info in step_buffer.items()}
+            obs_tokens.extend(info["obs_tokens"] for info in step_buffer.values())
+            prompt_tokens.extend(info["prompt_tokens"] for info in step_buffer.values())
+
+            # --- Environment Step ---
+            pipe.sync_env()
+            observations, rewards, terminations, truncations, infos = env.step(actions)
+
+            # --- Logging Phase ---
+            for aid, info in step_buffer.items():
+                r = rewards.get(aid, 0.0)
+                role = info['struct']['role']
+                icon = "🔴" if role == 'ADVERSARY' else "🟢"
+
+                if role == 'ADVERSARY': total_r_adv += r
+                else: total_r_good += r
+
+                if debug_on:
+                    # 1. 打印基础信息
+                    logger.debug("%s %s | Reward: %.4f", icon, aid, r)
+
+                    # 2. 打印物理感知 (Sight)
+                    if role == 'GOOD_AGENT':
+                        goal_vec = info['struct']['goal_rel']
+                        fake_vec = info['struct']['fake_rel']
+                        adv_vec = info['struct']['opponent_rel']
+                        logger.debug("   [Eye] Goal: %s", goal_vec)
+                        logger.debug("   [Eye] Fake: %s", fake_vec)
+                        logger.debug("   [Eye] Adv:  %s", adv_vec)
+                    else:
+                        opp_vec = info['struct']['opponent_rel']
+                        logger.debug("   [Eye] GoodAgent: %s", opp_vec)
+                        # 打印坏人看到的两个地标
+                        lms = info['struct']['landmarks']
+                        logger.debug("   [Eye] LM_A: %s | LM_B: %s", lms[0]['rel'], lms[1]['rel'])
+
+                    # 3. 打印完整思维 (Full Thought)
+                    logger.debug("   THOUGHT:\n   %s", info['thought'].strip())
+
+                    # 4. 打印动作解释
+                    act = info['action']
+                    act_str = []
+                    if act[1]>0.1: act_str.append(f"LEFT({act[1]:.2f})")
+                    if act[2]>0.1: act_str.append(f"RIGHT({act[2]:.2f})")
+                    if act[3]>0.1: act_str.append(f"DOWN({act[3]:.2f})")
+                    if act[4]>0.1: act_str.append(f"UP({act[4]:.2f})")
+                    if sum(act) < 0.1: act_str.append("NO-OP")
+                    logger.debug("   EXECUTION: %s -> %s", np.round(act, 2), ' + '.join(act_str))
+
+                # 5. 保存详细数据到 Log
+                game_log.append({
+                    "step": step,
+                    "agent": aid,
+                    "role": role,
+                    "obs": info['struct'],
+                    "action": info['action'].tolist(),
+                    "thought": info['thought'],
+                    "reward": r,
+                    "obs_tokens": info['obs_tokens'],
+                    "llm": info.get("llm"),
+                })
+
+            pipe.log(game_log)
+            if all(terminations.values()) or all(truncations.values()):
+                logger.debug("Game Over.")
+                break
+
+        # Add final summary
+        mean_reward = (total_r_good + total_r_adv) / 2.0
+        game_log.append({
+            "final_summary": True,
+            "env": "push",
+            "seed": seed,
+            "total_rewards": {"good": total_r_good, "adversary": total_r_adv},
+            "mean_reward": float(mean_reward),
+            "obs_format": obs_format,
+            "obs_tokens_mean": float(np.mean(obs_tokens)) if obs_tokens else 0.0,
+            "prompt_tokens_mean": float(np.mean(prompt_tokens)) if prompt_tokens else 0.0,
+            "circuit": llm_engine.circuit_summary(),
+        })
+
+        logger.info("SUMMARY: Good Reward=%.2f, Adv Reward=%.2f, Mean=%.2f", total_r_good, total_r_adv, mean_reward)
+
+        vid_name = pipe.finish_video()
+        if vid_name:
+            logger.info("Saved video to %s", vid_name)
+
+        final_log = get_unique_filename(output_name + ".json")
+        pipe.write_log(game_log, final_log)
+    finally:
+        pipe.close()
+        env.close()
+    logger.info("Saved detailed logs to %s", final_log)
 
 if __name__ == "__main__":
     # ========== 统一模型接口 ==========
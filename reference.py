@@ -1,3 +1,4 @@
+import logging
 import numpy as np
 import json
 from typing import Dict, Any
@@ -10,6 +11,11 @@ from prompt.prompt_for_reference import (
     get_task_and_reward,
 )
 from obs.parse_reference_obs import parse_reference_obs
+from obs.encode_obs import count_tokens, encode_obs
+from log_utils import get_logger
+from step_pipeline import StepPipeline
+
+logger = get_logger("reference")
 
 try:
     from pettingzoo.mpe import simple_reference_v3
@@ -17,7 +23,14 @@ except ImportError:
     raise ImportError("请安装 pettingzoo: pip install pettingzoo[mpe]")
 
 
-def _format_current_obs(obs_struct: Dict[str, Any], agent_id: str) -> str:
+def _format_current_obs(obs_struct: Dict[str, Any], agent_id: str, obs_format: str = "verbose") -> str:
+    if obs_format != "verbose":
+        return "\n".join([
+            "OBSERVATION SEMANTICS:",
+            "- obs = [vel(2), landmarks(3*2), partner_goal_rgb(3), comm(10)]",
+            f"CURRENT OBS ({obs_format}):",
+            encode_obs(obs_struct, obs_format),
+        ])
     lines = [
         "OBSERVATION SEMANTICS:",
         "- obs = [vel(2), landmarks(3*2), partner_goal_rgb(3), comm(10)]",
@@ -35,13 +48,13 @@ def _format_current_obs(obs_struct: Dict[str, Any], agent_id: str) -> str:
     return "\n".join(lines)
 
 
-def user_prompt_reference(agent_id: str, step: int, obs_struct: Dict[str, Any]) -> str:
+def user_prompt_reference(agent_id: str, step: int, obs_struct: Dict[str, Any], obs_format: str = "verbose") -> str:
     parts = [
         get_task_and_reward(),
         get_physics_rules(),
         get_action_and_response_format(),
         get_navigation_hints(),
-        _format_current_obs(obs_struct, agent_id),
+        _format_current_obs(obs_struct, agent_id, obs_format),
     ]
     return "\n\n".join(parts)
 
@@ -49,106 +62,125 @@ def user_prompt_reference(agent_id: str, step: int, obs_struct: Dict[str, Any])
 def run_reference_game(provider: str, output_name: str, **kwargs):
     MAX_STEPS = 30
     seed = kwargs.pop('seed', None)
+    obs_format = kwargs.pop('obs_format', 'verbose')
+    pipeline = kwargs.pop('pipeline', True)
+    checkpoint = kwargs.pop('checkpoint', False)
+    capture = kwargs.pop('capture', None)
     llm_engine = get_api_engine(provider, **kwargs)
 
-    print("Initializing Reference Env (Modular)...")
+    logger.info("Initializing Reference Env (Modular)...")
     env = simple_reference_v3.parallel_env(max_cycles=MAX_STEPS, continuous_actions=True, render_mode="rgb_array")
 
     observations, infos = env.reset(seed=seed) if seed is not None else env.reset()
-    frames = []
-    game_log = []
-    total_rewards = {aid: 0.0 for aid in env.agents}
-
-    for step in range(MAX_STEPS):
-        print(f"\n{'='*30} STEP {step} {'='*30}")
-        frame = env.render()
-        if frame is not None:
-            frames.append(frame)
-
-        actions = {}
-        step_buffer = {}
-
-        for agent_id in env.agents:
-            obs_struct = parse_reference_obs(observations[agent_id], agent_id)
-            full_prompt = user_prompt_reference(agent_id, step, obs_struct)
-
-            sys_r = "You are a precise communication agent. Follow the required action indices strictly."
-            action_vec, raw_thought = llm_engine.generate_action(sys_r, full_prompt)
-
-            if len(action_vec) < 15:
-                action_vec = np.concatenate([action_vec, np.zeros(15 - len(action_vec))])
-            action_vec = np.clip(action_vec[:15], 0.0, 1.0)
-
-            actions[agent_id] = action_vec
-            step_buffer[agent_id] = {"struct": obs_struct, "action": action_vec, "thought": raw_thought}
-
-        observations, rewards, terminations, truncations, infos = env.step(actions)
-
-        for aid, info in step_buffer.items():
-            r = rewards.get(aid, 0.0)
-            total_rewards[aid] = total_rewards.get(aid, 0.0) + r
-
-            struct = info["struct"]
-            act = info["action"]
-
-            move_str = "HOLD"
-            if len(act) >= 5:
-                move_idx = int(np.argmax(act[0:5]))
-                move_str = ["HOLD", "LEFT", "RIGHT", "DOWN", "UP"][move_idx]
-                if max(act[0:5]) < 0.1:
+    pipe = StepPipeline(llm_engine, output_name + ".mp4", fps=4, enabled=pipeline,
+                        checkpoint=checkpoint, seed=seed, capture=capture, macro_block_size=1)
+    try:
+        game_log = []
+        total_rewards = {aid: 0.0 for aid in env.agents}
+        obs_tokens = []
+        prompt_tokens = []
+        debug_on = logger.isEnabledFor(logging.DEBUG)
+
+        for step in range(MAX_STEPS):
+            logger.debug("=== STEP %d ===", step)
+            pipe.render(env)
+
+            def decide(agent_id):
+                obs_struct = parse_reference_obs(observations[agent_id], agent_id)
+                full_prompt = user_prompt_reference(agent_id, step, obs_struct, obs_format)
+
+                sys_r = "You are a precise communication agent. Follow the required action indices strictly."
+                ctx = {"env": "reference", "seed": seed, "step": step, "agent": agent_id, "obs": obs_struct,
+                       "action_dim": env.action_space(agent_id).shape[0]}
+                action_vec, raw_thought = llm_engine.generate_action(sys_r, full_prompt, context=ctx)
+
+                action_vec = np.clip(action_vec, 0.0, 1.0)
+
+                return {"struct": obs_struct, "action": action_vec, "thought": raw_thought,
+                        "obs_tokens": count_tokens(_format_current_obs(obs_struct, agent_id, obs_format)),
+                        "prompt_tokens": count_tokens(full_prompt), "llm": llm_engine.last_call_info()}
+
+            step_buffer = pipe.decide(env.agents, decide)
+            actions = {aid: info["action"] for aid, info in step_buffer.items()}
+            obs_tokens.extend(info["obs_tokens"] for info in step_buffer.values())
+            prompt_tokens.extend(info["prompt_tokens"] for info in step_buffer.values())
+
+            pipe.sync_env()
+            observations, rewards, terminations, truncations, infos = env.step(actions)
+
+            for aid, info in step_buffer.items():
+                r = rewards.get(aid, 0.0)
+                total_rewards[aid] = total_rewards.get(aid, 0.0) + r
+
+                struct = info["struct"]
+                act = info["action"]
+
+                if debug_on:
                     move_str = "HOLD"
-
-            say_str = "SILENT"
-            say_idx = -1
-            if len(act) >= 15 and max(act[5:15]) > 0.1:
-                say_idx = int(np.argmax(act[5:15]))
-                say_str = f"SAY_{say_idx}"
-
-            required_say_idx = 5 + struct.get("partner_target_id", -1)
-            say_value = act[required_say_idx] if 0 <= required_say_idx < len(act) else 0.0
-
-            print(f"\nAGENT {aid} | Reward: {r:.4f}")
-            print(f"   Speaker: target_id={struct.get('partner_target_id')} -> index {required_say_idx} value {say_value:.2f}")
-            print(f"   Listener: heard={struct.get('heard_signal')} (strength={struct.get('signal_strength')}) -> move {move_str}")
-            print(f"   Action: move={move_str}, say={say_str}")
-            warn = struct.get("warning")
-            if warn:
-                print(f"   Warning: {warn}")
-            
-            game_log.append({
-                "step": step,
-                "agent": aid,
-                "obs": struct,
-                "action": act.tolist(),
-                "thought": info["thought"],
-                "reward": r
-            })
-
-        if all(terminations.values()) or all(truncations.values()):
-            print("Game Over.")
-            break
-
-    env.close()
-
-    # Add final summary
-    mean_reward = sum(total_rewards.values()) / len(total_rewards) if total_rewards else 0.0
-    game_log.append({
-        "final_summary": True,
-        "total_rewards": {k: float(v) for k, v in total_rewards.items()},
-        "mean_reward": float(mean_reward)
-    })
-    print(f"\n📊 FINAL: Total Rewards={total_rewards}, Mean={mean_reward:.3f}")
-
-    if frames:
-        vid_name = get_unique_filename(output_name + ".mp4")
-        import imageio
-        imageio.mimsave(vid_name, frames, fps=4, macro_block_size=1)
-        print(f"Saved video to {vid_name}")
-
-    final_log = get_unique_filename(output_name + ".json")
-    with open(final_log, "w", encoding="utf-8") as f:
-        json.dump(game_log, f, indent=4)
-    print(f"Saved detailed logs to {final_log}")
+                    if len(act) >= 5:
+                        move_idx = int(np.argmax(act[0:5]))
+                        move_str = ["HOLD", "LEFT", "RIGHT", "DOWN", "UP"][move_idx]
+                        if max(act[0:5]) < 0.1:
+                            move_str = "HOLD"
+
+                    say_str = "SILENT"
+                    say_idx = -1
+                    if len(act) >= 15 and max(act[5:15]) > 0.1:
+                        say_idx = int(np.argmax(act[5:15]))
+                        say_str = f"SAY_{say_idx}"
+
+                    required_say_idx = 5 + struct.get("partner_target_id", -1)
+                    say_value = act[required_say_idx] if 0 <= required_say_idx < len(act) else 0.0
+
+                    logger.debug("AGENT %s | Reward: %.4f", aid, r)
+                    logger.debug("   Speaker: target_id=%s -> index %d value %.2f", struct.get('partner_target_id'), required_say_idx, say_value)
+                    logger.debug("   Listener: heard=%s (strength=%s) -> move %s", struct.get('heard_signal'), struct.get('signal_strength'), move_str)
+                    logger.debug("   Action: move=%s, say=%s", move_str, say_str)
+                    warn = struct.get("warning")
+                    if warn:
+                        logger.debug("   Warning: %s", warn)
+
+                game_log.append({
+                    "step": step,
+                    "agent": aid,
+                    "obs": struct,
+                    "action": act.tolist(),
+                    "thought": info["thought"],
+                    "reward": r,
+                    "obs_tokens": info["obs_tokens"],
+                    "llm": info.get("llm"),
+                })
+
+            pipe.log(game_log)
+            if all(terminations.values()) or all(truncations.values()):
+                logger.debug("Game Over.")
+                break
+
+        # Add final summary
+        mean_reward = sum(total_rewards.values()) / len(total_rewards) if total_rewards else 0.0
+        game_log.append({
+            "final_summary": True,
+            "env": "reference",
+            "seed": seed,
+            "total_rewards": {k: float(v) for k, v in total_rewards.items()},
+            "mean_reward": float(mean_reward),
+            "obs_format": obs_format,
+            "obs_tokens_mean": float(np.mean(obs_tokens)) if obs_tokens else 0.0,
+            "prompt_tokens_mean": float(np.mean(prompt_tokens)) if prompt_tokens else 0.0,
+            "circuit": llm_engine.circuit_summary(),
+        })
+        logger.info("FINAL: Total Rewards=%s, Mean=%.3f", total_rewards, mean_reward)
+
+        vid_name = pipe.finish_video()
+        if vid_name:
+            logger.info("Saved video to %s", vid_name)
+
+        final_log = get_unique_filename(output_name + ".json")
+        pipe.write_log(game_log, final_log)
+    finally:
+        pipe.close()
+        env.close()
+    logger.info("Saved detailed logs to %s", final_log)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,397 @@
+"""
+Deterministic action replay of logged episodes.
+
+Every episode log stores the exact action vector each agent sent to
+env.step, and the MPE games are deterministic given the reset seed and the
+action sequence. replay_episode() rebuilds an episode from its log alone:
+it creates the runner's parallel_env (vec_env.make_env), resets it with the
+logged seed and feeds the logged actions back step by step, with no LLM and
+no rendering unless asked for. That is enough to
+
+- re-score episodes with another reward aggregation (SCORERS; "runner"
+  reproduces the runners' own final_summary, "camp" averages agents per
+  camp with the analysis_engine camp rules, "agent" averages all agents),
+- regenerate videos (video=True) and extract per-step physical state
+  (states=True: positions / velocities / communication of every agent and
+  landmark positions, saved as .npz),
+- check reproducibility: replayed rewards are compared with the logged ones
+  (reward_max_abs_diff; `consistent` is False beyond REWARD_TOL, e.g. after
+  a PettingZoo upgrade changed the dynamics).
+
+Episode identity comes from the log's final_summary ('env', 'seed'); older
+logs fall back to the benchmark naming scheme <env>_ep<N>.json with
+seed = seed_start + N - 1 (as the replay provider does).
+
+Bulk replay over a results tree, one process per episode batch:
+
+    python replay_engine.py --base_dir results/batch_benchmarks --out_dir results/replay \\
+        --scorer camp --write_logs --video --states --workers 4
+
+writes <out_dir>/replay_summary.json (per-episode and per-directory
+summaries) and, mirroring the tree, rescored log copies (--write_logs; the
+analysis scripts read them with --base_dir <out_dir>), videos and state
+files. The original results are never modified.
+"""
+
+import argparse
+import json
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from analysis_engine import GAMES, OTHER, CampRegistry, latest_episode_files
+from episode_stream import load_records
+from log_utils import configure_logging, get_logger
+from vec_env import ENV_SPECS, make_env
+
+logger = get_logger("replay")
+
+SUMMARY_NAME = "replay_summary.json"
+# Record keys the replay reads; thought / obs / llm are skipped while decoding (see episode_stream.py)
+REPLAY_FIELDS = ("step", "agent", "role", "action", "reward", "final_summary", "env", "seed",
+                 "total_rewards", "mean_reward")
+# 回放奖励与日志奖励的最大允许偏差；超过说明环境版本/参数与录制时不同
+REWARD_TOL = 1e-6
+# 与各 runner 的 StepPipeline(fps=...) 一致
+VIDEO_FPS = {"spread": 1, "adversary": 4, "tag": 1, "push": 1, "crypto": 1,
+             "reference": 4, "speaker_listener": 4, "world_comm": 1, "simple": 5}
+
+_EPISODE_RE = re.compile(r"(.+?)_ep(\d+)(?:_\d+)?\.json$")
+
+StepRewards = List[Dict[str, float]]
+
+
+# ---------- 计分 ----------
+def agent_summary(game: str, rewards: StepRewards) -> Dict[str, Any]:
+    """Total reward per agent; mean_reward is the mean over agents."""
+    totals: Dict[str, float] = {}
+    for step in rewards:
+        for aid, r in step.items():
+            totals[aid] = totals.get(aid, 0.0) + r
+    return {"total_rewards": totals, "mean_reward": sum(totals.values()) / len(totals) if totals else 0.0}
+
+
+def runner_summary(game: str, rewards: StepRewards) -> Dict[str, Any]:
+    """The runners' own final_summary rules, summed in the same order (reproduces the logged values)."""
+    if game == "adversary":
+        # adv_API.py: good = agent_0 only (good agents share a reward), adversary = sum over adversaries
+        good = sum(step.get("agent_0", 0.0) for step in rewards)
+        adv = 0.0
+        for step in rewards:
+            for aid, r in step.items():
+                if "adversary" in aid:
+                    adv += r
+        return {"total_rewards": {"good": good, "adversary": adv}, "mean_reward": (good + adv) / 2.0}
+    if game == "tag":
+        # tag_API.py: prey = sum over prey, predators = per-step mean over predators
+        num_adv = ENV_SPECS["tag"]["kwargs"]["num_adversaries"]
+        prey = pred = 0.0
+        for step in rewards:
+            prey += sum(r for aid, r in step.items() if "agent" in aid)
+            pred += sum(r for aid, r in step.items() if "adversary" in aid) / num_adv
+        return {"total_rewards": {"prey": prey, "predators": pred}, "mean_reward": (prey + pred) / 2.0}
+    if game == "push":
+        good = adv = 0.0
+        for step in rewards:
+            for aid, r in step.items():
+                if "adversary" in aid:
+                    adv += r
+                else:
+                    good += r
+        return {"total_rewards": {"good": good, "adversary": adv}, "mean_reward": (good + adv) / 2.0}
+    return agent_summary(game, rewards)
+
+
+_REGISTRY = CampRegistry()
+
+
+def camp_summary(game: str, rewards: StepRewards) -> Dict[str, Any]:
+    """Per camp the mean over its agents' totals (camp rules of analysis_engine); mean_reward is the mean over camps."""
+    per_agent = agent_summary(game, rewards)["total_rewards"]
+    members: Dict[str, List[float]] = defaultdict(list)
+    for aid, total in per_agent.items():
+        members[_REGISTRY.camp(game, aid)].append(total)
+    order = [c for c in _REGISTRY.camps(game) if c in members] + ([OTHER] if OTHER in members else [])
+    totals = {camp: float(np.mean(members[camp])) for camp in order}
+    return {"total_rewards": totals, "mean_reward": float(np.mean(list(totals.values()))) if totals else 0.0}
+
+
+SCORERS: Dict[str, Callable[[str, StepRewards], Dict[str, Any]]] = {
+    "camp": camp_summary,
+    "runner": runner_summary,
+    "agent": agent_summary,
+}
+
+
+# ---------- 回放 ----------
+def episode_identity(path: Path, summary: Optional[Dict[str, Any]], seed_start: int = 1) -> Tuple[str, Optional[int]]:
+    """(game, seed) from the final_summary, else from the <env>_ep<N>.json naming scheme."""
+    env = (summary or {}).get("env")
+    seed = (summary or {}).get("seed")
+    match = _EPISODE_RE.match(path.name)
+    if env is None and match:
+        env = match.group(1)
+    if seed is None and match:
+        seed = seed_start + int(match.group(2)) - 1
+    if env is None:
+        raise ValueError(f"cannot tell the game of {path}")
+    return str(env), int(seed) if seed is not None else None
+
+
+def _snapshot(world: Any) -> Dict[str, np.ndarray]:
+    return {
+        "agent_pos": np.array([a.state.p_pos for a in world.agents], dtype=np.float64),
+        "agent_vel": np.array([a.state.p_vel for a in world.agents], dtype=np.float64),
+        "agent_comm": np.array([np.zeros(world.dim_c) if a.state.c is None else a.state.c for a in world.agents],
+                               dtype=np.float64),
+        "landmark_pos": np.array([l.state.p_pos for l in world.landmarks], dtype=np.float64).reshape(-1, world.dim_p),
+    }
+
+
+def replay_episode(log_path: Path, scorer: str = "camp", video_path: Optional[Path] = None,
+                   states_path: Optional[Path] = None, seed_start: int = 1) -> Dict[str, Any]:
+    """
+    Replay one logged episode through its env and score it.
+    video_path / states_path: also write the re-rendered video / per-step state arrays (.npz)
+    Returns the logged and replayed summaries plus the reward check; raises ValueError for unreplayable logs.
+    """
+    log_path = Path(log_path)
+    records = load_records(log_path, REPLAY_FIELDS)
+    summary = next((r for r in records if r.get("final_summary")), None)
+    game, seed = episode_identity(log_path, summary, seed_start)
+    if seed is None:
+        raise ValueError(f"{log_path}: no seed recorded, the episode cannot be replayed")
+
+    actions: Dict[int, Dict[str, Any]] = defaultdict(dict)
+    logged: Dict[int, Dict[str, float]] = defaultdict(dict)
+    for r in records:
+        if "step" not in r or "agent" not in r:
+            continue
+        step, aid = int(r["step"]), str(r["agent"])
+        if r.get("action") is not None:
+            actions[step][aid] = r["action"]
+        if r.get("reward") is not None:
+            logged[step][aid] = float(r["reward"])
+    if not actions:
+        raise ValueError(f"{log_path}: no logged actions")
+
+    env = make_env(game, render_mode="rgb_array" if video_path else None)
+    writer = None
+    rewards: StepRewards = []
+    states: Dict[str, List[np.ndarray]] = defaultdict(list)
+    max_diff = 0.0
+    missing = 0
+    try:
+        env.reset(seed=seed)
+        world = env.unwrapped.world
+        if video_path:
+            import imageio
+            Path(video_path).parent.mkdir(parents=True, exist_ok=True)
+            writer = imageio.get_writer(str(video_path), fps=VIDEO_FPS.get(game, 1), macro_block_size=1)
+        for step in sorted(actions):
+            if not env.agents:
+                break
+            if writer is not None:
+                writer.append_data(env.render())
+            if states_path:
+                for key, value in _snapshot(world).items():
+                    states[key].append(value)
+            step_actions = {}
+            for aid in env.agents:
+                if aid in actions[step]:
+                    # runner 送入 env.step 的是 float32 向量；保持相同精度才能逐位复现
+                    step_actions[aid] = np.asarray(actions[step][aid], dtype=np.float32)
+                else:
+                    missing += 1
+                    step_actions[aid] = np.zeros(env.action_space(aid).shape, dtype=np.float32)
+            _, rew, terminations, truncations, _ = env.step(step_actions)
+            rewards.append({aid: float(r) for aid, r in rew.items()})
+            for aid, r in rew.items():
+                if aid in logged[step]:
+                    max_diff = max(max_diff, abs(float(r) - logged[step][aid]))
+            if all(terminations.values()) or all(truncations.values()):
+                break
+        if states_path:
+            for key, value in _snapshot(world).items():
+                states[key].append(value)
+    finally:
+        if writer is not None:
+            writer.close()
+        env.close()
+
+    if states_path:
+        Path(states_path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            states_path,
+            agents=np.array([a.name for a in world.agents]),
+            landmarks=np.array([l.name for l in world.landmarks]),
+            **{key: np.stack(values) for key, values in states.items()},
+        )
+
+    replayed = SCORERS[scorer](game, rewards)
+    return {
+        "log": str(log_path),
+        "env": game,
+        "seed": seed,
+        "steps": len(rewards),
+        "logged_steps": len(actions),
+        "missing_actions": missing,
+        "reward_max_abs_diff": max_diff,
+        "consistent": max_diff <= REWARD_TOL and missing == 0 and len(rewards) == len(actions),
+        "logged": {"total_rewards": (summary or {}).get("total_rewards"),
+                   "mean_reward": (summary or {}).get("mean_reward")},
+        "scorer": scorer,
+        "replayed": replayed,
+        "video": str(video_path) if video_path else None,
+        "states": str(states_path) if states_path else None,
+    }
+
+
+def write_rescored_log(log_path: Path, result: Dict[str, Any], out_path: Path) -> None:
+    """Copy of the log whose final_summary carries the replayed totals (the logged ones are kept under 'rescored')."""
+    with Path(log_path).open("r", encoding="utf-8") as f:
+        data = json.load(f)
+    for entry in data:
+        if isinstance(entry, dict) and entry.get("final_summary"):
+            entry["rescored"] = {"scorer": result["scorer"], "total_rewards": entry.get("total_rewards"),
+                                 "mean_reward": entry.get("mean_reward")}
+            entry["total_rewards"] = result["replayed"]["total_rewards"]
+            entry["mean_reward"] = result["replayed"]["mean_reward"]
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with out_path.open("w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+# ---------- 批量 ----------
+def find_episode_logs(base_dir: Path, games: Optional[Iterable[str]] = None,
+                      exclude: Optional[Path] = None) -> List[Path]:
+    """Latest log of every episode under base_dir (or base_dir itself when it is a log file)."""
+    base_dir = Path(base_dir)
+    if base_dir.is_file():
+        return [base_dir]
+    exclude = exclude.resolve() if exclude is not None else None
+    dirs = sorted({p.parent for p in base_dir.rglob("*_ep*.json")})
+    if exclude is not None:
+        dirs = [d for d in dirs if d.resolve() != exclude and exclude not in d.resolve().parents]
+    logs = [p for d in dirs for p in latest_episode_files(d)]
+    if games is not None:
+        wanted = set(games)
+        logs = [p for p in logs if _EPISODE_RE.match(p.name) and _EPISODE_RE.match(p.name).group(1) in wanted]
+    return logs
+
+
+def _replay_job(log_path: Path, rel: Path, out_dir: Optional[Path], scorer: str, video: bool,
+                states: bool, write_logs: bool, seed_start: int) -> Dict[str, Any]:
+    """Replay + outputs of one episode. Runs in worker processes."""
+    target = out_dir / rel if out_dir is not None else None
+    try:
+        result = replay_episode(
+            log_path, scorer=scorer,
+            video_path=target.with_suffix(".mp4") if video and target is not None else None,
+            states_path=target.with_suffix(".states.npz") if states and target is not None else None,
+            seed_start=seed_start,
+        )
+    except Exception as exc:
+        return {"log": str(log_path), "error": f"{type(exc).__name__}: {exc}"}
+    if write_logs and target is not None:
+        write_rescored_log(log_path, result, target)
+    return result
+
+
+def replay_tree(base_dir: Path, out_dir: Optional[Path] = None, scorer: str = "camp",
+                games: Optional[Iterable[str]] = None, video: bool = False, states: bool = False,
+                write_logs: bool = False, workers: Optional[int] = None, seed_start: int = 1) -> Dict[str, Any]:
+    """
+    Replay every episode under base_dir; outputs mirror the tree under out_dir.
+    Returns (and writes to <out_dir>/replay_summary.json) {"episodes": [...], "groups": {dir: {...}}}.
+    """
+    if scorer not in SCORERS:
+        raise ValueError(f"Unknown scorer {scorer!r}; choose from {sorted(SCORERS)}")
+    base_dir = Path(base_dir)
+    if out_dir is not None and base_dir.is_dir() and Path(out_dir).resolve() == base_dir.resolve():
+        raise ValueError("out_dir must differ from base_dir (the original logs are never overwritten)")
+    if out_dir is None and (video or states or write_logs):
+        raise ValueError("video / states / write_logs need an out_dir")
+    logs = find_episode_logs(base_dir, games, exclude=out_dir)
+    root = base_dir if base_dir.is_dir() else base_dir.parent
+    jobs = [(p, p.relative_to(root), Path(out_dir) if out_dir is not None else None,
+             scorer, video, states, write_logs, seed_start) for p in logs]
+
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    logger.info("Replaying %d episodes from %s (%d workers)", len(jobs), base_dir, max(workers, 1))
+    if workers <= 1:
+        results = [_replay_job(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_replay_job, *zip(*jobs)))
+
+    groups: Dict[str, Dict[str, Any]] = {}
+    by_dir: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for (log_path, rel, *_), result in zip(jobs, results):
+        by_dir[str(rel.parent)].append(result)
+    for key, items in sorted(by_dir.items()):
+        ok = [r for r in items if "error" not in r]
+        logged = [r["logged"]["mean_reward"] for r in ok if r["logged"]["mean_reward"] is not None]
+        groups[key] = {
+            "episodes": len(items),
+            "errors": len(items) - len(ok),
+            "inconsistent": sum(not r["consistent"] for r in ok),
+            "mean_reward": float(np.mean([r["replayed"]["mean_reward"] for r in ok])) if ok else None,
+            "logged_mean_reward": float(np.mean(logged)) if logged else None,
+        }
+    report = {"base_dir": str(base_dir), "scorer": scorer, "episodes": results, "groups": groups}
+    if out_dir is not None:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+        with (Path(out_dir) / SUMMARY_NAME).open("w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Replay logged episodes from their actions (no LLM calls).")
+    p.add_argument("--base_dir", type=str, default="results/batch_benchmarks",
+                   help="Results tree (or a single episode log) to replay")
+    p.add_argument("--out_dir", type=str, default=None,
+                   help="Where replay_summary.json and the mirrored outputs go (default: <base_dir>_replay)")
+    p.add_argument("--games", nargs="+", default=None, choices=list(GAMES))
+    p.add_argument("--scorer", type=str, default="camp", choices=list(SCORERS),
+                   help="Reward aggregation of the replayed summaries ('runner' reproduces the logged final_summary)")
+    p.add_argument("--write_logs", action="store_true",
+                   help="Write log copies whose final_summary carries the replayed totals")
+    p.add_argument("--video", action="store_true", help="Re-render every episode to mp4")
+    p.add_argument("--states", action="store_true", help="Save per-step agent / landmark state arrays (.npz)")
+    p.add_argument("--seed_start", type=int, default=1, help="Seed of episode 1 for logs without a recorded seed")
+    p.add_argument("--workers", type=int, default=None, help="Replay processes (default: CPU count)")
+    p.add_argument("--log_level", type=str, default=os.getenv("MPE_LOG_LEVEL", "INFO"))
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    configure_logging(level=args.log_level)
+    base_dir = Path(args.base_dir)
+    out_dir = Path(args.out_dir) if args.out_dir else base_dir.with_name(base_dir.stem + "_replay")
+    report = replay_tree(base_dir, out_dir, scorer=args.scorer, games=args.games, video=args.video,
+                         states=args.states, write_logs=args.write_logs, workers=args.workers,
+                         seed_start=args.seed_start)
+    print(f"{'Directory':<40} {'Episodes':>8} {'Replayed':>10} {'Logged':>10} {'Inconsistent':>12} {'Errors':>6}")
+    for key, group in report["groups"].items():
+        print(f"{key:<40} {group['episodes']:>8} {_fmt(group['mean_reward']):>10} "
+              f"{_fmt(group['logged_mean_reward']):>10} {group['inconsistent']:>12} {group['errors']:>6}")
+    for result in report["episodes"]:
+        if "error" in result:
+            print(f"  ERROR {result['log']}: {result['error']}")
+    print(f"Replay summary: {out_dir / SUMMARY_NAME} (scorer: {report['scorer']})")
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:.4f}"
+
+
+if __name__ == "__main__":
+    main()
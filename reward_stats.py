@@ -0,0 +1,179 @@
+"""
+Vectorized reward statistics for model comparisons.
+
+Inputs are NaN-padded numpy arrays; NaN marks a missing entry (model without
+that game, seed not run, episode that ended early, game with fewer agents):
+
+    episode_means  (models, envs, seeds)                 one scalar per episode
+    rewards        (models, envs, seeds, steps, agents)  per-step rewards
+
+Every reduction is NaN-aware and runs over whole arrays at once, so a sweep of
+hundreds of episodes costs a few array operations instead of Python loops
+per (model, env). summarize() computes everything the reports and plots use
+in one call:
+
+    stats = summarize(episode_means, rewards, baseline=0)
+    stats["episode"]["mean"][m, e], stats["ci_low"][m, e], stats["ci_high"][m, e]
+    stats["paired"]["mean"][m, e]        # model m minus the baseline model on the same seeds
+    stats["step_curve"]["mean"][m, e, t], stats["step_curve"]["band"][m, e, t]
+
+Confidence intervals of episode means are percentile bootstraps over seeds
+(fixed RNG seed, so reports are reproducible). Per-step curves use a normal
+approximation (mean ± z·sem over seeds); bootstrapping every step would
+multiply memory by the number of steps. t_interval() is the Student-t
+interval (mean ± t_{n-1}·sem) used where few episodes are available (the
+adaptive stopping rule of run_benchmark): with 3-5 seeds the percentile
+bootstrap is far too narrow.
+"""
+
+import math
+from statistics import NormalDist
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_CI = 0.95
+DEFAULT_BOOTSTRAP = 2000
+DEFAULT_SEED = 0
+
+
+def describe(x: np.ndarray, axis: int = -1) -> Dict[str, np.ndarray]:
+    """
+    NaN-aware n / mean / var / std (population, ddof=0, as in run_benchmark) / sem (sample) / min / max
+    along axis; entries with no valid values are NaN (n = 0).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    valid = ~np.isnan(x)
+    n = valid.sum(axis=axis)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(valid, x, 0.0).sum(axis=axis) / n
+        dev = np.where(valid, x - np.expand_dims(mean, axis), 0.0)
+        var = (dev ** 2).sum(axis=axis) / n
+        sem = np.sqrt(var / (n - 1))
+    empty = n == 0
+    vmin = np.where(empty, np.nan, np.where(valid, x, np.inf).min(axis=axis, initial=np.inf))
+    vmax = np.where(empty, np.nan, np.where(valid, x, -np.inf).max(axis=axis, initial=-np.inf))
+    return {
+        "n": n,
+        "mean": mean,
+        "var": var,
+        "std": np.sqrt(var),
+        "sem": np.where(n > 1, sem, np.nan),
+        "min": vmin,
+        "max": vmax,
+    }
+
+
+def bootstrap_ci(samples: np.ndarray, axis: int = -1, n_boot: int = DEFAULT_BOOTSTRAP,
+                 ci: float = DEFAULT_CI, seed: int = DEFAULT_SEED) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Percentile bootstrap CI of the mean along axis, for every other index at once.
+    Each slice is resampled among its own valid (non-NaN) entries; returns (low, high), NaN where a slice is empty.
+    """
+    x = np.moveaxis(np.asarray(samples, dtype=np.float64), axis, -1)
+    lead, size = x.shape[:-1], x.shape[-1]
+    flat = x.reshape(int(np.prod(lead)), size)
+    if flat.size == 0:
+        return np.full(lead, np.nan), np.full(lead, np.nan)
+    valid = ~np.isnan(flat)
+    k = valid.sum(axis=1)
+    # 每行有效值排到前面，重采样下标取 [0, k)
+    packed = np.take_along_axis(flat, np.argsort(~valid, axis=1, kind="stable"), axis=1)
+    rng = np.random.default_rng(seed)
+    idx = (rng.random((n_boot, size))[None] * k[:, None, None]).astype(np.int64)  # (rows, n_boot, size)
+    used = np.arange(size)[None, None, :] < k[:, None, None]
+    draws = packed[np.arange(len(flat))[:, None, None], np.minimum(idx, size - 1)]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        boot_means = np.where(used, draws, 0.0).sum(axis=2) / k[:, None]
+    alpha = (1.0 - ci) / 2
+    low = np.full(len(flat), np.nan)
+    high = np.full(len(flat), np.nan)
+    has = k > 0
+    if has.any():
+        low[has], high[has] = np.quantile(boot_means[has], [alpha, 1.0 - alpha], axis=1)
+    return low.reshape(lead), high.reshape(lead)
+
+
+def _t_two_sided(t: float, df: int) -> float:
+    """P(|T| < t) for Student's t with integer df (closed form, no scipy)."""
+    theta = math.atan(t / math.sqrt(df))
+    c2 = math.cos(theta) ** 2
+    if df % 2:
+        term, total = 1.0, 1.0 if df > 1 else 0.0
+        for k in range(3, df, 2):
+            term *= c2 * (k - 1) / k
+            total += term
+        return 2 / math.pi * (theta + math.sin(theta) * math.cos(theta) * total)
+    term, total = 1.0, 1.0
+    for k in range(2, df, 2):
+        term *= c2 * (k - 1) / k
+        total += term
+    return math.sin(theta) * total
+
+
+def t_quantile(ci: float, df: int) -> float:
+    """Two-sided critical value t with P(|T| < t) = ci, e.g. t_quantile(0.95, 2) = 4.303."""
+    low, high = 0.0, 1.0
+    while _t_two_sided(high, df) < ci:
+        high *= 2
+    for _ in range(100):
+        mid = (low + high) / 2
+        if _t_two_sided(mid, df) < ci:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+
+def t_interval(samples: np.ndarray, axis: int = -1, ci: float = DEFAULT_CI) -> Tuple[np.ndarray, np.ndarray]:
+    """Student-t CI of the mean (mean ± t_{n-1} * sem) along axis; NaN where fewer than two valid values."""
+    stats = describe(samples, axis=axis)
+    n = np.asarray(stats["n"])
+    q = np.full(n.shape, np.nan)
+    for k in np.unique(n[n > 1]):
+        q[n == k] = t_quantile(ci, int(k) - 1)
+    half = q * stats["sem"]
+    return stats["mean"] - half, stats["mean"] + half
+
+
+def paired_differences(episode_means: np.ndarray, baseline: int, n_boot: int = DEFAULT_BOOTSTRAP,
+                       ci: float = DEFAULT_CI, seed: int = DEFAULT_SEED) -> Dict[str, np.ndarray]:
+    """
+    Per (model, env): mean over shared seeds of episode_means[model] - episode_means[baseline], with bootstrap CI.
+    Seeds missing on either side are dropped from that pair; n is the number of paired seeds.
+    """
+    diff = episode_means - episode_means[baseline][None]
+    stats = describe(diff, axis=-1)
+    low, high = bootstrap_ci(diff, axis=-1, n_boot=n_boot, ci=ci, seed=seed)
+    return {"n": stats["n"], "mean": stats["mean"], "sem": stats["sem"], "ci_low": low, "ci_high": high}
+
+
+def step_curves(rewards: np.ndarray, ci: float = DEFAULT_CI) -> Dict[str, np.ndarray]:
+    """
+    Team reward per step: mean over agents within each episode step, then mean over seeds.
+    rewards: (models, envs, seeds, steps, agents); returns arrays of shape (models, envs, steps) with
+    band = z * sem over seeds (NaN with fewer than two seeds).
+    """
+    per_episode = describe(rewards, axis=-1)["mean"]  # (models, envs, seeds, steps)
+    stats = describe(np.moveaxis(per_episode, 2, -1), axis=-1)
+    z = NormalDist().inv_cdf(0.5 + ci / 2)
+    return {"n": stats["n"], "mean": stats["mean"], "band": z * stats["sem"]}
+
+
+def summarize(episode_means: np.ndarray, rewards: Optional[np.ndarray] = None, baseline: Optional[int] = None,
+              n_boot: int = DEFAULT_BOOTSTRAP, ci: float = DEFAULT_CI, seed: int = DEFAULT_SEED) -> Dict[str, Any]:
+    """
+    Episode statistics, bootstrap CIs, paired differences against model index `baseline` (None: skipped)
+    and per-step curves (when rewards is given) in one call.
+    """
+    low, high = bootstrap_ci(episode_means, axis=-1, n_boot=n_boot, ci=ci, seed=seed)
+    return {
+        "ci": ci,
+        "n_boot": n_boot,
+        "episode": describe(episode_means, axis=-1),
+        "ci_low": low,
+        "ci_high": high,
+        "paired": (paired_differences(episode_means, baseline, n_boot=n_boot, ci=ci, seed=seed)
+                   if baseline is not None and len(episode_means) else None),
+        "step_curve": step_curves(rewards, ci=ci) if rewards is not None else None,
+    }
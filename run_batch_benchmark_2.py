@@ -3,6 +3,10 @@ import json
 import time
 import argparse
 from benchmark_runner import run_benchmark
+from log_utils import configure_logging, episode_context, get_logger
+from sweep_status import STATUS, StatusReporter
+from metrics_exporter import start_metrics_server, write_textfile
+from token_budget import REASONING_EFFORTS
 
 # Models specified by the user
 MODELS = [
@@ -24,17 +28,55 @@ BASE_OUT_DIR = "results/batch_benchmarks"
 
 def parse_args():
     p = argparse.ArgumentParser(description="Run batch benchmarks across multiple models and MPE environments.")
-    p.add_argument("--episodes", type=int, default=NUM_EPISODES)
+    p.add_argument("--episodes", type=int, default=NUM_EPISODES,
+                   help="Episodes per (model, env); the maximum when --target_ci is set")
+    p.add_argument("--target_ci", type=float, default=None,
+                   help="Adaptive mode: stop a (model, env) once the 95%% CI half-width of its mean reward <= this")
+    p.add_argument("--min_episodes", type=int, default=3, help="Episodes before --target_ci may stop a pair")
     p.add_argument("--seed_start", type=int, default=FIXED_SEED_START)
     p.add_argument("--out_dir", type=str, default=BASE_OUT_DIR)
     p.add_argument("--provider", type=str, default="zaiwen")
     p.add_argument("--api_base", type=str, default=os.getenv("ZAIWEN_API_BASE"))
     p.add_argument("--api_key", type=str, default=os.getenv("ZAIWEN_API_KEY"))
+    p.add_argument("--structured_output", type=str, default=None, choices=["json_schema", "json_object"],
+                   help="Request provider-native constrained JSON output sized to each agent's action space")
+    p.add_argument("--max_tokens", type=int, default=None, help="Fixed generation cap for every call")
+    p.add_argument("--token_budget", type=str, default=None,
+                   help="Per-game/role max_tokens: 'auto' or a JSON object, e.g. '{\"crypto\": {\"eve\": 512}}'")
+    p.add_argument("--reasoning_effort", type=str, default=None, choices=list(REASONING_EFFORTS))
+    p.add_argument("--hedge", action="store_true",
+                   help="Fire a duplicate request when a call exceeds the running p95 latency (see hedging.py)")
+    p.add_argument("--hedge_budget", type=float, default=0.1, help="Max share of calls that may be hedged")
+    p.add_argument("--circuit_breaker", action="store_true",
+                   help="Trip per endpoint after consecutive failed attempts; open circuits fail episodes fast")
+    p.add_argument("--failover_provider", type=str, default=None,
+                   help="Provider to use while the circuit is open (implies --circuit_breaker)")
+    p.add_argument("--no_pipeline", action="store_true",
+                   help="Run render / agent decisions / log serialization sequentially (see step_pipeline.py)")
+    p.add_argument("--checkpoint", action="store_true",
+                   help="Checkpoint every step; a rerun resumes interrupted episodes without repeating LLM calls")
+    p.add_argument("--capture", type=str, default=None, choices=["obs", "state"],
+                   help="Save raw float32 obs / actions / rewards ('state': plus entity positions) next to each log")
+    p.add_argument("--log_level", type=str, default=os.getenv("MPE_LOG_LEVEL", "INFO"),
+                   help="DEBUG prints per-step obs/thought/action; default INFO")
+    p.add_argument("--quiet", action="store_true", help="Console shows one progress line per episode plus warnings")
+    p.add_argument("--log_json", action="store_true", help="Emit log records as JSON lines")
+    p.add_argument("--log_file", type=str, default=None, help="Also write all records to this file")
+    p.add_argument("--status_file", type=str, default=None,
+                   help="Periodically rewritten status JSON (default: <out_dir>/status.json)")
+    p.add_argument("--status_interval", type=float, default=5.0)
+    p.add_argument("--dashboard", action="store_true", help="Live progress/throughput dashboard on stderr")
+    p.add_argument("--metrics_port", type=int, default=None, help="Serve Prometheus metrics on this port (/metrics)")
+    p.add_argument("--metrics_host", type=str, default="127.0.0.1")
+    p.add_argument("--metrics_textfile", type=str, default=None,
+                   help="Rewrite a node_exporter textfile (*.prom) after every environment")
     return p.parse_args()
 
 
 def main():
     args = parse_args()
+    configure_logging(level=args.log_level, quiet=args.quiet or None, json_lines=args.log_json, log_file=args.log_file)
+    logger = get_logger("batch")
 
     if args.provider.lower() == "zaiwen":
         if not args.api_key:
@@ -48,56 +90,97 @@ def main():
     all_results = {}
     
     start_time = time.time()
-    
+    summary_path = os.path.join(args.out_dir, "summary.json")
     for model in MODELS:
-        print(f"\n{'='*60}")
-        print(f"🚀 STARTING EVALUATION FOR MODEL: {model}")
-        print(f"{'='*60}\n")
-        
-        all_results[model] = {}
-        model_out_dir = os.path.join(args.out_dir, model)
-        os.makedirs(model_out_dir, exist_ok=True)
-        
         for env in ENVIRONMENTS:
-            print(f"\n--- Running Env: {env} | Model: {model} | Episodes: {args.episodes} ---")
-            
-            try:
-                # We use provider='zaiwen' because it's configured in utils_api.py to accept custom model_name
-                # and point to the unified API. If API key is missing, it will use ZAIWEN_API_KEY from env.
-                benchmark_kwargs = {
-                    "model_name": model,
-                }
-                if args.api_key:
-                    benchmark_kwargs["api_key"] = args.api_key
-                if args.api_base:
-                    benchmark_kwargs["api_base"] = args.api_base
-
-                result = run_benchmark(
-                    env_name=env,
-                    provider=args.provider,
-                    episodes=args.episodes,
-                    output_dir=model_out_dir,
-                    seed_start=args.seed_start,
-                    **benchmark_kwargs
-                )
-                
-                # Extract relevant stats
-                all_results[model][env] = {
-                    "mean_reward": result.get("mean_reward"),
-                    "std_reward": result.get("std_reward"),
-                    "episodes": result.get("episodes")
-                }
-            except Exception as e:
-                print(f"❌ Error running {env} with {model}: {str(e)}")
-                all_results[model][env] = {
-                    "error": str(e)
-                }
-                
-            # Save partial summary after each environment to avoid losing data
-            summary_path = os.path.join(args.out_dir, "summary.json")
-            with open(summary_path, "w", encoding="utf-8") as f:
-                json.dump(all_results, f, indent=4, ensure_ascii=False)
-                
+            STATUS.plan(model, env, args.episodes)
+    reporter = StatusReporter(
+        STATUS,
+        path=args.status_file or os.path.join(args.out_dir, "status.json"),
+        interval_s=args.status_interval,
+        dashboard=args.dashboard,
+    ).start()
+    try:
+        if args.metrics_port is not None:
+            metrics_server, _ = start_metrics_server(args.metrics_host, args.metrics_port)
+            logger.info("Prometheus metrics at %s", metrics_server.url)
+
+        for model in MODELS:
+            logger.info("STARTING EVALUATION FOR MODEL: %s", model)
+
+            all_results[model] = {}
+            model_out_dir = os.path.join(args.out_dir, model)
+            os.makedirs(model_out_dir, exist_ok=True)
+
+            for env in ENVIRONMENTS:
+                logger.info("Running Env: %s | Model: %s | Episodes: %d", env, model, args.episodes)
+
+                try:
+                    # We use provider='zaiwen' because it's configured in utils_api.py to accept custom model_name
+                    # and point to the unified API. If API key is missing, it will use ZAIWEN_API_KEY from env.
+                    benchmark_kwargs = {
+                        "model_name": model,
+                    }
+                    if args.api_key:
+                        benchmark_kwargs["api_key"] = args.api_key
+                    if args.api_base:
+                        benchmark_kwargs["api_base"] = args.api_base
+                    if args.structured_output:
+                        benchmark_kwargs["structured_output"] = args.structured_output
+                    if args.max_tokens:
+                        benchmark_kwargs["max_tokens"] = args.max_tokens
+                    if args.token_budget:
+                        benchmark_kwargs["token_budget"] = (
+                            args.token_budget if args.token_budget == "auto" else json.loads(args.token_budget))
+                    if args.reasoning_effort:
+                        benchmark_kwargs["reasoning_effort"] = args.reasoning_effort
+                    if args.hedge:
+                        benchmark_kwargs["hedge"] = {"budget": args.hedge_budget}
+                    if args.circuit_breaker or args.failover_provider:
+                        benchmark_kwargs["circuit_breaker"] = True
+                    if args.failover_provider:
+                        benchmark_kwargs["failover"] = args.failover_provider
+                    if args.no_pipeline:
+                        benchmark_kwargs["pipeline"] = False
+                    if args.checkpoint:
+                        benchmark_kwargs["checkpoint"] = True
+                    if args.capture:
+                        benchmark_kwargs["capture"] = args.capture
+
+                    with episode_context(model=model):
+                        result = run_benchmark(
+                            env_name=env,
+                            provider=args.provider,
+                            episodes=args.episodes,
+                            output_dir=model_out_dir,
+                            seed_start=args.seed_start,
+                            target_ci_half_width=args.target_ci,
+                            min_episodes=args.min_episodes,
+                            **benchmark_kwargs
+                        )
+
+                    # Extract relevant stats
+                    all_results[model][env] = {
+                        "mean_reward": result.get("mean_reward"),
+                        "std_reward": result.get("std_reward"),
+                        "mean_reward_ci95": result.get("mean_reward_ci95"),
+                        "episodes": result.get("episodes"),
+                        "early_stop": result.get("early_stop"),
+                    }
+                except Exception as e:
+                    logger.error("Error running %s with %s: %s", env, model, e)
+                    all_results[model][env] = {
+                        "error": str(e)
+                    }
+
+                # Save partial summary after each environment to avoid losing data
+                summary_path = os.path.join(args.out_dir, "summary.json")
+                with open(summary_path, "w", encoding="utf-8") as f:
+                    json.dump(all_results, f, indent=4, ensure_ascii=False)
+                if args.metrics_textfile:
+                    write_textfile(args.metrics_textfile)
+    finally:
+        reporter.stop()
     end_time = time.time()
     print("\n" + "="*60)
     print(f"✅ ALL BATCH BENCHMARKS COMPLETED in {end_time - start_time:.2f} seconds!")
@@ -1,6 +1,5 @@
 import json
 import numpy as np
-import imageio
 from typing import Dict, Any
 
 from utils_api import get_api_engine, get_unique_filename
@@ -11,6 +10,11 @@ from prompt.prompt_for_simple import (
     get_task_and_reward,
 )
 from obs.parse_simple_obs import parse_simple_obs
+from obs.encode_obs import count_tokens, encode_obs, row_layout
+from log_utils import get_logger
+from step_pipeline import StepPipeline
+
+logger = get_logger("simple")
 
 try:
     from pettingzoo.mpe import simple_v3
@@ -29,7 +33,14 @@ class NumpyEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
-def _format_current_obs(obs_struct: Dict[str, Any]) -> str:
+def _format_current_obs(obs_struct: Dict[str, Any], obs_format: str = "verbose") -> str:
+    if obs_format != "verbose":
+        return "\n".join([
+            "OBSERVATION SEMANTICS:",
+            "- obs = [vel_x, vel_y, dx, dy] where dx,dy = landmark_pos - your_pos",
+            f"CURRENT OBS ({obs_format}, landmark_rel = {row_layout(obs_format)}):",
+            encode_obs(obs_struct, obs_format),
+        ])
     lines = [
         "OBSERVATION SEMANTICS:",
         "- obs = [vel_x, vel_y, dx, dy] where dx,dy = landmark_pos - your_pos",
@@ -40,14 +51,14 @@ def _format_current_obs(obs_struct: Dict[str, Any]) -> str:
     return "\n".join(lines)
 
 
-def user_prompt_simple(agent: str, step_idx: int, obs_struct: Dict[str, Any]) -> str:
+def user_prompt_simple(agent: str, step_idx: int, obs_struct: Dict[str, Any], obs_format: str = "verbose") -> str:
     parts = [
         f"ENV: MPE_Simple_v3\nAGENT: {agent}\nSTEP: {step_idx}",
         get_task_and_reward(),
         get_physics_rules(),
         get_action_and_response_format(),
         get_navigation_hints(),
-        _format_current_obs(obs_struct),
+        _format_current_obs(obs_struct, obs_format),
     ]
     return "\n\n".join(parts)
 
@@ -55,98 +66,104 @@ def user_prompt_simple(agent: str, step_idx: int, obs_struct: Dict[str, Any]) ->
 def run_simple_game(provider: str, output_name: str, **kwargs):
     MAX_STEPS = 30
     seed = kwargs.pop('seed', None)
+    obs_format = kwargs.pop('obs_format', 'verbose')
+    pipeline = kwargs.pop('pipeline', True)
+    checkpoint = kwargs.pop('checkpoint', False)
+    capture = kwargs.pop('capture', None)
     llm_engine = get_api_engine(provider, **kwargs)
 
-    print("Initializing MPE Simple (Modular)...")
+    logger.info("Initializing MPE Simple (Modular)...")
     env = simple_v3.parallel_env(max_cycles=MAX_STEPS, continuous_actions=True, render_mode="rgb_array")
     observations, infos = env.reset(seed=seed) if seed is not None else env.reset()
-    frames = []
-    game_log = []
-
-    for step in range(MAX_STEPS):
-        print(f"\n{'='*20} STEP {step} {'='*20}")
-        frame = env.render()
-        if frame is not None:
-            frames.append(frame)
-
-        actions = {}
-        step_buffer = {}
-
-        for agent_id in env.agents:
-            if agent_id not in observations:
-                continue
-
-            obs_struct = parse_simple_obs(observations[agent_id])
-            full_prompt = user_prompt_simple(agent_id, step, obs_struct)
-            sys_r = "You are a decision module for a simple single-agent env. Output strict JSON only."
-
-            action_vec, raw_thought = llm_engine.generate_action(sys_r, full_prompt)
-
-            expected_dim = 5
-            if action_vec is None:
-                action_vec = np.zeros(expected_dim, dtype=np.float32)
-            else:
-                action_vec = np.array(action_vec, dtype=np.float32)
-                if action_vec.size == 0:
-                    action_vec = np.zeros(expected_dim, dtype=np.float32)
-            if len(action_vec) < expected_dim:
-                action_vec = np.concatenate([action_vec, np.zeros(expected_dim - len(action_vec))])
-            action_vec = action_vec[:expected_dim]
-            action_vec[:expected_dim] = np.clip(action_vec[:expected_dim], 0.0, 1.0)
-
-            actions[agent_id] = action_vec
-            step_buffer[agent_id] = {"obs": obs_struct, "action": action_vec, "thought": raw_thought}
-
-            print(f"[{agent_id}] action: {np.round(action_vec, 2)} | thought: {str(raw_thought)[:120]}")
-
-        if not actions:
-            break
-
-        observations, rewards, terminations, truncations, infos = env.step(actions)
-
-        print("Rewards:")
-        for aid, r in rewards.items():
-            print(f"  {aid}: {r:.3f}")
-            game_log.append({
-                "step": step,
-                "agent": aid,
-                "obs": step_buffer.get(aid, {}).get("obs"),
-                "action": step_buffer.get(aid, {}).get("action"),
-                "thought": step_buffer.get(aid, {}).get("thought"),
-                "reward": float(r)
-            })
-
-        if all(terminations.values()) or all(truncations.values()):
-            print("Game over (terminated or truncated).")
-            break
-
-    env.close()
-
-    # Add final summary
-    total_rewards = {}
-    for entry in game_log:
-        if "agent" in entry:
-            aid = entry["agent"]
-            total_rewards[aid] = total_rewards.get(aid, 0.0) + entry.get("reward", 0.0)
-    
-    mean_reward = sum(total_rewards.values()) / len(total_rewards) if total_rewards else 0.0
-    game_log.append({
-        "final_summary": True,
-        "total_rewards": {k: float(v) for k, v in total_rewards.items()},
-        "mean_reward": float(mean_reward)
-    })
-    print(f"\n📊 FINAL: Total Rewards={total_rewards}, Mean={mean_reward:.3f}")
-
-    if frames:
-        vid_name = get_unique_filename(f"{output_name}.mp4")
-        imageio.mimsave(vid_name, frames, fps=5, macro_block_size=1)
-        print(f"Saved video to {vid_name}")
-
-    if game_log:
-        log_name = get_unique_filename(f"{output_name}.json")
-        with open(log_name, "w", encoding="utf-8") as f:
-            json.dump(game_log, f, indent=2, cls=NumpyEncoder)
-        print(f"Saved log to {log_name}")
+    pipe = StepPipeline(llm_engine, f"{output_name}.mp4", fps=5, enabled=pipeline,
+                        checkpoint=checkpoint, seed=seed, capture=capture,
+                        json_kwargs={"indent": 2, "cls": NumpyEncoder}, macro_block_size=1)
+    try:
+        game_log = []
+        obs_tokens = []
+        prompt_tokens = []
+
+        for step in range(MAX_STEPS):
+            logger.debug("=== STEP %d ===", step)
+            pipe.render(env)
+
+            def decide(agent_id):
+                obs_struct = parse_simple_obs(observations[agent_id])
+                full_prompt = user_prompt_simple(agent_id, step, obs_struct, obs_format)
+                sys_r = "You are a decision module for a simple single-agent env. Output strict JSON only."
+
+                ctx = {"env": "simple", "seed": seed, "step": step, "agent": agent_id, "obs": obs_struct,
+                       "action_dim": env.action_space(agent_id).shape[0]}
+                action_vec, raw_thought = llm_engine.generate_action(sys_r, full_prompt, context=ctx)
+
+                action_vec = np.clip(action_vec, 0.0, 1.0)
+
+                logger.debug("[%s] action: %s | thought: %.120s", agent_id, action_vec, raw_thought)
+                return {"obs": obs_struct, "action": action_vec, "thought": raw_thought,
+                        "obs_tokens": count_tokens(_format_current_obs(obs_struct, obs_format)),
+                        "prompt_tokens": count_tokens(full_prompt), "llm": llm_engine.last_call_info()}
+
+            step_buffer = pipe.decide([aid for aid in env.agents if aid in observations], decide)
+            actions = {aid: info["action"] for aid, info in step_buffer.items()}
+            obs_tokens.extend(info["obs_tokens"] for info in step_buffer.values())
+            prompt_tokens.extend(info["prompt_tokens"] for info in step_buffer.values())
+
+            if not actions:
+                break
+
+            pipe.sync_env()
+            observations, rewards, terminations, truncations, infos = env.step(actions)
+
+            logger.debug("Rewards: %s", rewards)
+            for aid, r in rewards.items():
+                game_log.append({
+                    "step": step,
+                    "agent": aid,
+                    "obs": step_buffer.get(aid, {}).get("obs"),
+                    "action": step_buffer.get(aid, {}).get("action"),
+                    "thought": step_buffer.get(aid, {}).get("thought"),
+                    "reward": float(r),
+                    "obs_tokens": step_buffer.get(aid, {}).get("obs_tokens"),
+                    "llm": step_buffer.get(aid, {}).get("llm"),
+                })
+
+            pipe.log(game_log)
+            if all(terminations.values()) or all(truncations.values()):
+                logger.debug("Game over (terminated or truncated).")
+                break
+
+        # Add final summary
+        total_rewards = {}
+        for entry in game_log:
+            if "agent" in entry:
+                aid = entry["agent"]
+                total_rewards[aid] = total_rewards.get(aid, 0.0) + entry.get("reward", 0.0)
+
+        mean_reward = sum(total_rewards.values()) / len(total_rewards) if total_rewards else 0.0
+        game_log.append({
+            "final_summary": True,
+            "env": "simple",
+            "seed": seed,
+            "total_rewards": {k: float(v) for k, v in total_rewards.items()},
+            "mean_reward": float(mean_reward),
+            "obs_format": obs_format,
+            "obs_tokens_mean": float(np.mean(obs_tokens)) if obs_tokens else 0.0,
+            "prompt_tokens_mean": float(np.mean(prompt_tokens)) if prompt_tokens else 0.0,
+            "circuit": llm_engine.circuit_summary(),
+        })
+        logger.info("FINAL: Total Rewards=%s, Mean=%.3f", total_rewards, mean_reward)
+
+        vid_name = pipe.finish_video()
+        if vid_name:
+            logger.info("Saved video to %s", vid_name)
+
+        if game_log:
+            log_name = get_unique_filename(f"{output_name}.json")
+            pipe.write_log(game_log, log_name)
+            logger.info("Saved log to %s", log_name)
+    finally:
+        pipe.close()
+        env.close()
 
 
 if __name__ == "__main__":
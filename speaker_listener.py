@@ -1,3 +1,4 @@
+import logging
 import numpy as np
 import json
 from typing import Dict, Any
@@ -10,6 +11,11 @@ from prompt.prompt_for_speaker_listener import (
     get_task_and_reward,
 )
 from obs.parse_speaker_listener_obs import parse_speaker_listener_obs
+from obs.encode_obs import count_tokens, encode_obs
+from log_utils import get_logger
+from step_pipeline import StepPipeline
+
+logger = get_logger("speaker_listener")
 
 try:
     from pettingzoo.mpe import simple_speaker_listener_v4
@@ -17,11 +23,18 @@ except ImportError:
     raise ImportError("请安装 pettingzoo: pip install pettingzoo[mpe]")
 
 
-def _format_current_obs(obs_struct: Dict[str, Any], agent_id: str) -> str:
+def _format_current_obs(obs_struct: Dict[str, Any], agent_id: str, obs_format: str = "verbose") -> str:
     role = obs_struct["role"]
     lines = [
         "OBSERVATION SEMANTICS:",
     ]
+    if obs_format != "verbose":
+        if role == "SPEAKER":
+            lines.append("- obs = [goal_vector(3)] one-hot indicating target landmark")
+        else:
+            lines.append("- obs = [vel(2), landmarks(3x2), comm_vector(3)]")
+        lines.extend([f"CURRENT OBS ({obs_format}):", encode_obs(obs_struct, obs_format)])
+        return "\n".join(lines)
     if role == "SPEAKER":
         lines.extend([
             "- obs = [goal_vector(3)] one-hot indicating target landmark",
@@ -47,14 +60,14 @@ def _format_current_obs(obs_struct: Dict[str, Any], agent_id: str) -> str:
     return "\n".join(lines)
 
 
-def user_prompt_speaker_listener(agent_id: str, step: int, obs_struct: Dict[str, Any]) -> str:
+def user_prompt_speaker_listener(agent_id: str, step: int, obs_struct: Dict[str, Any], obs_format: str = "verbose") -> str:
     role = obs_struct["role"]
     parts = [
         get_task_and_reward(role),
         get_physics_rules(role),
         get_action_and_response_format(role),
         get_navigation_hints(role),
-        _format_current_obs(obs_struct, agent_id),
+        _format_current_obs(obs_struct, agent_id, obs_format),
     ]
     return "\n\n".join(parts)
 
@@ -62,106 +75,123 @@ def user_prompt_speaker_listener(agent_id: str, step: int, obs_struct: Dict[str,
 def run_speaker_listener(provider: str, output_name: str, **kwargs):
     MAX_STEPS = 30
     seed = kwargs.pop('seed', None)
+    obs_format = kwargs.pop('obs_format', 'verbose')
+    pipeline = kwargs.pop('pipeline', True)
+    checkpoint = kwargs.pop('checkpoint', False)
+    capture = kwargs.pop('capture', None)
     llm_engine = get_api_engine(provider, **kwargs)
 
-    print("Initializing Speaker-Listener (Modular)...")
+    logger.info("Initializing Speaker-Listener (Modular)...")
     env = simple_speaker_listener_v4.parallel_env(max_cycles=MAX_STEPS, continuous_actions=True, render_mode="rgb_array")
 
     observations, infos = env.reset(seed=seed) if seed is not None else env.reset()
-    frames = []
-    game_log = []
-    total_rewards = {aid: 0.0 for aid in env.agents}
-
-    for step in range(MAX_STEPS):
-        print(f"\n{'='*30} STEP {step} {'='*30}")
-        frame = env.render()
-        if frame is not None:
-            frames.append(frame)
-
-        actions = {}
-        step_buffer = {}
-
-        for agent_id in env.agents:
-            obs_struct = parse_speaker_listener_obs(observations[agent_id], agent_id)
-            role = obs_struct["role"]
-            full_prompt = user_prompt_speaker_listener(agent_id, step, obs_struct)
-
-            sys_r = f"You are a precise {role} agent. Output strict JSON."
-            action_vec, raw_thought = llm_engine.generate_action(sys_r, full_prompt)
-
-            # Determine expected dimension
-            expected_dim = 3 if role == "SPEAKER" else 5
-
-            if len(action_vec) < expected_dim:
-                action_vec = np.concatenate([action_vec, np.zeros(expected_dim - len(action_vec))])
-            action_vec = np.clip(action_vec[:expected_dim], 0.0, 1.0)
-
-            actions[agent_id] = action_vec
-            step_buffer[agent_id] = {"struct": obs_struct, "action": action_vec, "thought": raw_thought}
-
-        observations, rewards, terminations, truncations, infos = env.step(actions)
-
-        for aid, info in step_buffer.items():
-            r = rewards.get(aid, 0.0)
-            total_rewards[aid] = total_rewards.get(aid, 0.0) + r
-
-            struct = info["struct"]
-            act = info["action"]
-            role = struct["role"]
-
-            print(f"\nAGENT {aid} ({role}) | Reward: {r:.4f}")
-
-            if role == "SPEAKER":
-                target_id = struct.get("target_landmark_id")
-                say_idx = int(np.argmax(act)) if max(act) > 0.1 else -1
-                print(f"   Target: {target_id} -> Broadcast: Say_{say_idx}")
-                print(f"   Action: {np.round(act, 2)}")
-            else:
-                heard = struct.get("heard_id")
-                move_idx = int(np.argmax(act)) if max(act) > 0.1 else 0
-                move_str = ["HOLD", "LEFT", "RIGHT", "DOWN", "UP"][move_idx]
-                print(f"   Heard: {heard} -> Move: {move_str}")
-                print(f"   Action: {np.round(act, 2)}")
-
-            warn = struct.get("warning")
-            if warn:
-                print(f"   Warning: {warn}")
-
-            game_log.append({
-                "step": step,
-                "agent": aid,
-                "role": role,
-                "obs": struct,
-                "action": act.tolist(),
-                "thought": info["thought"],
-                "reward": r
-            })
-
-        if all(terminations.values()) or all(truncations.values()):
-            print("Game Over.")
-            break
-
-    env.close()
-
-    # Add final summary
-    mean_reward = sum(total_rewards.values()) / len(total_rewards) if total_rewards else 0.0
-    game_log.append({
-        "final_summary": True,
-        "total_rewards": {k: float(v) for k, v in total_rewards.items()},
-        "mean_reward": float(mean_reward)
-    })
-    print(f"\n📊 FINAL: Total Rewards={total_rewards}, Mean={mean_reward:.3f}")
-
-    if frames:
-        vid_name = get_unique_filename(output_name + ".mp4")
-        import imageio
-        imageio.mimsave(vid_name, frames, fps=4, macro_block_size=1)
-        print(f"Saved video to {vid_name}")
-
-    final_log = get_unique_filename(output_name + ".json")
-    with open(final_log, "w", encoding="utf-8") as f:
-        json.dump(game_log, f, indent=4)
-    print(f"Saved detailed logs to {final_log}")
+    pipe = StepPipeline(llm_engine, output_name + ".mp4", fps=4, enabled=pipeline,
+                        checkpoint=checkpoint, seed=seed, capture=capture, macro_block_size=1)
+    try:
+        game_log = []
+        total_rewards = {aid: 0.0 for aid in env.agents}
+        obs_tokens = []
+        prompt_tokens = []
+        debug_on = logger.isEnabledFor(logging.DEBUG)
+
+        for step in range(MAX_STEPS):
+            logger.debug("=== STEP %d ===", step)
+            pipe.render(env)
+
+            def decide(agent_id):
+                obs_struct = parse_speaker_listener_obs(observations[agent_id], agent_id)
+                role = obs_struct["role"]
+                full_prompt = user_prompt_speaker_listener(agent_id, step, obs_struct, obs_format)
+
+                sys_r = f"You are a precise {role} agent. Output strict JSON."
+                ctx = {"env": "speaker_listener", "seed": seed, "step": step, "agent": agent_id, "obs": obs_struct,
+                       "action_dim": env.action_space(agent_id).shape[0]}
+                action_vec, raw_thought = llm_engine.generate_action(sys_r, full_prompt, context=ctx)
+
+                # Width already matches the role (speaker 3 / listener 5) via action_dim
+                action_vec = np.clip(action_vec, 0.0, 1.0)
+
+                return {"struct": obs_struct, "action": action_vec, "thought": raw_thought,
+                        "obs_tokens": count_tokens(_format_current_obs(obs_struct, agent_id, obs_format)),
+                        "prompt_tokens": count_tokens(full_prompt), "llm": llm_engine.last_call_info()}
+
+            step_buffer = pipe.decide(env.agents, decide)
+            actions = {aid: info["action"] for aid, info in step_buffer.items()}
+            obs_tokens.extend(info["obs_tokens"] for info in step_buffer.values())
+            prompt_tokens.extend(info["prompt_tokens"] for info in step_buffer.values())
+
+            pipe.sync_env()
+            observations, rewards, terminations, truncations, infos = env.step(actions)
+
+            for aid, info in step_buffer.items():
+                r = rewards.get(aid, 0.0)
+                total_rewards[aid] = total_rewards.get(aid, 0.0) + r
+
+                struct = info["struct"]
+                act = info["action"]
+                role = struct["role"]
+
+                if debug_on:
+                    logger.debug("AGENT %s (%s) | Reward: %.4f", aid, role, r)
+
+                    if role == "SPEAKER":
+                        target_id = struct.get("target_landmark_id")
+                        say_idx = int(np.argmax(act)) if max(act) > 0.1 else -1
+                        logger.debug("   Target: %s -> Broadcast: Say_%d", target_id, say_idx)
+                        logger.debug("   Action: %s", np.round(act, 2))
+                    else:
+                        heard = struct.get("heard_id")
+                        move_idx = int(np.argmax(act)) if max(act) > 0.1 else 0
+                        move_str = ["HOLD", "LEFT", "RIGHT", "DOWN", "UP"][move_idx]
+                        logger.debug("   Heard: %s -> Move: %s", heard, move_str)
+                        logger.debug("   Action: %s", np.round(act, 2))
+
+                    warn = struct.get("warning")
+                    if warn:
+                        logger.debug("   Warning: %s", warn)
+
+                game_log.append({
+                    "step": step,
+                    "agent": aid,
+                    "role": role,
+                    "obs": struct,
+                    "action": act.tolist(),
+                    "thought": info["thought"],
+                    "reward": r,
+                    "obs_tokens": info["obs_tokens"],
+                    "llm": info.get("llm"),
+                })
+
+            pipe.log(game_log)
+            if all(terminations.values()) or all(truncations.values()):
+                logger.debug("Game Over.")
+                break
+
+        # Add final summary
+        mean_reward = sum(total_rewards.values()) / len(total_rewards) if total_rewards else 0.0
+        game_log.append({
+            "final_summary": True,
+            "env": "speaker_listener",
+            "seed": seed,
+            "total_rewards": {k: float(v) for k, v in total_rewards.items()},
+            "mean_reward": float(mean_reward),
+            "obs_format": obs_format,
+            "obs_tokens_mean": float(np.mean(obs_tokens)) if obs_tokens else 0.0,
+            "prompt_tokens_mean": float(np.mean(prompt_tokens)) if prompt_tokens else 0.0,
+            "circuit": llm_engine.circuit_summary(),
+        })
+        logger.info("FINAL: Total Rewards=%s, Mean=%.3f", total_rewards, mean_reward)
+
+        vid_name = pipe.finish_video()
+        if vid_name:
+            logger.info("Saved video to %s", vid_name)
+
+        final_log = get_unique_filename(output_name + ".json")
+        pipe.write_log(game_log, final_log)
+    finally:
+        pipe.close()
+        env.close()
+    logger.info("Saved detailed logs to %s", final_log)
 
 
 if __name__ == "__main__":
@@ -2,7 +2,6 @@ import os
 import re
 import json
 import numpy as np
-import imageio
 import math
 from typing import Dict, Any, List
 from utils_api import get_api_engine, get_unique_filename
@@ -13,6 +12,11 @@ from prompt.prompt_for_spread import (
     get_task_and_reward,
 )
 from obs.parse_spread_obs import parse_spread_obs
+from obs.encode_obs import count_tokens, encode_obs, row_layout
+from log_utils import get_logger
+from step_pipeline import StepPipeline
+
+logger = get_logger("spread")
 try:
     from pettingzoo.mpe import simple_spread_v3
 except ImportError:
@@ -23,14 +27,14 @@ try:
     import google.generativeai as genai
 except ImportError:
     # 如果只是为了跑通代码，可以暂时忽略，但调用 API 会报错
-    print("Warning: API libraries (openai, google-generativeai) not installed.")
+    logger.warning("API libraries (openai, google-generativeai) not installed.")
 
 ENV_MODULE = "MPE_Simple_v3"
 LOCAL_RATIO = 0.5
 DEFAULT_N = 3
 
 
-def _format_current_obs(obs_struct: Dict[str, Any], num_agents: int) -> str:
+def _format_current_obs(obs_struct: Dict[str, Any], num_agents: int, obs_format: str = "verbose") -> str:
     obs_semantics = (
         "OBSERVATION semantics:\n"
         f"- obs = [self_vel(2), self_pos(2), landmark_rel(2N), other_agent_rel(2({num_agents}-1)), comm(2({num_agents}-1))]\n"
@@ -38,6 +42,12 @@ def _format_current_obs(obs_struct: Dict[str, Any], num_agents: int) -> str:
         "- other_agent_rel: (other_agent_pos - your_pos) for each teammate.\n"
         "- comm: other agents' communication (usually zeros).\n\n"
     )
+    if obs_format != "verbose":
+        return (
+            obs_semantics +
+            f"CURRENT OBS ({obs_format}, rows = {row_layout(obs_format)}):\n"
+            f"{encode_obs(obs_struct, obs_format)}\n"
+        )
     return (
         obs_semantics +
         "CURRENT OBS (structured):\n"
@@ -45,7 +55,14 @@ def _format_current_obs(obs_struct: Dict[str, Any], num_agents: int) -> str:
     )
 
 
-def user_prompt(agent: str, step_idx: int, obs_struct: Dict[str, Any], num_agents: int, local_ratio: float) -> str:
+def user_prompt(
+    agent: str,
+    step_idx: int,
+    obs_struct: Dict[str, Any],
+    num_agents: int,
+    local_ratio: float,
+    obs_format: str = "verbose",
+) -> str:
     header = (
         f"ENV: {ENV_MODULE}\n"
         f"AGENT: {agent}\n"
@@ -58,7 +75,7 @@ def user_prompt(agent: str, step_idx: int, obs_struct: Dict[str, Any], num_agent
         get_physics_rules(),
         get_action_and_response_format(),
         get_navigation_hints(),
-        _format_current_obs(obs_struct, num_agents),
+        _format_current_obs(obs_struct, num_agents, obs_format),
     ]
 
     return "\n".join(parts)
@@ -82,14 +99,19 @@ def run_spread_game(
         output_file: 输出视频文件名
         N: 智能体数量
         local_ratio: 本地奖励比例
-        **kwargs: 传递给 get_api_engine 的额外参数
+        **kwargs: 传递给 get_api_engine 的额外参数（支持 seed / obs_format / pipeline 参数；
+                  pipeline=False 关闭渲染/日志/多智能体调用的流水线重叠，见 step_pipeline.py）
     """
     MAX_STEPS = 30
     seed = kwargs.pop('seed', None)
+    obs_format = kwargs.pop('obs_format', 'verbose')
+    pipeline = kwargs.pop('pipeline', True)
+    checkpoint = kwargs.pop('checkpoint', False)
+    capture = kwargs.pop('capture', None)
     llm_engine = get_api_engine(provider, **kwargs)
     system_prompt = "You are a decision module for a game agent. Output only one-line JSON."
 
-    print("Initializing MPE Simple...")
+    logger.info("Initializing MPE Spread (N=%d)...", N)
     env = simple_spread_v3.parallel_env(
         N=N,
         local_ratio=local_ratio,
@@ -98,74 +120,92 @@ def run_spread_game(
         render_mode="rgb_array",
     )
     observations, infos = env.reset(seed=seed) if seed is not None else env.reset()
-    frames = []
-    game_log = []
-    total_rewards = {aid: 0.0 for aid in env.agents}
-    step_buffer = {}
-
-    for step in range(MAX_STEPS):
-        print(f"=== STEP {step} ===")
-        frame = env.render()
-        if frame is not None:
-            frames.append(frame)
-
-        actions = {}
+    pipe = StepPipeline(llm_engine, output_file, fps=1, enabled=pipeline,
+                        checkpoint=checkpoint, seed=seed, capture=capture,
+                        json_kwargs={"indent": 2, "ensure_ascii": False})
+    try:
+        game_log = []
+        total_rewards = {aid: 0.0 for aid in env.agents}
         step_buffer = {}
-        for agent_id in env.agents:
-            obs_raw = observations[agent_id]
-            obs_struct = parse_spread_obs(obs_raw, num_agents=N)
-            print(f"Agent {agent_id} Obs: {obs_struct}")
-
-            full_prompt = user_prompt(agent_id, step, obs_struct, num_agents=N, local_ratio=local_ratio)
-
-            action_vec, response_text = llm_engine.generate_action(system_prompt, full_prompt)
-            action_vec = np.clip(action_vec, 0.0, 1.0)
-            actions[agent_id] = action_vec
-            step_buffer[agent_id] = {"obs": obs_struct, "action": action_vec, "thought": response_text}
-            print(f"  Action: {np.round(action_vec, 2)}")
-            print(f"  Response: {response_text[:]}...")
-
-        if not actions:
-            break
-
-        observations, rewards, terminations, truncations, infos = env.step(actions)
-        print(f"Rewards: {rewards}")
-        
-        for aid, r in rewards.items():
-            total_rewards[aid] += r
-            game_log.append({
-                "step": step,
-                "agent": aid,
-                "obs": step_buffer[aid]["obs"],
-                "action": step_buffer[aid]["action"].tolist(),
-                "thought": step_buffer[aid]["thought"],
-                "reward": float(r)
-            })
-        
-        if all(terminations.values()) or all(truncations.values()):
-            break
-
-    env.close()
-    
-    # Add final summary
-    mean_reward = sum(total_rewards.values()) / len(total_rewards) if total_rewards else 0.0
-    game_log.append({
-        "final_summary": True,
-        "total_rewards": {k: float(v) for k, v in total_rewards.items()},
-        "mean_reward": float(mean_reward)
-    })
-    print(f"\nFINAL REWARDS: {total_rewards}, MEAN: {mean_reward:.3f}")
-    
-    if frames:
-        final_output = get_unique_filename(output_file)
-        print(f"Saving video to {final_output}...")
-        imageio.mimsave(final_output, frames, fps=1)
-    
-    if game_log:
-        log_file = get_unique_filename(output_file.replace(".mp4", ".json"))
-        with open(log_file, "w", encoding="utf-8") as f:
-            json.dump(game_log, f, indent=2, ensure_ascii=False)
-        print(f"Saved log to {log_file}")
+        obs_tokens = []
+        prompt_tokens = []
+
+        for step in range(MAX_STEPS):
+            logger.debug("=== STEP %d ===", step)
+            pipe.render(env)
+
+            def decide(agent_id):
+                obs_raw = observations[agent_id]
+                obs_struct = parse_spread_obs(obs_raw, num_agents=N)
+                logger.debug("Agent %s Obs: %s", agent_id, obs_struct)
+
+                full_prompt = user_prompt(agent_id, step, obs_struct, num_agents=N, local_ratio=local_ratio, obs_format=obs_format)
+                n_obs_tokens = count_tokens(_format_current_obs(obs_struct, N, obs_format))
+
+                ctx = {"env": "spread", "seed": seed, "step": step, "agent": agent_id, "obs": obs_struct,
+                       "action_dim": env.action_space(agent_id).shape[0]}
+                action_vec, response_text = llm_engine.generate_action(system_prompt, full_prompt, context=ctx)
+                action_vec = np.clip(action_vec, 0.0, 1.0)
+                logger.debug("  Action: %s", action_vec)
+                logger.debug("  Response: %s", response_text)
+                return {"obs": obs_struct, "action": action_vec, "thought": response_text, "obs_tokens": n_obs_tokens,
+                        "prompt_tokens": count_tokens(full_prompt), "llm": llm_engine.last_call_info()}
+
+            step_buffer = pipe.decide(env.agents, decide)
+            actions = {aid: b["action"] for aid, b in step_buffer.items()}
+            obs_tokens.extend(b["obs_tokens"] for b in step_buffer.values())
+            prompt_tokens.extend(b["prompt_tokens"] for b in step_buffer.values())
+
+            if not actions:
+                break
+
+            pipe.sync_env()
+            observations, rewards, terminations, truncations, infos = env.step(actions)
+            logger.debug("Rewards: %s", rewards)
+
+            for aid, r in rewards.items():
+                total_rewards[aid] += r
+                game_log.append({
+                    "step": step,
+                    "agent": aid,
+                    "obs": step_buffer[aid]["obs"],
+                    "action": step_buffer[aid]["action"].tolist(),
+                    "thought": step_buffer[aid]["thought"],
+                    "reward": float(r),
+                    "obs_tokens": step_buffer[aid]["obs_tokens"],
+                    "llm": step_buffer[aid].get("llm"),
+                })
+
+            pipe.log(game_log)
+            if all(terminations.values()) or all(truncations.values()):
+                break
+
+        # Add final summary
+        mean_reward = sum(total_rewards.values()) / len(total_rewards) if total_rewards else 0.0
+        game_log.append({
+            "final_summary": True,
+            "env": "spread",
+            "seed": seed,
+            "total_rewards": {k: float(v) for k, v in total_rewards.items()},
+            "mean_reward": float(mean_reward),
+            "obs_format": obs_format,
+            "obs_tokens_mean": float(np.mean(obs_tokens)) if obs_tokens else 0.0,
+            "prompt_tokens_mean": float(np.mean(prompt_tokens)) if prompt_tokens else 0.0,
+            "circuit": llm_engine.circuit_summary(),
+        })
+        logger.info("FINAL REWARDS: %s, MEAN: %.3f", total_rewards, mean_reward)
+
+        final_output = pipe.finish_video()
+        if final_output:
+            logger.info("Saved video to %s", final_output)
+
+        if game_log:
+            log_file = get_unique_filename(output_file.replace(".mp4", ".json"))
+            pipe.write_log(game_log, log_file)
+            logger.info("Saved log to %s", log_file)
+    finally:
+        pipe.close()
+        env.close()
 
 if __name__ == "__main__":
     # ========== 统一模型接口 ==========
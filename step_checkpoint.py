@@ -0,0 +1,121 @@
+"""
+Step-level checkpoint / resume for the game runners.
+
+The MPE environments are deterministic given the reset seed and the action
+sequence, so an episode can be rebuilt up to step t from the agents'
+decisions alone. StepCheckpoint keeps them in an append-only pickle stream
+next to the episode outputs (<output_name>.ckpt):
+
+    header  {"version", "seed", "provider", "model"}
+    step    {"step", "decisions", "log_len", "rewards"}   one record per finished step
+
+`decisions` is exactly what StepPipeline.decide() returned for the step
+(actions, thoughts, token counts, LLM call info), `log_len` the length of
+game_log after the step and `rewards` the per-agent reward sums so far.
+
+A restarted run of the same episode (same output name, seed and model) finds
+the records in `replay`; the pipeline hands them back from decide() instead
+of calling the LLM, the runner feeds them through env.step as usual, and the
+rewards of every replayed step are checked against the recorded ones. Once
+the records are exhausted the episode continues live and keeps appending.
+
+A record torn by a kill in the middle of a write is dropped (the file is
+truncated to the last complete record); the file is removed once the
+episode's log has been written.
+"""
+
+import os
+import pickle
+from typing import Any, Dict, List, Optional
+
+from log_utils import get_logger
+
+logger = get_logger("checkpoint")
+
+CHECKPOINT_VERSION = 1
+
+
+class StepCheckpoint:
+    def __init__(self, path: str, seed: Optional[int] = None, provider: Optional[str] = None,
+                 model: Optional[str] = None):
+        self.path = path
+        self.header = {"version": CHECKPOINT_VERSION, "seed": seed, "provider": provider, "model": model}
+        self._file = None
+        # _offsets[i]: file offset right after step record i (_offsets[-1]: after the header)
+        self._offsets: Dict[int, int] = {}
+        self.replay: List[Dict[str, Any]] = self._load()
+        if self.replay:
+            logger.info("Resuming from %s: replaying %d cached steps", path, len(self.replay))
+
+    def _load(self) -> List[Dict[str, Any]]:
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return []
+        records: List[Dict[str, Any]] = []
+        with f:
+            try:
+                header = pickle.load(f)
+            except Exception as exc:
+                logger.warning("Ignoring unreadable checkpoint %s: %s", self.path, exc)
+                return []
+            if header != self.header:
+                logger.warning("Ignoring checkpoint %s written for %s (now %s)", self.path, header, self.header)
+                return []
+            self._offsets[-1] = f.tell()
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    break
+                except Exception as exc:
+                    # 进程在写入中途被杀：丢弃残缺的尾记录
+                    logger.warning("Checkpoint %s truncated after step %d: %s", self.path, len(records) - 1, exc)
+                    break
+                self._offsets[len(records)] = f.tell()
+                records.append(record)
+        return records
+
+    def _open(self) -> None:
+        if -1 in self._offsets:
+            self._file = open(self.path, "r+b")
+            self._file.truncate(self._offsets[len(self.replay) - 1])
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(self.path, "wb")
+            self._write(self.header)
+            self._offsets[-1] = self._file.tell()
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        pickle.dump(record, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        # flush 到 OS 即可在进程被杀后保留；不做 fsync，避免每步一次磁盘同步
+        self._file.flush()
+
+    def append(self, step: int, decisions: Any, log_len: int, rewards: Dict[str, float]) -> None:
+        """Record a finished live step."""
+        if self._file is None:
+            self._open()
+        self._write({"step": step, "decisions": decisions, "log_len": log_len, "rewards": rewards})
+        self._offsets[step] = self._file.tell()
+
+    def discard_from(self, step: int) -> None:
+        """Drop the cached records from `step` on (the episode diverged from them); later steps run live."""
+        del self.replay[step:]
+        if self._file is None:
+            self._open()
+        else:
+            self._file.truncate(self._offsets[step - 1])
+            self._file.seek(0, os.SEEK_END)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self) -> None:
+        """The episode finished: the checkpoint is no longer needed."""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
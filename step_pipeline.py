@@ -0,0 +1,280 @@
+"""
+Pipelined step execution for the game runners.
+
+A runner step used to be strictly sequential: render, then for each agent
+build the prompt and wait on the LLM, then env.step, then log. StepPipeline
+overlaps everything that does not touch the environment state with the
+in-flight LLM requests:
+
+- render(env) renders the frame of step t on a background I/O worker while
+  the agents of step t are deciding; sync_env() waits for it right before
+  env.step, so the environment never changes under the renderer. The frame
+  is then encoded into the video on the same worker during step t+1.
+- decide(agent_ids, fn) runs fn(agent_id) (prompt construction + LLM call)
+  for all agents of the step concurrently when the engine allows it, so the
+  step waits for the slowest agent instead of the sum of all agents.
+- log(game_log) serializes the entries appended since the previous call
+  (step t-1) in the background; write_log() only joins the chunks.
+
+Episode semantics are unchanged: actions of a step are still collected for
+every agent before env.step, results are returned in agent order, and the
+JSON log and video are identical to the sequential ones. pipeline=False
+(runner kwarg) runs the same code path sequentially on the calling thread.
+
+checkpoint=True (runner kwarg) additionally records every finished step in
+<output_name>.ckpt; a rerun of an interrupted episode replays the recorded
+decisions without LLM calls and continues live from there (see
+step_checkpoint.py).
+
+capture="obs" | "state" (runner kwarg) records the raw float32 observations,
+actions and rewards (plus world state) of every step into <log>.capture/
+next to the episode log (see episode_capture.py).
+"""
+
+import contextvars
+import json
+import math
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import imageio
+
+from episode_capture import EpisodeCapture, capture_path
+from log_utils import get_logger
+from step_checkpoint import StepCheckpoint
+from utils_api import get_unique_filename
+
+logger = get_logger("pipeline")
+
+# Providers whose generate_action may run on several threads at once (HTTP clients / offline backends);
+# transformers and vllm share one in-process model and stay sequential.
+CONCURRENT_PROVIDERS = ("openai", "deepseek", "qwen", "gpt", "chatgpt", "gemini", "ollama", "mock", "replay", "heuristic")
+
+
+class StepPipeline:
+    def __init__(
+        self,
+        llm_engine: Any,
+        video_path: Optional[str],
+        fps: int = 1,
+        enabled: bool = True,
+        json_kwargs: Optional[Dict[str, Any]] = None,
+        checkpoint: bool = False,
+        seed: Optional[int] = None,
+        capture: Optional[str] = None,
+        **video_kwargs: Any,
+    ):
+        """
+        video_path: base video file name (made unique on the first frame, except that a resumed episode
+            overwrites the interrupted run's video); fps / **video_kwargs go to imageio
+        json_kwargs: json.dump options of the runner's log file, e.g. {"indent": 2, "ensure_ascii": False}
+        enabled: False runs render / decide / serialization inline, in the original order
+        checkpoint: record each step next to video_path (.ckpt) and resume from an existing record;
+            seed is the episode's env.reset seed, a checkpoint of another seed / model is ignored
+        capture: "obs" / "state" to write raw per-step arrays next to the log (True means "obs")
+        """
+        self.enabled = bool(enabled)
+        self.video_base = video_path
+        self.video_path: Optional[str] = None
+        self.fps = fps
+        self.video_kwargs = video_kwargs
+        self._writer = None
+        self._io = ThreadPoolExecutor(1, thread_name_prefix="pipeline-io") if self.enabled else None
+        parallel_agents = self.enabled and getattr(llm_engine, "provider", None) in CONCURRENT_PROVIDERS
+        self._agents = ThreadPoolExecutor(8, thread_name_prefix="pipeline-agent") if parallel_agents else None
+        self._render: Optional[Future] = None
+        self._chunks: List[Future] = []
+        # 已提交但可能未完成的任务，close() 时取消（cancel_futures 需要 Python 3.9）
+        self._pending: List[Future] = []
+        self._logged = 0
+        self._json_kwargs: Dict[str, Any] = {"indent": 4, **(json_kwargs or {})}
+        self._ckpt: Optional[StepCheckpoint] = None
+        if checkpoint and seed is None:
+            logger.warning("Step checkpoints need a seeded env.reset to replay; checkpointing disabled")
+        elif checkpoint and video_path:
+            self._ckpt = StepCheckpoint(os.path.splitext(video_path)[0] + ".ckpt", seed=seed,
+                                        provider=getattr(llm_engine, "provider", None),
+                                        model=getattr(llm_engine, "model_name", None))
+        self._capture = EpisodeCapture("obs" if capture is True else capture, seed=seed) if capture else None
+        self._step = 0
+        self._decisions: Any = None
+        self._decide_s: Optional[float] = None
+        self._rewards: Dict[str, float] = {}
+
+    def _submit(self, pool: ThreadPoolExecutor, fn: Callable, *args: Any) -> Future:
+        # 在工作线程中保留 episode_context（日志字段）
+        future = pool.submit(contextvars.copy_context().run, fn, *args)
+        self._pending = [f for f in self._pending if not f.done()]
+        self._pending.append(future)
+        return future
+
+    # ---------- 渲染 / 视频编码 ----------
+    def render(self, env: Any) -> None:
+        """Render the current state; must be followed by sync_env() before env.step."""
+        if self._capture is not None:
+            self._capture.observe(env)
+        if self._io is None:
+            self._encode(env.render())
+        else:
+            self._render = self._submit(self._io, env.render)
+
+    def sync_env(self) -> None:
+        """Wait for the pending render, then queue the frame for encoding."""
+        if self._render is not None:
+            frame = self._render.result()
+            self._render = None
+            self._submit(self._io, self._encode, frame)
+
+    def _encode(self, frame: Any) -> None:
+        if frame is None or self.video_base is None:
+            return
+        if self._writer is None:
+            if self._ckpt is not None and self._ckpt.replay and os.path.exists(self.video_base):
+                # 从检查点恢复：video_base 是被中断那次运行的半截视频（检查点与它同名），直接覆盖
+                logger.info("Resumed episode overwrites the interrupted video %s", self.video_base)
+                self.video_path = self.video_base
+            else:
+                self.video_path = get_unique_filename(self.video_base)
+            self._writer = imageio.get_writer(self.video_path, fps=self.fps, **self.video_kwargs)
+        self._writer.append_data(frame)
+
+    # ---------- 决策 ----------
+    def decide(self, agent_ids: Iterable[str], fn: Callable[[str], Any]) -> Dict[str, Any]:
+        """
+        {agent_id: fn(agent_id)} in agent order; concurrent across agents when the provider allows it.
+        While resuming from a checkpoint, the recorded decisions of the step are returned instead.
+        """
+        agent_ids = list(agent_ids)
+        cached = self._replayed()
+        if cached is not None:
+            if set(cached) == set(agent_ids):
+                self._decisions = cached
+                self._decide_s = None
+                return {aid: cached[aid] for aid in agent_ids}
+            logger.warning("Checkpoint step %d was recorded for agents %s, not %s; continuing live",
+                           self._step, sorted(cached), agent_ids)
+            self._ckpt.discard_from(self._step)
+        t0 = time.perf_counter()
+        if self._agents is None or len(agent_ids) < 2:
+            decisions = {aid: fn(aid) for aid in agent_ids}
+        else:
+            futures = [self._submit(self._agents, fn, aid) for aid in agent_ids]
+            decisions = {aid: f.result() for aid, f in zip(agent_ids, futures)}
+        self._decide_s = time.perf_counter() - t0
+        self._decisions = decisions
+        return decisions
+
+    def _replayed(self) -> Optional[Dict[str, Any]]:
+        if self._ckpt is None or self._step >= len(self._ckpt.replay):
+            return None
+        return self._ckpt.replay[self._step]["decisions"]
+
+    # ---------- 日志 ----------
+    def log(self, game_log: List[Dict[str, Any]]) -> None:
+        """
+        Serialize the entries appended since the last call in the background.
+        Called once per step after its rewards are logged; this also records the step in the checkpoint.
+        """
+        new = game_log[self._logged:]
+        self._logged = len(game_log)
+        if self._decide_s is not None:
+            # 本步决策阶段的实测墙钟时间（智能体并发时 < 各调用耗时之和），供 llm_qos 统计步延迟
+            for e in new:
+                if isinstance(e.get("llm"), dict):
+                    e["llm"]["step_wall_s"] = round(self._decide_s, 4)
+            self._decide_s = None
+        if new:
+            if self._io is None:
+                self._chunks.append(_done(self._serialize(new)))
+            else:
+                self._chunks.append(self._submit(self._io, self._serialize, new))
+        if self._capture is not None:
+            self._capture.record(new)
+        if self._ckpt is not None and self._decisions is not None:
+            self._checkpoint(new)
+
+    def _checkpoint(self, new: List[Dict[str, Any]]) -> None:
+        for e in new:
+            if "agent" in e and "reward" in e:
+                self._rewards[e["agent"]] = self._rewards.get(e["agent"], 0.0) + float(e["reward"])
+        record = self._ckpt.replay[self._step] if self._step < len(self._ckpt.replay) else None
+        if record is not None and not _same_step(record, self._logged, self._rewards):
+            # 重放结果与记录不一致（环境或代码已变）：丢弃之后的缓存，从这一步起实时运行
+            logger.warning("Replayed step %d diverged from checkpoint (rewards %s, recorded %s); continuing live",
+                           self._step, self._rewards, record["rewards"])
+            self._ckpt.discard_from(self._step)
+            record = None
+        if record is None:
+            self._ckpt.append(self._step, self._decisions, self._logged, dict(self._rewards))
+        self._step += 1
+        self._decisions = None
+
+    def _serialize(self, entries: List[Dict[str, Any]]) -> str:
+        # json.dump(list, indent=k) == 每个元素的 dumps 结果逐行缩进 k 个空格后以 ",\n" 连接
+        pad = " " * self._json_kwargs["indent"]
+        return ",\n".join(pad + json.dumps(e, **self._json_kwargs).replace("\n", "\n" + pad) for e in entries)
+
+    def write_log(self, game_log: List[Dict[str, Any]], path: str) -> None:
+        """Write game_log (including anything appended after the last log() call) as json.dump would."""
+        self.log(game_log)
+        body = ",\n".join(f.result() for f in self._chunks if f.result())
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("[\n" + body + "\n]" if body else "[]")
+        if self._capture is not None:
+            saved = self._capture.save(capture_path(path))
+            if saved:
+                logger.info("Saved raw step capture to %s", saved)
+        if self._ckpt is not None:
+            self._ckpt.remove()
+
+    def finish_video(self) -> Optional[str]:
+        """Flush queued frames and close the video; returns its path (None if nothing was rendered)."""
+        self.sync_env()
+        if self._io is not None:
+            self._submit(self._io, lambda: None).result()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        return self.video_path
+
+    def close(self) -> None:
+        """
+        Release the worker threads, the video writer and the checkpoint file; safe to call more than once.
+        Runners call it in a finally block: a video that finish_video() did not complete (the episode
+        raised) is closed and removed rather than left behind as a truncated but valid-looking file.
+        """
+        for f in self._pending:
+            f.cancel()
+        self._pending = []
+        for pool in (self._agents, self._io):
+            if pool is not None:
+                pool.shutdown(wait=True)
+        if self._ckpt is not None:
+            self._ckpt.close()
+        if self._writer is not None:
+            # finish_video() 未被调用：episode 异常中断，丢弃半截视频
+            try:
+                self._writer.close()
+            except Exception as exc:
+                logger.debug("Closing partial video %s failed: %s", self.video_path, exc)
+            self._writer = None
+            try:
+                os.remove(self.video_path)
+                logger.warning("Episode aborted; removed partial video %s", self.video_path)
+            except OSError:
+                pass
+            self.video_path = None
+
+
+def _same_step(record: Dict[str, Any], log_len: int, rewards: Dict[str, float]) -> bool:
+    recorded = record["rewards"]
+    return (record["log_len"] == log_len and recorded.keys() == rewards.keys()
+            and all(math.isclose(recorded[a], r, rel_tol=1e-9, abs_tol=1e-9) for a, r in rewards.items()))
+
+
+def _done(value: Any) -> Future:
+    f: Future = Future()
+    f.set_result(value)
+    return f
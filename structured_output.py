@@ -0,0 +1,98 @@
+"""
+Provider-native constrained output for action responses.
+
+Builds a JSON schema sized to the agent's action space (speaker 3, crypto 4,
+world_comm leader 9, reference 15, others 5) and translates it into each
+backend's structured-output option:
+
+- OpenAI protocol: response_format={"type": "json_schema", ...}; providers that
+  only support JSON mode get {"type": "json_object"} (mode="json_object")
+- Gemini:          generation_config response_mime_type + response_schema
+- Ollama:          format=<schema>
+- vLLM:            SamplingParams(guided_decoding=GuidedDecodingParams(json=schema))
+- transformers:    prefix_allowed_tokens_fn from lm-format-enforcer (optional dependency)
+
+With constrained output every response parses cleanly, so parse-failure
+retries (a full extra round trip each) disappear and outputs are shorter.
+"""
+
+import copy
+import json
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional
+
+STRUCTURED_MODES = ("json_schema", "json_object")
+
+
+@lru_cache(maxsize=None)
+def _action_schema_json(action_dim: int, with_notes: bool) -> str:
+    properties: Dict[str, Any] = {
+        "action": {
+            "type": "array",
+            "items": {"type": "number", "minimum": 0.0, "maximum": 1.0},
+            "minItems": action_dim,
+            "maxItems": action_dim,
+        },
+    }
+    if with_notes:
+        properties["notes"] = {"type": "string", "maxLength": 200}
+    return json.dumps({
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    })
+
+
+def action_schema(action_dim: int, with_notes: bool = True) -> Dict[str, Any]:
+    """JSON schema for {"action": [action_dim numbers in [0, 1]], "notes": "..."}."""
+    return json.loads(_action_schema_json(int(action_dim), with_notes))
+
+
+def openai_response_format(schema: Dict[str, Any], mode: str = "json_schema") -> Dict[str, Any]:
+    if mode == "json_object":
+        return {"type": "json_object"}
+    dim = schema["properties"]["action"]["maxItems"]
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": f"mpe_action_{dim}", "schema": schema, "strict": True},
+    }
+
+
+def gemini_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Gemini accepts an OpenAPI subset: drop additionalProperties / numeric bounds / maxLength."""
+    out = copy.deepcopy(schema)
+    out.pop("additionalProperties", None)
+    out["properties"]["action"]["items"] = {"type": "number"}
+    if "notes" in out["properties"]:
+        out["properties"]["notes"] = {"type": "string"}
+    return out
+
+
+def vllm_sampling_params(base, schema: Dict[str, Any], temperature: float, max_tokens: int):
+    """Copy of the engine's SamplingParams with JSON-schema guided decoding; None if this vLLM lacks it."""
+    try:
+        from vllm.sampling_params import GuidedDecodingParams
+    except ImportError:
+        return None
+    params = base.clone() if hasattr(base, "clone") else copy.deepcopy(base)
+    params.temperature = temperature
+    params.max_tokens = max_tokens
+    params.guided_decoding = GuidedDecodingParams(json=schema)
+    return params
+
+
+_PREFIX_FN_CACHE: Dict[Any, Callable] = {}
+
+
+def transformers_prefix_fn(tokenizer, schema: Dict[str, Any]) -> Optional[Callable]:
+    """prefix_allowed_tokens_fn for model.generate(); None when lm-format-enforcer is not installed."""
+    try:
+        from lmformatenforcer import JsonSchemaParser
+        from lmformatenforcer.integrations.transformers import build_transformers_prefix_allowed_tokens_fn
+    except ImportError:
+        return None
+    key = (id(tokenizer), json.dumps(schema, sort_keys=True))
+    if key not in _PREFIX_FN_CACHE:
+        _PREFIX_FN_CACHE[key] = build_transformers_prefix_allowed_tokens_fn(tokenizer, JsonSchemaParser(schema))
+    return _PREFIX_FN_CACHE[key]
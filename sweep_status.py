@@ -0,0 +1,333 @@
+"""
+Live progress / throughput status for long benchmark sweeps.
+
+The inference layer (APIInferencer.generate_action) and the scheduler
+(benchmark_runner.run_benchmark) report into the process-wide STATUS
+collector; a StatusReporter thread periodically rewrites a status JSON
+(atomic replace, safe to `watch cat` or poll from another process) and/or
+redraws a terminal dashboard.
+
+Reported per (model, env): episodes planned / done / failed / in flight.
+Reported per model and overall (sliding window, default 60 s):
+requests/s, tokens/s, p50/p95 LLM latency, error rate (failed attempts),
+retry rate (requests that needed >1 attempt), fallback rate (requests that
+exhausted retries), provider prompt-cache hit rate, and ETA.
+
+Usage:
+    from sweep_status import STATUS, StatusReporter
+    with StatusReporter(STATUS, path="results/status.json", dashboard=True):
+        run_benchmark(...)
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class _PairStats:
+    __slots__ = ("planned", "done", "failed", "in_flight", "reruns", "episode_s")
+
+    def __init__(self):
+        self.planned = 0
+        self.done = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.reruns = 0
+        self.episode_s: List[float] = []
+
+
+class SweepStatus:
+    """Thread-safe counters for one sweep; see module docstring."""
+
+    def __init__(self, window_s: float = 60.0, max_samples: int = 20000):
+        self.window_s = window_s
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started_at = time.time()
+            self._t0 = time.monotonic()
+            self._pairs: Dict[Tuple[str, str], _PairStats] = {}
+            # (t_end, model, latency_s, ok, attempts, prompt_tokens, completion_tokens, cached_tokens)
+            self._requests: Deque[tuple] = deque(maxlen=self.max_samples)
+            self._attempt_errors: Deque[Tuple[float, str]] = deque(maxlen=self.max_samples)
+            self._totals = {"requests": 0, "attempt_errors": 0, "fallbacks": 0, "tokens": 0}
+
+    # ---------------- scheduler side ----------------
+    def _pair(self, model: str, env: str) -> _PairStats:
+        key = (model, env)
+        if key not in self._pairs:
+            self._pairs[key] = _PairStats()
+        return self._pairs[key]
+
+    def plan(self, model: str, env: str, episodes: int) -> None:
+        """Declare how many episodes (model, env) will run (drives ETA). Idempotent per pair."""
+        with self._lock:
+            p = self._pair(model, env)
+            p.planned = max(p.planned, episodes)
+
+    def stop_early(self, model: str, env: str) -> None:
+        """Drop the pair's remaining planned episodes (adaptive runs that reached their CI target)."""
+        with self._lock:
+            p = self._pair(model, env)
+            p.planned = p.done + p.failed + p.in_flight
+
+    def episode_started(self, model: str, env: str) -> float:
+        with self._lock:
+            self._pair(model, env).in_flight += 1
+        return time.monotonic()
+
+    def episode_finished(self, model: str, env: str, started: float, ok: bool = True, rerun: bool = False) -> None:
+        """rerun=True: this attempt is discarded and the same planned episode runs again (not done / failed)."""
+        with self._lock:
+            p = self._pair(model, env)
+            p.in_flight = max(0, p.in_flight - 1)
+            if rerun:
+                p.reruns += 1
+            elif ok:
+                p.done += 1
+                p.episode_s.append(time.monotonic() - started)
+            else:
+                p.failed += 1
+
+    # ---------------- inference side ----------------
+    def record_attempt_error(self, model: str) -> None:
+        with self._lock:
+            self._attempt_errors.append((time.monotonic(), model))
+            self._totals["attempt_errors"] += 1
+
+    def record_request(
+        self,
+        model: str,
+        latency_s: float,
+        ok: bool,
+        attempts: int = 1,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cached_tokens: int = 0,
+    ) -> None:
+        """One generate_action call (all attempts); latency_s is the final attempt's wall time."""
+        with self._lock:
+            self._requests.append((time.monotonic(), model, latency_s, ok, attempts,
+                                   prompt_tokens, completion_tokens, cached_tokens))
+            self._totals["requests"] += 1
+            self._totals["tokens"] += prompt_tokens + completion_tokens
+            if not ok:
+                self._totals["fallbacks"] += 1
+
+    # ---------------- reporting ----------------
+    @staticmethod
+    def _request_stats(rows: List[tuple], errors: int, span_s: float) -> Dict[str, Any]:
+        n = len(rows)
+        if n == 0:
+            return {"requests": 0, "req_per_s": 0.0, "tokens_per_s": 0.0, "latency_p50_s": None,
+                    "latency_p95_s": None, "error_rate": 0.0 if not errors else 1.0, "retry_rate": 0.0,
+                    "fallback_rate": 0.0, "cache_hit_rate": None}
+        lat = np.fromiter((r[2] for r in rows), dtype=np.float64, count=n)
+        attempts = sum(r[4] for r in rows)
+        prompt = sum(r[5] for r in rows)
+        completion = sum(r[6] for r in rows)
+        cached = sum(r[7] for r in rows)
+        span_s = max(span_s, 1e-6)
+        p50, p95 = np.percentile(lat, [50, 95])
+        return {
+            "requests": n,
+            "req_per_s": round(n / span_s, 3),
+            "tokens_per_s": round((prompt + completion) / span_s, 1),
+            "latency_p50_s": round(float(p50), 4),
+            "latency_p95_s": round(float(p95), 4),
+            "error_rate": round(errors / max(attempts, errors, 1), 4),
+            "retry_rate": round(sum(1 for r in rows if r[4] > 1) / n, 4),
+            "fallback_rate": round(sum(1 for r in rows if not r[3]) / n, 4),
+            "cache_hit_rate": round(cached / prompt, 4) if prompt else None,
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            cutoff = now - self.window_s
+            rows = [r for r in self._requests if r[0] >= cutoff]
+            errs = [e for e in self._attempt_errors if e[0] >= cutoff]
+            pairs = {k: (v.planned, v.done, v.failed, v.in_flight, v.reruns, list(v.episode_s))
+                     for k, v in self._pairs.items()}
+            totals = dict(self._totals)
+        elapsed = now - self._t0
+        span = min(self.window_s, elapsed)
+
+        models = sorted({r[1] for r in rows} | {e[1] for e in errs})
+        per_model = {
+            m: self._request_stats([r for r in rows if r[1] == m], sum(1 for e in errs if e[1] == m), span)
+            for m in models
+        }
+
+        pair_rows = []
+        planned = done = failed = in_flight = reruns = 0
+        ep_times: List[float] = []
+        for (model, env), (p_planned, p_done, p_failed, p_in, p_reruns, p_times) in sorted(pairs.items()):
+            pair_rows.append({
+                "model": model, "env": env, "planned": p_planned, "done": p_done,
+                "failed": p_failed, "in_flight": p_in, "reruns": p_reruns,
+                "episode_s_mean": round(sum(p_times) / len(p_times), 2) if p_times else None,
+            })
+            planned += p_planned
+            done += p_done
+            failed += p_failed
+            in_flight += p_in
+            reruns += p_reruns
+            ep_times.extend(p_times)
+
+        # ETA: remaining episodes at the observed completion rate (covers any concurrency level)
+        finished = done + failed
+        remaining = max(planned - finished, 0)
+        eta_s = round(remaining * elapsed / finished, 1) if finished and planned else None
+
+        return {
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "elapsed_s": round(elapsed, 1),
+            "window_s": self.window_s,
+            "episodes": {"planned": planned, "done": done, "failed": failed,
+                         "in_flight": in_flight, "reruns": reruns, "remaining": remaining, "eta_s": eta_s},
+            "pairs": pair_rows,
+            "llm": self._request_stats(rows, len(errs), span),
+            "llm_by_model": per_model,
+            "totals": totals,
+        }
+
+
+def _fmt(x: Any, spec: str = "", none: str = "-") -> str:
+    return none if x is None else format(x, spec)
+
+
+def _fmt_eta(s: Optional[float]) -> str:
+    if s is None:
+        return "-"
+    s = int(s)
+    return f"{s // 3600}h{s % 3600 // 60:02d}m" if s >= 3600 else f"{s // 60}m{s % 60:02d}s"
+
+
+def render_dashboard(snap: Dict[str, Any]) -> str:
+    """Plain-text dashboard for one snapshot."""
+    ep = snap["episodes"]
+    llm = snap["llm"]
+    lines = [
+        f"MPE sweep  elapsed {_fmt_eta(snap['elapsed_s'])}  "
+        f"episodes {ep['done']}/{ep['planned']} (failed {ep['failed']}, in flight {ep['in_flight']})  "
+        f"ETA {_fmt_eta(ep['eta_s'])}",
+        f"LLM ({snap['window_s']:.0f}s window)  {llm['req_per_s']:.2f} req/s  {llm['tokens_per_s']:.0f} tok/s  "
+        f"p50 {_fmt(llm['latency_p50_s'], '.2f')}s  p95 {_fmt(llm['latency_p95_s'], '.2f')}s  "
+        f"err {llm['error_rate']:.1%}  retry {llm['retry_rate']:.1%}  fallback {llm['fallback_rate']:.1%}  "
+        f"cache {_fmt(llm['cache_hit_rate'], '.1%')}",
+        "",
+        f"{'model':<24} {'env':<18} {'done':>9} {'fail':>5} {'run':>4} {'ep_s':>7}",
+    ]
+    for r in snap["pairs"]:
+        lines.append(
+            f"{r['model'][:24]:<24} {r['env'][:18]:<18} {str(r['done']) + '/' + str(r['planned']):>9} "
+            f"{r['failed']:>5} {r['in_flight']:>4} {_fmt(r['episode_s_mean'], '.1f'):>7}"
+        )
+    if len(snap["llm_by_model"]) > 1:
+        lines.append("")
+        for m, s in snap["llm_by_model"].items():
+            lines.append(
+                f"{m[:24]:<24} {s['req_per_s']:.2f} req/s  p50 {_fmt(s['latency_p50_s'], '.2f')}s  "
+                f"p95 {_fmt(s['latency_p95_s'], '.2f')}s  err {s['error_rate']:.1%}"
+            )
+    return "\n".join(lines)
+
+
+class StatusReporter:
+    """
+    Background thread: every `interval_s` rewrite `path` (JSON) and/or redraw
+    the dashboard on `stream` (stderr by default, so it does not mix with
+    stdout logs). Use as a context manager; a final snapshot is written on exit.
+    """
+
+    def __init__(
+        self,
+        status: "SweepStatus",
+        path: Optional[str] = None,
+        interval_s: float = 2.0,
+        dashboard: bool = False,
+        stream=None,
+    ):
+        self.status = status
+        self.path = path
+        self.interval_s = interval_s
+        self.dashboard = dashboard
+        self.stream = stream or sys.stderr
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def write_once(self) -> Dict[str, Any]:
+        snap = self.status.snapshot()
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(snap, f, indent=2, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        if self.dashboard:
+            text = render_dashboard(snap)
+            if getattr(self.stream, "isatty", lambda: False)():
+                text = "\x1b[H\x1b[2J" + text  # redraw in place
+            self.stream.write(text + "\n")
+            self.stream.flush()
+        return snap
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.write_once()
+            except Exception as e:  # never take the sweep down for a status write
+                sys.stderr.write(f"[status] write failed: {e}\n")
+
+    def start(self) -> "StatusReporter":
+        if self._thread is None and (self.path or self.dashboard):
+            self._thread = threading.Thread(target=self._loop, name="sweep-status", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval_s + 1)
+            self._thread = None
+            self.write_once()
+
+    def __enter__(self) -> "StatusReporter":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+# Process-wide collector fed by utils_api and benchmark_runner
+STATUS = SweepStatus()
+
+
+if __name__ == "__main__":
+    # Render a status JSON written by another process: python sweep_status.py results/status.json
+    import argparse
+
+    p = argparse.ArgumentParser(description="Show a sweep status JSON as a live dashboard.")
+    p.add_argument("path")
+    p.add_argument("--interval", type=float, default=2.0)
+    args = p.parse_args()
+    try:
+        while True:
+            with open(args.path, encoding="utf-8") as f:
+                snap = json.load(f)
+            sys.stdout.write("\x1b[H\x1b[2J" + render_dashboard(snap) + "\n")
+            sys.stdout.flush()
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
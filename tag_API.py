@@ -1,5 +1,5 @@
+import logging
 import numpy as np
-import imageio
 import json
 from typing import Dict, Any
 
@@ -13,6 +13,11 @@ from prompt.prompt_for_tag import (
     get_task_and_reward,
 )
 from obs.parse_tag_obs import parse_tag_obs
+from obs.encode_obs import count_tokens, encode_obs, row_layout
+from log_utils import get_logger
+from step_pipeline import StepPipeline
+
+logger = get_logger("tag")
 
 # 2. 导入 Tag 环境
 try:
@@ -36,7 +41,7 @@ NUM_ADV = 3         # 捕食者数量
 NUM_OBS = 2         # 障碍物数量
 MAX_STEPS = 30      # 追逐通常需要长一点时间
 
-def _format_current_obs(obs_struct: Dict[str, Any], is_predator: bool, num_obstacles: int) -> str:
+def _format_current_obs(obs_struct: Dict[str, Any], is_predator: bool, num_obstacles: int, obs_format: str = "verbose") -> str:
     obs_semantics = (
         "OBSERVATION SEMANTICS:\n"
         f"- obs = [self_vel, self_pos, obstacles_rel({num_obstacles}), other_agents...]\n"
@@ -46,7 +51,13 @@ def _format_current_obs(obs_struct: Dict[str, Any], is_predator: bool, num_obsta
         obs_semantics += "- other_agents: LAST item is the PREY (target); others are PREDATOR teammates.\n\n"
     else:
         obs_semantics += "- other_agents: All items are PREDATORS (threats).\n\n"
-    
+
+    if obs_format != "verbose":
+        return (
+            obs_semantics +
+            f"CURRENT OBS ({obs_format}, rows = {row_layout(obs_format)}):\n"
+            f"{encode_obs(obs_struct, obs_format)}\n"
+        )
     return (
         obs_semantics +
         "CURRENT OBS (Structured):\n"
@@ -58,7 +69,14 @@ def _format_current_obs(obs_struct: Dict[str, Any], is_predator: bool, num_obsta
     )
 
 
-def user_prompt_tag(agent: str, step: int, obs: Dict[str, Any], is_predator: bool, num_obstacles: int) -> str:
+def user_prompt_tag(
+    agent: str,
+    step: int,
+    obs: Dict[str, Any],
+    is_predator: bool,
+    num_obstacles: int,
+    obs_format: str = "verbose",
+) -> str:
     role_name = "PREDATOR" if is_predator else "PREY"
     parts = [
         get_header("MPE_Simple_Tag_v3", agent, step, role_name),
@@ -66,7 +84,7 @@ def user_prompt_tag(agent: str, step: int, obs: Dict[str, Any], is_predator: boo
         get_physics_rules(),
         get_action_and_response_format(),
         get_navigation_hints(is_predator),
-        _format_current_obs(obs, is_predator, num_obstacles),
+        _format_current_obs(obs, is_predator, num_obstacles, obs_format),
     ]
     return "\n\n".join(parts)
 
@@ -80,15 +98,20 @@ def run_tag_game(provider: str, output_name: str, **kwargs):
     Args:
         provider: 模型提供商 ('qwen', 'deepseek', 'gpt', 'ollama', 'transformers', etc.)
         output_name: 输出文件名前缀
-        **kwargs: 传递给 get_api_engine 的额外参数
+        **kwargs: 传递给 get_api_engine 的额外参数（支持 seed / obs_format / pipeline 参数，
+                  pipeline=False 关闭渲染/决策/日志的流水线并发，见 step_pipeline.py）
     """
 
     
 
     # 初始化 API
     seed = kwargs.pop('seed', None)
+    obs_format = kwargs.pop('obs_format', 'verbose')
+    pipeline = kwargs.pop('pipeline', True)
+    checkpoint = kwargs.pop('checkpoint', False)
+    capture = kwargs.pop('capture', None)
     llm_engine = get_api_engine(provider, **kwargs)
-    print(f"Initializing Tag Env (Prey={NUM_GOOD}, Pred={NUM_ADV})...")
+    logger.info("Initializing Tag Env (Prey=%d, Pred=%d)...", NUM_GOOD, NUM_ADV)
     env = simple_tag_v3.parallel_env(
         num_good=NUM_GOOD, 
         num_adversaries=NUM_ADV, 
@@ -99,106 +122,128 @@ def run_tag_game(provider: str, output_name: str, **kwargs):
     )
     
     observations, infos = env.reset(seed=seed) if seed is not None else env.reset()
-    frames = []
-    game_log = []
-    
-    # 记录总分 (Tag环境是零和博弈，分别记录)
-    total_reward_prey = 0.0
-    total_reward_pred = 0.0
-
-    for step in range(MAX_STEPS):
-        print(f"\n=== STEP {step} ===")
-        frame = env.render()
-        if frame is not None: frames.append(frame)
-        
-        actions = {}
-        step_records = {}
-
-        # --- 1. 决策循环 ---
-        for agent_id in env.agents:
-            obs_raw = observations[agent_id]
-            print(obs_raw)
-            is_predator = "adversary" in agent_id
-
-            # A. 解析观测
-            obs_struct = parse_tag_obs(obs_raw, agent_id, NUM_OBS, NUM_GOOD, NUM_ADV)
-            print(f"  Agent: {agent_id} | Role: {'PREDATOR' if is_predator else 'PREY'} | Obs: {obs_struct}")
-            # B. 生成 Prompt (核心差异点)
-            full_prompt = user_prompt_tag(agent_id, step, obs_struct, is_predator, NUM_OBS)
-            
-            # C. 调用 API
-            system_role = "You are a Hunter." if is_predator else "You are the Prey."
-            action_vec, raw_thought = llm_engine.generate_action(system_role, full_prompt)
-            
-            # D. 限幅 & 存储
-            action_vec = np.clip(action_vec, 0.0, 1.0)
-            actions[agent_id] = action_vec
-            
-            role_label = "[WOLF]" if is_predator else "[SHEEP]"
-            print(f"  {role_label} {agent_id} Action: {np.round(action_vec, 2)}")
-            
-            # E. 日志
-            step_records[agent_id] = {
-                "step": step,
-                "agent": agent_id,
-                "role": "predator" if is_predator else "prey",
-                "obs": obs_struct,
-                "thought": raw_thought,
-                "action": action_vec.tolist(),
-                "reward": 0.0
-            }
-
-        if not actions: break
-
-        # --- 2. 物理步进 ---
-        observations, rewards, terminations, truncations, infos = env.step(actions)
-        
-        # --- 3. 统计 ---
-        # 猎物和捕食者分开统计
-        step_r_prey = 0.0
-        step_r_pred = 0.0
-        
-        for aid, r in rewards.items():
-            if "agent" in aid: step_r_prey += r
-            if "adversary" in aid: step_r_pred += r # 这里简单累加所有捕食者得分
-            
-            # 回填日志
-            if aid in step_records:
-                step_records[aid]["reward"] = r
-                game_log.append(step_records[aid])
-
-        total_reward_prey += step_r_prey
-        # 捕食者通常共享奖励，取平均或者单个代表即可，这里累加看总势能
-        total_reward_pred += step_r_pred / NUM_ADV 
-        print(rewards)
-        print(f"  >> Reward: Prey={step_r_prey:.2f} (Tot:{total_reward_prey:.2f}) | Pred_Avg={step_r_pred/NUM_ADV:.2f}")
-
-        if all(terminations.values()) or all(truncations.values()):
-            print("Game Over.")
-            break
-
-    env.close()
-    
-    # Add final summary
-    all_rewards = {"prey": total_reward_prey, "predators": total_reward_pred}
-    mean_reward = (total_reward_prey + total_reward_pred) / 2.0
-    game_log.append({
-        "final_summary": True,
-        "total_rewards": all_rewards,
-        "mean_reward": float(mean_reward)
-    })
-    print(f"\nFINAL: Prey={total_reward_prey:.2f}, Pred={total_reward_pred:.2f}, Mean={mean_reward:.2f}")
-    
-    # 保存结果
-    if frames:
-        final_video = get_unique_filename(output_name + ".mp4")
-        print(f"Saving video to {final_video} ...")
-        imageio.mimsave(final_video, frames, fps=1)
-    
-    final_log = get_unique_filename(output_name + ".json")
-    print(f"Saving logs to {final_log} ...")
-    with open(final_log, "w", encoding="utf-8") as f:
-        json.dump(game_log, f, indent=4, ensure_ascii=False)
+    pipe = StepPipeline(llm_engine, output_name + ".mp4", fps=1, enabled=pipeline,
+                        checkpoint=checkpoint, seed=seed, capture=capture,
+                        json_kwargs={"indent": 4, "ensure_ascii": False})
+    try:
+        game_log = []
+
+        # 记录总分 (Tag环境是零和博弈，分别记录)
+        total_reward_prey = 0.0
+        total_reward_pred = 0.0
+        obs_tokens = []
+        prompt_tokens = []
+        debug_on = logger.isEnabledFor(logging.DEBUG)
+
+        for step in range(MAX_STEPS):
+            logger.debug("=== STEP %d ===", step)
+            pipe.render(env)
+
+            # --- 1. 决策循环 ---
+            def decide(agent_id):
+                obs_raw = observations[agent_id]
+                logger.debug("%s raw obs: %s", agent_id, obs_raw)
+                is_predator = "adversary" in agent_id
+
+                # A. 解析观测
+                obs_struct = parse_tag_obs(obs_raw, agent_id, NUM_OBS, NUM_GOOD, NUM_ADV)
+                logger.debug("  Agent: %s | Role: %s | Obs: %s", agent_id, "PREDATOR" if is_predator else "PREY", obs_struct)
+                # B. 生成 Prompt (核心差异点)
+                full_prompt = user_prompt_tag(agent_id, step, obs_struct, is_predator, NUM_OBS, obs_format)
+
+                # C. 调用 API
+                system_role = "You are a Hunter." if is_predator else "You are the Prey."
+                ctx = {"env": "tag", "seed": seed, "step": step, "agent": agent_id, "obs": obs_struct,
+                       "action_dim": env.action_space(agent_id).shape[0]}
+                action_vec, raw_thought = llm_engine.generate_action(system_role, full_prompt, context=ctx)
+
+                # D. 限幅 & 存储
+                action_vec = np.clip(action_vec, 0.0, 1.0)
+
+                if debug_on:
+                    role_label = "[WOLF]" if is_predator else "[SHEEP]"
+                    logger.debug("  %s %s Action: %s", role_label, agent_id, np.round(action_vec, 2))
+
+                # E. 日志
+                record = {
+                    "step": step,
+                    "agent": agent_id,
+                    "role": "predator" if is_predator else "prey",
+                    "obs": obs_struct,
+                    "thought": raw_thought,
+                    "action": action_vec.tolist(),
+                    "reward": 0.0,
+                    "obs_tokens": count_tokens(_format_current_obs(obs_struct, is_predator, NUM_OBS, obs_format)),
+                    "llm": llm_engine.last_call_info(),
+                }
+                return record, action_vec, count_tokens(full_prompt)
+
+            decisions = pipe.decide(env.agents, decide)
+            step_records = {aid: d[0] for aid, d in decisions.items()}
+            actions = {aid: d[1] for aid, d in decisions.items()}
+            obs_tokens.extend(d[0]["obs_tokens"] for d in decisions.values())
+            prompt_tokens.extend(d[2] for d in decisions.values())
+
+            if not actions: break
+
+            # --- 2. 物理步进 ---
+            pipe.sync_env()
+            observations, rewards, terminations, truncations, infos = env.step(actions)
+
+            # --- 3. 统计 ---
+            # 猎物和捕食者分开统计
+            step_r_prey = 0.0
+            step_r_pred = 0.0
+
+            for aid, r in rewards.items():
+                if "agent" in aid: step_r_prey += r
+                if "adversary" in aid: step_r_pred += r # 这里简单累加所有捕食者得分
+
+                # 回填日志
+                if aid in step_records:
+                    step_records[aid]["reward"] = r
+                    game_log.append(step_records[aid])
+
+            total_reward_prey += step_r_prey
+            # 捕食者通常共享奖励，取平均或者单个代表即可，这里累加看总势能
+            total_reward_pred += step_r_pred / NUM_ADV 
+            logger.debug(
+                "  >> Reward: Prey=%.2f (Tot:%.2f) | Pred_Avg=%.2f | %s",
+                step_r_prey, total_reward_prey, step_r_pred / NUM_ADV, rewards,
+            )
+
+            pipe.log(game_log)
+            if all(terminations.values()) or all(truncations.values()):
+                logger.debug("Game Over.")
+                break
+
+        # Add final summary
+        all_rewards = {"prey": total_reward_prey, "predators": total_reward_pred}
+        mean_reward = (total_reward_prey + total_reward_pred) / 2.0
+        game_log.append({
+            "final_summary": True,
+            "env": "tag",
+            "seed": seed,
+            "total_rewards": all_rewards,
+            "mean_reward": float(mean_reward),
+            "obs_format": obs_format,
+            "obs_tokens_mean": float(np.mean(obs_tokens)) if obs_tokens else 0.0,
+            "prompt_tokens_mean": float(np.mean(prompt_tokens)) if prompt_tokens else 0.0,
+            "circuit": llm_engine.circuit_summary(),
+        })
+        logger.info("FINAL: Prey=%.2f, Pred=%.2f, Mean=%.2f", total_reward_prey, total_reward_pred, mean_reward)
+
+        # 保存结果
+        final_video = pipe.finish_video()
+        if final_video:
+            logger.info("Saved video to %s", final_video)
+
+        final_log = get_unique_filename(output_name + ".json")
+        logger.info("Saving logs to %s ...", final_log)
+        pipe.write_log(game_log, final_log)
+    finally:
+        pipe.close()
+        env.close()
 
 # ============================================================================== 
 # 3. 运行入口
@@ -0,0 +1,111 @@
+"""
+Per-game / per-role generation budgets and the reasoning-effort knob.
+
+Every action is a short JSON object ({"action": [...], "notes": "..."}), yet
+generate_action used to cap every call at 4096 tokens. TokenBudget resolves
+max_tokens from the call context (env, agent role, action_dim) instead:
+
+    token_budget=None     legacy fixed cap (4096, or max_tokens when given)
+    token_budget="auto"   DEFAULT_TOKEN_BUDGETS
+    token_budget={...}    overrides merged over the defaults, e.g.
+                          {"crypto": {"eve": 512}, "simple": 256}
+
+reasoning_effort ("none" | "low" | "medium" | "high") scales the reasoning
+part of the budget (none: answer only, low x0.5, medium x1, high x2) and is
+forwarded to each backend's own thinking control (see APIInferencer).
+The answer itself is never cut: budgets are floored at answer_tokens(dim).
+"""
+
+import re
+from typing import Any, Dict, Optional, Union
+
+REASONING_EFFORTS = ("none", "low", "medium", "high")
+LEGACY_MAX_TOKENS = 4096
+
+# 每个游戏/角色的默认预算（medium 档位，含推理 + 回答）。角色 = agent id 去掉 "_<n>" 后缀
+DEFAULT_TOKEN_BUDGETS: Dict[str, Union[int, Dict[str, int]]] = {
+    "simple": 512,
+    "spread": 1536,
+    "adversary": {"adversary": 1024, "agent": 1536},
+    "tag": {"adversary": 1536, "agent": 1024},
+    "push": {"adversary": 1024, "agent": 1024},
+    "crypto": {"alice": 1024, "bob": 1024, "eve": 768},
+    "reference": 1024,
+    "speaker_listener": {"speaker": 384, "listener": 768},
+    "world_comm": {"leadadversary": 2048, "adversary": 1536, "agent": 1536},
+    "default": 1024,
+}
+
+EFFORT_SCALE = {"none": 0.0, "low": 0.5, "medium": 1.0, "high": 2.0}
+_ROLE_RE = re.compile(r"_\d+$")
+
+
+def role_of(agent: Optional[str]) -> str:
+    """'leadadversary_0' -> 'leadadversary'"""
+    return _ROLE_RE.sub("", agent or "")
+
+
+def answer_tokens(action_dim: Optional[int]) -> int:
+    """Room for the JSON answer alone: ~8 tokens per number plus a 200-char notes field."""
+    return 96 + 8 * int(action_dim or 5)
+
+
+def _merge(overrides: Dict[str, Any]) -> Dict[str, Any]:
+    merged = {k: (dict(v) if isinstance(v, dict) else v) for k, v in DEFAULT_TOKEN_BUDGETS.items()}
+    for env, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(env), dict):
+            merged[env].update(value)
+        else:
+            merged[env] = value
+    return merged
+
+
+class TokenBudget:
+    """Resolves max_tokens for one generate_action call from its context."""
+
+    def __init__(
+        self,
+        budgets: Union[None, str, Dict[str, Any]] = None,
+        max_tokens: Optional[int] = None,
+        reasoning_effort: Optional[str] = None,
+    ):
+        if reasoning_effort is not None and reasoning_effort not in REASONING_EFFORTS:
+            raise ValueError(f"reasoning_effort must be one of {REASONING_EFFORTS}, got {reasoning_effort!r}")
+        if budgets is not None and budgets != "auto" and not isinstance(budgets, dict):
+            raise ValueError(f"token_budget must be None, 'auto' or a dict, got {budgets!r}")
+        self.table = None if budgets is None else _merge({} if budgets == "auto" else budgets)
+        self.max_tokens = int(max_tokens) if max_tokens is not None else None
+        self.reasoning_effort = reasoning_effort
+
+    def base(self, env: Optional[str], agent: Optional[str]) -> int:
+        entry = self.table.get(env or "", self.table["default"])
+        if isinstance(entry, dict):
+            entry = entry.get(role_of(agent), entry.get("default", self.table["default"]))
+        return int(entry)
+
+    def resolve(self, context: Optional[Dict[str, Any]] = None) -> int:
+        if self.max_tokens is not None:
+            return self.max_tokens
+        if self.table is None:
+            return LEGACY_MAX_TOKENS
+        ctx = context or {}
+        floor = answer_tokens(ctx.get("action_dim"))
+        scale = EFFORT_SCALE[self.reasoning_effort or "medium"]
+        reasoning = (self.base(ctx.get("env"), ctx.get("agent")) - floor) * scale
+        return floor + max(0, int(reasoning))
+
+
+def openai_reasoning_kwargs(provider: str, effort: Optional[str], thinking_budget: int) -> Dict[str, Any]:
+    """
+    Request options for OpenAI-protocol providers:
+    Qwen (DashScope) takes enable_thinking / thinking_budget via extra_body,
+    OpenAI and most compatible servers take reasoning_effort.
+    """
+    if effort is None:
+        return {}
+    if provider == "qwen":
+        body: Dict[str, Any] = {"enable_thinking": effort != "none"}
+        if effort != "none":
+            body["thinking_budget"] = max(1, thinking_budget)
+        return {"extra_body": body}
+    return {"reasoning_effort": effort}
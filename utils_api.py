@@ -2,8 +2,21 @@ import os
 import re
 import json
 import time
+import threading
 import numpy as np
-from typing import Tuple, Optional, Dict, Any
+from typing import Tuple, Optional, Dict, Any, List
+
+from log_utils import get_logger
+from obs.encode_obs import count_tokens
+from sweep_status import STATUS
+import metrics_exporter as metrics
+from llm_qos import OUTCOME_CLEAN, OUTCOME_DEFAULT, OUTCOME_REGEX, OUTCOME_TRANSPORT
+import structured_output as so
+from token_budget import TokenBudget, answer_tokens, openai_reasoning_kwargs
+from hedging import get_hedger
+from circuit_breaker import CircuitOpenError, get_breaker
+
+logger = get_logger("api")
 
 # 自动加载 .env 文件中的环境变量
 try:
@@ -19,7 +32,7 @@ try:
     from openai import OpenAI
     import google.generativeai as genai
 except ImportError:
-    print("Warning: API libraries (openai, google-generativeai) not installed.")
+    logger.warning("API libraries (openai, google-generativeai) not installed.")
 
 # 本地模型依赖（可选）
 try:
@@ -35,6 +48,13 @@ try:
 except ImportError:
     OLLAMA_AVAILABLE = False
 
+# orjson（可选）解析更快；两者的解析错误都是 ValueError 子类
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 # ==============================================================================
 # 2. 通用工具函数
 # ==============================================================================
@@ -54,6 +74,121 @@ def get_unique_filename(filepath):
             return new_filepath
         counter += 1
 
+_THINK_END = "</think>"
+_ACTION_KEY = '"action"'
+_ACTION_LIST_RE = re.compile(r'"action"\s*:\s*\[([^\[\]]*)\]')
+_NUMBER_RE = re.compile(r"[-+]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?")
+_JSON_TOKEN_RE = re.compile(r'[{}"\\]')
+_MAX_OBJECT_PROBES = 16
+DEFAULT_ACTION_DIM = 5
+
+
+def _match_brace(text: str, open_idx: int) -> int:
+    """text[open_idx] == '{'：返回与之配对的 '}' 下标（跳过字符串内的括号与转义），不平衡时返回 -1"""
+    depth = 0
+    in_str = False
+    escaped_at = -1
+    for m in _JSON_TOKEN_RE.finditer(text, open_idx):
+        i = m.start()
+        if i == escaped_at:
+            continue
+        c = text[i]
+        if in_str:
+            if c == "\\":
+                escaped_at = i + 1
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = True
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+
+def _fit_width(vec: np.ndarray, action_dim: Optional[int]) -> np.ndarray:
+    if action_dim is None or vec.shape[0] == action_dim:
+        return vec
+    if vec.shape[0] > action_dim:
+        return vec[:action_dim]
+    return np.concatenate([vec, np.zeros(action_dim - vec.shape[0], dtype=np.float32)])
+
+
+def _action_from(data: Any) -> Optional[np.ndarray]:
+    if isinstance(data, dict):
+        action = data.get("action")
+        # 只接受有限实数：null / true / "0.5" 会被 asarray 转成 NaN / 1 / 0.5 并以 clean 标签进入 env.step
+        if isinstance(action, list) and action and all(
+                isinstance(x, (int, float)) and not isinstance(x, bool) for x in action):
+            vec = np.asarray(action, dtype=np.float32)
+            if np.isfinite(vec).all():
+                return vec
+    return None
+
+
+def extract_action(text: str, action_dim: Optional[int] = None) -> Tuple[np.ndarray, str]:
+    """
+    从模型回复中提取动作向量，返回 (action_vec, outcome)。
+
+    只看最后一个 </think> 之后的部分；从末尾向前找 "action" 键，取包含它的最内层平衡 JSON 对象
+    （支持嵌套对象与 Markdown 代码块），失败时在同一位置用正则读取数字列表，都失败则返回零动作。
+    action_dim 给定时补零/截断到该宽度（speaker 3, crypto 4, world_comm leader 9 ...），否则保持模型输出的宽度。
+
+    outcome: clean | regex_fallback | default_zeros（见 llm_qos.py）
+    """
+    text = text or ""
+    start = text.rfind(_THINK_END)
+    start = start + len(_THINK_END) if start != -1 else 0
+
+    # 快速路径：回复主体就是一个 JSON 对象（可带代码块/前置说明）时一次解析完成
+    first_open = text.find("{", start)
+    last_close = text.rfind("}")
+    if start <= first_open < last_close:
+        try:
+            vec = _action_from(_json_loads(text[first_open:last_close + 1]))
+        except ValueError:
+            vec = None
+        if vec is not None:
+            return _fit_width(vec, action_dim), OUTCOME_CLEAN
+
+    probes = 0
+    key = text.rfind(_ACTION_KEY, start)
+    last_key = key
+    while key != -1 and probes < _MAX_OBJECT_PROBES:
+        open_idx = text.rfind("{", start, key)
+        while open_idx != -1 and probes < _MAX_OBJECT_PROBES:
+            probes += 1
+            close_idx = _match_brace(text, open_idx)
+            if close_idx == -1:
+                break  # 截断的输出：外层对象同样不平衡
+            if close_idx > key:
+                try:
+                    vec = _action_from(_json_loads(text[open_idx:close_idx + 1]))
+                except ValueError:
+                    vec = None
+                if vec is not None:
+                    return _fit_width(vec, action_dim), OUTCOME_CLEAN
+            open_idx = text.rfind("{", start, open_idx)
+        key = text.rfind(_ACTION_KEY, start, key)
+
+    # 兜底：在最后一个 "action" 键处直接读取数字列表（JSON 不完整/不合法时）
+    key = last_key
+    while key != -1:
+        m = _ACTION_LIST_RE.match(text, key)
+        if m:
+            nums = _NUMBER_RE.findall(m.group(1))
+            if nums:
+                vec = np.array([float(x) for x in nums], dtype=np.float32)
+                if np.isfinite(vec).all():  # 1e999 等溢出 float32 的数值
+                    return _fit_width(vec, action_dim), OUTCOME_REGEX
+        key = text.rfind(_ACTION_KEY, start, key)
+
+    return np.zeros(action_dim or DEFAULT_ACTION_DIM, dtype=np.float32), OUTCOME_DEFAULT
+
+
 # ==============================================================================
 # 3. 统一推理引擎 (支持远程API和本地模型)
 # ==============================================================================
@@ -62,6 +197,7 @@ class APIInferencer:
     统一的模型推理接口，支持：
     - 远程API: OpenAI协议 (DeepSeek, Qwen, GPT), Gemini
     - 本地模型: transformers, ollama, vllm
+    - 离线后端: mock (脚本/随机动作 + 延迟/错误注入), replay (回放历史日志), heuristic (规则策略基线)
     """
     def __init__(
         self,
@@ -71,22 +207,63 @@ class APIInferencer:
         base_url: Optional[str] = None,
         model_path: Optional[str] = None,
         device: str = "auto",
+        retry_delay: float = 1.0,
+        stream: bool = False,
+        structured_output: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        token_budget: Any = None,
+        reasoning_effort: Optional[str] = None,
+        hedge: Any = None,
+        circuit_breaker: Any = None,
+        failover: Any = None,
         **kwargs
     ):
+        """
+        structured_output: None（自由文本 + 解析）| "json_schema"（按 action_dim 约束输出，见 structured_output.py）
+                           | "json_object"（仅 OpenAI 协议 JSON mode，供不支持 json_schema 的服务使用）
+        max_tokens: 所有调用的固定生成上限（覆盖 token_budget）
+        token_budget: None（固定 4096）| "auto" | {env: int 或 {role: int}}，按游戏/角色决定 max_tokens（见 token_budget.py）
+        reasoning_effort: None | "none" | "low" | "medium" | "high"，缩放推理预算并转为各后端的思考开关
+        hedge: None | True | {quantile, budget, min_samples, ...}，OpenAI 协议调用超过滚动 p95 延迟时发送副本请求（见 hedging.py）
+        circuit_breaker: None | True | {failure_threshold, cooldown_s}，远程 API 按 (provider, base_url) 熔断（见 circuit_breaker.py）
+        failover: None | provider 名 | get_api_engine 的参数字典（含 "provider"），熔断打开时改用的备用引擎；
+                  未配置时熔断打开直接抛出 CircuitOpenError，使该局快速失败
+        """
+        if structured_output is True:
+            structured_output = "json_schema"
+        if structured_output and structured_output not in so.STRUCTURED_MODES:
+            raise ValueError(f"structured_output must be one of {so.STRUCTURED_MODES}, got {structured_output!r}")
         self.provider = provider.lower()
         self.model_name = model_name
         self.api_key = api_key
         self.device = device
+        self.retry_delay = retry_delay
+        self.stream = stream
+        self.structured_output = structured_output or None
+        self.budget = TokenBudget(token_budget, max_tokens, reasoning_effort)
+        self.reasoning_effort = reasoning_effort
+        self._warned_effort = False
+        self._warned_unconstrained = False
+        self.hedger = None
+        self.breaker = None
+        self.failover = failover
+        self._failover_engine = None
+        self._circuit_counts = {"rejected_calls": 0, "failover_calls": 0}
+        self._created_at = time.time()
         self.client = None
         self.tokenizer = None
         self.model = None
+        self._usage_local = threading.local()  # 每线程记录最近一次调用的 usage (供 sweep_status 统计)
+        self._call_local = threading.local()   # 每线程记录最近一次 generate_action 的结果标签 (见 last_call_info)
         
-        print(f"Loading Model: {provider} -> {model_name}...")
-        print(f"DEBUG: api_key = {api_key[:20] + '...' if api_key else 'None'}")
+        logger.info("Loading Model: %s -> %s...", provider, model_name)
+        logger.debug("api_key = %s", api_key[:8] + "..." if api_key else "None")
         
         # 远程 API 服务
         if self.provider in ["openai", "deepseek", "qwen", "gpt", "chatgpt"]:
-            self._init_openai_api(base_url)
+            self._init_openai_api(base_url, **kwargs)
+            if hedge:
+                self.hedger = get_hedger((self.provider, str(base_url), model_name), **({} if hedge is True else hedge))
         
         elif self.provider == "gemini":
             self._init_gemini_api()
@@ -101,14 +278,39 @@ class APIInferencer:
         elif self.provider == "vllm":
             self._init_vllm(model_path or model_name, **kwargs)
         
+        # 离线后端（无网络、无权重）
+        elif self.provider == "mock":
+            self._init_mock(**kwargs)
+        
+        elif self.provider == "replay":
+            self._init_replay(**kwargs)
+        
+        elif self.provider == "heuristic":
+            self._init_heuristic(**kwargs)
+        
         else:
             raise ValueError(f"Unsupported provider: {provider}")
         
-        print("Model initialized successfully.")
+        if circuit_breaker and self.provider in ["openai", "deepseek", "qwen", "gpt", "chatgpt", "gemini"]:
+            self.breaker = get_breaker((self.provider, str(base_url or "")),
+                                       **({} if circuit_breaker is True else circuit_breaker))
+        elif circuit_breaker:
+            logger.warning("circuit_breaker is only used for remote API providers; ignored for %s", self.provider)
+        if hedge and self.hedger is None:
+            logger.warning("hedge is only supported for OpenAI-protocol providers; ignored for %s", self.provider)
+        logger.info("Model initialized successfully.")
     
-    def _init_openai_api(self, base_url: Optional[str]):
-        """初始化 OpenAI 协议的 API"""
-        self.client = OpenAI(api_key=self.api_key, base_url=base_url)
+    def _init_openai_api(self, base_url: Optional[str], **kwargs):
+        """
+        初始化 OpenAI 协议的 API
+        可选: timeout (秒), client_max_retries (SDK 内部重试次数；压测时设为 0，只保留 generate_action 的重试)
+        """
+        client_kwargs = {"api_key": self.api_key, "base_url": base_url}
+        if kwargs.get("timeout") is not None:
+            client_kwargs["timeout"] = kwargs["timeout"]
+        if kwargs.get("client_max_retries") is not None:
+            client_kwargs["max_retries"] = kwargs["client_max_retries"]
+        self.client = OpenAI(**client_kwargs)
     
     def _init_gemini_api(self):
         """初始化 Gemini API"""
@@ -128,7 +330,7 @@ class APIInferencer:
             torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
             **kwargs
         )
-        print(f"  Device: {device_map}, Dtype: {self.model.dtype}")
+        logger.info("  Device: %s, Dtype: %s", device_map, self.model.dtype)
     
     def _init_ollama(self):
         """初始化 Ollama 本地服务"""
@@ -141,17 +343,35 @@ class APIInferencer:
         try:
             from vllm import LLM, SamplingParams
             self.client = LLM(model=model_path, **kwargs)
-            self.sampling_params = SamplingParams(temperature=0.5, max_tokens=4096)
+            self.sampling_params = SamplingParams(temperature=0.5, max_tokens=self.budget.resolve())
         except ImportError:
             raise ImportError("vllm not installed. Run: pip install vllm")
 
+    def _init_mock(self, **kwargs):
+        """初始化 Mock 后端（脚本/随机动作，可配置延迟分布与 错误/429 注入）"""
+        from mock_providers import MockBackend
+        self.client = MockBackend(**kwargs)
+
+    def _init_replay(self, **kwargs):
+        """初始化 Replay 后端（按 (env, seed, step, agent) 回放历史日志中的回复）"""
+        from mock_providers import ReplayBackend
+        if not kwargs.get("replay_dir"):
+            raise ValueError("replay provider requires replay_dir=<results directory>")
+        self.client = ReplayBackend(**kwargs)
+
+    def _init_heuristic(self, **kwargs):
+        """初始化规则策略后端（各游戏的启发式基线，需 context['obs'] 为解析后的观测）"""
+        from heuristic_policies import HeuristicBackend
+        self.client = HeuristicBackend(**kwargs)
+
     def generate_action(
         self,
         system_prompt: str,
         user_prompt_str: str,
         temperature: float = 0.5,
-        max_tokens: int = 4096,
-        max_retries: int = 10
+        max_tokens: Optional[int] = None,
+        max_retries: int = 10,
+        context: Optional[Dict[str, Any]] = None
     ) -> Tuple[np.ndarray, str]:
         """
         统一的推理接口，返回 (action_vec, response_text)
@@ -160,69 +380,332 @@ class APIInferencer:
             system_prompt: 系统提示词
             user_prompt_str: 用户提示词
             temperature: 采样温度
-            max_tokens: 最大生成token数
+            max_tokens: 最大生成token数（None: 由引擎的 max_tokens / token_budget / reasoning_effort 按 context 决定）
             max_retries: 最大重试次数
+            context: 本次调用所属的 {env, seed, step, agent, obs, action_dim}（replay/mock/heuristic 后端据此定位/复现/决策；
+                     action_dim 给定时返回的动作向量补零/截断到该宽度）
         
         Returns:
             (action_vec, response_text): 动作向量和完整回复
+
+        本次调用的结果标签 (clean / regex_fallback / default_zeros / transport_failure)、尝试次数、
+        延迟和重试浪费的时间可随后通过 last_call_info() 取得（见 llm_qos.py）。
         """
+        t_call = time.perf_counter()
+        action_dim = (context or {}).get("action_dim")
+        if max_tokens is None:
+            max_tokens = self.budget.resolve(context)
+        schema = so.action_schema(action_dim or DEFAULT_ACTION_DIM) if self.structured_output else None
         for attempt in range(max_retries):
+            if self.breaker is not None and not self.breaker.allow():
+                return self._circuit_open(system_prompt, user_prompt_str, temperature, max_tokens, max_retries, context)
+            t_attempt = time.perf_counter()
+            self._usage_local.usage = None
+            self._usage_local.truncated = None
+            self._usage_local.hedge = None
             try:
                 # 根据不同 provider 调用对应方法
-                if self.provider in ["openai", "deepseek", "qwen", "gpt", "chatgpt"]:
-                    response_text = self._call_openai_api(system_prompt, user_prompt_str, temperature, max_tokens)
+                if self.provider in ["openai", "deepseek", "qwen", "gpt", "chatgpt"] and self.hedger is not None:
+                    response_text = self._call_openai_hedged(system_prompt, user_prompt_str, temperature, max_tokens, schema)
+                
+                elif self.provider in ["openai", "deepseek", "qwen", "gpt", "chatgpt"]:
+                    response_text = self._call_openai_api(system_prompt, user_prompt_str, temperature, max_tokens, schema)
                 
                 elif self.provider == "gemini":
-                    response_text = self._call_gemini_api(system_prompt, user_prompt_str)
+                    response_text = self._call_gemini_api(system_prompt, user_prompt_str, temperature, max_tokens, schema)
                 
                 elif self.provider == "transformers":
-                    response_text = self._call_transformers(system_prompt, user_prompt_str, temperature, max_tokens)
+                    response_text = self._call_transformers(system_prompt, user_prompt_str, temperature, max_tokens, schema)
                 
                 elif self.provider == "ollama":
-                    response_text = self._call_ollama(system_prompt, user_prompt_str, temperature)
+                    response_text = self._call_ollama(system_prompt, user_prompt_str, temperature, max_tokens, schema)
                 
                 elif self.provider == "vllm":
-                    response_text = self._call_vllm(system_prompt, user_prompt_str, temperature, max_tokens)
+                    response_text = self._call_vllm(system_prompt, user_prompt_str, temperature, max_tokens, schema)
+                
+                elif self.provider in ["mock", "replay", "heuristic"]:
+                    response_text = self.client.complete(system_prompt, user_prompt_str, context)
                 
                 else:
                     raise ValueError(f"Unknown provider: {self.provider}")
                 
                 # 解析 JSON 并返回
-                action_vec = self._parse_json(response_text)
+                if self.breaker is not None:
+                    self.breaker.record_success()
+                action_vec, outcome = self._parse_action(response_text, action_dim)
+                latency_s = time.perf_counter() - t_attempt
+                tokens = self._record_request(latency_s, True, attempt + 1, system_prompt, user_prompt_str, response_text)
+                self._set_call_info(outcome, attempt + 1, latency_s, t_attempt - t_call, max_tokens, tokens)
                 return action_vec, response_text
 
             except Exception as e:
-                print(f"[Inference Error - Attempt {attempt+1}/{max_retries}] {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(1)
+                if self.breaker is not None:
+                    self.breaker.record_failure()
+                STATUS.record_attempt_error(self.model_name)
+                metrics.LLM_FAILURES.inc(provider=self.provider, model=self.model_name, error=type(e).__name__)
+                logger.warning(
+                    "Inference error (%s)", type(e).__name__,
+                    extra={"data": {"attempt": f"{attempt+1}/{max_retries}", "error": str(e)[:200]}},
+                )
+                # 确定性错误（如 replay 缺少记录）重试无意义，直接返回兜底动作
+                retryable = getattr(e, "retryable", True)
+                if retryable and attempt < max_retries - 1:
+                    time.sleep(self.retry_delay)
                 else:
-                    return np.array([0,0,0,0,0], dtype=np.float32), f"Failed: {str(e)}"
-    
-    def _call_openai_api(self, system_prompt: str, user_prompt: str, temperature: float, max_tokens: int) -> str:
-        """调用 OpenAI 协议 API"""
-        completion = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
+                    latency_s = time.perf_counter() - t_attempt
+                    tokens = self._record_request(latency_s, False, attempt + 1, system_prompt, user_prompt_str, "")
+                    self._set_call_info(OUTCOME_TRANSPORT, attempt + 1, latency_s, time.perf_counter() - t_call,
+                                        max_tokens, tokens)
+                    return np.zeros(action_dim or DEFAULT_ACTION_DIM, dtype=np.float32), f"Failed: {str(e)}"
+
+    def _circuit_open(self, system_prompt: str, user_prompt_str: str, temperature: float, max_tokens: int,
+                      max_retries: int, context: Optional[Dict[str, Any]]) -> Tuple[np.ndarray, str]:
+        """熔断打开：转给备用引擎，未配置备用时抛出 CircuitOpenError"""
+        self._circuit_counts["rejected_calls"] += 1
+        if self.failover is None:
+            raise CircuitOpenError(f"circuit open for {self.provider} {self.breaker.key[1]}")
+        if self._failover_engine is None:
+            cfg = {"provider": self.failover} if isinstance(self.failover, str) else dict(self.failover)
+            logger.warning("Circuit open for %s; failing over to %s", self.provider, cfg["provider"])
+            self._failover_engine = get_api_engine(cfg.pop("provider"), **cfg)
+        engine = self._failover_engine
+        result = engine.generate_action(system_prompt, user_prompt_str, temperature, max_tokens, max_retries, context)
+        self._circuit_counts["failover_calls"] += 1
+        self._call_local.info = {**(engine.last_call_info() or {}), "failover": f"{engine.provider}:{engine.model_name}"}
+        return result
+
+    def circuit_summary(self) -> Optional[Dict[str, Any]]:
+        """熔断器状态与本引擎（即本局）被拒绝 / 转备用的调用数，写入局末 final_summary 的 "circuit" 字段"""
+        if self.breaker is None:
+            return None
+        return {**self.breaker.snapshot(), **self._circuit_counts,
+                "transitions": [t for t in self.breaker.transitions if t["t"] >= self._created_at]}
+
+    def _set_call_info(self, outcome: str, attempts: int, latency_s: float, wasted_s: float,
+                       max_tokens: int, tokens: Tuple[int, int]) -> None:
+        self._call_local.info = {
+            "outcome": outcome,
+            "attempts": attempts,
+            "latency_s": round(latency_s, 4),
+            "wasted_s": round(wasted_s, 4),  # 失败尝试 + 重试等待耗时
+            "max_tokens": max_tokens,
+            "tokens_in": tokens[0],
+            "tokens_out": tokens[1],
+        }
+        truncated = getattr(self._usage_local, "truncated", None)
+        if truncated is not None:
+            self._call_local.info["truncated"] = truncated  # finish_reason == "length"（仅 OpenAI 协议可知）
+        hedge = getattr(self._usage_local, "hedge", None)
+        if hedge and hedge["hedged"]:
+            self._call_local.info.update(hedge)
+        metrics.LLM_OUTCOMES.inc(provider=self.provider, model=self.model_name, outcome=outcome)
+
+    def last_call_info(self) -> Optional[Dict[str, Any]]:
+        """当前线程最近一次 generate_action 的 {outcome, attempts, latency_s, wasted_s, max_tokens, tokens_in, tokens_out}，
+        写入步级日志的 "llm" 字段"""
+        info = getattr(self._call_local, "info", None)
+        return dict(info) if info is not None else None
+
+    def _record_request(self, latency_s: float, ok: bool, attempts: int,
+                        system_prompt: str, user_prompt: str, response_text: str) -> Tuple[int, int]:
+        """上报一次 generate_action 到 sweep_status 与 metrics_exporter；优先用服务端 usage，否则按文本估算 token 数"""
+        usage = getattr(self._usage_local, "usage", None)
+        if usage is not None:
+            prompt_tokens, completion_tokens, cached_tokens = usage
+        else:
+            prompt_tokens = count_tokens(system_prompt) + count_tokens(user_prompt)
+            completion_tokens = count_tokens(response_text)
+            cached_tokens = 0
+        STATUS.record_request(self.model_name, latency_s, ok, attempts,
+                              prompt_tokens, completion_tokens, cached_tokens)
+        labels = {"provider": self.provider, "model": self.model_name}
+        metrics.LLM_CALLS.inc(**labels)
+        metrics.LLM_ATTEMPTS.inc(attempts, **labels)
+        if attempts > 1:
+            metrics.LLM_RETRIES.inc(attempts - 1, **labels)
+        metrics.LLM_LATENCY.observe(latency_s, **labels)
+        metrics.LLM_TOKENS_IN.inc(prompt_tokens, **labels)
+        metrics.LLM_TOKENS_OUT.inc(completion_tokens, **labels)
+        if not ok:
+            metrics.LLM_FALLBACKS.inc(**labels)
+        return prompt_tokens, completion_tokens
+
+    def generate_action_batch(
+        self,
+        system_prompt: str,
+        user_prompts: List[str],
+        temperature: float = 0.5,
+        max_tokens: Optional[int] = None,
+        max_retries: int = 10,
+        contexts: Optional[List[Optional[Dict[str, Any]]]] = None
+    ) -> List[Tuple[np.ndarray, str]]:
+        """
+        批量推理接口（供 vec_env 的多 episode 同步 rollout 使用），返回与 user_prompts 等长的 (action_vec, response_text) 列表
+
+        vllm 一次 generate 处理整批 prompt；其余 provider 逐条调用 generate_action。
+        两条路径都按 prompt 上报请求统计 / 指标 / 结果标签，每条的 call info 见 last_batch_call_info()。
+        """
+        contexts = contexts if contexts is not None else [None] * len(user_prompts)
+        if self.provider == "vllm" and user_prompts and (self.breaker is None or self.breaker.allow()):
+            try:
+                return self._vllm_batch(system_prompt, user_prompts, temperature, max_tokens, contexts)
+            except Exception as e:
+                if self.breaker is not None:
+                    self.breaker.record_failure()
+                STATUS.record_attempt_error(self.model_name)
+                metrics.LLM_FAILURES.inc(provider=self.provider, model=self.model_name, error=type(e).__name__)
+                logger.warning("Batch inference error (batch of %d): %s; falling back to per-prompt calls", len(user_prompts), e)
+        results, infos = [], []
+        for p, ctx in zip(user_prompts, contexts):
+            results.append(self.generate_action(system_prompt, p, temperature, max_tokens, max_retries, context=ctx))
+            infos.append(self.last_call_info())
+        self._call_local.batch_info = infos
+        return results
+
+    def _vllm_batch(self, system_prompt: str, user_prompts: List[str], temperature: float,
+                    max_tokens: Optional[int], contexts: List[Optional[Dict[str, Any]]]) -> List[Tuple[np.ndarray, str]]:
+        """一次 vllm generate 处理整批；每条 prompt 的延迟记为整批耗时（各条都等待了整批完成）"""
+        t_batch = time.perf_counter()
+        prompts = [f"{system_prompt}\n\nUser: {p}\n\nAssistant:" for p in user_prompts]
+        dims = [(ctx or {}).get("action_dim") for ctx in contexts]
+        budgets = [max_tokens if max_tokens is not None else self.budget.resolve(ctx) for ctx in contexts]
+        params = [
+            self._vllm_params(temperature, mt, so.action_schema(d or DEFAULT_ACTION_DIM) if self.structured_output else None)
+            for mt, d in zip(budgets, dims)
+        ]
+        outputs = self.client.generate(prompts, params)
+        texts = [o.outputs[0].text for o in outputs]
+        latency_s = time.perf_counter() - t_batch
+        if self.breaker is not None:
+            self.breaker.record_success()
+        results, infos = [], []
+        for p, t, d, mt in zip(user_prompts, texts, dims, budgets):
+            self._usage_local.usage = None
+            self._usage_local.truncated = None
+            self._usage_local.hedge = None
+            action_vec, outcome = self._parse_action(t, d)
+            tokens = self._record_request(latency_s, True, 1, system_prompt, p, t)
+            self._set_call_info(outcome, 1, latency_s, 0.0, mt, tokens)
+            results.append((action_vec, t))
+            infos.append(self.last_call_info())
+        self._call_local.batch_info = infos
+        return results
+
+    def last_batch_call_info(self) -> Optional[List[Optional[Dict[str, Any]]]]:
+        """当前线程最近一次 generate_action_batch 中每条 prompt 的 call info（与 last_call_info() 同格式）"""
+        infos = getattr(self._call_local, "batch_info", None)
+        return list(infos) if infos is not None else None
+
+    def _warn_effort_ignored(self, reason: str) -> None:
+        if not self._warned_effort:
+            self._warned_effort = True
+            logger.warning("reasoning_effort=%s ignored: %s (max_tokens budget still applies)", self.reasoning_effort, reason)
+
+    def _warn_unconstrained(self, reason: str) -> None:
+        if not self._warned_unconstrained:
+            self._warned_unconstrained = True
+            logger.warning("structured_output requested but %s; falling back to free-form output", reason)
+
+    def _call_openai_api(self, system_prompt: str, user_prompt: str, temperature: float, max_tokens: int,
+                         schema: Optional[Dict[str, Any]] = None) -> str:
+        """
+        调用 OpenAI 协议 API（stream=True 时按 SSE 增量拼接回复；schema 给定时使用 response_format 约束输出；
+        reasoning_effort 给定时附带 reasoning_effort / Qwen 的 enable_thinking + thinking_budget）
+        """
+        extra = {}
+        if schema is not None:
+            extra["response_format"] = so.openai_response_format(schema, self.structured_output)
+        if self.reasoning_effort is not None:
+            dim = schema["properties"]["action"]["maxItems"] if schema is not None else None
+            extra.update(openai_reasoning_kwargs(self.provider, self.reasoning_effort, max_tokens - answer_tokens(dim)))
+        try:
+            completion = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=self.stream,
+                **extra
+            )
+        except Exception as e:
+            # 服务端不支持 json_schema 时降级为 JSON mode（只降级一次，之后的调用直接使用 json_object）
+            if self.structured_output == "json_schema" and "response_format" in str(e):
+                logger.warning("Provider rejected json_schema response_format (%s); switching to json_object", e)
+                self.structured_output = "json_object"
+                return self._call_openai_api(system_prompt, user_prompt, temperature, max_tokens, schema)
+            # 服务端不认识推理参数时去掉（只警告一次）
+            if self.reasoning_effort is not None and any(k in str(e) for k in ("reasoning_effort", "enable_thinking", "thinking_budget")):
+                self._warn_effort_ignored(f"provider rejected it ({e})")
+                self.reasoning_effort = None
+                return self._call_openai_api(system_prompt, user_prompt, temperature, max_tokens, schema)
+            raise
+        
+        if self.stream:
+            parts = []
+            for chunk in completion:
+                if chunk.choices and chunk.choices[0].delta is not None and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    self._usage_local.truncated = chunk.choices[0].finish_reason == "length"
+            if not parts:
+                raise ValueError(f"Empty API response")
+            return "".join(parts)
         
         if not completion.choices or completion.choices[0].message is None:
             raise ValueError(f"Empty API response")
         
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            # OpenAI: prompt_tokens_details.cached_tokens；DeepSeek: prompt_cache_hit_tokens
+            details = getattr(usage, "prompt_tokens_details", None)
+            cached = getattr(details, "cached_tokens", None) if details is not None else None
+            if cached is None:
+                cached = getattr(usage, "prompt_cache_hit_tokens", None)
+            self._usage_local.usage = (usage.prompt_tokens or 0, usage.completion_tokens or 0, cached or 0)
+        self._usage_local.truncated = completion.choices[0].finish_reason == "length"
+        
         return completion.choices[0].message.content
     
-    def _call_gemini_api(self, system_prompt: str, user_prompt: str) -> str:
-        """调用 Gemini API"""
+    def _call_openai_hedged(self, system_prompt: str, user_prompt: str, temperature: float, max_tokens: int,
+                            schema: Optional[Dict[str, Any]] = None) -> str:
+        """经共享 Hedger 调用 _call_openai_api；请求在工作线程执行，usage / truncated 带回调用线程"""
+        def request():
+            self._usage_local.usage = None
+            self._usage_local.truncated = None
+            text = self._call_openai_api(system_prompt, user_prompt, temperature, max_tokens, schema)
+            return text, self._usage_local.usage, self._usage_local.truncated
+
+        (text, usage, truncated), hedge = self.hedger.call(request)
+        self._usage_local.usage = usage
+        self._usage_local.truncated = truncated
+        self._usage_local.hedge = hedge
+        if hedge["hedged"]:
+            metrics.LLM_HEDGES.inc(provider=self.provider, model=self.model_name,
+                                   winner="hedge" if hedge["hedge_won"] else "primary")
+        return text
+
+    def _call_gemini_api(self, system_prompt: str, user_prompt: str, temperature: float, max_tokens: int,
+                         schema: Optional[Dict[str, Any]] = None) -> str:
+        """调用 Gemini API（schema 给定时使用 response_schema 约束输出）"""
         full_prompt = f"{system_prompt}\n\n{user_prompt}"
-        response = self.client.generate_content(full_prompt)
+        generation_config = {"temperature": temperature, "max_output_tokens": max_tokens}
+        if schema is not None:
+            generation_config["response_mime_type"] = "application/json"
+            generation_config["response_schema"] = so.gemini_schema(schema)
+        if self.reasoning_effort is not None:
+            self._warn_effort_ignored("google-generativeai has no thinking control")
+        response = self.client.generate_content(full_prompt, generation_config=generation_config)
         return response.text
     
-    def _call_transformers(self, system_prompt: str, user_prompt: str, temperature: float, max_tokens: int) -> str:
-        """调用 transformers 本地模型"""
+    def _call_transformers(self, system_prompt: str, user_prompt: str, temperature: float, max_tokens: int,
+                           schema: Optional[Dict[str, Any]] = None) -> str:
+        """
+        调用 transformers 本地模型（schema 给定且安装了 lm-format-enforcer 时做语法约束解码；
+        reasoning_effort="none" 通过 chat template 的 enable_thinking=False 关闭思考，如 Qwen3）
+        """
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
@@ -230,70 +713,87 @@ class APIInferencer:
         
         # 使用 chat template
         if hasattr(self.tokenizer, "apply_chat_template"):
-            prompt = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            template_kwargs = {}
+            if self.reasoning_effort is not None:
+                template_kwargs["enable_thinking"] = self.reasoning_effort != "none"
+            prompt = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True,
+                                                        **template_kwargs)
         else:
             # 降级方案
             prompt = f"{system_prompt}\n\nUser: {user_prompt}\n\nAssistant:"
         
         inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
         
+        extra = {}
+        if schema is not None:
+            prefix_fn = so.transformers_prefix_fn(self.tokenizer, schema)
+            if prefix_fn is None:
+                self._warn_unconstrained("lm-format-enforcer is not installed (pip install lm-format-enforcer)")
+            else:
+                extra["prefix_allowed_tokens_fn"] = prefix_fn
+        
         outputs = self.model.generate(
             **inputs,
             max_new_tokens=max_tokens,
             temperature=temperature,
             do_sample=temperature > 0,
-            pad_token_id=self.tokenizer.eos_token_id
+            pad_token_id=self.tokenizer.eos_token_id,
+            **extra
         )
         
         response = self.tokenizer.decode(outputs[0][inputs.input_ids.shape[1]:], skip_special_tokens=True)
         return response
     
-    def _call_ollama(self, system_prompt: str, user_prompt: str, temperature: float) -> str:
-        """调用 Ollama 本地服务"""
+    def _call_ollama(self, system_prompt: str, user_prompt: str, temperature: float, max_tokens: int,
+                     schema: Optional[Dict[str, Any]] = None) -> str:
+        """调用 Ollama 本地服务（schema 给定时通过 format 约束输出；reasoning_effort 映射为 think 开关）"""
+        extra = {"format": schema} if schema is not None else {}
+        if self.reasoning_effort is not None:
+            extra["think"] = self.reasoning_effort != "none"
         response = self.client.chat(
             model=self.model_name,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
             ],
-            options={"temperature": temperature}
+            options={"temperature": temperature, "num_predict": max_tokens},
+            **extra
         )
         return response['message']['content']
     
-    def _call_vllm(self, system_prompt: str, user_prompt: str, temperature: float, max_tokens: int) -> str:
-        """调用 vLLM 引擎"""
+    def _vllm_params(self, temperature: float, max_tokens: int, schema: Optional[Dict[str, Any]] = None):
+        """本次调用的 SamplingParams：引擎默认参数 + 本次的 temperature / max_tokens（+ JSON schema 引导解码）"""
+        if self.reasoning_effort is not None:
+            self._warn_effort_ignored("offline vLLM prompts bypass the chat template")
+        if schema is not None:
+            params = so.vllm_sampling_params(self.sampling_params, schema, temperature, max_tokens)
+            if params is not None:
+                return params
+            self._warn_unconstrained("this vLLM version has no GuidedDecodingParams")
+        params = self.sampling_params.clone()
+        params.temperature = temperature
+        params.max_tokens = max_tokens
+        return params
+
+    def _call_vllm(self, system_prompt: str, user_prompt: str, temperature: float, max_tokens: int,
+                   schema: Optional[Dict[str, Any]] = None) -> str:
+        """调用 vLLM 引擎（schema 给定时做 JSON schema 引导解码）"""
         prompt = f"{system_prompt}\n\nUser: {user_prompt}\n\nAssistant:"
-        outputs = self.client.generate([prompt], self.sampling_params)
+        outputs = self.client.generate([prompt], self._vllm_params(temperature, max_tokens, schema))
         return outputs[0].outputs[0].text
 
-    def _parse_json(self, text: str) -> np.ndarray:
+    def _parse_json(self, text: str, action_dim: Optional[int] = None) -> np.ndarray:
         """
-        强壮的 JSON 解析器，能处理 <think> 标签和 Markdown 格式。
+        强壮的 JSON 解析器，能处理 <think> 标签、Markdown 格式和嵌套 JSON（见 extract_action）。
         """
-        try:
-            # 1. 移除 DeepSeek 思考过程
-            clean_text = text.split("</think>")[-1] if "</think>" in text else text
-            
-            # 2. 提取 Markdown JSON
-            match = re.search(r'```json\s*(\{.*?\})\s*```', clean_text, re.DOTALL)
-            if not match:
-                match = re.search(r'(\{.*?\})', clean_text, re.DOTALL)
-            
-            if match:
-                data = json.loads(match.group(1))
-                # 兼容 "action" 字段不存在的情况
-                return np.array(data.get("action", [0]*5), dtype=np.float32)
-            
-            # 3. 兜底正则
-            match = re.search(r'"action"\s*:\s*\[(.*?)\]', clean_text, re.DOTALL)
-            if match:
-                nums = re.findall(r"[-+]?\d*\.\d+|\d+", match.group(1))
-                if len(nums) >= 5:
-                    return np.array([float(x) for x in nums[:5]], dtype=np.float32)
-            
-            return np.array([0,0,0,0,0], dtype=np.float32)
-        except Exception:
-            return np.array([0,0,0,0,0], dtype=np.float32)
+        return self._parse_action(text, action_dim)[0]
+
+    def _parse_action(self, text: str, action_dim: Optional[int] = None) -> Tuple[np.ndarray, str]:
+        """_parse_json 的实现，额外返回解析路径: clean / regex_fallback / default_zeros"""
+        action_vec, outcome = extract_action(text, action_dim)
+        if outcome == OUTCOME_DEFAULT:
+            metrics.LLM_PARSE_FAILURES.inc(provider=self.provider, model=self.model_name)
+        return action_vec, outcome
 
 # ==============================================================================
 # 4. 配置工厂（统一接口）
@@ -306,6 +806,7 @@ def get_api_engine(provider: str, **kwargs) -> APIInferencer:
         provider: 模型提供商，支持:
             - 远程API: 'deepseek', 'qwen', 'gpt', 'chatgpt', 'gemini'
             - 本地模型: 'transformers', 'ollama', 'vllm'
+            - 离线后端: 'mock', 'replay', 'heuristic'
         **kwargs: 额外配置参数（可覆盖默认配置）
     
     Examples:
@@ -317,6 +818,14 @@ def get_api_engine(provider: str, **kwargs) -> APIInferencer:
         engine = get_api_engine("transformers", model_path="/path/to/model")
         engine = get_api_engine("ollama", model_name="qwen2.5:7b")
         engine = get_api_engine("vllm", model_path="meta-llama/Llama-3-8B")
+        
+        # 离线后端
+        engine = get_api_engine("mock", latency_ms=800, latency_dist="lognormal", rate_limit_rate=0.05)
+        engine = get_api_engine("replay", replay_dir="results/benchmarks")
+        engine = get_api_engine("heuristic")
+        
+        # 本地 OpenAI 兼容压测服务 (python mock_server.py --port 8765)
+        engine = get_api_engine("zaiwen", api_base="http://127.0.0.1:8765/v1", api_key="local", stream=True)
     """
     provider = provider.lower()
     
@@ -365,7 +874,7 @@ def get_api_engine(provider: str, **kwargs) -> APIInferencer:
         if not config["base_url"]:
             raise ValueError("ZAIWEN_API_BASE is not set. Please configure it in .env or pass api_base/base_url.")
 
-        print(f"DEBUG: Zaiwen config: {config}")
+        logger.debug("Zaiwen config: %s", {**config, "api_key": "***"})
     
     elif provider in ["gpt", "chatgpt", "openai"]:
         config = {
@@ -405,10 +914,32 @@ def get_api_engine(provider: str, **kwargs) -> APIInferencer:
             "tensor_parallel_size": kwargs.get("tensor_parallel_size", 1)
         }
     
+    # ========== 离线后端配置 ==========
+    elif provider == "mock":
+        config = {
+            "provider": "mock",
+            "model_name": kwargs.get("model_name", "mock"),
+            "retry_delay": kwargs.get("retry_delay", 0.0),
+        }
+    
+    elif provider == "replay":
+        config = {
+            "provider": "replay",
+            "model_name": kwargs.get("model_name", "replay"),
+            "retry_delay": kwargs.get("retry_delay", 0.0),
+        }
+    
+    elif provider == "heuristic":
+        config = {
+            "provider": "heuristic",
+            "model_name": kwargs.get("model_name", "heuristic"),
+            "retry_delay": kwargs.get("retry_delay", 0.0),
+        }
+    
     else:
         raise ValueError(
             f"Unknown provider: {provider}\n"
-            f"Supported: deepseek, qwen, gpt, gemini, transformers, ollama, vllm"
+            f"Supported: deepseek, qwen, gpt, gemini, transformers, ollama, vllm, mock, replay, heuristic"
         )
     
     # 合并用户自定义配置
@@ -0,0 +1,353 @@
+"""
+Vectorized multi-episode stepping for the nine MPE games.
+
+VecMPEEnv holds K copies of one game (one per seed), steps them in lockstep
+and stacks observations / rewards into arrays:
+
+    obs[agent_id]      -> np.ndarray (K, obs_dim)
+    actions[agent_id]  -> np.ndarray (K, action_dim)
+    rewards[agent_id]  -> np.ndarray (K,)
+    dones              -> np.ndarray (K,) bool
+
+Copies that finished keep their last observation and report zero reward
+until the whole batch is done. With num_workers > 0 the copies are split
+across subprocesses (one pipe per worker), which is what scales heuristic
+rollouts to thousands of env-steps per second on multi-core machines.
+
+Env construction parameters and the parser call for each game mirror the
+single-episode runners, so parse_obs_batch() yields the same structs the
+runners log and the heuristic / LLM policies consume.
+
+Usage:
+    python vec_env.py --env spread --num_envs 64 --workers 4
+"""
+
+import argparse
+import importlib
+import multiprocessing as mp
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from obs.parse_adv_obs import parse_adversary_obs
+from obs.parse_crypto_obs import parse_crypto_obs
+from obs.parse_push_obs import parse_push_obs
+from obs.parse_reference_obs import parse_reference_obs
+from obs.parse_simple_obs import parse_simple_obs
+from obs.parse_speaker_listener_obs import parse_speaker_listener_obs
+from obs.parse_spread_obs import parse_spread_obs
+from obs.parse_tag_obs import parse_tag_obs
+from obs.parse_world_comm_obs import parse_world_comm_obs
+
+# Same constructor arguments / step caps as the runners (spread_API.py, adv_API.py, ...)
+ENV_SPECS: Dict[str, Dict[str, Any]] = {
+    "spread": {"module": "simple_spread_v3", "kwargs": {"N": 3, "local_ratio": 0.5}, "max_cycles": 30},
+    "adversary": {"module": "simple_adversary_v3", "kwargs": {"N": 3}, "max_cycles": 30},
+    "tag": {"module": "simple_tag_v3", "kwargs": {"num_good": 1, "num_adversaries": 3, "num_obstacles": 2}, "max_cycles": 30},
+    "push": {"module": "simple_push_v3", "kwargs": {}, "max_cycles": 30},
+    "crypto": {"module": "simple_crypto_v3", "kwargs": {}, "max_cycles": 10},
+    "reference": {"module": "simple_reference_v3", "kwargs": {}, "max_cycles": 30},
+    "speaker_listener": {"module": "simple_speaker_listener_v4", "kwargs": {}, "max_cycles": 30},
+    "world_comm": {
+        "module": "simple_world_comm_v3",
+        "kwargs": {"num_good": 2, "num_adversaries": 4, "num_obstacles": 1, "num_food": 2, "num_forests": 2},
+        "max_cycles": 50,
+    },
+    "simple": {"module": "simple_v3", "kwargs": {}, "max_cycles": 30},
+}
+
+OBS_PARSERS: Dict[str, Callable[[np.ndarray, str], Dict[str, Any]]] = {
+    "spread": lambda o, a: parse_spread_obs(o, num_agents=ENV_SPECS["spread"]["kwargs"]["N"]),
+    "adversary": lambda o, a: parse_adversary_obs(o, a, ENV_SPECS["adversary"]["kwargs"]["N"]),
+    "tag": lambda o, a: parse_tag_obs(
+        o, a,
+        ENV_SPECS["tag"]["kwargs"]["num_obstacles"],
+        ENV_SPECS["tag"]["kwargs"]["num_good"],
+        ENV_SPECS["tag"]["kwargs"]["num_adversaries"],
+    ),
+    "push": lambda o, a: parse_push_obs(o, a),
+    "crypto": lambda o, a: parse_crypto_obs(o, a),
+    "reference": lambda o, a: parse_reference_obs(o, a),
+    "speaker_listener": lambda o, a: parse_speaker_listener_obs(o, a),
+    "world_comm": lambda o, a: parse_world_comm_obs(o, a),
+    "simple": lambda o, a: parse_simple_obs(o),
+}
+
+
+def make_env(env_name: str, max_cycles: Optional[int] = None, render_mode: Optional[str] = None, **overrides):
+    """Build one continuous-action parallel_env with the runner's parameters."""
+    if env_name not in ENV_SPECS:
+        raise ValueError(f"Unsupported env_name: {env_name}")
+    spec = ENV_SPECS[env_name]
+    module = importlib.import_module(f"pettingzoo.mpe.{spec['module']}")
+    kwargs = {**spec["kwargs"], **overrides}
+    return module.parallel_env(
+        max_cycles=max_cycles or spec["max_cycles"],
+        continuous_actions=True,
+        render_mode=render_mode,
+        **kwargs,
+    )
+
+
+def parse_obs_batch(env_name: str, agent_id: str, obs_batch: np.ndarray) -> List[Dict[str, Any]]:
+    """Parse a stacked (K, obs_dim) observation array row by row with the game's parser."""
+    parser = OBS_PARSERS[env_name]
+    return [parser(row, agent_id) for row in obs_batch]
+
+
+class _EnvGroup:
+    """A list of envs stepped sequentially in one process (the unit a worker owns)."""
+
+    def __init__(self, env_name: str, seeds: Sequence[int], env_kwargs: Dict[str, Any]):
+        self.envs = [make_env(env_name, **env_kwargs) for _ in seeds]
+        self.seeds = list(seeds)
+        self.last_obs: List[Dict[str, np.ndarray]] = []
+        self.done = [False] * len(self.envs)
+
+    def reset(self) -> List[Dict[str, np.ndarray]]:
+        self.last_obs = [env.reset(seed=int(s))[0] for env, s in zip(self.envs, self.seeds)]
+        self.done = [False] * len(self.envs)
+        return self.last_obs
+
+    def step(self, actions: List[Dict[str, np.ndarray]]):
+        rewards, dones = [], []
+        for i, env in enumerate(self.envs):
+            if self.done[i] or not env.agents:
+                self.done[i] = True
+                rewards.append({})
+                dones.append(True)
+                continue
+            obs, rew, term, trunc, _ = env.step({a: actions[i][a] for a in env.agents})
+            finished = not env.agents or all(term.values()) or all(trunc.values())
+            if obs:
+                self.last_obs[i] = obs
+            self.done[i] = finished
+            rewards.append(rew)
+            dones.append(finished)
+        return self.last_obs, rewards, dones
+
+    def close(self) -> None:
+        for env in self.envs:
+            env.close()
+
+
+def _worker(remote, env_name: str, seeds: Sequence[int], env_kwargs: Dict[str, Any]) -> None:
+    group = _EnvGroup(env_name, seeds, env_kwargs)
+    try:
+        while True:
+            cmd, payload = remote.recv()
+            if cmd == "reset":
+                remote.send(group.reset())
+            elif cmd == "step":
+                remote.send(group.step(payload))
+            elif cmd == "close":
+                break
+    finally:
+        group.close()
+        remote.close()
+
+
+class VecMPEEnv:
+    """
+    K copies of one MPE game stepped in lockstep.
+
+    Args:
+        env_name: one of ENV_SPECS
+        seeds: one seed per copy (K = len(seeds))
+        num_workers: 0 = step in this process, N = split copies across N subprocesses
+        **env_kwargs: overrides for make_env (max_cycles, ...); OBS_PARSERS assume the default agent counts
+    """
+
+    def __init__(self, env_name: str, seeds: Sequence[int], num_workers: int = 0, **env_kwargs: Any):
+        self.env_name = env_name
+        self.seeds = [int(s) for s in seeds]
+        self.num_envs = len(self.seeds)
+        probe = make_env(env_name, **env_kwargs)
+        probe.reset(seed=self.seeds[0] if self.seeds else None)
+        self.agents: List[str] = list(probe.agents)
+        self.action_dims = {a: int(probe.action_space(a).shape[0]) for a in self.agents}
+        self.obs_dims = {a: int(probe.observation_space(a).shape[0]) for a in self.agents}
+        self.max_cycles = env_kwargs.get("max_cycles") or ENV_SPECS[env_name]["max_cycles"]
+        probe.close()
+
+        self.num_workers = max(0, min(int(num_workers), self.num_envs))
+        self._remotes = []
+        self._procs = []
+        self._chunks: List[List[int]] = []
+        if self.num_workers:
+            ctx = mp.get_context()
+            self._chunks = [list(c) for c in np.array_split(np.arange(self.num_envs), self.num_workers)]
+            for chunk in self._chunks:
+                parent, child = ctx.Pipe()
+                proc = ctx.Process(
+                    target=_worker,
+                    args=(child, env_name, [self.seeds[i] for i in chunk], env_kwargs),
+                    daemon=True,
+                )
+                proc.start()
+                child.close()
+                self._remotes.append(parent)
+                self._procs.append(proc)
+        else:
+            self._group = _EnvGroup(env_name, self.seeds, env_kwargs)
+        self.dones = np.zeros(self.num_envs, dtype=bool)
+
+    def _stack_obs(self, per_env_obs: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+        out = {a: np.zeros((self.num_envs, self.obs_dims[a]), dtype=np.float32) for a in self.agents}
+        for i, obs in enumerate(per_env_obs):
+            for a, o in obs.items():
+                out[a][i] = o
+        return out
+
+    def reset(self) -> Dict[str, np.ndarray]:
+        self.dones[:] = False
+        if self.num_workers:
+            for remote in self._remotes:
+                remote.send(("reset", None))
+            per_env = [o for remote in self._remotes for o in remote.recv()]
+        else:
+            per_env = self._group.reset()
+        return self._stack_obs(per_env)
+
+    def step(self, actions: Dict[str, np.ndarray]):
+        """actions[agent] is (K, action_dim); returns (obs, rewards, dones) as stacked arrays."""
+        per_env_actions = [
+            {a: np.asarray(actions[a][i], dtype=np.float32) for a in self.agents}
+            for i in range(self.num_envs)
+        ]
+        if self.num_workers:
+            for remote, chunk in zip(self._remotes, self._chunks):
+                remote.send(("step", [per_env_actions[i] for i in chunk]))
+            per_env_obs, per_env_rew, per_env_done = [], [], []
+            for remote in self._remotes:
+                obs, rew, done = remote.recv()
+                per_env_obs.extend(obs)
+                per_env_rew.extend(rew)
+                per_env_done.extend(done)
+        else:
+            per_env_obs, per_env_rew, per_env_done = self._group.step(per_env_actions)
+
+        rewards = {a: np.zeros(self.num_envs, dtype=np.float32) for a in self.agents}
+        for i, rew in enumerate(per_env_rew):
+            for a, r in rew.items():
+                rewards[a][i] = r
+        self.dones = np.asarray(per_env_done, dtype=bool)
+        return self._stack_obs(per_env_obs), rewards, self.dones.copy()
+
+    def close(self) -> None:
+        if self.num_workers:
+            for remote in self._remotes:
+                try:
+                    remote.send(("close", None))
+                except (BrokenPipeError, OSError):
+                    pass
+            for proc in self._procs:
+                proc.join(timeout=5)
+        else:
+            self._group.close()
+
+
+def _fit_dim(batch: np.ndarray, dim: int) -> np.ndarray:
+    """Pad / truncate (K, d) actions to the env's action dim and clip to the Box bounds."""
+    if batch.shape[1] < dim:
+        batch = np.pad(batch, ((0, 0), (0, dim - batch.shape[1])))
+    return np.clip(batch[:, :dim], 0.0, 1.0).astype(np.float32)
+
+
+def rollout(
+    env_name: str,
+    seeds: Sequence[int],
+    engine,
+    num_workers: int = 0,
+    system_prompt: str = "You are a decision module for a game agent. Output only one-line JSON.",
+    prompt_fn: Optional[Callable[[str, int, Dict[str, Any]], str]] = None,
+    **env_kwargs: Any,
+) -> Dict[str, Any]:
+    """
+    Run one episode per seed in lockstep with an APIInferencer (heuristic, mock,
+    vllm, ...), one generate_action_batch() call per agent per step.
+
+    prompt_fn(agent_id, step, obs_struct) builds the user prompt. Offline engines
+    (heuristic / mock / replay) ignore it and get empty prompts by default; other
+    engines default to the compact obs encoding. For LLM rollouts pass the
+    runner's own prompt builder.
+
+    Returns per-seed per-agent total rewards, mean_reward (mean over agents,
+    then seeds) and env_steps_per_s.
+    """
+    from obs.encode_obs import encode_obs
+
+    if prompt_fn is None:
+        if getattr(engine, "provider", None) in ("heuristic", "mock", "replay"):
+            prompt_fn = lambda agent_id, step, struct: ""
+        else:
+            prompt_fn = lambda agent_id, step, struct: encode_obs(struct, "compact")
+
+    venv = VecMPEEnv(env_name, seeds, num_workers=num_workers, **env_kwargs)
+    totals = {a: np.zeros(venv.num_envs, dtype=np.float64) for a in venv.agents}
+    t0 = time.perf_counter()
+    env_steps = 0
+    try:
+        obs = venv.reset()
+        for step in range(venv.max_cycles):
+            active = ~venv.dones
+            actions = {}
+            for agent_id in venv.agents:
+                structs = parse_obs_batch(env_name, agent_id, obs[agent_id])
+                contexts = [
+                    {"env": env_name, "seed": s, "step": step, "agent": agent_id, "obs": st,
+                     "action_dim": venv.action_dims[agent_id]}
+                    for s, st in zip(venv.seeds, structs)
+                ]
+                prompts = [prompt_fn(agent_id, step, st) for st in structs]
+                results = engine.generate_action_batch(system_prompt, prompts, contexts=contexts)
+                batch = np.stack([vec for vec, _ in results]).astype(np.float32, copy=False)
+                actions[agent_id] = _fit_dim(batch, venv.action_dims[agent_id])
+            obs, rewards, dones = venv.step(actions)
+            env_steps += int(active.sum())
+            for agent_id, r in rewards.items():
+                totals[agent_id] += r
+            if dones.all():
+                break
+    finally:
+        venv.close()
+    elapsed = time.perf_counter() - t0
+
+    per_seed = [
+        {"seed": s, "total_rewards": {a: float(totals[a][i]) for a in venv.agents},
+         "mean_reward": float(np.mean([totals[a][i] for a in venv.agents]))}
+        for i, s in enumerate(venv.seeds)
+    ]
+    return {
+        "env": env_name,
+        "num_envs": venv.num_envs,
+        "num_workers": venv.num_workers,
+        "mean_reward": float(np.mean([p["mean_reward"] for p in per_seed])) if per_seed else 0.0,
+        "episodes": per_seed,
+        "env_steps": env_steps,
+        "elapsed_s": elapsed,
+        "env_steps_per_s": env_steps / elapsed if elapsed > 0 else None,
+    }
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Vectorized MPE rollouts (throughput check).")
+    p.add_argument("--env", type=str, default="spread", choices=list(ENV_SPECS))
+    p.add_argument("--provider", type=str, default="heuristic")
+    p.add_argument("--num_envs", type=int, default=32)
+    p.add_argument("--seed_start", type=int, default=1)
+    p.add_argument("--workers", type=int, default=0)
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    from utils_api import get_api_engine
+
+    args = parse_args()
+    engine = get_api_engine(args.provider)
+    seeds = list(range(args.seed_start, args.seed_start + args.num_envs))
+    result = rollout(args.env, seeds, engine, num_workers=args.workers)
+    print(f"{result['env']}: {result['num_envs']} envs x {result['num_workers']} workers | "
+          f"mean_reward={result['mean_reward']:.3f} | {result['env_steps']} env-steps in "
+          f"{result['elapsed_s']:.2f}s -> {result['env_steps_per_s']:.0f} env-steps/s")
@@ -13,6 +13,11 @@ from prompt.prompt_for_world_comm import (
     get_task_and_reward,
 )
 from obs.parse_world_comm_obs import parse_world_comm_obs
+from obs.encode_obs import count_tokens, encode_obs
+from log_utils import get_logger
+from step_pipeline import StepPipeline
+
+logger = get_logger("world_comm")
 
 try:
     from pettingzoo.mpe import simple_world_comm_v3
@@ -34,8 +39,15 @@ class NumpyEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
-def _format_current_obs(obs_struct: Dict[str, Any], agent_name: str) -> str:
+def _format_current_obs(obs_struct: Dict[str, Any], agent_name: str, obs_format: str = "verbose") -> str:
     role = obs_struct.get("role", "UNKNOWN")
+    if obs_format != "verbose":
+        return "\n".join([
+            "OBSERVATION SEMANTICS:",
+            "- obs = [vel(2), position(2), landmarks(10), teammates(6), enemies(4), comm(4)] role-dependent",
+            f"CURRENT OBS ({obs_format}):",
+            encode_obs(obs_struct, obs_format),
+        ])
     lines = [
         "OBSERVATION SEMANTICS:",
         "- obs = [vel(2), position(2), landmarks(10), teammates(6), enemies(4), comm(4)] role-dependent",
@@ -66,7 +78,7 @@ def _format_current_obs(obs_struct: Dict[str, Any], agent_name: str) -> str:
     return "\n".join(lines)
 
 
-def user_prompt_world_comm(agent_name: str, step: int, obs_struct: Dict[str, Any]) -> str:
+def user_prompt_world_comm(agent_name: str, step: int, obs_struct: Dict[str, Any], obs_format: str = "verbose") -> str:
     """Assemble the full prompt for the agent."""
     role = obs_struct.get("role", "UNKNOWN")
     
@@ -93,7 +105,7 @@ def user_prompt_world_comm(agent_name: str, step: int, obs_struct: Dict[str, Any
         get_physics_rules(role),
         get_action_and_response_format(role),
         get_navigation_hints(role),
-        _format_current_obs(obs_struct, agent_name),
+        _format_current_obs(obs_struct, agent_name, obs_format),
         comm_hint,
     ]
     return "\n\n".join(filter(None, parts))
@@ -102,121 +114,118 @@ def user_prompt_world_comm(agent_name: str, step: int, obs_struct: Dict[str, Any
 def run_world_comm(provider: str, output_name: str, **kwargs):
     MAX_STEPS = 50
     seed = kwargs.pop('seed', None)
+    obs_format = kwargs.pop('obs_format', 'verbose')
+    pipeline = kwargs.pop('pipeline', True)
+    checkpoint = kwargs.pop('checkpoint', False)
+    capture = kwargs.pop('capture', None)
     llm_engine = get_api_engine(provider, **kwargs)
 
-    print("Initializing World Comm Environment (Modular)...")
+    logger.info("Initializing World Comm Environment (Modular)...")
     env = simple_world_comm_v3.parallel_env(
         num_good=2, num_adversaries=4, num_obstacles=1, num_food=2, num_forests=2,
         max_cycles=MAX_STEPS, continuous_actions=True, render_mode="rgb_array"
     )
 
     observations, infos = env.reset(seed=seed) if seed is not None else env.reset()
-    frames = []
-    total_rewards = defaultdict(float)
-    game_log = []
-
-    for step in range(MAX_STEPS):
-        print(f"\n{'='*30} STEP {step} {'='*30}")
-        frame = env.render()
-        if frame is not None:
-            frames.append(frame)
-
-        actions = {}
-        step_buffer = {}
-
-        for agent_id in env.agents:
-            if agent_id not in observations:
-                continue
-
-            # Parse observation
-            obs_struct = parse_world_comm_obs(observations[agent_id], agent_id)
-            role = obs_struct.get("role", "UNKNOWN")
-
-            # Generate prompt and action
-            full_prompt = user_prompt_world_comm(agent_id, step, obs_struct)
-            sys_r = f"You are a tactical {role} agent. Output strict JSON only."
-
-            action_vec, raw_thought = llm_engine.generate_action(sys_r, full_prompt)
-
-            # Determine expected dimension based on role
-            if role == "LEADER":
-                expected_dim = 9
-            else:
-                expected_dim = 5
-
-            # 修复 ValueError，并处理 None/空返回
-            if action_vec is None:
-                action_vec = np.zeros(expected_dim, dtype=np.float32)
-            else:
-                action_vec = np.array(action_vec, dtype=np.float32)
-                if action_vec.size == 0:
-                    action_vec = np.zeros(expected_dim, dtype=np.float32)
-            if len(action_vec) < expected_dim:
-                action_vec = np.concatenate([action_vec, np.zeros(expected_dim - len(action_vec))])
-            action_vec = action_vec[:expected_dim]
-
-            # For movement (indices 0-4), clip to [0, 1]
-            if len(action_vec) >= 5:
-                action_vec[:5] = np.clip(action_vec[:5], 0.0, 1.0)
-            # For communication (indices 5+), allow any float
-
-            actions[agent_id] = action_vec
-            step_buffer[agent_id] = {"struct": obs_struct, "action": action_vec, "thought": raw_thought}
-
-            # Print step info
-            print(f"\n[{agent_id}] Role: {role}")
-            print(f"   Thought: {raw_thought[:100]}")
-            print(f"   Action: {np.round(action_vec, 2)}")
-
-        if not actions:
-            break
-
-        observations, rewards, terminations, truncations, infos = env.step(actions)
-
-        # Log rewards
-        print(f"\n--- Rewards (Step {step}) ---")
-        for aid, r in rewards.items():
-            total_rewards[aid] += r
-            print(f"{aid}: {r:.3f} (total: {total_rewards[aid]:.3f})")
-
-            struct = step_buffer[aid]["struct"]
-            act = step_buffer[aid]["action"]
-
-            game_log.append({
-                "step": step,
-                "agent": aid,
-                "role": struct.get("role"),
-                "obs": struct,
-                "action": act.tolist(),
-                "thought": step_buffer[aid]["thought"],
-                "reward": float(r),
-            })
-
-        if all(terminations.values()) or all(truncations.values()):
-            print("Game Over.")
-            break
-
-    env.close()
-
-    # Add final summary
-    mean_reward = sum(total_rewards.values()) / len(total_rewards) if total_rewards else 0.0
-    game_log.append({
-        "final_summary": True,
-        "total_rewards": {k: float(v) for k, v in total_rewards.items()},
-        "mean_reward": float(mean_reward)
-    })
-    print(f"\nFINAL REWARDS: {dict(total_rewards)}, MEAN: {mean_reward:.3f}")
-
-    if frames:
-        import imageio
-        vid_name = get_unique_filename(output_name + ".mp4")
-        imageio.mimsave(vid_name, frames, fps=1, macro_block_size=1)
-        print(f"Saved video to {vid_name}")
-
-    final_log = get_unique_filename(output_name + ".json")
-    with open(final_log, "w", encoding="utf-8") as f:
-        json.dump(game_log, f, indent=4, cls=NumpyEncoder)
-    print(f"Saved detailed logs to {final_log}")
+    pipe = StepPipeline(llm_engine, output_name + ".mp4", fps=1, enabled=pipeline,
+                        checkpoint=checkpoint, seed=seed, capture=capture,
+                        json_kwargs={"indent": 4, "cls": NumpyEncoder}, macro_block_size=1)
+    try:
+        total_rewards = defaultdict(float)
+        game_log = []
+        obs_tokens = []
+        prompt_tokens = []
+
+        for step in range(MAX_STEPS):
+            logger.debug("=== STEP %d ===", step)
+            pipe.render(env)
+
+            def decide(agent_id):
+                # Parse observation
+                obs_struct = parse_world_comm_obs(observations[agent_id], agent_id)
+                role = obs_struct.get("role", "UNKNOWN")
+
+                # Generate prompt and action
+                full_prompt = user_prompt_world_comm(agent_id, step, obs_struct, obs_format)
+                sys_r = f"You are a tactical {role} agent. Output strict JSON only."
+
+                ctx = {"env": "world_comm", "seed": seed, "step": step, "agent": agent_id, "obs": obs_struct,
+                       "action_dim": env.action_space(agent_id).shape[0]}
+                action_vec, raw_thought = llm_engine.generate_action(sys_r, full_prompt, context=ctx)
+
+                # Width already matches the role (leader 9 / others 5) via action_dim
+                # For movement (indices 0-4), clip to [0, 1]
+                if len(action_vec) >= 5:
+                    action_vec[:5] = np.clip(action_vec[:5], 0.0, 1.0)
+                # For communication (indices 5+), allow any float
+
+                # Print step info
+                logger.debug("[%s] Role: %s | Thought: %.100s | Action: %s", agent_id, role, raw_thought, action_vec)
+                return {"struct": obs_struct, "action": action_vec, "thought": raw_thought,
+                        "obs_tokens": count_tokens(_format_current_obs(obs_struct, agent_id, obs_format)),
+                        "prompt_tokens": count_tokens(full_prompt), "llm": llm_engine.last_call_info()}
+
+            step_buffer = pipe.decide([aid for aid in env.agents if aid in observations], decide)
+            actions = {aid: info["action"] for aid, info in step_buffer.items()}
+            obs_tokens.extend(info["obs_tokens"] for info in step_buffer.values())
+            prompt_tokens.extend(info["prompt_tokens"] for info in step_buffer.values())
+
+            if not actions:
+                break
+
+            pipe.sync_env()
+            observations, rewards, terminations, truncations, infos = env.step(actions)
+
+            # Log rewards
+            logger.debug("Rewards (Step %d): %s", step, rewards)
+            for aid, r in rewards.items():
+                total_rewards[aid] += r
+
+                struct = step_buffer[aid]["struct"]
+                act = step_buffer[aid]["action"]
+
+                game_log.append({
+                    "step": step,
+                    "agent": aid,
+                    "role": struct.get("role"),
+                    "obs": struct,
+                    "action": act.tolist(),
+                    "thought": step_buffer[aid]["thought"],
+                    "reward": float(r),
+                    "obs_tokens": step_buffer[aid]["obs_tokens"],
+                    "llm": step_buffer[aid].get("llm"),
+                })
+
+            pipe.log(game_log)
+            if all(terminations.values()) or all(truncations.values()):
+                logger.debug("Game Over.")
+                break
+
+        # Add final summary
+        mean_reward = sum(total_rewards.values()) / len(total_rewards) if total_rewards else 0.0
+        game_log.append({
+            "final_summary": True,
+            "env": "world_comm",
+            "seed": seed,
+            "total_rewards": {k: float(v) for k, v in total_rewards.items()},
+            "mean_reward": float(mean_reward),
+            "obs_format": obs_format,
+            "obs_tokens_mean": float(np.mean(obs_tokens)) if obs_tokens else 0.0,
+            "prompt_tokens_mean": float(np.mean(prompt_tokens)) if prompt_tokens else 0.0,
+            "circuit": llm_engine.circuit_summary(),
+        })
+        logger.info("FINAL REWARDS: %s, MEAN: %.3f", dict(total_rewards), mean_reward)
+
+        vid_name = pipe.finish_video()
+        if vid_name:
+            logger.info("Saved video to %s", vid_name)
+
+        final_log = get_unique_filename(output_name + ".json")
+        pipe.write_log(game_log, final_log)
+    finally:
+        pipe.close()
+        env.close()
+    logger.info("Saved detailed logs to %s", final_log)
 
 
 if __name__ == "__main__":